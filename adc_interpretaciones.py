@@ -0,0 +1,369 @@
+"""
+Interpretaciones ADC Almacenadas por Orden
+==========================================
+
+obtener_adc_postgres calculaba el perfil ADC y esperaba a OpenAI en cada
+preview o generación del certificado; con temperature=0.7 la interpretación
+cambiaba entre un render y el siguiente.
+
+Ahora el perfil y su interpretación se guardan en adc_interpretaciones, una
+fila por orden_id, ligada a la versión de las respuestas (sha256 de la fila
+de "pruebasADC"): si la prueba se corrige, la versión cambia y se regenera.
+
+- Worker: descubre pruebas recién enviadas (sin fila todavía), calcula el
+  perfil y genera la interpretación fuera del render. Reintenta con espera
+  creciente hasta ADC_MAX_INTENTOS; las que los agotan se vuelven a intentar
+  cada ADC_REENCOLAR_HORAS.
+- obtener_adc_almacenado(): lo que usa el render. Lee la fila; si falta o
+  la versión no coincide, guarda el perfil como pendiente y despierta al
+  worker. Mientras no esté lista el perfil sale sin interpretación (como
+  cuando OpenAI fallaba en el render); al guardarse, el trigger del snapshot
+  del certificado lo marca para reconstruir.
+- reencolar_interpretacion(): vuelve a intentar una orden en error.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import adc_scoring
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+ADC_WORKER_ENABLED = os.getenv("ADC_WORKER_ENABLED", "true").lower() == "true"
+ADC_WORKER_POLL_SEG = int(os.getenv("ADC_WORKER_POLL_SEG", "30"))
+ADC_DESCUBRIR_DIAS = int(os.getenv("ADC_DESCUBRIR_DIAS", "3"))
+ADC_REENCOLAR_HORAS = int(os.getenv("ADC_REENCOLAR_HORAS", "1"))
+ADC_MAX_INTENTOS = 3
+
+# Columnas de "pruebasADC" que usa calcular_perfil_adc (cooc37 no existe en PostgreSQL)
+COLUMNAS_ADC = [col for col in adc_scoring.COLUMNAS_ADC if col != 'cooc37']
+
+_worker = None
+_worker_lock = threading.Lock()
+_despertar = threading.Event()
+_metricas = {'almacenadas': 0, 'pendientes': 0, 'generadas': 0, 'fallidas': 0}
+_metricas_lock = threading.Lock()
+
+
+def _conectar():
+    """Conexión con la tabla garantizada (se crea la primera vez en el proceso)"""
+    return conectar_con_esquema('init_adc_interpretaciones.sql')
+
+
+def _contar(metrica):
+    with _metricas_lock:
+        _metricas[metrica] += 1
+
+
+def version_respuestas(respuestas):
+    """sha256 de las respuestas: cambia si la prueba se corrige"""
+    material = json.dumps([respuestas.get(col) for col in COLUMNAS_ADC], default=str, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def leer_respuestas_adc(cur, orden_id):
+    """Última fila de "pruebasADC" de la orden como dict columna -> respuesta, o None"""
+    cur.execute(
+        f'''
+        SELECT {", ".join(COLUMNAS_ADC)}
+        FROM "pruebasADC"
+        WHERE orden_id = %s
+        ORDER BY created_at DESC
+        LIMIT 1
+        ''',
+        (orden_id,)
+    )
+    fila = cur.fetchone()
+    if not fila:
+        return None
+    respuestas = dict(zip(COLUMNAS_ADC, fila))
+    respuestas['cooc37'] = None  # Columna ausente en PostgreSQL
+    return respuestas
+
+
+def _guardar_pendiente(cur, orden_id, version, perfil):
+    """Perfil nuevo (o de otra versión) queda pendiente de interpretación"""
+    cur.execute(
+        """
+        INSERT INTO adc_interpretaciones (orden_id, version, perfil, estado)
+        VALUES (%s, %s, %s, 'pendiente')
+        ON CONFLICT (orden_id) DO UPDATE
+        SET version = EXCLUDED.version, perfil = EXCLUDED.perfil, interpretacion_ia = NULL,
+            estado = 'pendiente', intentos = 0, ultimo_error = NULL,
+            proximo_intento = CURRENT_TIMESTAMP, actualizado_en = CURRENT_TIMESTAMP
+        WHERE adc_interpretaciones.version <> EXCLUDED.version
+        """,
+        (orden_id, version, json.dumps(perfil, ensure_ascii=False))
+    )
+
+
+def _reencolar(cur, orden_id):
+    """Orden en error vuelve a pendiente con los intentos en cero"""
+    cur.execute(
+        """
+        UPDATE adc_interpretaciones
+        SET estado = 'pendiente', intentos = 0, proximo_intento = CURRENT_TIMESTAMP,
+            actualizado_en = CURRENT_TIMESTAMP
+        WHERE orden_id = %s AND estado = 'error'
+        """,
+        (orden_id,)
+    )
+    return cur.rowcount > 0
+
+
+def obtener_adc_almacenado(orden_id):
+    """
+    Perfil ADC de la orden con su interpretación guardada.
+
+    Args:
+        orden_id: _id de HistoriaClinica
+
+    Returns:
+        dict: perfil de calcular_perfil_adc con interpretacion_ia (la guardada,
+              o None mientras se genera o si falló),
+              o None si la orden no tiene prueba ADC
+    """
+    from adc_scoring import calcular_perfil_adc
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        respuestas = leer_respuestas_adc(cur, orden_id)
+        if not respuestas:
+            cur.close()
+            return None
+        version = version_respuestas(respuestas)
+
+        cur.execute(
+            "SELECT perfil, interpretacion_ia, estado, intentos FROM adc_interpretaciones WHERE orden_id = %s AND version = %s",
+            (orden_id, version)
+        )
+        fila = cur.fetchone()
+        if fila:
+            perfil, interpretacion, estado, intentos = fila
+        else:
+            perfil = calcular_perfil_adc(respuestas)
+            _guardar_pendiente(cur, orden_id, version, perfil)
+            conn.commit()
+            interpretacion, estado, intentos = None, 'pendiente', 0
+            _despertar.set()
+            logger.info(f"🧠 ADC de {orden_id} encolado para interpretación (versión {version[:8]})")
+
+        cur.close()
+    finally:
+        conn.close()
+
+    if isinstance(perfil, str):
+        perfil = json.loads(perfil)
+    if isinstance(interpretacion, str):
+        interpretacion = json.loads(interpretacion)
+
+    if estado == 'listo':
+        _contar('almacenadas')
+        perfil['interpretacion_ia'] = interpretacion
+    else:
+        # Sin interpretación, como cuando OpenAI fallaba en el render: el worker
+        # la completa y los renders siguientes ya la incluyen
+        if estado != 'error' or intentos < ADC_MAX_INTENTOS:
+            _contar('pendientes')
+        perfil['interpretacion_ia'] = None
+    return perfil
+
+
+def reencolar_interpretacion(orden_id):
+    """
+    Vuelve a intentar la interpretación de una orden en error (intentos en cero).
+
+    Returns:
+        bool: True si la orden estaba en error y quedó pendiente
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        reencolada = _reencolar(cur, orden_id)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if reencolada:
+        _despertar.set()
+        logger.info(f"🔁 Interpretación ADC de {orden_id} encolada de nuevo")
+    return reencolada
+
+
+# ============================================================================
+# WORKER DE GENERACIÓN
+# ============================================================================
+
+def descubrir_pruebas_nuevas(limite=50):
+    """
+    Pruebas ADC recientes sin fila en adc_interpretaciones: calcula el perfil y
+    las deja pendientes, así la interpretación está lista antes del primer render.
+
+    Returns:
+        int: pruebas encoladas
+    """
+    from adc_scoring import calcular_perfil_adc
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT DISTINCT p.orden_id
+            FROM "pruebasADC" p
+            WHERE p.created_at > CURRENT_TIMESTAMP - make_interval(days => %s)
+              AND p.orden_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM adc_interpretaciones a WHERE a.orden_id = p.orden_id)
+            LIMIT %s
+            """,
+            (ADC_DESCUBRIR_DIAS, limite)
+        )
+        ordenes = [fila[0] for fila in cur.fetchall()]
+        for orden_id in ordenes:
+            respuestas = leer_respuestas_adc(cur, orden_id)
+            if respuestas:
+                _guardar_pendiente(cur, orden_id, version_respuestas(respuestas), calcular_perfil_adc(respuestas))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if ordenes:
+        logger.info(f"🧠 {len(ordenes)} pruebas ADC nuevas encoladas para interpretación")
+    return len(ordenes)
+
+
+def _tomar_pendientes(cur, limite=5):
+    # Las 'error' que agotaron los intentos se retoman cada ADC_REENCOLAR_HORAS;
+    # las 'generando' de hace más de 10 min son de un worker que murió
+    cur.execute(
+        """
+        UPDATE adc_interpretaciones
+        SET estado = 'generando', actualizado_en = CURRENT_TIMESTAMP
+        WHERE orden_id IN (
+            SELECT orden_id FROM adc_interpretaciones
+            WHERE (estado IN ('pendiente', 'error') AND intentos < %s AND proximo_intento <= CURRENT_TIMESTAMP)
+               OR (estado = 'error' AND actualizado_en < CURRENT_TIMESTAMP - make_interval(hours => %s))
+               OR (estado = 'generando' AND actualizado_en < CURRENT_TIMESTAMP - INTERVAL '10 minutes')
+            ORDER BY proximo_intento
+            FOR UPDATE SKIP LOCKED
+            LIMIT %s
+        )
+        RETURNING orden_id, version, perfil
+        """,
+        (ADC_MAX_INTENTOS, ADC_REENCOLAR_HORAS, limite)
+    )
+    return cur.fetchall()
+
+
+def procesar_pendientes(generar_fn):
+    """
+    Genera las interpretaciones pendientes.
+
+    Args:
+        generar_fn: callable(perfil) -> {'interpretacion', 'recomendaciones'} o None
+
+    Returns:
+        int: interpretaciones procesadas
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        filas = _tomar_pendientes(cur)
+        conn.commit()
+
+        for orden_id, version, perfil in filas:
+            if isinstance(perfil, str):
+                perfil = json.loads(perfil)
+            try:
+                interpretacion = generar_fn(perfil)
+                error = None if interpretacion else 'Sin respuesta de OpenAI'
+            except Exception as e:
+                interpretacion, error = None, str(e)
+
+            # La condición de versión descarta el resultado si la prueba cambió mientras tanto
+            if interpretacion:
+                cur.execute(
+                    """
+                    UPDATE adc_interpretaciones
+                    SET interpretacion_ia = %s, estado = 'listo', ultimo_error = NULL,
+                        generado_en = CURRENT_TIMESTAMP, actualizado_en = CURRENT_TIMESTAMP
+                    WHERE orden_id = %s AND version = %s
+                    """,
+                    (json.dumps(interpretacion, ensure_ascii=False), orden_id, version)
+                )
+                _contar('generadas')
+                logger.info(f"✅ Interpretación ADC de {orden_id} generada y guardada")
+            else:
+                cur.execute(
+                    """
+                    UPDATE adc_interpretaciones
+                    SET estado = 'error', intentos = intentos + 1, ultimo_error = %s,
+                        proximo_intento = CURRENT_TIMESTAMP + make_interval(mins => power(2, LEAST(intentos, 10))::int),
+                        actualizado_en = CURRENT_TIMESTAMP
+                    WHERE orden_id = %s AND version = %s
+                    """,
+                    (error[:500], orden_id, version)
+                )
+                _contar('fallidas')
+                logger.error(f"❌ Interpretación ADC de {orden_id} falló: {error}")
+            conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return len(filas)
+
+
+def _loop_worker(generar_fn):
+    while True:
+        _despertar.wait(ADC_WORKER_POLL_SEG)
+        _despertar.clear()
+        try:
+            descubrir_pruebas_nuevas()
+            while procesar_pendientes(generar_fn):
+                pass
+        except Exception as e:
+            logger.error(f"❌ Error en worker de interpretaciones ADC: {e}")
+
+
+def iniciar_worker_adc(generar_fn):
+    """Arranca (una sola vez por proceso) el worker de interpretaciones ADC"""
+    global _worker
+    with _worker_lock:
+        if _worker or not ADC_WORKER_ENABLED:
+            return
+        _worker = threading.Thread(
+            target=_loop_worker, args=(generar_fn,),
+            name="adc-interpretaciones", daemon=True
+        )
+        _worker.start()
+    _despertar.set()
+    logger.info("✅ Worker de interpretaciones ADC iniciado")
+
+
+def obtener_metricas_adc():
+    """Renders servidos desde lo guardado vs. pendientes (este proceso) y filas por estado"""
+    with _metricas_lock:
+        metricas = dict(_metricas)
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT estado, COUNT(*) FROM adc_interpretaciones GROUP BY estado")
+            metricas['por_estado'] = dict(cur.fetchall())
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        metricas['por_estado'] = None
+        metricas['error'] = str(e)
+    return metricas
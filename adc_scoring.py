@@ -4,8 +4,16 @@ Modulo de calificacion del Perfil Psicologico ADC.
 Porta la logica de calificacion del archivo MediData (ADC - RESULTADOS)
 a Python. Incluye las tres escalas: Ansiedad, Congruencia y Depresion,
 con sus baremos, textos interpretativos y matriz de congruencia.
+
+calcular_perfil_adc califica una prueba; calcular_perfiles_adc califica un
+lote (por ejemplo, las filas de un cursor de "pruebasADC") con arreglos de
+numpy y tablas precalculadas, con el mismo resultado.
 """
 
+from operator import itemgetter
+
+import numpy as np
+
 # ============================================================
 # CONVERSION DE RESPUESTAS A PUNTAJES
 # ============================================================
@@ -363,6 +371,13 @@ INTERP_CONGRUENCIA = {
     ],
 }
 
+AREAS_CONGRUENCIA = [
+    ("Familia", "familia_valoracion", "familia_conducta"),
+    ("Relaciones", "relacion_valoracion", "relacion_conducta"),
+    ("Autocuidado", "autocuidado_valoracion", "autocuidado_conducta"),
+    ("Ocupacional", "ocupacional_valoracion", "ocupacional_conducta"),
+]
+
 # ============================================================
 # MATRIZ DE CONGRUENCIA
 # ============================================================
@@ -537,15 +552,8 @@ def calcular_perfil_adc(datos_respuestas):
     }
 
     # --- CONGRUENCIA ---
-    areas_config = [
-        ("Familia", "familia_valoracion", "familia_conducta"),
-        ("Relaciones", "relacion_valoracion", "relacion_conducta"),
-        ("Autocuidado", "autocuidado_valoracion", "autocuidado_conducta"),
-        ("Ocupacional", "ocupacional_valoracion", "ocupacional_conducta"),
-    ]
-
     congruencia_areas = {}
-    for nombre_area, key_val, key_con in areas_config:
+    for nombre_area, key_val, key_con in AREAS_CONGRUENCIA:
         raw_val = calcular_subdimension(datos_respuestas, CONGRUENCIA_ITEMS[key_val])
         raw_con = calcular_subdimension(datos_respuestas, CONGRUENCIA_ITEMS[key_con])
 
@@ -573,3 +581,221 @@ def calcular_perfil_adc(datos_respuestas):
     resultado["congruencia"] = {"areas": congruencia_areas}
 
     return resultado
+
+
+# ============================================================
+# CALIFICACION POR LOTES
+# ============================================================
+#
+# Las respuestas se codifican como enteros 0-4 (4 = vacia o desconocida),
+# los puntajes de cada item salen de una tabla item x codigo y los brutos de
+# cada escala son sumas por tramos de columnas. Baremo, nivel, interpretacion
+# y congruencia se precalculan con las funciones de arriba para cada bruto
+# posible, asi el lote da exactamente lo mismo que calcular_perfil_adc.
+
+# Escalas en el orden de las columnas de la matriz de brutos
+ESCALAS_ADC = (
+    [("ansiedad", nombre) for nombre in ANSIEDAD_ITEMS]
+    + [("depresion", nombre) for nombre in DEPRESION_ITEMS]
+    + [("congruencia", clave) for clave in CONGRUENCIA_ITEMS]
+    + [("ansiedad", "general"), ("depresion", "general")]
+)
+
+_ITEMS_ESCALA = list(ANSIEDAD_ITEMS.values()) + list(DEPRESION_ITEMS.values()) + list(CONGRUENCIA_ITEMS.values())
+
+# Columnas ordenadas por escala: cada escala es un tramo contiguo
+COLUMNAS_ADC = [col for items in _ITEMS_ESCALA for col, _ in items]
+
+_INICIO_ESCALAS = np.cumsum([0] + [len(items) for items in _ITEMS_ESCALA[:-1]])
+_N_ANSIEDAD = len(ANSIEDAD_ITEMS)
+_N_DEPRESION = len(DEPRESION_ITEMS)
+
+_CODIGOS = {texto: i for i, texto in enumerate(SCORE_DA)}
+_SIN_PUNTAJE = len(_CODIGOS)
+
+# Puntaje de cada item (fila) para cada codigo de respuesta (columna)
+_PUNTAJES_ITEM = np.array([
+    [(SCORE_DA if direccion == "DA" else SCORE_DE)[texto] for texto in _CODIGOS] + [0]
+    for items in _ITEMS_ESCALA for _, direccion in items
+], dtype=np.int64)
+
+ETIQUETAS_NIVEL = [etiqueta for _, etiqueta in NIVELES]
+
+
+def _bruto_maximo(escala, nombre):
+    if nombre == "general":
+        items = ANSIEDAD_ITEMS if escala == "ansiedad" else DEPRESION_ITEMS
+        return 3 * sum(len(i) for i in items.values())
+    return 3 * len(_ITEMS_ESCALA[ESCALAS_ADC.index((escala, nombre))])
+
+
+def _tablas_escala(escala, nombre):
+    if escala == "ansiedad":
+        baremo = BAREMO_ANSIEDAD_GENERAL if nombre == "general" else BAREMOS_ANSIEDAD[nombre]
+        interp = INTERP_ANSIEDAD_GENERAL if nombre == "general" else INTERP_ANSIEDAD[nombre]
+    elif escala == "depresion":
+        baremo = BAREMO_DEPRESION_GENERAL if nombre == "general" else BAREMOS_DEPRESION[nombre]
+        interp = INTERP_DEPRESION_GENERAL if nombre == "general" else INTERP_DEPRESION[nombre]
+    else:
+        baremo, interp = BAREMOS_CONGRUENCIA[nombre], INTERP_CONGRUENCIA[nombre]
+    return baremo, interp
+
+
+def _precalcular():
+    """Por escala y bruto: el dict del perfil (plantilla), el estandarizado y el nivel"""
+    plantillas, estandarizados, niveles = [], [], []
+    ancho = max(_bruto_maximo(*e) for e in ESCALAS_ADC) + 1
+    for escala, nombre in ESCALAS_ADC:
+        baremo, interp = _tablas_escala(escala, nombre)
+        fila_plantillas, fila_est, fila_nivel = [], [], []
+        for raw in range(_bruto_maximo(escala, nombre) + 1):
+            est = aplicar_baremo(raw, baremo)
+            nivel = obtener_nivel(est)
+            fila_plantillas.append({
+                "raw": raw,
+                "estandarizado": est,
+                "nivel": nivel,
+                "interpretacion": obtener_interpretacion(est, interp),
+            })
+            fila_est.append(est)
+            fila_nivel.append(ETIQUETAS_NIVEL.index(nivel))
+        plantillas.append(fila_plantillas)
+        # Relleno hasta el ancho comun: esos brutos no ocurren
+        estandarizados.append(fila_est + [0] * (ancho - len(fila_est)))
+        niveles.append(fila_nivel + [0] * (ancho - len(fila_nivel)))
+
+    congruencia = []
+    for _, key_val, key_con in AREAS_CONGRUENCIA:
+        congruencia.append([
+            [ETIQUETAS_NIVEL.index(calcular_congruencia_nivel(
+                aplicar_baremo(raw_val, BAREMOS_CONGRUENCIA[key_val]),
+                aplicar_baremo(raw_con, BAREMOS_CONGRUENCIA[key_con])))
+             for raw_con in range(_bruto_maximo("congruencia", key_con) + 1)]
+            for raw_val in range(_bruto_maximo("congruencia", key_val) + 1)
+        ])
+    return plantillas, np.array(estandarizados), np.array(niveles), np.array(congruencia)
+
+
+_PLANTILLAS, _ESTANDARIZADO, _NIVEL, _CONGRUENCIA = _precalcular()
+_COL_ESCALA = {escala: i for i, escala in enumerate(ESCALAS_ADC)}
+_AREAS_IDX = [
+    (nombre_area, _COL_ESCALA[("congruencia", key_val)], _COL_ESCALA[("congruencia", key_con)])
+    for nombre_area, key_val, key_con in AREAS_CONGRUENCIA
+]
+
+
+def _codigo_respuesta(respuesta_texto):
+    # Misma regla que puntuar_respuesta
+    if not respuesta_texto:
+        return _SIN_PUNTAJE
+    return _CODIGOS.get(respuesta_texto.strip(), _SIN_PUNTAJE)
+
+
+def codificar_respuestas(filas, columnas=None):
+    """
+    Codifica un lote de pruebas como matriz N x len(COLUMNAS_ADC) de enteros 0-4.
+
+    Args:
+        filas: dicts columna -> respuesta, o tuplas de un cursor si se pasa columnas
+        columnas: nombres de las columnas de las tuplas (cursor.description);
+                  las que falten (cooc37 en PostgreSQL) cuentan como vacias
+    """
+    filas = list(filas)
+    if columnas is None:
+        presentes = list(range(len(COLUMNAS_ADC)))
+        obtener = lambda fila: map(fila.get, COLUMNAS_ADC)
+    else:
+        posicion = {col: i for i, col in enumerate(columnas)}
+        presentes = [j for j, col in enumerate(COLUMNAS_ADC) if col in posicion]
+        obtener = itemgetter(*[posicion[COLUMNAS_ADC[j]] for j in presentes])
+
+    valores = [valor for fila in filas for valor in obtener(fila)]
+    memo = dict(_CODIGOS)
+    try:
+        for valor in set(valores) - memo.keys():
+            memo[valor] = _codigo_respuesta(valor)
+        codigos = np.fromiter(map(memo.__getitem__, valores), dtype=np.int64, count=len(valores))
+    except TypeError:
+        # Valores no hashables: uno por uno
+        codigos = np.fromiter(map(_codigo_respuesta, valores), dtype=np.int64, count=len(valores))
+
+    matriz = np.full((len(filas), len(COLUMNAS_ADC)), _SIN_PUNTAJE, dtype=np.int64)
+    matriz[:, presentes] = codigos.reshape(len(filas), len(presentes))
+    return matriz
+
+
+def puntuar_lote(codigos):
+    """Matriz N x len(ESCALAS_ADC) de puntajes brutos a partir de codificar_respuestas"""
+    if not len(codigos):
+        return np.zeros((0, len(ESCALAS_ADC)), dtype=np.int64)
+    puntajes = _PUNTAJES_ITEM[np.arange(len(COLUMNAS_ADC)), codigos]
+    brutos = np.add.reduceat(puntajes, _INICIO_ESCALAS, axis=1)
+    generales = np.stack([
+        brutos[:, :_N_ANSIEDAD].sum(axis=1),
+        brutos[:, _N_ANSIEDAD:_N_ANSIEDAD + _N_DEPRESION].sum(axis=1),
+    ], axis=1)
+    return np.hstack([brutos, generales])
+
+
+def estandarizar_lote(brutos):
+    """
+    Estandarizados y niveles de un lote, sin armar los dicts del perfil.
+
+    Returns:
+        (estandarizados, niveles, congruencia): las dos primeras N x len(ESCALAS_ADC);
+        congruencia N x len(AREAS_CONGRUENCIA). Niveles y congruencia son indices
+        de ETIQUETAS_NIVEL.
+    """
+    columnas = np.arange(len(ESCALAS_ADC))
+    congruencia = np.stack([
+        _CONGRUENCIA[a, brutos[:, val], brutos[:, con]] for a, (_, val, con) in enumerate(_AREAS_IDX)
+    ], axis=1) if len(brutos) else np.zeros((0, len(_AREAS_IDX)), dtype=np.int64)
+    return _ESTANDARIZADO[columnas, brutos], _NIVEL[columnas, brutos], congruencia
+
+
+def calcular_perfiles_adc(filas, columnas=None):
+    """
+    calcular_perfil_adc para un lote de pruebas.
+
+    Args:
+        filas: dicts columna -> respuesta, o tuplas de un cursor de "pruebasADC"
+        columnas: nombres de las columnas de las tuplas (ver codificar_respuestas)
+
+    Returns:
+        list: un perfil por fila, igual al de calcular_perfil_adc
+    """
+    brutos = puntuar_lote(codificar_respuestas(filas, columnas))
+    if not len(brutos):
+        return []
+    _, _, congruencia = estandarizar_lote(brutos)
+
+    ans_cols = [(nombre, _COL_ESCALA[("ansiedad", nombre)], _PLANTILLAS[_COL_ESCALA[("ansiedad", nombre)]])
+                for nombre in ANSIEDAD_ITEMS]
+    dep_cols = [(nombre, _COL_ESCALA[("depresion", nombre)], _PLANTILLAS[_COL_ESCALA[("depresion", nombre)]])
+                for nombre in DEPRESION_ITEMS]
+    ans_gen = _COL_ESCALA[("ansiedad", "general")]
+    dep_gen = _COL_ESCALA[("depresion", "general")]
+    plantillas_ans_gen, plantillas_dep_gen = _PLANTILLAS[ans_gen], _PLANTILLAS[dep_gen]
+    areas = [(nombre, val, _PLANTILLAS[val], con, _PLANTILLAS[con]) for nombre, val, con in _AREAS_IDX]
+
+    perfiles = []
+    for raw, cong in zip(brutos.tolist(), congruencia.tolist()):
+        perfiles.append({
+            "ansiedad": {
+                "subdimensiones": {nombre: tabla[raw[j]].copy() for nombre, j, tabla in ans_cols},
+                "general": plantillas_ans_gen[raw[ans_gen]].copy(),
+            },
+            "depresion": {
+                "subdimensiones": {nombre: tabla[raw[j]].copy() for nombre, j, tabla in dep_cols},
+                "general": plantillas_dep_gen[raw[dep_gen]].copy(),
+            },
+            "congruencia": {"areas": {
+                nombre: {
+                    "valoracion": tabla_val[raw[val]].copy(),
+                    "conducta": tabla_con[raw[con]].copy(),
+                    "congruencia": ETIQUETAS_NIVEL[cong[a]],
+                }
+                for a, (nombre, val, tabla_val, con, tabla_con) in enumerate(areas)
+            }},
+        })
+    return perfiles
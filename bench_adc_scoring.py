@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la calificación ADC por lotes (adc_scoring.py).
+
+Califica N pruebas sintéticas (tuplas como las de un cursor de "pruebasADC",
+con ~2% de respuestas vacías o con espacios) con calcular_perfil_adc fila
+por fila y con calcular_perfiles_adc, verifica que den lo mismo y reporta
+pruebas por segundo. También mide solo los arreglos numéricos
+(puntuar_lote + estandarizar_lote), que es lo que usa un informe agregado.
+
+Uso:
+    python bench_adc_scoring.py [--filas 1000 10000 50000] [--repeticiones 3]
+"""
+
+import gc
+import time
+import random
+import argparse
+
+from adc_scoring import (
+    calcular_perfil_adc, calcular_perfiles_adc, codificar_respuestas, puntuar_lote,
+    estandarizar_lote, COLUMNAS_ADC, SCORE_DA
+)
+
+COLUMNAS = [col for col in COLUMNAS_ADC if col != 'cooc37']
+RESPUESTAS = list(SCORE_DA)
+RAROS = [None, '', ' De acuerdo ', 'En desacuerdo ']
+
+
+def datos(filas, semilla=2026):
+    rnd = random.Random(semilla)
+    return [
+        tuple(rnd.choice(RAROS) if rnd.random() < 0.02 else rnd.choice(RESPUESTAS) for _ in COLUMNAS)
+        for _ in range(filas)
+    ]
+
+
+def escalar(tuplas):
+    perfiles = []
+    for fila in tuplas:
+        datos_respuestas = dict(zip(COLUMNAS, fila))
+        datos_respuestas['cooc37'] = None
+        perfiles.append(calcular_perfil_adc(datos_respuestas))
+    return perfiles
+
+
+def solo_arreglos(tuplas):
+    return estandarizar_lote(puntuar_lote(codificar_respuestas(tuplas, COLUMNAS)))
+
+
+def medir(funcion, repeticiones, *args):
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, min(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filas', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    fallas = 0
+    print(f"{'filas':>8} {'escalar':>10} {'lote':>10} {'arreglos':>10} {'pruebas/s lote':>15}  paridad")
+    for filas in args.filas:
+        tuplas = datos(filas)
+        esperado, t_escalar = medir(escalar, args.repeticiones, tuplas)
+        obtenido, t_lote = medir(calcular_perfiles_adc, args.repeticiones, tuplas, COLUMNAS)
+        _, t_arreglos = medir(solo_arreglos, args.repeticiones, tuplas)
+        igual = obtenido == esperado
+        fallas += not igual
+        print(f"{filas:>8} {t_escalar * 1000:>8.0f}ms {t_lote * 1000:>8.0f}ms {t_arreglos * 1000:>8.0f}ms "
+              f"{filas / t_lote:>15,.0f}  {'✅' if igual else '❌'} ({t_escalar / t_lote:.1f}x)")
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Benchmark del motor de estadísticas del informe (estadisticas_informe.py).
+
+Compara calcular_estadisticas con la implementación anterior (las funciones
+contar_* y generar_sve de descargar_bsl.py, copiadas tal cual abajo como
+referencia) sobre filas sintéticas con las mismas mezclas que llegan en
+producción: claves snake_case (PostgreSQL) y camelCase (Wix), valores None,
+edades/hijos no numéricos, encuesta como array o como campos individuales y
+diagnósticos separados por ',' y ';'. Verifica que el resultado sea idéntico
+(==, incluido el orden de las listas) y reporta los tiempos.
+
+Uso:
+    python bench_estadisticas_informe.py [--filas 10000 50000 100000] [--repeticiones 3]
+"""
+
+import gc
+import time
+import random
+import argparse
+
+from estadisticas_informe import (
+    calcular_estadisticas, SVE_VISUAL_CONDITIONS, SVE_AUDITORY_CONDITIONS, SVE_WEIGHT_CONDITIONS
+)
+
+
+# ============================================================================
+# IMPLEMENTACIÓN ANTERIOR (referencia de paridad, sin cambios)
+# ============================================================================
+
+def contar_genero(items):
+    total = len(items)
+    masculino = sum(1 for item in items if str(item.get('genero', '')).upper().strip() == 'MASCULINO')
+    femenino = sum(1 for item in items if str(item.get('genero', '')).upper().strip() == 'FEMENINO')
+
+    return {
+        'total': total,
+        'masculino': {
+            'cantidad': masculino,
+            'porcentaje': (masculino / total * 100) if total > 0 else 0
+        },
+        'femenino': {
+            'cantidad': femenino,
+            'porcentaje': (femenino / total * 100) if total > 0 else 0
+        }
+    }
+
+
+def contar_edad(items):
+    total = len(items)
+    rangos = {'15-20': 0, '21-30': 0, '31-40': 0, '41-50': 0, 'mayor50': 0}
+
+    for item in items:
+        try:
+            edad = int(item.get('edad', 0))
+            if 15 <= edad <= 20:
+                rangos['15-20'] += 1
+            elif 21 <= edad <= 30:
+                rangos['21-30'] += 1
+            elif 31 <= edad <= 40:
+                rangos['31-40'] += 1
+            elif 41 <= edad <= 50:
+                rangos['41-50'] += 1
+            elif edad > 50:
+                rangos['mayor50'] += 1
+        except (ValueError, TypeError):
+            pass
+
+    return {
+        'total': total,
+        'rangos': {
+            key: {
+                'cantidad': value,
+                'porcentaje': (value / total * 100) if total > 0 else 0
+            } for key, value in rangos.items()
+        }
+    }
+
+
+def contar_estado_civil(items):
+    total = len(items)
+    estados = {'soltero': 0, 'casado': 0, 'divorciado': 0, 'viudo': 0, 'unionLibre': 0}
+
+    for item in items:
+        # PostgreSQL usa estado_civil, Wix usa estadoCivil
+        estado = str(item.get('estado_civil', item.get('estadoCivil', ''))).upper().strip()
+        if estado == 'SOLTERO':
+            estados['soltero'] += 1
+        elif estado == 'CASADO':
+            estados['casado'] += 1
+        elif estado == 'DIVORCIADO':
+            estados['divorciado'] += 1
+        elif estado == 'VIUDO':
+            estados['viudo'] += 1
+        elif estado in ['UNIÓN LIBRE', 'UNION LIBRE']:
+            estados['unionLibre'] += 1
+
+    return {
+        'total': total,
+        'estados': {
+            key: {
+                'cantidad': value,
+                'porcentaje': (value / total * 100) if total > 0 else 0
+            } for key, value in estados.items()
+        }
+    }
+
+
+def contar_nivel_educativo(items):
+    total = len(items)
+    niveles = {'primaria': 0, 'secundaria': 0, 'universitario': 0, 'postgrado': 0}
+
+    for item in items:
+        # PostgreSQL usa nivel_educativo, Wix usa nivelEducativo
+        nivel = str(item.get('nivel_educativo', item.get('nivelEducativo', ''))).upper().strip()
+        if nivel == 'PRIMARIA':
+            niveles['primaria'] += 1
+        elif nivel == 'SECUNDARIA':
+            niveles['secundaria'] += 1
+        elif nivel == 'UNIVERSITARIO':
+            niveles['universitario'] += 1
+        elif nivel == 'POSTGRADO':
+            niveles['postgrado'] += 1
+
+    return {
+        'total': total,
+        'niveles': {
+            key: {
+                'cantidad': value,
+                'porcentaje': (value / total * 100) if total > 0 else 0
+            } for key, value in niveles.items()
+        }
+    }
+
+
+def contar_hijos(items):
+    total = len(items)
+    grupos = {'sinHijos': 0, 'unHijo': 0, 'dosHijos': 0, 'tresOMas': 0}
+
+    for item in items:
+        try:
+            hijos = int(item.get('hijos', 0))
+            if hijos == 0:
+                grupos['sinHijos'] += 1
+            elif hijos == 1:
+                grupos['unHijo'] += 1
+            elif hijos == 2:
+                grupos['dosHijos'] += 1
+            elif hijos >= 3:
+                grupos['tresOMas'] += 1
+        except (ValueError, TypeError):
+            pass
+
+    return {
+        'total': total,
+        'grupos': {
+            key: {
+                'cantidad': value,
+                'porcentaje': (value / total * 100) if total > 0 else 0
+            } for key, value in grupos.items()
+        }
+    }
+
+
+def contar_ciudad_residencia(items):
+    total = len(items)
+    ciudades_map = {}
+
+    for item in items:
+        # PostgreSQL usa ciudad_residencia, Wix usa ciudadDeResidencia
+        ciudad = str(item.get('ciudad_residencia', item.get('ciudadDeResidencia', ''))).upper().strip()
+        if ciudad:
+            ciudades_map[ciudad] = ciudades_map.get(ciudad, 0) + 1
+
+    ciudades = sorted([
+        {
+            'nombre': ciudad,
+            'cantidad': cantidad,
+            'porcentaje': (cantidad / total * 100) if total > 0 else 0
+        }
+        for ciudad, cantidad in ciudades_map.items()
+    ], key=lambda x: x['cantidad'], reverse=True)
+
+    return {'total': total, 'ciudades': ciudades}
+
+
+def contar_profesion(items):
+    total = len(items)
+    profesiones_map = {}
+
+    for item in items:
+        # PostgreSQL usa profesion_oficio, Wix usa profesionUOficio
+        profesion = str(item.get('profesion_oficio', item.get('profesionUOficio', ''))).upper().strip()
+        if profesion:
+            profesiones_map[profesion] = profesiones_map.get(profesion, 0) + 1
+
+    profesiones = sorted([
+        {
+            'nombre': profesion,
+            'cantidad': cantidad,
+            'porcentaje': (cantidad / total * 100) if total > 0 else 0
+        }
+        for profesion, cantidad in profesiones_map.items()
+    ], key=lambda x: x['cantidad'], reverse=True)
+
+    return {'total': total, 'profesiones': profesiones}
+
+
+def contar_encuesta_salud(items):
+    total = len(items)
+    respuestas_map = {}
+
+    # Campos de salud en PostgreSQL (snake_case) vs Wix (camelCase o array)
+    campos_salud_postgres = [
+        ('dolor_cabeza', 'Dolor de Cabeza'),
+        ('dolor_espalda', 'Dolor de Espalda'),
+        ('ruido_jaqueca', 'Ruido/Jaqueca'),
+        ('problemas_sueno', 'Problemas de Sueño'),
+        ('presion_alta', 'Presión Alta'),
+        ('problemas_azucar', 'Problemas de Azúcar'),
+        ('problemas_cardiacos', 'Problemas Cardíacos'),
+        ('enfermedad_pulmonar', 'Enfermedad Pulmonar'),
+        ('enfermedad_higado', 'Enfermedad del Hígado'),
+        ('hernias', 'Hernias'),
+        ('hormigueos', 'Hormigueos'),
+        ('varices', 'Varices'),
+        ('hepatitis', 'Hepatitis'),
+        ('cirugia_ocular', 'Cirugía Ocular'),
+        ('cirugia_programada', 'Cirugía Programada'),
+        ('condicion_medica', 'Condición Médica'),
+        ('embarazo', 'Embarazo'),
+        ('fuma', 'Fuma'),
+        ('consumo_licor', 'Consumo de Licor'),
+        ('ejercicio', 'Ejercicio'),
+        ('usa_anteojos', 'Usa Anteojos'),
+        ('usa_lentes_contacto', 'Usa Lentes de Contacto')
+    ]
+
+    for item in items:
+        # Intentar primero el formato Wix (array encuestaSalud)
+        encuesta = item.get('encuestaSalud', [])
+        if isinstance(encuesta, list) and len(encuesta) > 0:
+            for respuesta in encuesta:
+                resp = str(respuesta).upper().strip()
+                if resp:
+                    respuestas_map[resp] = respuestas_map.get(resp, 0) + 1
+        else:
+            # Formato PostgreSQL (campos individuales)
+            for campo_db, nombre_display in campos_salud_postgres:
+                valor = str(item.get(campo_db, '')).upper().strip()
+                # Solo contar respuestas afirmativas (SÍ, SI, S, TRUE, 1, etc.)
+                if valor in ['SÍ', 'SI', 'S', 'TRUE', '1', 'YES', 'Y']:
+                    respuestas_map[nombre_display.upper()] = respuestas_map.get(nombre_display.upper(), 0) + 1
+
+    respuestas = sorted([
+        {
+            'nombre': respuesta,
+            'cantidad': cantidad,
+            'porcentaje': (cantidad / total * 100) if total > 0 else 0
+        }
+        for respuesta, cantidad in respuestas_map.items()
+    ], key=lambda x: x['cantidad'], reverse=True)
+
+    return {'total': total, 'respuestas': respuestas}
+
+
+def contar_diagnosticos(items):
+    total = len(items)
+    diagnosticos_map = {}
+
+    for item in items:
+        md_dx1 = str(item.get('mdDx1', '')).strip()
+        if md_dx1:
+            for dx in md_dx1.replace(';', ',').split(','):
+                dx_clean = dx.strip().upper()
+                if dx_clean:
+                    diagnosticos_map[dx_clean] = diagnosticos_map.get(dx_clean, 0) + 1
+
+    diagnosticos = sorted([
+        {
+            'nombre': dx,
+            'cantidad': cantidad,
+            'porcentaje': (cantidad / total * 100) if total > 0 else 0
+        }
+        for dx, cantidad in diagnosticos_map.items()
+    ], key=lambda x: x['cantidad'], reverse=True)
+
+    return {'total': total, 'diagnosticos': diagnosticos}
+
+
+def generar_sve(items):
+    """Genera datos del Sistema de Vigilancia Epidemiológica"""
+    pacientes = []
+    resumen = {'visual': 0, 'auditivo': 0, 'controlPeso': 0}
+
+    for item in items:
+        nombres = f"{item.get('primerNombre', '')} {item.get('primerApellido', '')}".strip()
+        documento = item.get('numeroId', '')
+
+        all_dx = []
+        for dx_field in ['mdDx1', 'mdDx2']:
+            dx_value = str(item.get(dx_field, '')).strip()
+            if dx_value:
+                all_dx.extend([d.strip().upper() for d in dx_value.replace(';', ',').split(',')])
+
+        for dx in all_dx:
+            sistema = None
+            if dx in SVE_VISUAL_CONDITIONS:
+                sistema = 'Visual'
+                resumen['visual'] += 1
+            elif dx in SVE_AUDITORY_CONDITIONS:
+                sistema = 'Auditivo'
+                resumen['auditivo'] += 1
+            elif dx in SVE_WEIGHT_CONDITIONS:
+                sistema = 'Control de Peso'
+                resumen['controlPeso'] += 1
+
+            if sistema:
+                pacientes.append({
+                    'nombres': nombres,
+                    'documento': documento,
+                    'sistema': sistema,
+                    'diagnostico': dx
+                })
+
+    return {
+        'pacientes': pacientes,
+        'resumen': resumen,
+        'totalPacientesAfectados': len(pacientes)
+    }
+
+
+def estadisticas_anteriores(formulario_items, historia_clinica_items):
+    return {
+        'genero': contar_genero(formulario_items),
+        'edad': contar_edad(formulario_items),
+        'estadoCivil': contar_estado_civil(formulario_items),
+        'nivelEducativo': contar_nivel_educativo(formulario_items),
+        'hijos': contar_hijos(formulario_items),
+        'ciudadResidencia': contar_ciudad_residencia(formulario_items),
+        'profesionUOficio': contar_profesion(formulario_items),
+        'encuestaSalud': contar_encuesta_salud(formulario_items),
+        'diagnosticos': contar_diagnosticos(historia_clinica_items),
+        'sve': generar_sve(historia_clinica_items)
+    }
+
+
+# ============================================================================
+# DATOS SINTÉTICOS
+# ============================================================================
+
+GENEROS = ['MASCULINO', 'Femenino', ' femenino ', 'OTRO', '', None]
+ESTADOS = ['Soltero', 'CASADO', 'Unión Libre', 'union libre', 'Divorciado', 'viudo', '', None]
+NIVELES = ['Primaria', 'SECUNDARIA', 'Universitario', 'postgrado', 'Técnico', '', None]
+CIUDADES = [f"Ciudad {i}" for i in range(60)] + ['bogota', 'BOGOTA ', '', None]
+PROFESIONES = [f"Oficio {i}" for i in range(120)] + ['', None]
+RESPUESTAS = ['Sí', 'SI', 'no', 'NO', 'No', 'true', '1', 'Y', '', None]
+# Valores raros (~1% de las celdas): booleanos y números que son la misma
+# clave de dict pero normalizan distinto, y listas no hashables
+RAROS = [True, 1, 1.0, 0, False, ['Cali'], []]
+
+
+def valor(rnd, opciones):
+    return rnd.choice(RAROS) if rnd.random() < 0.01 else rnd.choice(opciones)
+
+CAMPOS_SALUD = ['dolor_cabeza', 'dolor_espalda', 'ruido_jaqueca', 'problemas_sueno', 'presion_alta',
+                'problemas_azucar', 'fuma', 'consumo_licor', 'ejercicio', 'usa_anteojos']
+ENCUESTA_WIX = ['Dolor de cabeza', 'Hernias', 'varices', 'Ninguna', '']
+DIAGNOSTICOS = (SVE_VISUAL_CONDITIONS + SVE_AUDITORY_CONDITIONS + SVE_WEIGHT_CONDITIONS
+                + [f"DIAGNOSTICO GENERAL {i}" for i in range(80)])
+PESOS_DX = [1 / (i + 1) for i in range(len(DIAGNOSTICOS))]
+
+
+def formulario(rnd):
+    item = {'genero': rnd.choice(GENEROS), 'edad': valor(rnd, [rnd.randint(14, 70), str(rnd.randint(18, 60)), 'n/a', None, 35.7])}
+    if rnd.random() < 0.1:
+        del item['edad']
+    if rnd.random() < 0.6:
+        # PostgreSQL
+        item.update({
+            'estado_civil': rnd.choice(ESTADOS), 'nivel_educativo': rnd.choice(NIVELES),
+            'ciudad_residencia': valor(rnd, CIUDADES), 'profesion_oficio': rnd.choice(PROFESIONES),
+            'hijos': rnd.choice([0, 1, 2, 3, 5, '2', '', None]),
+        })
+        for campo in CAMPOS_SALUD:
+            item[campo] = valor(rnd, RESPUESTAS)
+    else:
+        # Wix
+        item.update({
+            'estadoCivil': rnd.choice(ESTADOS), 'nivelEducativo': rnd.choice(NIVELES),
+            'ciudadDeResidencia': valor(rnd, CIUDADES), 'profesionUOficio': rnd.choice(PROFESIONES),
+            'hijos': rnd.choice([0, 1, 2, 4, '1']),
+            'encuestaSalud': rnd.sample(ENCUESTA_WIX, rnd.randint(0, 3)),
+        })
+    return item
+
+
+def historia(rnd, i):
+    item = {'primerNombre': rnd.choice(['Ana', 'Luis', None]), 'primerApellido': 'Pérez', 'numeroId': str(10000 + i)}
+    if rnd.random() < 0.85:
+        # Pocos diagnósticos concentran la mayoría de los casos, como en los informes reales
+        separador = rnd.choice([', ', ', ', ', ', ';', ' ; '])
+        cantidad = rnd.choices([1, 2, 3], weights=[70, 25, 5])[0]
+        item['mdDx1'] = separador.join(rnd.choices(DIAGNOSTICOS, weights=PESOS_DX, k=cantidad))
+    if rnd.random() < 0.3:
+        item['mdDx2'] = rnd.choice(DIAGNOSTICOS + ['', None])
+    return item
+
+
+def datos(filas, semilla=2026):
+    rnd = random.Random(semilla)
+    return [formulario(rnd) for _ in range(filas)], [historia(rnd, i) for i in range(filas)]
+
+
+def medir(funcion, repeticiones, *args):
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, min(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    fallas = 0
+    # Casos borde: listas vacías
+    if calcular_estadisticas([], []) != estadisticas_anteriores([], []):
+        print("❌ Listas vacías: resultado distinto")
+        fallas += 1
+
+    print(f"{'filas':>8} {'anterior':>10} {'motor':>10} {'speedup':>8}  paridad")
+    for filas in args.filas:
+        formularios, historias = datos(filas)
+        esperado, t_anterior = medir(estadisticas_anteriores, args.repeticiones, formularios, historias)
+        obtenido, t_motor = medir(calcular_estadisticas, args.repeticiones, formularios, historias)
+        igual = obtenido == esperado
+        fallas += not igual
+        print(f"{filas:>8} {t_anterior * 1000:>8.0f}ms {t_motor * 1000:>8.0f}ms {t_anterior / t_motor:>7.1f}x  "
+              f"{'✅' if igual else '❌'}")
+        if not igual:
+            for clave in esperado:
+                if obtenido.get(clave) != esperado[clave]:
+                    print(f"   ❌ Distinto: {clave}")
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
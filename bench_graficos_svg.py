@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark PNG vs SVG de los gráficos del informe (graficos_informe).
+
+Para cada dataset típico (empresa chica, mediana, grande: más ciudades,
+profesiones y diagnósticos) dibuja los ocho gráficos del PDF en cada formato
+y reporta tiempo de render y tamaño base64 embebido en el HTML. Si WeasyPrint
+está disponible, arma un HTML con los ocho gráficos y mide también el tiempo
+de WeasyPrint y el tamaño del PDF.
+
+Uso:
+    python bench_graficos_svg.py [--repeticiones 3]
+"""
+
+import time
+import argparse
+import statistics
+
+from graficos_informe import GENERADORES, MIME_GRAFICOS
+
+DATASETS = {
+    'chica': {'ciudades': 3, 'profesiones': 5, 'diagnosticos': 4},
+    'mediana': {'ciudades': 10, 'profesiones': 15, 'diagnosticos': 12},
+    'grande': {'ciudades': 40, 'profesiones': 60, 'diagnosticos': 45},
+}
+
+
+def trabajos_informe(tamanos):
+    """Los mismos ocho gráficos que arma generar_pdf_informe"""
+    ciudades = {f"Ciudad {i}": 200 - 3 * i for i in range(tamanos['ciudades'])}
+    profesiones = {f"Profesión u oficio {i}": 150 - 2 * i for i in range(tamanos['profesiones'])}
+    diagnosticos = {f"Diagnóstico con descripción larga número {i}": 90 - i for i in range(tamanos['diagnosticos'])}
+    return {
+        'genero': ('pie', ({'Masculino': 60, 'Femenino': 40}, 'Distribución por Género'), {}),
+        'edad': ('barras', ({'15-20': 10, '21-30': 30, '31-40': 35, '41-50': 20, 'Mayor 50': 5}, 'Distribución por Edad'),
+                 {'xlabel': 'Rango de Edad', 'ylabel': 'Cantidad de Trabajadores'}),
+        'estadoCivil': ('pie', ({'Soltero': 45, 'Casado': 30, 'Unión Libre': 20, 'Divorciado': 3, 'Viudo': 2},
+                                'Distribución por Estado Civil'), {}),
+        'nivelEducativo': ('barras', ({'Primaria': 12, 'Secundaria': 50, 'Universitario': 30, 'Postgrado': 8},
+                                      'Distribución por Nivel Educativo'),
+                           {'xlabel': 'Nivel Educativo', 'ylabel': 'Cantidad de Trabajadores'}),
+        'hijos': ('barras', ({'Sin hijos': 40, '1 hijo': 30, '2 hijos': 20, '3+ hijos': 10}, 'Distribución por Número de Hijos'),
+                  {'xlabel': 'Número de Hijos', 'ylabel': 'Cantidad de Trabajadores'}),
+        'ciudadResidencia': ('barras_horizontales', (ciudades, 'Top 15 Ciudades de Residencia'),
+                             {'xlabel': 'Cantidad de Trabajadores', 'max_items': 15}),
+        'profesionUOficio': ('barras_horizontales', (profesiones, 'Top 15 Profesiones u Oficios'),
+                             {'xlabel': 'Cantidad de Trabajadores', 'max_items': 15}),
+        'diagnosticos': ('barras_horizontales', (diagnosticos, 'Top 15 Diagnósticos Encontrados'),
+                         {'xlabel': 'Número de Casos', 'max_items': 15}),
+    }
+
+
+def dibujar(trabajos, formato):
+    return {clave: GENERADORES[tipo](*args, **{**kwargs, 'formato': formato})
+            for clave, (tipo, args, kwargs) in trabajos.items()}
+
+
+def html_informe(graficos, formato):
+    imagenes = ''.join(
+        f'<div class="chart"><img src="data:{MIME_GRAFICOS[formato]};base64,{img}" style="max-width: 70%; height: auto;"></div>'
+        for img in graficos.values() if img
+    )
+    return f"<html><body>{imagenes}</body></html>"
+
+
+def cargar_weasyprint():
+    try:
+        from weasyprint import HTML
+        return HTML
+    except Exception:
+        print("⚠️ WeasyPrint no disponible: solo render y tamaño base64")
+        return None
+
+
+def medir_weasyprint(HTML, html):
+    if HTML is None:
+        return None
+    inicio = time.perf_counter()
+    pdf = HTML(string=html).write_pdf()
+    return time.perf_counter() - inicio, len(pdf)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    HTML = cargar_weasyprint()
+    dibujar(trabajos_informe(DATASETS['chica']), 'png')  # calentar matplotlib y fuentes
+
+    print(f"{'dataset':<9} {'formato':<7} {'render':>9} {'base64':>10} {'weasyprint':>11} {'pdf':>10}")
+    for nombre, tamanos in DATASETS.items():
+        trabajos = trabajos_informe(tamanos)
+        for formato in ('png', 'svg'):
+            tiempos = []
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                graficos = dibujar(trabajos, formato)
+                tiempos.append(time.perf_counter() - inicio)
+            tamano = sum(len(img) for img in graficos.values() if img)
+            weasy = medir_weasyprint(HTML, html_informe(graficos, formato))
+            weasy_txt = f"{weasy[0]:>10.2f}s {weasy[1] / 1024:>8.0f}KB" if weasy else f"{'n/d':>11} {'n/d':>10}"
+            print(f"{nombre:<9} {formato:<7} {statistics.median(tiempos):>8.2f}s {tamano / 1024:>8.0f}KB {weasy_txt}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark de backends de almacenamiento (storage_backends).
+
+Mide la ida y vuelta completa de un PDF, como la vive el usuario: put()
+(guardar), public_url() y descarga del enlace por HTTP (servir), y compara
+los bytes descargados con los subidos. Reporta idas y vueltas por segundo,
+p50 de guardar y de servir, y p50/p95 del total por backend y tamaño.
+
+'local' se sirve con un servidor HTTP de la stdlib sobre un directorio
+temporal, con la misma ruta /storage-local/ de la app, así corre offline.
+Si el enlace no es descargable (bucket privado), se sirve con get() y se
+avisa. Para medir MinIO u otro backend:
+
+    STORAGE_S3_ENDPOINT=http://localhost:9000 python bench_storage_backends.py local s3
+
+Uso:
+    python bench_storage_backends.py [backend ...] [--n 50] [--hilos 4]
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from storage_backends import obtener_backend, registrar_backend, LocalStorageBackend
+
+TAMANOS_KB = [50, 500, 2048]  # certificado típico, certificado con fotos, informe con gráficos
+
+
+def crear_pdf_sintetico(tamano_kb):
+    """PDF mínimo válido, relleno con un stream hasta el tamaño pedido"""
+    cabecera = b"%PDF-1.4\n1 0 obj<</Type/Catalog>>endobj\n"
+    cola = b"\n%%EOF\n"
+    relleno = os.urandom(max(tamano_kb * 1024 - len(cabecera) - len(cola), 0))
+    f = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+    f.write(cabecera + relleno + cola)
+    f.close()
+    return f.name
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    k = max(int(round(p / 100.0 * len(ordenados))) - 1, 0)
+    return ordenados[k]
+
+
+class _HandlerStorageLocal(SimpleHTTPRequestHandler):
+    """Sirve el directorio del backend local bajo /storage-local/, como la app"""
+
+    def translate_path(self, path):
+        return super().translate_path(path.replace('/storage-local', '', 1))
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor_local():
+    """Registra 'local' sobre un directorio temporal servido por HTTP; devuelve (servidor, raiz)"""
+    raiz = tempfile.mkdtemp(prefix="bench-storage-")
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), partial(_HandlerStorageLocal, directory=raiz))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    registrar_backend("local", lambda: LocalStorageBackend(raiz=raiz, base_url=base_url))
+    return servidor, raiz
+
+
+def servir(backend, enlace, nombre, carpeta, avisos):
+    """Descarga el enlace público; si no es descargable, get() del backend"""
+    try:
+        with urllib.request.urlopen(enlace, timeout=30) as r:
+            return r.read()
+    except (urllib.error.HTTPError, ValueError) as e:
+        if not avisos:
+            avisos.append(f"enlace no descargable ({e}), se sirve con get()")
+        return backend.get(nombre, carpeta)
+
+
+def medir(backend, ruta_pdf, n, hilos):
+    carpeta = f"bench-{uuid.uuid4().hex[:8]}"
+    nombres = [f"bench_{i}.pdf" for i in range(n)]
+    with open(ruta_pdf, 'rb') as f:
+        esperado = f.read()
+    guardar, servir_lat, totales, distintos, avisos = [], [], [], [], []
+
+    def ida_y_vuelta(nombre):
+        inicio = time.perf_counter()
+        backend.put(ruta_pdf, nombre, carpeta)
+        enlace = backend.public_url(nombre, carpeta)
+        guardado = time.perf_counter()
+        contenido = servir(backend, enlace, nombre, carpeta, avisos)
+        fin = time.perf_counter()
+        guardar.append(guardado - inicio)
+        servir_lat.append(fin - guardado)
+        totales.append(fin - inicio)
+        if contenido != esperado:
+            distintos.append(nombre)
+
+    inicio_total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        list(pool.map(ida_y_vuelta, nombres))
+    total = time.perf_counter() - inicio_total
+
+    for nombre in nombres:
+        try:
+            backend.delete(nombre, carpeta)
+        except Exception:
+            pass
+
+    return {
+        'idas_seg': n / total,
+        'guardar_p50_ms': statistics.median(guardar) * 1000,
+        'servir_p50_ms': statistics.median(servir_lat) * 1000,
+        'p50_ms': statistics.median(totales) * 1000,
+        'p95_ms': percentil(totales, 95) * 1000,
+        'distintos': len(distintos),
+        'avisos': avisos,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de almacenamiento")
+    parser.add_argument("backends", nargs="*", default=["local"])
+    parser.add_argument("--n", type=int, default=50, help="idas y vueltas por backend y tamaño")
+    parser.add_argument("--hilos", type=int, default=4)
+    args = parser.parse_args()
+
+    pdfs = {kb: crear_pdf_sintetico(kb) for kb in TAMANOS_KB}
+    servidor, raiz_local = iniciar_servidor_local()
+
+    print(f"{'backend':<12}{'tamaño':>10}{'idas/s':>9}{'guardar':>10}{'servir':>9}{'p50 ms':>9}{'p95 ms':>9}")
+    print("-" * 68)
+    fallas = 0
+    try:
+        for nombre in args.backends:
+            try:
+                backend = obtener_backend(nombre)
+            except Exception as e:
+                print(f"{nombre:<12} ❌ no disponible: {e}")
+                continue
+            for kb, ruta in pdfs.items():
+                r = medir(backend, ruta, args.n, args.hilos)
+                print(f"{nombre:<12}{str(kb) + ' KB':>10}{r['idas_seg']:>9.1f}{r['guardar_p50_ms']:>10.1f}"
+                      f"{r['servir_p50_ms']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}")
+                for aviso in r['avisos']:
+                    print(f"   ⚠️ {aviso}")
+                if r['distintos']:
+                    print(f"   ❌ {r['distintos']} descargas no coinciden con el PDF subido")
+                    fallas += 1
+    finally:
+        servidor.shutdown()
+        shutil.rmtree(raiz_local, ignore_errors=True)
+        for ruta in pdfs.values():
+            os.remove(ruta)
+
+    return 1 if fallas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
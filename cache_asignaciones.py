@@ -0,0 +1,242 @@
+"""
+Cache de Asignaciones de Conversaciones WhatsApp
+================================================
+
+Mapa celular -> agente en memoria para el webhook de Whapi y la vista de
+conversaciones, que antes abrían una conexión a Postgres por cada mensaje:
+
+- Se carga completo desde conversaciones_whatsapp al arrancar.
+- Write-through: quien asigna en la BD actualiza el cache en el mismo paso.
+- Reasignaciones de otros procesos llegan por LISTEN/NOTIFY (canal
+  'asignacion_conversacion', trigger en sql/init_cache_asignaciones.sql).
+- La actividad (fecha_ultima_actividad) se acumula en memoria y se escribe en
+  lotes cada CACHE_ACTIVIDAD_FLUSH_SEG segundos con un solo UPDATE.
+
+Si el cache no pudo cargarse, las consultas caen a la BD como antes.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import select
+import logging
+import threading
+
+from conexion_pg import obtener_conexion_pg, conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+CACHE_ASIGNACIONES_ENABLED = os.getenv("CACHE_ASIGNACIONES_ENABLED", "true").lower() == "true"
+CACHE_ACTIVIDAD_FLUSH_SEG = float(os.getenv("CACHE_ACTIVIDAD_FLUSH_SEG", "5"))
+CANAL_NOTIFY = "asignacion_conversacion"
+
+_asignaciones = {}          # celular -> agente
+_actividad_pendiente = set()  # celulares con mensajes aún no reflejados en la BD
+_lock = threading.Lock()
+_cargado = False
+_iniciado = False
+_metricas = {'aciertos': 0, 'fallos': 0, 'notificaciones': 0, 'flushes': 0, 'actividades_coalescidas': 0}
+
+
+# ============================================================================
+# CARGA Y CONSULTA
+# ============================================================================
+
+def cargar_asignaciones():
+    """Carga (o recarga) todas las asignaciones desde la BD"""
+    global _cargado
+    conn = conectar_con_esquema('init_cache_asignaciones.sql')
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT celular, agente_asignado FROM conversaciones_whatsapp WHERE agente_asignado IS NOT NULL")
+        filas = cur.fetchall()
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    with _lock:
+        _asignaciones.clear()
+        _asignaciones.update(filas)
+        _cargado = True
+    logger.info(f"✅ Cache de asignaciones cargado: {len(filas)} conversaciones")
+
+
+def obtener_agente_cacheado(celular):
+    """
+    Returns:
+        tuple: (encontrado, agente). encontrado=False significa "preguntar a la BD".
+    """
+    with _lock:
+        agente = _asignaciones.get(celular)
+        if agente is not None:
+            _metricas['aciertos'] += 1
+            return True, agente
+        _metricas['fallos'] += 1
+        return False, None
+
+
+def registrar_asignacion(celular, agente):
+    """Write-through: llamar después de escribir la asignación en la BD"""
+    with _lock:
+        if agente:
+            _asignaciones[celular] = agente
+        else:
+            _asignaciones.pop(celular, None)
+
+
+def invalidar_asignacion(celular=None):
+    """Olvida una asignación (o todas) para forzar la lectura desde la BD"""
+    with _lock:
+        if celular is None:
+            _asignaciones.clear()
+        else:
+            _asignaciones.pop(celular, None)
+
+
+# ============================================================================
+# ACTIVIDAD EN LOTES
+# ============================================================================
+
+def marcar_actividad(celular):
+    """
+    Acumula la actividad; se escribe en el próximo flush. fecha_ultima_actividad
+    queda con a lo sumo CACHE_ACTIVIDAD_FLUSH_SEG de atraso.
+    """
+    with _lock:
+        if celular in _actividad_pendiente:
+            _metricas['actividades_coalescidas'] += 1
+        _actividad_pendiente.add(celular)
+
+
+def flush_actividad():
+    """Escribe toda la actividad pendiente en un solo UPDATE. Devuelve filas enviadas."""
+    with _lock:
+        if not _actividad_pendiente:
+            return 0
+        pendientes = list(_actividad_pendiente)
+        _actividad_pendiente.clear()
+
+    try:
+        conn = obtener_conexion_pg()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE conversaciones_whatsapp
+                SET fecha_ultima_actividad = CURRENT_TIMESTAMP
+                WHERE celular = ANY(%s)
+                """,
+                (pendientes,)
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        # Se devuelven al buffer para el próximo intento
+        with _lock:
+            _actividad_pendiente.update(pendientes)
+        logger.error(f"❌ Error escribiendo lote de actividad ({len(pendientes)} conversaciones): {e}")
+        return 0
+
+    with _lock:
+        _metricas['flushes'] += 1
+    return len(pendientes)
+
+
+def _loop_flush(detener):
+    while not detener.wait(CACHE_ACTIVIDAD_FLUSH_SEG):
+        flush_actividad()
+
+
+# ============================================================================
+# LISTEN / NOTIFY
+# ============================================================================
+
+def _aplicar_notificacion(payload):
+    try:
+        datos = json.loads(payload)
+    except ValueError:
+        logger.warning(f"⚠️ Payload NOTIFY inválido: {payload}")
+        return
+    registrar_asignacion(datos.get('celular'), datos.get('agente'))
+    with _lock:
+        _metricas['notificaciones'] += 1
+
+
+def _escuchar_y_cargar():
+    """
+    LISTEN y después carga completa: un aviso enviado durante la carga queda
+    en la conexión y se aplica después, en vez de perderse.
+    """
+    conn = obtener_conexion_pg()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(f"LISTEN {CANAL_NOTIFY}")
+        cur.close()
+        cargar_asignaciones()
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _loop_listen(detener, conn=None):
+    """Escucha el canal; si la conexión se cae, reconecta y recarga todo (pudo perder avisos)"""
+    while not detener.is_set():
+        try:
+            if conn is None:
+                conn = _escuchar_y_cargar()
+
+            while not detener.is_set():
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _aplicar_notificacion(conn.notifies.pop(0).payload)
+        except Exception as e:
+            logger.error(f"❌ LISTEN de asignaciones caído: {e} — reintentando en 5s")
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            conn = None
+            detener.wait(5)
+
+
+def iniciar_cache_asignaciones():
+    """Carga el cache y arranca los hilos de LISTEN y flush (una vez por proceso)"""
+    global _iniciado
+    with _lock:
+        if _iniciado or not CACHE_ASIGNACIONES_ENABLED:
+            return
+        _iniciado = True
+
+    # La carga inicial se hace aquí (cache listo al volver), ya escuchando el canal
+    conn = None
+    try:
+        conn = _escuchar_y_cargar()
+    except Exception as e:
+        logger.error(f"❌ No se pudo cargar el cache de asignaciones ({e}) — se consulta la BD")
+
+    detener = threading.Event()
+    threading.Thread(target=_loop_listen, args=(detener, conn), name="asignaciones-listen", daemon=True).start()
+    threading.Thread(target=_loop_flush, args=(detener,), name="asignaciones-flush", daemon=True).start()
+
+
+def cache_activo():
+    return _iniciado
+
+
+def obtener_metricas_cache():
+    with _lock:
+        metricas = dict(_metricas)
+        metricas['conversaciones'] = len(_asignaciones)
+        metricas['actividad_pendiente'] = len(_actividad_pendiente)
+        metricas['cargado'] = _cargado
+    return metricas
@@ -0,0 +1,262 @@
+"""
+Caché Persistente de Respuestas LLM
+===================================
+
+call_openai (recomendaciones del informe) y generar_interpretacion_adc_openai
+(certificados) llamaban a OpenAI en cada request aunque el prompt fuera el
+mismo: un informe repetido o un certificado re-renderizado pagaba tokens y
+segundos de latencia otra vez.
+
+completar_chat() guarda cada respuesta en llm_cache bajo un hash de
+(modelo, system, prompt, parámetros) junto con su usage, y la devuelve sin
+llamar a la API mientras no venza.
+
+- Modo determinista (LLM_CACHE_DETERMINISTA, por defecto activo): los prompts
+  cacheables se piden con temperature=0, así la respuesta guardada es la que
+  el modelo daría de nuevo y no una muestra al azar.
+- TTL por entrada (LLM_CACHE_TTL_HORAS, por defecto 30 días) e invalidación
+  manual por clave, por modelo o completa (invalidar_cache_llm).
+- Un LRU chico en memoria evita la lectura a Postgres dentro del proceso.
+  Cada entrada vence con su expira_en o a los LLM_CACHE_MEMORIA_SEG (5 min),
+  lo que llegue primero. invalidar_cache_llm limpia la memoria de este
+  proceso y Postgres; los demás workers e instancias dejan de servir lo
+  invalidado cuando vence su copia en memoria (como mucho
+  LLM_CACHE_MEMORIA_SEG después).
+- Si Postgres falla, se llama a OpenAI como antes.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_HABILITADO = os.getenv("LLM_CACHE_HABILITADO", "true").lower() == "true"
+LLM_CACHE_DETERMINISTA = os.getenv("LLM_CACHE_DETERMINISTA", "true").lower() == "true"
+LLM_CACHE_TTL_HORAS = int(os.getenv("LLM_CACHE_TTL_HORAS", str(24 * 30)))
+LLM_CACHE_EN_MEMORIA = int(os.getenv("LLM_CACHE_EN_MEMORIA", "256"))
+LLM_CACHE_MEMORIA_SEG = int(os.getenv("LLM_CACHE_MEMORIA_SEG", "300"))
+
+_memoria = OrderedDict()   # clave -> (respuesta, usage, vence: epoch)
+_lock = threading.Lock()
+_metricas = {
+    'hits_memoria': 0,
+    'hits_postgres': 0,
+    'misses': 0,
+    'no_cacheables': 0,
+    'errores_cache': 0,
+    'tokens_ahorrados': 0,
+    'tokens_gastados': 0,
+}
+
+
+def _conectar():
+    """Conexión con la tabla garantizada (se crea la primera vez en el proceso)"""
+    return conectar_con_esquema('init_llm_cache.sql')
+
+
+def _contar(metrica, cantidad=1):
+    with _lock:
+        _metricas[metrica] += cantidad
+
+
+def clave_llm(modelo, system, prompt, parametros):
+    """sha256 de (modelo, system, prompt, parámetros): cualquier cambio es otra entrada"""
+    material = json.dumps([modelo, system, prompt, parametros], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _recordar(clave, respuesta, usage, expira_en):
+    """Guarda en memoria hasta expira_en (epoch) o LLM_CACHE_MEMORIA_SEG, lo que llegue primero"""
+    vence = min(expira_en, time.time() + LLM_CACHE_MEMORIA_SEG)
+    with _lock:
+        _memoria[clave] = (respuesta, usage, vence)
+        _memoria.move_to_end(clave)
+        while len(_memoria) > LLM_CACHE_EN_MEMORIA:
+            _memoria.popitem(last=False)
+
+
+def _leer(clave):
+    """(respuesta, usage, origen) o None"""
+    with _lock:
+        entrada = _memoria.get(clave)
+        if entrada and entrada[2] <= time.time():
+            del _memoria[clave]
+            entrada = None
+        if entrada:
+            _memoria.move_to_end(clave)
+    if entrada:
+        return entrada[0], entrada[1], 'memoria'
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE llm_cache
+            SET hits = hits + 1, ultimo_hit = CURRENT_TIMESTAMP
+            WHERE clave = %s AND expira_en > CURRENT_TIMESTAMP
+            RETURNING respuesta, usage, EXTRACT(EPOCH FROM expira_en - CURRENT_TIMESTAMP)
+            """,
+            (clave,)
+        )
+        fila = cur.fetchone()
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if not fila:
+        return None
+    respuesta, usage, vigencia_seg = fila
+    if isinstance(usage, str):
+        usage = json.loads(usage)
+    _recordar(clave, respuesta, usage, time.time() + float(vigencia_seg))
+    return respuesta, usage, 'postgres'
+
+
+def _guardar(clave, modelo, respuesta, usage, ttl_horas):
+    _recordar(clave, respuesta, usage, time.time() + ttl_horas * 3600)
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO llm_cache (clave, modelo, respuesta, usage, expira_en)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(hours => %s))
+            ON CONFLICT (clave) DO UPDATE
+            SET respuesta = EXCLUDED.respuesta, usage = EXCLUDED.usage,
+                creado_en = CURRENT_TIMESTAMP, expira_en = EXCLUDED.expira_en, hits = 0
+            """,
+            (clave, modelo, respuesta, json.dumps(usage), ttl_horas)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def completar_chat(client, modelo, system, prompt, max_tokens, temperature=0.7, cacheable=True, ttl_horas=None):
+    """
+    chat.completions.create con caché persistente.
+
+    Args:
+        client: cliente OpenAI
+        modelo, system, prompt, max_tokens, temperature: como en la API
+        cacheable: False para prompts que deben variar en cada llamada
+        ttl_horas: vigencia de la entrada (por defecto LLM_CACHE_TTL_HORAS)
+
+    Returns:
+        dict: {content, usage: {prompt_tokens, completion_tokens, total_tokens}, cache: bool}
+
+    Los errores de la API se propagan igual que sin caché.
+    """
+    usar_cache = cacheable and LLM_CACHE_HABILITADO
+    if usar_cache and LLM_CACHE_DETERMINISTA:
+        temperature = 0
+
+    clave = None
+    if usar_cache:
+        clave = clave_llm(modelo, system, prompt, {'max_tokens': max_tokens, 'temperature': temperature})
+        try:
+            encontrada = _leer(clave)
+        except Exception as e:
+            logger.warning(f"⚠️ Caché LLM no disponible, se llama a OpenAI: {e}")
+            _contar('errores_cache')
+            encontrada = None
+        if encontrada:
+            respuesta, usage, origen = encontrada
+            _contar('hits_' + origen)
+            _contar('tokens_ahorrados', (usage or {}).get('total_tokens', 0))
+            logger.info(f"♻️ Respuesta LLM desde caché ({origen}), {(usage or {}).get('total_tokens', 0)} tokens ahorrados")
+            return {'content': respuesta, 'usage': usage, 'cache': True}
+        _contar('misses')
+    else:
+        _contar('no_cacheables')
+
+    response = client.chat.completions.create(
+        model=modelo,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens,
+        temperature=temperature
+    )
+    respuesta = response.choices[0].message.content
+    usage = {
+        'prompt_tokens': response.usage.prompt_tokens,
+        'completion_tokens': response.usage.completion_tokens,
+        'total_tokens': response.usage.total_tokens
+    }
+    _contar('tokens_gastados', usage['total_tokens'])
+
+    # Respuestas cortadas por max_tokens no se guardan: la siguiente llamada reintenta
+    if usar_cache and respuesta and response.choices[0].finish_reason != 'length':
+        try:
+            _guardar(clave, modelo, respuesta, usage, ttl_horas or LLM_CACHE_TTL_HORAS)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar la respuesta LLM en caché: {e}")
+            _contar('errores_cache')
+
+    return {'content': respuesta, 'usage': usage, 'cache': False}
+
+
+def invalidar_cache_llm(clave=None, modelo=None):
+    """
+    Borra entradas de la caché: una clave, todas las de un modelo, o todas
+    si no se pasa ninguno de los dos.
+
+    La memoria que se limpia es la de este proceso; en los demás la copia
+    vence sola en LLM_CACHE_MEMORIA_SEG como máximo.
+
+    Returns:
+        int: entradas borradas en Postgres
+    """
+    with _lock:
+        if clave:
+            _memoria.pop(clave, None)
+        else:
+            # La memoria no guarda el modelo: se vacía entera
+            _memoria.clear()
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        if clave:
+            cur.execute("DELETE FROM llm_cache WHERE clave = %s", (clave,))
+        elif modelo:
+            cur.execute("DELETE FROM llm_cache WHERE modelo = %s", (modelo,))
+        else:
+            cur.execute("DELETE FROM llm_cache")
+        borradas = cur.rowcount
+        # Limpieza de los vencidos de paso
+        cur.execute("DELETE FROM llm_cache WHERE expira_en < CURRENT_TIMESTAMP")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    logger.info(f"🗑️ Caché LLM invalidada ({clave or modelo or 'todo'}): {borradas} entradas")
+    return borradas
+
+
+def obtener_metricas_llm():
+    """Aciertos y tokens ahorrados de la caché LLM (este proceso)"""
+    with _lock:
+        metricas = dict(_metricas)
+        metricas['entradas_memoria'] = len(_memoria)
+    consultas = metricas['hits_memoria'] + metricas['hits_postgres'] + metricas['misses']
+    metricas['tasa_aciertos'] = round((metricas['hits_memoria'] + metricas['hits_postgres']) / consultas, 3) if consultas else 0
+    metricas['habilitada'] = LLM_CACHE_HABILITADO
+    metricas['determinista'] = LLM_CACHE_DETERMINISTA
+    return metricas
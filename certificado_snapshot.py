@@ -0,0 +1,450 @@
+"""
+Snapshot del Certificado por Orden
+==================================
+
+Cada preview del certificado (y cada PDF, que Puppeteer imprime desde el
+preview) arma los datos consultando HistoriaClinica, formularios,
+audiometrias, visiometrias, voximetrias_virtual, laboratorios, "pruebasADC",
+medicos, tenants y empresas, y recorre la cadena de textos de
+resultados_generales.
+
+Ahora ese resultado se guarda en certificado_snapshot, un documento JSON por
+orden, y el preview lee una fila:
+
+- Triggers en las tablas de origen suben certificado_snapshot.cambios y
+  avisan con NOTIFY certificado_snapshot (sql/init_certificado_snapshot.sql).
+- Worker: escucha el canal (y revisa cada CERT_SNAPSHOT_POLL_SEG por si se
+  perdió un aviso), espera CERT_SNAPSHOT_DEBOUNCE_SEG para agrupar ráfagas de
+  cambios y reconstruye los snapshots de órdenes atendidas. Un advisory lock
+  deja un solo constructor entre todos los procesos.
+- obtener_datos_certificado(): lo que usa el preview. Si el snapshot está al
+  día lo devuelve; si no, ensambla en vivo y lo guarda.
+- verificar_consistencia(): compara una muestra de snapshots con el
+  ensamblado en vivo.
+
+Los campos de cada render (código de seguridad, fecha de custodia) no se
+guardan: los pone el preview.
+
+Desactivado por defecto (CERT_SNAPSHOT_ENABLED): instala triggers en las
+tablas de producción. Al arrancar desactivado, apaga los triggers que haya
+dejado una activación anterior (certificado_snapshot_config.activo = false);
+sql/drop_certificado_snapshot.sql los elimina.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import time
+import select
+import logging
+import threading
+
+from conexion_pg import conectar_con_esquema, obtener_conexion_pg
+
+logger = logging.getLogger(__name__)
+
+CERT_SNAPSHOT_ENABLED = os.getenv("CERT_SNAPSHOT_ENABLED", "false").lower() == "true"
+CERT_SNAPSHOT_POLL_SEG = int(os.getenv("CERT_SNAPSHOT_POLL_SEG", "60"))
+CERT_SNAPSHOT_DEBOUNCE_SEG = int(os.getenv("CERT_SNAPSHOT_DEBOUNCE_SEG", "5"))
+# Lo que no cubren los triggers (respaldo de Wix, archivos estáticos) se refresca por edad
+CERT_SNAPSHOT_TTL_HORAS = int(os.getenv("CERT_SNAPSHOT_TTL_HORAS", "24"))
+CERT_SNAPSHOT_MAX_INTENTOS = 3
+
+CANAL = 'certificado_snapshot'
+# Clave del pg_try_advisory_lock del constructor
+LOCK_CONSTRUCTOR = 720501
+
+_worker = None
+_worker_lock = threading.Lock()
+_metricas = {'hits': 0, 'misses': 0, 'construidos': 0, 'fallidos': 0}
+_metricas_lock = threading.Lock()
+
+
+def _conectar():
+    """Conexión con tabla y triggers garantizados (se crean la primera vez en el proceso)"""
+    return conectar_con_esquema('init_certificado_snapshot.sql')
+
+
+def _contar(metrica):
+    with _metricas_lock:
+        _metricas[metrica] += 1
+
+
+def normalizar_documento(datos_certificado):
+    """
+    Forma en que el documento queda guardado: fechas y decimales como texto.
+    El template solo los imprime, así que renderiza igual.
+    """
+    return json.loads(json.dumps(datos_certificado, default=str, ensure_ascii=False))
+
+
+def _cargar(documento):
+    if isinstance(documento, str):
+        return json.loads(documento)
+    return documento
+
+
+# ============================================================================
+# LECTURA Y ESCRITURA
+# ============================================================================
+
+def leer_snapshot(cur, orden_id):
+    """
+    Returns:
+        tuple: (documento o None si falta o está desactualizado, cambios leídos)
+    """
+    cur.execute(
+        """
+        SELECT documento, cambios,
+               documento IS NOT NULL AND construido_con = cambios
+               AND construido_en > CURRENT_TIMESTAMP - make_interval(hours => %s)
+        FROM certificado_snapshot
+        WHERE orden_id = %s
+        """,
+        (CERT_SNAPSHOT_TTL_HORAS, orden_id)
+    )
+    fila = cur.fetchone()
+    if not fila:
+        return None, 0
+    documento, cambios, al_dia = fila
+    return (_cargar(documento) if al_dia else None), cambios
+
+
+def guardar_snapshot(cur, orden_id, documento, cambios_leidos):
+    """
+    Guarda el documento ensamblado después de leer cambios_leidos.
+
+    Si un trigger subió cambios mientras tanto, el snapshot queda guardado
+    pero desactualizado y el worker lo vuelve a construir. Nunca pisa un
+    documento construido con una versión más nueva.
+    """
+    cur.execute(
+        """
+        INSERT INTO certificado_snapshot (orden_id, documento, cambios, construido_con, construido_en)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (orden_id) DO UPDATE
+        SET documento = EXCLUDED.documento, construido_con = EXCLUDED.construido_con,
+            construido_en = CURRENT_TIMESTAMP, intentos = 0, ultimo_error = NULL
+        WHERE certificado_snapshot.construido_con <= EXCLUDED.construido_con
+        """,
+        (orden_id, json.dumps(documento, default=str, ensure_ascii=False) if documento is not None else None,
+         cambios_leidos, cambios_leidos)
+    )
+
+
+def obtener_datos_certificado(orden_id, ensamblar_fn):
+    """
+    Datos del certificado desde el snapshot, o ensamblados en vivo si falta o
+    está desactualizado (y entonces se guardan).
+
+    Args:
+        orden_id: _id de HistoriaClinica
+        ensamblar_fn: callable(orden_id) -> datos_certificado o None
+
+    Returns:
+        dict o None si la orden no existe
+    """
+    if not CERT_SNAPSHOT_ENABLED:
+        return ensamblar_fn(orden_id)
+
+    cambios = None
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            documento, cambios = leer_snapshot(cur, orden_id)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        if documento:
+            _contar('hits')
+            logger.info(f"📸 Certificado de {orden_id} servido desde snapshot")
+            return documento
+    except Exception as e:
+        logger.warning(f"⚠️ Error leyendo snapshot de {orden_id}: {e}")
+
+    _contar('misses')
+    datos_certificado = ensamblar_fn(orden_id)
+    if datos_certificado is None or cambios is None:
+        return datos_certificado
+
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            guardar_snapshot(cur, orden_id, datos_certificado, cambios)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"⚠️ Error guardando snapshot de {orden_id}: {e}")
+    return datos_certificado
+
+
+# ============================================================================
+# WORKER DE CONSTRUCCIÓN
+# ============================================================================
+
+def construir_pendientes(ensamblar_fn, limite=20):
+    """
+    Reconstruye los snapshots desactualizados de órdenes atendidas cuyo
+    último cambio tiene más de CERT_SNAPSHOT_DEBOUNCE_SEG.
+
+    Returns:
+        int: snapshots procesados
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT s.orden_id, s.cambios
+            FROM certificado_snapshot s
+            JOIN "HistoriaClinica" h ON h._id = s.orden_id
+            WHERE s.construido_con < s.cambios
+              AND s.intentos < %s
+              AND s.cambio_en <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+              AND UPPER(TRIM(h.atendido)) IN ('ATENDIDO', 'ATENDIDA')
+            ORDER BY s.cambio_en
+            LIMIT %s
+            """,
+            (CERT_SNAPSHOT_MAX_INTENTOS, CERT_SNAPSHOT_DEBOUNCE_SEG, limite)
+        )
+        pendientes = cur.fetchall()
+        conn.commit()
+
+        for orden_id, cambios in pendientes:
+            try:
+                # None (orden sin datos) también se guarda: el preview lo trata como faltante
+                guardar_snapshot(cur, orden_id, ensamblar_fn(orden_id), cambios)
+                _contar('construidos')
+            except Exception as e:
+                conn.rollback()
+                cur.execute(
+                    """
+                    UPDATE certificado_snapshot
+                    SET intentos = intentos + 1, ultimo_error = %s
+                    WHERE orden_id = %s AND cambios = %s
+                    """,
+                    (str(e)[:500], orden_id, cambios)
+                )
+                _contar('fallidos')
+                logger.error(f"❌ Snapshot del certificado {orden_id} falló: {e}")
+            conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if pendientes:
+        logger.info(f"📸 {len(pendientes)} snapshots de certificado reconstruidos")
+    return len(pendientes)
+
+
+def _escuchar():
+    """Conexión en autocommit suscrita al canal; intenta tomar el rol de constructor"""
+    conn = _conectar()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {CANAL}")
+    cur.close()
+    return conn
+
+
+def _es_constructor(conn):
+    # Lock de sesión: se libera solo si el proceso muere y la conexión se cierra
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_CONSTRUCTOR,))
+    tomado = cur.fetchone()[0]
+    cur.close()
+    return tomado
+
+
+def esperar_cambios(conn, timeout):
+    """Espera un NOTIFY hasta timeout segundos; descarta los que se acumularon"""
+    if not conn.notifies:
+        select.select([conn], [], [], timeout)
+    conn.poll()
+    avisos = len(conn.notifies)
+    conn.notifies.clear()
+    return avisos
+
+
+def _loop_worker(ensamblar_fn):
+    conn = None
+    constructor = False
+    while True:
+        try:
+            if conn is None:
+                conn = _escuchar()
+                constructor = False
+            if not constructor:
+                constructor = _es_constructor(conn)
+                if constructor:
+                    logger.info("📸 Este proceso construye los snapshots de certificado")
+
+            esperar_cambios(conn, CERT_SNAPSHOT_POLL_SEG)
+            if not constructor:
+                continue
+
+            # Agrupar las ráfagas (un examen guarda varias filas seguidas)
+            time.sleep(CERT_SNAPSHOT_DEBOUNCE_SEG)
+            while construir_pendientes(ensamblar_fn):
+                pass
+        except Exception as e:
+            logger.error(f"❌ Error en worker de snapshots de certificado: {e}")
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            conn = None
+            time.sleep(CERT_SNAPSHOT_POLL_SEG)
+
+
+def desactivar_triggers():
+    """
+    Apaga los triggers que dejó una activación anterior (no crea nada si
+    el snapshot nunca se activó).
+
+    Returns:
+        bool: True si había triggers instalados y quedaron apagados
+    """
+    conn = obtener_conexion_pg()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass('certificado_snapshot_config') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            cur.close()
+            return False
+        cur.execute("UPDATE certificado_snapshot_config SET activo = false WHERE activo")
+        apagados = cur.rowcount > 0
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if apagados:
+        logger.info("🔕 Triggers de certificado_snapshot apagados (CERT_SNAPSHOT_ENABLED desactivado)")
+    return apagados
+
+
+def iniciar_worker_snapshot(ensamblar_fn):
+    """
+    Arranca (una sola vez por proceso) el worker de snapshots. Desactivado,
+    apaga los triggers para que dejen de escribir en cada cambio.
+
+    Args:
+        ensamblar_fn: callable(orden_id) -> datos_certificado o None
+    """
+    global _worker
+    if not CERT_SNAPSHOT_ENABLED:
+        if os.getenv("POSTGRES_PASSWORD"):
+            try:
+                desactivar_triggers()
+            except Exception as e:
+                logger.error(f"❌ No se pudieron apagar los triggers de certificado_snapshot: {e}")
+        return
+    with _worker_lock:
+        if _worker:
+            return
+        _worker = threading.Thread(
+            target=_loop_worker, args=(ensamblar_fn,),
+            name="certificado-snapshot", daemon=True
+        )
+        _worker.start()
+    logger.info("✅ Worker de snapshots de certificado iniciado")
+
+
+# ============================================================================
+# CONSISTENCIA
+# ============================================================================
+
+def comparar_documentos(guardado, vivo):
+    """Claves de primer nivel cuyo valor difiere entre dos documentos normalizados"""
+    guardado, vivo = guardado or {}, vivo or {}
+    return sorted(
+        clave for clave in set(guardado) | set(vivo)
+        if guardado.get(clave) != vivo.get(clave)
+    )
+
+
+def verificar_consistencia(ensamblar_fn, muestra=20):
+    """
+    Ensambla en vivo una muestra aleatoria de snapshots al día y los compara.
+
+    Returns:
+        dict: revisados, consistentes, inconsistentes [{orden_id, campos}], errores
+    """
+    if not CERT_SNAPSHOT_ENABLED:
+        return {'habilitado': False}
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT orden_id, documento
+            FROM certificado_snapshot
+            WHERE documento IS NOT NULL AND construido_con = cambios
+            ORDER BY random()
+            LIMIT %s
+            """,
+            (muestra,)
+        )
+        filas = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    resultado = {'revisados': 0, 'consistentes': 0, 'inconsistentes': [], 'errores': []}
+    for orden_id, documento in filas:
+        try:
+            vivo = normalizar_documento(ensamblar_fn(orden_id))
+        except Exception as e:
+            resultado['errores'].append({'orden_id': orden_id, 'error': str(e)})
+            continue
+        resultado['revisados'] += 1
+        campos = comparar_documentos(_cargar(documento), vivo)
+        if campos:
+            resultado['inconsistentes'].append({'orden_id': orden_id, 'campos': campos})
+        else:
+            resultado['consistentes'] += 1
+
+    if resultado['inconsistentes']:
+        logger.warning(f"⚠️ {len(resultado['inconsistentes'])} de {resultado['revisados']} snapshots difieren del ensamblado en vivo")
+    return resultado
+
+
+def obtener_metricas_snapshot():
+    """Renders desde snapshot vs. ensamblados (este proceso) y estado de la tabla"""
+    with _metricas_lock:
+        metricas = dict(_metricas)
+    metricas['habilitado'] = CERT_SNAPSHOT_ENABLED
+    if not CERT_SNAPSHOT_ENABLED:
+        return metricas
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT COUNT(*) FILTER (WHERE construido_con = cambios AND documento IS NOT NULL),
+                       COUNT(*) FILTER (WHERE construido_con < cambios),
+                       COUNT(*) FILTER (WHERE construido_con < cambios AND intentos >= %s)
+                FROM certificado_snapshot
+                """,
+                (CERT_SNAPSHOT_MAX_INTENTOS,)
+            )
+            al_dia, pendientes, fallidos = cur.fetchone()
+            metricas['tabla'] = {'al_dia': al_dia, 'pendientes': pendientes, 'fallidos': fallidos}
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        metricas['tabla'] = None
+        metricas['error'] = str(e)
+    return metricas
@@ -21,6 +21,7 @@ import logging
 import requests
 from requests.exceptions import HTTPError
 import uuid
+import threading
 import json as json_module
 
 # Configurar logger
@@ -81,9 +82,10 @@ TWILIO_AVAILABLE = False
 twilio_client = None
 
 try:
-    from twilio.rest import Client
+    from twilio_clients import obtener_cliente_twilio
     if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-        twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        # Cliente del registro compartido: mismo pool keep-alive que los envíos de certificados
+        twilio_client = obtener_cliente_twilio(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, 'bsl')
         TWILIO_AVAILABLE = True
         logger.info("✅ Twilio client initialized successfully")
     else:
@@ -119,6 +121,20 @@ def require_auth(f):
 # FUNCIONES DE BASE DE DATOS (NUEVO)
 # ============================================================================
 
+from store_chat_whatsapp import (
+    WHAPI_PHONE_NUMBER, guardar_mensajes_whapi, actualizar_estado_mensaje, marcar_leida,
+    listar_conversaciones, listar_mensajes, backfill_historial, backfill_resumen_conversaciones
+)
+from cola_webhooks import (
+    WEBHOOK_COLA_ENABLED, encolar_eventos, iniciar_workers_webhooks, obtener_metricas_cola
+)
+from conexion_pg import conectar_con_esquema
+from cache_asignaciones import (
+    obtener_agente_cacheado, registrar_asignacion, marcar_actividad, cache_activo,
+    obtener_metricas_cache
+)
+from push_notifications import register_push_token, send_new_message_notification, obtener_metricas_push
+
 def obtener_conexion_pg():
     """
     Helper para obtener conexión PostgreSQL reutilizable.
@@ -142,6 +158,7 @@ def obtener_conexion_pg():
 def obtener_agente_asignado(numero_telefono):
     """
     Obtiene el agente asignado a un número de teléfono.
+    Primero mira el cache en memoria (cache_asignaciones); solo va a la BD si no está.
 
     Args:
         numero_telefono (str): Número de teléfono (formato: +57...)
@@ -149,6 +166,10 @@ def obtener_agente_asignado(numero_telefono):
     Returns:
         str or None: Username del agente asignado o None si no existe
     """
+    encontrado, agente = obtener_agente_cacheado(numero_telefono)
+    if encontrado:
+        return agente
+
     try:
         conn = obtener_conexion_pg()
         cur = conn.cursor()
@@ -162,16 +183,39 @@ def obtener_agente_asignado(numero_telefono):
         cur.close()
         conn.close()
 
-        return result[0] if result else None
+        agente = result[0] if result else None
+        if agente:
+            registrar_asignacion(numero_telefono, agente)
+        return agente
 
     except Exception as e:
         logger.error(f"❌ Error obteniendo agente asignado para {numero_telefono}: {e}")
         return None
 
+def _registrar_agentes(cur):
+    """
+    Registra los agentes de AGENTES en agentes_chat, junto con
+    sql/init_asignacion_round_robin.sql (tabla, secuencia y función de
+    asignación). Un agente que ya existe no se toca: su 'activo' lo manda la BD.
+    """
+    for orden, (username, info) in enumerate(AGENTES.items()):
+        cur.execute(
+            """
+            INSERT INTO agentes_chat (username, nombre, activo, orden)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (username) DO NOTHING
+            """,
+            (username, info['nombre'], info['activo'], orden)
+        )
+
 def asignar_conversacion_round_robin(numero_telefono):
     """
     Asigna una conversación nueva usando algoritmo round-robin.
-    Alterna automáticamente entre agentes activos.
+    Alterna automáticamente entre los agentes activos de agentes_chat.
+
+    Todo ocurre en la función SQL asignar_conversacion_round_robin: un solo
+    viaje a la BD, sin bloquear un contador compartido. Si el número ya tenía
+    agente (dos webhooks simultáneos), devuelve ese mismo.
 
     Args:
         numero_telefono (str): Número de teléfono a asignar
@@ -180,66 +224,19 @@ def asignar_conversacion_round_robin(numero_telefono):
         str or None: Username del agente asignado o None si hubo error
     """
     try:
-        conn = obtener_conexion_pg()
+        # La primera vez en el proceso crea la función SQL y registra los agentes
+        conn = conectar_con_esquema('init_asignacion_round_robin.sql', despues=_registrar_agentes)
         cur = conn.cursor()
 
-        # Obtener contador actual (con bloqueo para evitar race conditions)
-        cur.execute(
-            "SELECT valor FROM sistema_asignacion WHERE clave = 'contador_round_robin' FOR UPDATE"
-        )
-        result = cur.fetchone()
-        contador = result[0] if result else 0
-
-        # Lista de agentes activos
-        agentes_activos = [username for username, info in AGENTES.items() if info['activo']]
-
-        if not agentes_activos:
-            raise Exception("No hay agentes activos disponibles")
-
-        # Seleccionar agente usando módulo (round-robin)
-        agente_asignado = agentes_activos[contador % len(agentes_activos)]
-
-        # Incrementar contador
-        nuevo_contador = contador + 1
-        cur.execute(
-            "UPDATE sistema_asignacion SET valor = %s, updated_at = CURRENT_TIMESTAMP WHERE clave = 'contador_round_robin'",
-            (nuevo_contador,)
-        )
-
-        # Verificar si la conversación ya existe
-        cur.execute(
-            "SELECT id FROM conversaciones_whatsapp WHERE celular = %s",
-            (numero_telefono,)
-        )
-        existe = cur.fetchone()
-
-        if existe:
-            # Si existe, actualizar agente_asignado
-            cur.execute(
-                """
-                UPDATE conversaciones_whatsapp
-                SET agente_asignado = %s,
-                    fecha_asignacion = CURRENT_TIMESTAMP,
-                    fecha_ultima_actividad = CURRENT_TIMESTAMP
-                WHERE celular = %s
-                """,
-                (agente_asignado, numero_telefono)
-            )
-        else:
-            # Si no existe, insertar nueva conversación
-            cur.execute(
-                """
-                INSERT INTO conversaciones_whatsapp (celular, agente_asignado, estado)
-                VALUES (%s, %s, 'activa')
-                """,
-                (numero_telefono, agente_asignado)
-            )
+        cur.execute("SELECT asignar_conversacion_round_robin(%s)", (numero_telefono,))
+        agente_asignado = cur.fetchone()[0]
 
         conn.commit()
         cur.close()
         conn.close()
 
-        logger.info(f"✅ Conversación {numero_telefono} asignada a {agente_asignado} (contador: {nuevo_contador})")
+        registrar_asignacion(numero_telefono, agente_asignado)
+        logger.info(f"✅ Conversación {numero_telefono} asignada a {agente_asignado}")
 
         return agente_asignado
 
@@ -253,10 +250,15 @@ def actualizar_actividad_conversacion(numero_telefono):
     """
     Actualiza la fecha de última actividad de una conversación.
     Se llama cada vez que llega un mensaje de una conversación existente.
+    Con el cache activo solo se anota y se escribe en el próximo lote.
 
     Args:
         numero_telefono (str): Número de teléfono
     """
+    if cache_activo():
+        marcar_actividad(numero_telefono)
+        return
+
     try:
         conn = obtener_conexion_pg()
         cur = conn.cursor()
@@ -688,29 +690,83 @@ def set_socketio_instance(socketio):
     _socketio_instance = socketio
     logger.info("✅ Instancia de Socket.IO configurada en chat_whatsapp")
 
+# ============================================================================
+# SALAS SOCKET.IO
+# ============================================================================
+#
+# Cada socket con sesión de agente entra a 'agente:<username>' y a las salas
+# 'conv:<numero>' de los chats que abre. Los eventos van solo a las salas que
+# les importan. Los sockets sin sesión (clientes viejos) quedan en
+# SALA_SIN_SESION, que sigue recibiendo todo como antes.
+
+SALA_SIN_SESION = 'sin_sesion'
+SOCKET_COALESCER_ESTADOS_SEG = 0.3
+
+_estados_pendientes = {}   # numero -> {message_id: data} (último estado de cada mensaje)
+_estados_lock = threading.Lock()
+
+def sala_agente(username):
+    return f"agente:{username}"
+
+def sala_conversacion(numero):
+    return f"conv:{numero.replace('whatsapp:', '').lstrip('+')}"
+
+def salas_de_evento(event_type, data):
+    """Salas destino de un evento; None = todos los clientes (eventos sin número)"""
+    numero = (data or {}).get('numero')
+    if not numero:
+        return None
+    salas = [sala_conversacion(numero), SALA_SIN_SESION]
+    # message_status solo le sirve a quien tiene el chat abierto
+    if event_type != 'message_status':
+        agente = obtener_agente_asignado(numero.replace('whatsapp:', '').lstrip('+'))
+        if agente:
+            salas.append(sala_agente(agente))
+    return salas
+
+def _emitir(event_type, data):
+    salas = salas_de_evento(event_type, data)
+    if salas is None:
+        _socketio_instance.emit(event_type, data, namespace='/twilio-chat')
+    else:
+        _socketio_instance.emit(event_type, data, to=salas, namespace='/twilio-chat')
+    logger.info(f"📡 Evento WebSocket enviado: {event_type} → {salas or 'todos'}")
+
+def _vaciar_estados(numero):
+    with _estados_lock:
+        pendientes = _estados_pendientes.pop(numero, {})
+    for data in pendientes.values():
+        _emitir('message_status', data)
+
 def broadcast_websocket_event(event_type, data):
-    """Envía un evento a todos los clientes conectados vía WebSocket"""
+    """
+    Envía un evento vía WebSocket a las salas que lo necesitan (agente dueño
+    de la conversación y quienes la tienen abierta).
+
+    Los message_status de una conversación se agrupan durante
+    SOCKET_COALESCER_ESTADOS_SEG: sent → delivered → read seguidos salen como
+    un solo evento con el último estado de cada mensaje.
+    """
     try:
-        if _socketio_instance:
-            _socketio_instance.emit(event_type, data, namespace='/twilio-chat')
-            logger.info(f"📡 Evento WebSocket enviado: {event_type}")
-        else:
+        if not _socketio_instance:
             logger.warning(f"⚠️ Socket.IO no inicializado, no se pudo enviar evento: {event_type}")
+            return
+
+        if event_type == 'message_status' and data.get('numero'):
+            numero = data['numero']
+            with _estados_lock:
+                nuevo_lote = numero not in _estados_pendientes
+                _estados_pendientes.setdefault(numero, {})[data.get('message_id')] = data
+            if nuevo_lote:
+                temporizador = threading.Timer(SOCKET_COALESCER_ESTADOS_SEG, _vaciar_estados, args=(numero,))
+                temporizador.daemon = True
+                temporizador.start()
+            return
+
+        _emitir(event_type, data)
     except Exception as e:
         logger.error(f"❌ Error enviando evento WebSocket: {e}")
 
-def register_push_token(token, platform='ios'):
-    """Registra un token de notificaciones push (stub)"""
-    # TODO: Implementar almacenamiento de tokens push si se requiere en el futuro
-    logger.info(f"📱 Push token registrado: {token[:20]}... (platform: {platform})")
-    return True
-
-def send_new_message_notification(sender_name, message_body, conversation_id):
-    """Envía notificación push de nuevo mensaje (stub)"""
-    # TODO: Implementar envío de push notifications si se requiere en el futuro
-    logger.info(f"🔔 Push notification: {sender_name} - {message_body[:30]}...")
-    return True
-
 # ============================================================================
 # ENDPOINTS DE AUTENTICACIÓN
 # ============================================================================
@@ -780,7 +836,9 @@ def twilio_health():
         'status': 'healthy',
         'service': 'twilio-bsl',
         'timestamp': datetime.now().isoformat(),
-        'twilio_configured': twilio_client is not None
+        'twilio_configured': twilio_client is not None,
+        'cache_asignaciones': obtener_metricas_cache(),
+        'push': obtener_metricas_push()
     })
 
 @chat_bp.route('/debug/db-status')
@@ -886,128 +944,34 @@ def twilio_get_conversaciones():
     try:
         username = session.get('username')
 
-        # Obtener números asignados a este agente
-        numeros_asignados = obtener_conversaciones_por_agente(username)
-        numeros_set = set(numeros_asignados)
-
-        logger.info(f"📱 Agente {username} tiene {len(numeros_asignados)} conversaciones asignadas")
-
-        # Parámetros de paginación
+        # Parámetros de paginación (keyset: cursor devuelto en next_cursor)
         limit = request.args.get('limit', default=30, type=int)
-        offset = request.args.get('offset', default=0, type=int)
+        cursor = request.args.get('cursor')
 
-        conversaciones = {}
-
-        # ==================== OBTENER MENSAJES DE WHAPI ====================
-        try:
-            logger.info("📱 Obteniendo conversaciones de Whapi...")
-            chats_whapi = obtener_conversaciones_whapi()
-            logger.info(f"✅ Total de chats Whapi obtenidos: {len(chats_whapi)}")
-
-            for chat in chats_whapi:
-                chat_id = chat.get('id', '')
-                # Limpiar el chat_id para obtener solo el número
-                numero_clean = chat_id.replace('@s.whatsapp.net', '').replace('@g.us', '')
-
-                # ========== FILTRO DE ASIGNACIÓN ==========
-                # Normalizar número para comparar (SIN el + para que coincida con la BD)
-                numero_normalizado = numero_clean.lstrip('+')
-
-                # Solo mostrar conversaciones asignadas a este agente
-                if numero_normalizado not in numeros_set:
-                    continue
-                # ==========================================
-
-                # Saltar números excluidos
-                if is_numero_excluido(numero_clean):
-                    continue
-
-                # Obtener nombre del contacto
-                nombre = chat.get('name', f"Usuario {numero_clean[-4:]}")
-
-                # Obtener foto de perfil de Whapi desde los datos del chat
-                foto_perfil = obtener_foto_perfil_whapi(chat)
-
-                if numero_clean not in conversaciones:
-                    conversaciones[numero_clean] = {
-                        'numero': numero_clean,
-                        'nombre': nombre,
-                        'messages': [],
-                        'last_message_time': None,
-                        'last_message_preview': '',
-                        'source': 'whapi',
-                        'profile_picture': foto_perfil
-                    }
-
-                # Obtener último mensaje del chat
-                last_msg = chat.get('last_message', {})
-                if last_msg:
-                    last_msg_time = last_msg.get('timestamp', 0)
-                    last_msg_text = last_msg.get('text', {}).get('body', '') if last_msg.get('type') == 'text' else '(media)'
-
-                    # Crear timestamp comparable
-                    from datetime import datetime, timezone
-                    if isinstance(last_msg_time, int):
-                        # Convertir a UTC aware datetime
-                        last_msg_datetime = datetime.fromtimestamp(last_msg_time, tz=timezone.utc)
-                    else:
-                        last_msg_datetime = datetime.now(timezone.utc)
-
-                    # Actualizar último mensaje si es más reciente
-                    existing_time = conversaciones[numero_clean]['last_message_time']
-                    if existing_time and existing_time.tzinfo is None:
-                        existing_time = existing_time.replace(tzinfo=timezone.utc)
-
-                    if not existing_time or last_msg_datetime > existing_time:
-                        conversaciones[numero_clean]['last_message_time'] = last_msg_datetime
-                        conversaciones[numero_clean]['last_message_preview'] = last_msg_text[:50]
+        # Sale del store local (alimentado por los webhooks). La primera vez en el
+        # proceso se completan nombres/fotos/último mensaje desde Whapi en segundo plano.
+        backfill_resumen_conversaciones()
+        pagina = listar_conversaciones(username, limit, cursor)
 
-                        # Actualizar actividad en BD
-                        actualizar_actividad_conversacion(numero_normalizado)
-
-        except Exception as e:
-            logger.error(f"⚠️ Error obteniendo conversaciones de Whapi: {str(e)}")
-
-        # ==================== FORMATEAR RESPUESTA ====================
-        # Convertir a lista y ordenar por fecha de último mensaje (más reciente primero)
-        conversaciones_lista = []
-        for numero, data in conversaciones.items():
-            conversaciones_lista.append({
-                'numero': numero,
-                'nombre': data['nombre'],
-                'last_message': data['last_message_preview'],
-                'last_message_time': data['last_message_time'].isoformat() if data['last_message_time'] else None,
-                'last_message_time_raw': data['last_message_time'],
-                'source': data['source'],
-                'profile_picture': data.get('profile_picture'),
-                'message_count': len(data['messages'])
-            })
-
-        # Ordenar por fecha de último mensaje (más reciente primero)
-        conversaciones_lista.sort(key=lambda x: x['last_message_time_raw'] or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
-
-        # Aplicar paginación
-        total_conversaciones = len(conversaciones_lista)
-        conversaciones_paginadas = conversaciones_lista[offset:offset+limit]
-
-        # Convertir lista ordenada a diccionario para mantener compatibilidad con frontend
+        # Diccionario por número para mantener compatibilidad con el frontend
         conversaciones_formateadas = {}
-        for conv in conversaciones_paginadas:
-            numero = conv.pop('numero')
-            conv.pop('last_message_time_raw')
-            conversaciones_formateadas[numero] = conv
-            conversaciones_formateadas[numero]['numero'] = numero
+        for conv in pagina['conversaciones']:
+            if is_numero_excluido(conv['numero']):
+                continue
+            conv.pop('id')
+            conv['message_count'] = 0
+            conversaciones_formateadas[conv['numero']] = conv
 
-        logger.info(f"✅ Conversaciones: {len(conversaciones_formateadas)}/{total_conversaciones} (offset={offset}, limit={limit})")
+        logger.info(f"✅ Conversaciones {username}: {len(conversaciones_formateadas)}/{pagina['total']} (limit={limit})")
 
         return jsonify({
             'success': True,
             'conversaciones': conversaciones_formateadas,
-            'total': total_conversaciones,
+            'total': pagina['total'],
             'count': len(conversaciones_formateadas),
-            'offset': offset,
             'limit': limit,
-            'has_more': (offset + limit) < total_conversaciones,
+            'has_more': pagina['next_cursor'] is not None,
+            'next_cursor': pagina['next_cursor'],
             'agente': username
         })
     except Exception as e:
@@ -1032,56 +996,36 @@ def twilio_get_conversacion(numero):
             logger.warning(f"⚠️ Agente {username} intentó acceder a conversación de {agente_asignado}: {numero}")
             return jsonify({'success': False, 'error': 'No tienes permiso para ver esta conversación'}), 403
 
-        # Parámetros de paginación
+        # Parámetros de paginación (keyset hacia mensajes más antiguos)
         limit = request.args.get('limit', default=50, type=int)
-        offset = request.args.get('offset', default=0, type=int)
+        cursor = request.args.get('cursor')
 
-        logger.info(f"📱 Obteniendo conversación para número: {numero} (offset={offset}, limit={limit})")
+        logger.info(f"📱 Obteniendo conversación para número: {numero} (limit={limit}, cursor={cursor})")
 
-        conversacion_messages = []
-
-        # ==================== OBTENER MENSAJES DE WHAPI ====================
-        try:
-            # Construir chat_id para Whapi
-            numero_clean = numero.replace('whatsapp:', '').replace('+', '')
-            chat_id = f"{numero_clean}@s.whatsapp.net"
+        pagina = listar_mensajes(numero_normalizado, limit, cursor)
 
-            logger.info(f"📱 Buscando mensajes Whapi para: {chat_id}")
-            mensajes_whapi = obtener_mensajes_whapi(chat_id)
-
-            for msg in mensajes_whapi:
-                mensaje_formateado = formatear_mensaje_whapi(msg, numero_clean)
-                if mensaje_formateado:
-                    conversacion_messages.append(mensaje_formateado)
-
-            logger.info(f"✅ Mensajes Whapi encontrados: {len([m for m in conversacion_messages if m.get('source') == 'whapi'])}")
-        except Exception as e:
-            logger.error(f"⚠️ Error obteniendo mensajes de Whapi: {str(e)}")
-
-        # ==================== ORDENAR Y FORMATEAR ====================
-        # Ordenar cronológicamente todos los mensajes (más antiguos primero)
-        conversacion_messages.sort(key=lambda x: x.get('date_sent', ''))
-
-        # Aplicar paginación (desde el final - mensajes más recientes)
-        total_messages = len(conversacion_messages)
-
-        # Calcular índices para paginación inversa
-        start_index = max(0, total_messages - offset - limit)
-        end_index = total_messages - offset
+        # Backfill en frío: solo la primera vez que se abre una conversación anterior al store
+        if not pagina['historial_cargado'] and not cursor:
+            try:
+                if backfill_historial(numero_normalizado):
+                    pagina = listar_mensajes(numero_normalizado, limit, cursor)
+            except Exception as e:
+                logger.error(f"⚠️ Error en backfill de Whapi para {numero_normalizado}: {str(e)}")
 
-        mensajes_paginados = conversacion_messages[start_index:end_index]
+        if not cursor:
+            marcar_leida(numero_normalizado)
 
-        logger.info(f"✅ Mensajes: {len(mensajes_paginados)}/{total_messages} (offset={offset}, limit={limit})")
+        mensajes_paginados = pagina['mensajes']
+        logger.info(f"✅ Mensajes: {len(mensajes_paginados)} (más antiguos: {pagina['next_cursor'] is not None})")
 
         return jsonify({
             'success': True,
             'numero': numero,
             'twilio_messages': mensajes_paginados,
-            'total': total_messages,
             'count': len(mensajes_paginados),
-            'offset': offset,
             'limit': limit,
-            'has_more': start_index > 0,
+            'has_more': pagina['next_cursor'] is not None,
+            'next_cursor': pagina['next_cursor'],
             'source': 'whapi'
         })
     except Exception as e:
@@ -1102,7 +1046,7 @@ def register_push_token_endpoint():
         if not token:
             return jsonify({'success': False, 'error': 'Token is required'}), 400
 
-        success = register_push_token(token, platform)
+        success = register_push_token(token, platform, agente=session.get('username'))
 
         if success:
             return jsonify({'success': True, 'message': 'Token registered successfully'})
@@ -1119,6 +1063,7 @@ def marcar_conversacion_leida(numero):
     """Marca una conversación como leída"""
     try:
         logger.info(f"📖 Marcando conversación como leída: {numero}")
+        marcar_leida(numero.replace('whatsapp:', '').replace('+', '').strip())
 
         # Notificar via WebSocket que la conversación fue marcada como leída
         broadcast_websocket_event('conversation_read', {
@@ -1187,115 +1132,178 @@ def twilio_enviar_mensaje():
 # WEBHOOKS
 # ============================================================================
 
+def procesar_mensaje_whapi(msg):
+    """
+    Procesa un mensaje de Whapi (lo llama el worker de la cola de webhooks):
+    asignación round-robin, store local, WebSocket y push.
+    """
+    chat_id = msg.get('chat_id', '')
+    from_number = msg.get('from', '')
+    message_id = msg.get('id', '')
+    message_type = msg.get('type', 'text')
+    from_me = msg.get('from_me', False)
+
+    # Extraer número limpio (SIN el +, como está en la BD)
+    numero_clean = chat_id.replace('@s.whatsapp.net', '').replace('@g.us', '')
+    numero_normalizado = numero_clean.lstrip('+')
+
+    # ========== ASIGNACIÓN AUTOMÁTICA ROUND-ROBIN ==========
+    agente = obtener_agente_asignado(numero_normalizado)
+
+    if not agente:
+        # Primera vez - Asignar con round-robin
+        agente = asignar_conversacion_round_robin(numero_normalizado)
+        logger.info(f"🆕 Nueva conversación {numero_normalizado} → {agente}")
+    else:
+        # Conversación existente - Actualizar actividad
+        actualizar_actividad_conversacion(numero_normalizado)
+        logger.info(f"📝 Conversación existente {numero_normalizado} → {agente}")
+
+    # Guardar en el store local (idempotente por ID de Whapi). Si falla, el
+    # worker reintenta el evento completo.
+    guardar_mensajes_whapi([msg])
+    # ======================================================
+
+    # Extraer el cuerpo del mensaje según el tipo
+    if message_type == 'text':
+        body = msg.get('text', {}).get('body', '')
+    else:
+        body = f'(media: {message_type})'
+
+    # Convertir timestamp UNIX a ISO string para frontend
+    timestamp = msg.get('timestamp', 0)
+    if isinstance(timestamp, (int, float)):
+        timestamp_iso = datetime.fromtimestamp(timestamp).isoformat()
+    else:
+        timestamp_iso = timestamp
+
+    logger.info(f"📱 Mensaje Whapi {message_id} ({message_type}) de {from_number} en {chat_id}, from_me={from_me}")
+
+    # Determinar dirección del mensaje
+    direction = 'outbound' if from_me else 'inbound'
+
+    # Enviar notificación WebSocket para TODOS los mensajes
+    broadcast_websocket_event('new_message', {
+        'numero': numero_clean,
+        'from': WHAPI_PHONE_NUMBER if from_me else from_number,
+        'to': numero_clean if from_me else WHAPI_PHONE_NUMBER,
+        'body': body,
+        'message_id': message_id,
+        'chat_id': chat_id,
+        'type': message_type,
+        'timestamp': timestamp_iso,
+        'direction': direction,
+        'source': 'whapi'
+    })
+
+    # Solo enviar push notification para mensajes entrantes (se encola: el
+    # despachador de push_notifications agrupa y envía en segundo plano)
+    if not from_me:
+        try:
+            send_new_message_notification(
+                sender_name=numero_clean,
+                message_body=body or '(media)',
+                conversation_id=numero_clean,
+                agente=agente
+            )
+        except Exception as push_error:
+            logger.error(f"⚠️ Error enviando push notification: {push_error}")
+
+def procesar_estado_whapi(status_update):
+    """Procesa un cambio de estado de Whapi (lo llama el worker de la cola de webhooks)"""
+    message_id = status_update.get('id', '')
+    status_code = status_update.get('code', 0)
+    status_text = status_update.get('status', '')
+    recipient_id = status_update.get('recipient_id', '')
+    timestamp = status_update.get('timestamp', 0)
+
+    # Limpiar el recipient_id para obtener el número
+    numero_clean = recipient_id.replace('@s.whatsapp.net', '').replace('@g.us', '')
+
+    # Convertir timestamp UNIX a ISO
+    if timestamp:
+        timestamp_iso = datetime.fromtimestamp(int(timestamp)).isoformat()
+    else:
+        timestamp_iso = None
+
+    actualizar_estado_mensaje([(message_id, status_text)])
+
+    # Emitir evento WebSocket para actualizar estado de mensaje
+    broadcast_websocket_event('message_status', {
+        'message_id': message_id,
+        'numero': numero_clean,
+        'status': status_text,
+        'status_code': status_code,
+        'timestamp': timestamp_iso,
+        'source': 'whapi'
+    })
+
+    # Si es un mensaje leído, actualizar la conversación
+    if status_text == 'read' or status_code == 4:
+        broadcast_websocket_event('conversation_update', {
+            'numero': numero_clean,
+            'last_read_timestamp': timestamp_iso,
+            'event_type': 'message_read',
+            'source': 'whapi'
+        })
+
+MANEJADORES_WEBHOOK = {
+    'mensaje': procesar_mensaje_whapi,
+    'estado': procesar_estado_whapi,
+}
+
+def encolar_o_procesar(eventos):
+    """
+    Encola los eventos en la cola durable y vuelve. Si la cola está apagada o
+    la BD no responde, se procesan en línea como antes (mejor lento que perdido).
+    """
+    if WEBHOOK_COLA_ENABLED:
+        try:
+            # Normalmente ya arrancaron en inicializar_servicios; no hace nada si es así
+            iniciar_workers_webhooks(MANEJADORES_WEBHOOK)
+            nuevos = encolar_eventos(eventos)
+            logger.info(f"📥 Webhook Whapi: {nuevos}/{len(eventos)} eventos encolados")
+            return
+        except Exception as e:
+            logger.error(f"⚠️ Cola de webhooks no disponible ({e}) — procesando en línea")
+
+    for ev in eventos:
+        try:
+            MANEJADORES_WEBHOOK[ev['tipo']](ev['payload'])
+        except Exception as e:
+            logger.error(f"❌ Error procesando evento {ev['evento_id']}: {e}")
+
 @chat_bp.route('/webhook/whapi', methods=['GET', 'POST'])
 def whapi_webhook():
-    """Webhook para mensajes entrantes de Whapi - Con asignación automática round-robin"""
+    """
+    Webhook para mensajes entrantes de Whapi. Solo valida y encola: la
+    asignación round-robin, el store, el WebSocket y el push los hace el
+    worker de la cola (cola_webhooks.py).
+    """
     try:
         # Si es GET, responder para validación de Whapi
         if request.method == 'GET':
             return jsonify({'success': True, 'status': 'webhook_ready', 'service': 'whapi'}), 200
 
         # Whapi envía JSON en lugar de form data
-        data = request.get_json()
-
-        logger.info("="*60)
-        logger.info("📨 MENSAJE ENTRANTE DE WHAPI")
-        logger.info(f"   Payload completo: {json_module.dumps(data, indent=2)}")
-        logger.info("="*60)
-
-        # ========== ASIGNACIÓN AUTOMÁTICA ROUND-ROBIN ==========
-        messages = data.get('messages', [])
-
-        if messages:
-            for msg in messages:
-                chat_id = msg.get('chat_id', '')
-                from_number = msg.get('from', '')
-
-                # Extraer número limpio (SIN el +, como está en la BD)
-                numero_clean = chat_id.replace('@s.whatsapp.net', '').replace('@g.us', '')
-                # Remover + si existe para que coincida con la BD
-                numero_normalizado = numero_clean.lstrip('+')
-
-                # Verificar asignación existente
-                agente = obtener_agente_asignado(numero_normalizado)
-
-                if not agente:
-                    # Primera vez - Asignar con round-robin
-                    agente = asignar_conversacion_round_robin(numero_normalizado)
-                    logger.info(f"🆕 Nueva conversación {numero_normalizado} → {agente}")
-                else:
-                    # Conversación existente - Actualizar actividad
-                    actualizar_actividad_conversacion(numero_normalizado)
-                    logger.info(f"📝 Conversación existente {numero_normalizado} → {agente}")
-        # ======================================================
-
-        # Extraer información del mensaje de Whapi
-        event = data.get('event', {})
-
-        if messages:
-            for msg in messages:
-                chat_id = msg.get('chat_id', '')
-                from_number = msg.get('from', '')
-                message_id = msg.get('id', '')
-                message_type = msg.get('type', 'text')
-
-                # Extraer el cuerpo del mensaje según el tipo
-                if message_type == 'text':
-                    body = msg.get('text', {}).get('body', '')
-                else:
-                    body = f'(media: {message_type})'
-
-                from_me = msg.get('from_me', False)
-                timestamp = msg.get('timestamp', 0)
-
-                # Convertir timestamp UNIX a ISO string para frontend
-                from datetime import datetime
-                if isinstance(timestamp, (int, float)):
-                    timestamp_iso = datetime.fromtimestamp(timestamp).isoformat()
-                else:
-                    timestamp_iso = timestamp
-
-                logger.info("📱 Procesando mensaje de Whapi:")
-                logger.info(f"   ID: {message_id}")
-                logger.info(f"   Chat ID: {chat_id}")
-                logger.info(f"   De: {from_number}")
-                logger.info(f"   Tipo: {message_type}")
-                logger.info(f"   Mensaje: {body}")
-                logger.info(f"   From me: {from_me}")
-
-                # Extraer número limpio
-                numero_clean = chat_id.replace('@s.whatsapp.net', '').replace('@g.us', '')
-
-                # Determinar dirección del mensaje
-                direction = 'outbound' if from_me else 'inbound'
-
-                # Enviar notificación WebSocket para TODOS los mensajes
-                broadcast_websocket_event('new_message', {
-                    'numero': numero_clean,
-                    'from': WHAPI_PHONE_NUMBER if from_me else from_number,
-                    'to': numero_clean if from_me else WHAPI_PHONE_NUMBER,
-                    'body': body,
-                    'message_id': message_id,
-                    'chat_id': chat_id,
-                    'type': message_type,
-                    'timestamp': timestamp_iso,
-                    'direction': direction,
-                    'source': 'whapi'
-                })
-
-                logger.info(f"✅ Notificación WebSocket enviada para mensaje {direction} de Whapi: {numero_clean}")
-
-                # Solo enviar push notification para mensajes entrantes
-                if not from_me:
-                    try:
-                        send_new_message_notification(
-                            sender_name=numero_clean,
-                            message_body=body or '(media)',
-                            conversation_id=numero_clean
-                        )
-                    except Exception as push_error:
-                        logger.error(f"⚠️ Error enviando push notification: {push_error}")
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'JSON inválido'}), 400
+
+        logger.debug(f"📨 Payload Whapi: {json_module.dumps(data)}")
+
+        eventos = []
+        for msg in data.get('messages') or []:
+            if not isinstance(msg, dict) or not msg.get('chat_id'):
+                continue
+            eventos.append({
+                'evento_id': f"msg:{msg.get('id') or uuid.uuid4().hex}",
+                'tipo': 'mensaje',
+                'clave_orden': msg['chat_id'].replace('@s.whatsapp.net', '').replace('@g.us', '').lstrip('+'),
+                'payload': msg
+            })
 
+        encolar_o_procesar(eventos)
         return jsonify({'success': True}), 200
 
     except Exception as e:
@@ -1305,67 +1313,26 @@ def whapi_webhook():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 def whapi_webhook_statuses():
-    """Procesa cambios de estado de mensajes (read receipts, delivery)"""
+    """Cambios de estado de mensajes (read receipts, delivery): valida y encola"""
     try:
-        data = request.get_json()
-
-        logger.info("="*60)
-        logger.info("📨 EVENTO WHAPI: CAMBIO DE ESTADO DE MENSAJE")
-        logger.info(f"   Payload: {json_module.dumps(data, indent=2)}")
-        logger.info("="*60)
-
-        statuses = data.get('statuses', [])
-
-        if not statuses:
-            return jsonify({'success': True}), 200
-
-        # Procesar cada cambio de estado
-        for status_update in statuses:
-            message_id = status_update.get('id', '')
-            status_code = status_update.get('code', 0)
-            status_text = status_update.get('status', '')
-            recipient_id = status_update.get('recipient_id', '')
-            timestamp = status_update.get('timestamp', 0)
-
-            # Limpiar el recipient_id para obtener el número
-            numero_clean = recipient_id.replace('@s.whatsapp.net', '').replace('@g.us', '')
-
-            # Convertir timestamp UNIX a ISO
-            from datetime import datetime
-            if timestamp:
-                timestamp_int = int(timestamp) if isinstance(timestamp, str) else timestamp
-                timestamp_iso = datetime.fromtimestamp(timestamp_int).isoformat()
-            else:
-                timestamp_iso = None
-
-            logger.info("📱 Procesando cambio de estado:")
-            logger.info(f"   Mensaje ID: {message_id}")
-            logger.info(f"   Estado: {status_text} (code: {status_code})")
-            logger.info(f"   Contacto: {numero_clean}")
-            logger.info(f"   Timestamp: {timestamp_iso}")
-
-            # Emitir evento WebSocket para actualizar estado de mensaje
-            broadcast_websocket_event('message_status', {
-                'message_id': message_id,
-                'numero': numero_clean,
-                'status': status_text,
-                'status_code': status_code,
-                'timestamp': timestamp_iso,
-                'source': 'whapi'
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'JSON inválido'}), 400
+
+        logger.debug(f"📨 Estados Whapi: {json_module.dumps(data)}")
+
+        eventos = []
+        for st in data.get('statuses') or []:
+            if not isinstance(st, dict) or not st.get('id'):
+                continue
+            eventos.append({
+                'evento_id': f"st:{st['id']}:{st.get('status', '')}",
+                'tipo': 'estado',
+                'clave_orden': (st.get('recipient_id') or '').replace('@s.whatsapp.net', '').replace('@g.us', '').lstrip('+'),
+                'payload': st
             })
 
-            logger.info(f"✅ WebSocket event 'message_status' enviado para {numero_clean}")
-
-            # Si es un mensaje leído, actualizar la conversación
-            if status_text == 'read' or status_code == 4:
-                broadcast_websocket_event('conversation_update', {
-                    'numero': numero_clean,
-                    'last_read_timestamp': timestamp_iso,
-                    'event_type': 'message_read',
-                    'source': 'whapi'
-                })
-                logger.info(f"✅ WebSocket event 'conversation_update' enviado (read): {numero_clean}")
-
+        encolar_o_procesar(eventos)
         return jsonify({'success': True}), 200
 
     except Exception as e:
@@ -1374,6 +1341,15 @@ def whapi_webhook_statuses():
         logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@chat_bp.route('/api/metricas/cola-webhooks')
+def metricas_cola_webhooks():
+    """Pendientes, lag y latencia de la cola de webhooks"""
+    try:
+        return jsonify(obtener_metricas_cola())
+    except Exception as e:
+        logger.error(f"❌ Error obteniendo métricas de la cola: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 def whapi_webhook_chats():
     """Procesa actualizaciones de chat - DESHABILITADO"""
     try:
@@ -1401,6 +1377,47 @@ def whapi_webhook_events():
 
     return jsonify({'error': 'Unknown event type'}), 400
 
+@chat_bp.route('/webhook/twilio/status', methods=['POST'])
+def twilio_status_callback():
+    """
+    Status callback de Twilio (chat y certificados). Guarda el último estado por
+    SID en twilio_mensajes_estado; el worker de reintentos toma los fallidos.
+    Solo acepta requests firmados por Twilio: un "failed" falso dispararía
+    reenvíos de certificados.
+    """
+    from twilio_estados import registrar_estado, firma_twilio_valida
+
+    # Detrás del balanceador Flask ve http://; Twilio firmó la URL pública (https)
+    urls = [request.url]
+    if request.url.startswith('http://'):
+        urls.append('https://' + request.url[len('http://'):])
+    try:
+        firma_ok = firma_twilio_valida(urls, request.form.to_dict(), request.headers.get('X-Twilio-Signature'))
+    except Exception as e:
+        logger.error(f"❌ Error validando firma Twilio: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if not firma_ok:
+        logger.warning(f"🚫 Status callback Twilio con firma inválida desde {request.remote_addr}")
+        return jsonify({'error': 'Firma de Twilio inválida'}), 403
+
+    sid = request.values.get('MessageSid')
+    estado = request.values.get('MessageStatus')
+    if not sid or not estado:
+        return jsonify({'error': 'MessageSid y MessageStatus requeridos'}), 400
+
+    try:
+        registrar_estado(
+            sid, estado,
+            error_code=request.values.get('ErrorCode'),
+            destino=request.values.get('To')
+        )
+        if estado in ('failed', 'undelivered'):
+            logger.warning(f"⚠️ Mensaje {sid} {estado} (error {request.values.get('ErrorCode')})")
+        return '', 204
+    except Exception as e:
+        logger.error(f"❌ Error guardando estado Twilio {sid}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Servir archivos estáticos
 @chat_bp.route('/static/<path:filename>')
 def twilio_static(filename):
@@ -1414,10 +1431,17 @@ def twilio_static(filename):
 
 def register_socketio_handlers(socketio):
     """Registra los handlers de Socket.IO para el namespace /twilio-chat"""
+    from flask_socketio import join_room, leave_room
 
     @socketio.on('connect', namespace='/twilio-chat')
     def handle_connect():
-        logger.info(f"✅ Cliente conectado a Socket.IO (namespace: /twilio-chat)")
+        username = session.get('username') if session.get('logged_in') else None
+        if username:
+            join_room(sala_agente(username))
+            logger.info(f"✅ Agente {username} conectado a Socket.IO (sala {sala_agente(username)})")
+        else:
+            join_room(SALA_SIN_SESION)
+            logger.info("✅ Cliente sin sesión conectado a Socket.IO (recibe todos los eventos)")
         emit('connection_status', {'status': 'connected', 'timestamp': datetime.now().isoformat()})
 
     @socketio.on('disconnect', namespace='/twilio-chat')
@@ -1426,10 +1450,23 @@ def register_socketio_handlers(socketio):
 
     @socketio.on('join_conversation', namespace='/twilio-chat')
     def handle_join_conversation(data):
-        numero = data.get('numero')
+        numero = (data or {}).get('numero')
+        if not numero:
+            return
+        username = session.get('username') if session.get('logged_in') else None
+        if username and obtener_agente_asignado(numero.replace('whatsapp:', '').lstrip('+')) != username:
+            emit('joined_conversation', {'numero': numero, 'error': 'No tienes permiso para ver esta conversación'})
+            return
+        join_room(sala_conversacion(numero))
         logger.info(f"👤 Cliente se unió a conversación: {numero}")
         emit('joined_conversation', {'numero': numero, 'timestamp': datetime.now().isoformat()})
 
+    @socketio.on('leave_conversation', namespace='/twilio-chat')
+    def handle_leave_conversation(data):
+        numero = (data or {}).get('numero')
+        if numero:
+            leave_room(sala_conversacion(numero))
+
     logger.info("📡 Socket.IO handlers registrados para /twilio-chat")
 
 logger.info("📦 Chat WhatsApp module loaded - All endpoints OK")
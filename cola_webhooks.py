@@ -0,0 +1,291 @@
+"""
+Cola Durable de Webhooks de Whapi
+=================================
+
+El webhook valida, encola y responde 200 de inmediato. Antes hacía la
+asignación en BD, el broadcast WebSocket y el push de Expo (timeout 10 s)
+antes de responder: cuando algo se ponía lento Whapi reintentaba y la carga
+se multiplicaba.
+
+- Una fila por mensaje / cambio de estado en webhook_eventos; evento_id único
+  descarta los reenvíos de Whapi.
+- Los workers reclaman con FOR UPDATE SKIP LOCKED el evento más viejo de cada
+  conversación que no tenga otro anterior sin terminar: orden por conversación
+  aunque haya varios workers o procesos.
+- Reintentos con backoff; tras WEBHOOK_COLA_MAX_INTENTOS el evento queda
+  'fallido' y deja pasar a los siguientes de su conversación.
+- obtener_metricas_cola(): pendientes, lag y latencia de procesamiento.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import random
+import logging
+import threading
+import time
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+WEBHOOK_COLA_ENABLED = os.getenv("WEBHOOK_COLA_ENABLED", "true").lower() == "true"
+WEBHOOK_COLA_WORKERS = int(os.getenv("WEBHOOK_COLA_WORKERS", "4"))
+WEBHOOK_COLA_MAX_INTENTOS = 5
+WEBHOOK_COLA_LOTE = 20                 # eventos reclamados por consulta
+WEBHOOK_COLA_POLL_SEG = 2              # espera cuando la cola está vacía
+WEBHOOK_COLA_LOCK_TIMEOUT = 5 * 60     # eventos 'procesando' más viejos se consideran huérfanos
+WEBHOOK_COLA_RETENCION_DIAS = 7
+
+_workers = []
+_workers_lock = threading.Lock()
+_despertar = threading.Event()
+_metricas = {'encolados': 0, 'duplicados': 0, 'procesados': 0, 'errores': 0}
+_metricas_lock = threading.Lock()
+
+
+def _conectar():
+    """Conexión con la tabla garantizada (se crea la primera vez en el proceso)"""
+    return conectar_con_esquema('init_cola_webhooks.sql')
+
+
+def _contar(clave, n=1):
+    with _metricas_lock:
+        _metricas[clave] += n
+
+
+# ============================================================================
+# ENCOLAR
+# ============================================================================
+
+def encolar_eventos(eventos):
+    """
+    Encola eventos ya separados por el webhook.
+
+    Args:
+        eventos: lista de dicts {'evento_id', 'tipo', 'clave_orden', 'payload'}
+
+    Returns:
+        int: eventos nuevos (los reenvíos ya encolados se ignoran)
+    """
+    if not eventos:
+        return 0
+
+    nuevos = 0
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        for ev in eventos:
+            cur.execute(
+                """
+                INSERT INTO webhook_eventos (evento_id, tipo, clave_orden, payload)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (evento_id) DO NOTHING
+                """,
+                (ev['evento_id'], ev['tipo'], ev['clave_orden'], json.dumps(ev['payload']))
+            )
+            nuevos += cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    _contar('encolados', nuevos)
+    _contar('duplicados', len(eventos) - nuevos)
+    if nuevos:
+        _despertar.set()
+    return nuevos
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+def _tomar_eventos(cur):
+    """
+    Reclama el evento más viejo de cada conversación que no tenga uno anterior
+    sin terminar (pendiente o procesando): así dos workers nunca procesan dos
+    eventos de la misma conversación a la vez ni fuera de orden.
+    """
+    cur.execute(
+        """
+        UPDATE webhook_eventos
+        SET estado = 'procesando', intentos = intentos + 1, bloqueado_en = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT e.id FROM webhook_eventos e
+            WHERE ((e.estado = 'pendiente' AND e.proximo_intento <= CURRENT_TIMESTAMP)
+                   OR (e.estado = 'procesando' AND e.bloqueado_en < CURRENT_TIMESTAMP - make_interval(secs => %s)))
+              AND NOT EXISTS (
+                  SELECT 1 FROM webhook_eventos p
+                  WHERE p.clave_orden = e.clave_orden AND p.id < e.id
+                    AND p.estado IN ('pendiente', 'procesando')
+              )
+            ORDER BY e.id
+            FOR UPDATE SKIP LOCKED
+            LIMIT %s
+        )
+        RETURNING id, tipo, payload, intentos
+        """,
+        (WEBHOOK_COLA_LOCK_TIMEOUT, WEBHOOK_COLA_LOTE)
+    )
+    return sorted(cur.fetchall())
+
+
+def procesar_lote(manejadores):
+    """
+    Procesa un lote de eventos.
+
+    Args:
+        manejadores: dict tipo -> callable(payload)
+
+    Returns:
+        int: eventos tomados (0 si la cola estaba vacía)
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        eventos = _tomar_eventos(cur)
+        conn.commit()
+
+        for evento_id, tipo, payload, intentos in eventos:
+            try:
+                manejadores[tipo](payload)
+                cur.execute(
+                    """
+                    UPDATE webhook_eventos
+                    SET estado = 'procesado', procesado_en = CURRENT_TIMESTAMP, bloqueado_en = NULL, ultimo_error = NULL
+                    WHERE id = %s
+                    """,
+                    (evento_id,)
+                )
+                _contar('procesados')
+            except Exception as e:
+                _contar('errores')
+                if intentos >= WEBHOOK_COLA_MAX_INTENTOS:
+                    cur.execute(
+                        "UPDATE webhook_eventos SET estado = 'fallido', ultimo_error = %s, bloqueado_en = NULL WHERE id = %s",
+                        (str(e)[:2000], evento_id)
+                    )
+                    logger.error(f"❌ Evento webhook #{evento_id} ({tipo}) falló definitivamente: {e}")
+                else:
+                    espera = random.uniform(1, 2 ** intentos)
+                    cur.execute(
+                        """
+                        UPDATE webhook_eventos
+                        SET estado = 'pendiente', ultimo_error = %s, bloqueado_en = NULL,
+                            proximo_intento = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                        WHERE id = %s
+                        """,
+                        (str(e)[:2000], espera, evento_id)
+                    )
+                    logger.warning(f"⚠️ Evento webhook #{evento_id} ({tipo}) falló (intento {intentos}), reintento en {espera:.0f}s: {e}")
+            conn.commit()
+
+        cur.close()
+        return len(eventos)
+    finally:
+        conn.close()
+
+
+def limpiar_procesados():
+    """Borra eventos procesados más viejos que la retención"""
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM webhook_eventos WHERE estado = 'procesado' AND procesado_en < CURRENT_TIMESTAMP - make_interval(days => %s)",
+            (WEBHOOK_COLA_RETENCION_DIAS,)
+        )
+        borrados = cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    if borrados:
+        logger.info(f"🧹 Cola de webhooks: {borrados} eventos procesados eliminados")
+
+
+def _loop_worker(manejadores, limpiador):
+    ultima_limpieza = 0
+    while True:
+        try:
+            if procesar_lote(manejadores):
+                continue
+            if limpiador and time.time() - ultima_limpieza > 3600:
+                ultima_limpieza = time.time()
+                limpiar_procesados()
+        except Exception as e:
+            logger.error(f"❌ Error en worker de la cola de webhooks: {e}")
+        _despertar.wait(WEBHOOK_COLA_POLL_SEG)
+        _despertar.clear()
+
+
+def iniciar_workers_webhooks(manejadores, num_workers=None):
+    """Arranca (una sola vez por proceso) los workers de la cola"""
+    with _workers_lock:
+        if _workers:
+            return
+        for i in range(num_workers or WEBHOOK_COLA_WORKERS):
+            t = threading.Thread(
+                target=_loop_worker, args=(manejadores, i == 0),
+                name=f"cola-webhooks-{i}", daemon=True
+            )
+            t.start()
+            _workers.append(t)
+    logger.info(f"✅ Workers de la cola de webhooks iniciados: {len(_workers)}")
+
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+def obtener_metricas_cola():
+    """Estado de la cola: pendientes, lag del evento más viejo y latencia reciente"""
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE estado = 'pendiente'),
+                COUNT(*) FILTER (WHERE estado = 'procesando'),
+                COUNT(*) FILTER (WHERE estado = 'fallido'),
+                EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(recibido_en) FILTER (WHERE estado IN ('pendiente', 'procesando')))
+            FROM webhook_eventos
+            WHERE estado <> 'procesado'
+            """
+        )
+        pendientes, procesando, fallidos, lag = cur.fetchone()
+        cur.execute(
+            """
+            SELECT COUNT(*),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM procesado_en - recibido_en)),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM procesado_en - recibido_en))
+            FROM webhook_eventos
+            WHERE estado = 'procesado' AND procesado_en > CURRENT_TIMESTAMP - INTERVAL '5 minutes'
+            """
+        )
+        recientes, p50, p95 = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    with _metricas_lock:
+        proceso = dict(_metricas)
+    return {
+        'pendientes': pendientes,
+        'procesando': procesando,
+        'fallidos': fallidos,
+        'lag_seg': round(float(lag), 3) if lag is not None else 0.0,
+        'procesados_5min': recientes,
+        'latencia_p50_seg': round(float(p50), 3) if p50 is not None else None,
+        'latencia_p95_seg': round(float(p95), 3) if p95 is not None else None,
+        'workers': len(_workers),
+        'proceso': proceso,
+    }
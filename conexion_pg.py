@@ -0,0 +1,77 @@
+"""
+Conexión PostgreSQL Compartida
+==============================
+
+Un solo lugar para abrir conexiones a PostgreSQL desde los módulos de
+soporte (outbox, colas, cachés, workers), con las mismas variables de
+entorno que el resto de la aplicación.
+
+- obtener_conexion_pg(): conexión nueva
+- conectar_con_esquema(): conexión con las tablas de sql/<archivo>
+  garantizadas; el script se ejecuta la primera vez en el proceso
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import threading
+
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql')
+
+_esquemas_listos = set()
+_esquemas_lock = threading.Lock()
+
+
+def obtener_conexion_pg():
+    """
+    Helper para obtener conexión PostgreSQL.
+    Usa las mismas variables de entorno que el resto de la aplicación.
+    """
+    import psycopg2
+
+    postgres_password = os.getenv("POSTGRES_PASSWORD")
+    if not postgres_password:
+        raise Exception("POSTGRES_PASSWORD no configurada")
+
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
+        port=int(os.getenv("POSTGRES_PORT", "25060")),
+        user=os.getenv("POSTGRES_USER", "doadmin"),
+        password=postgres_password,
+        database=os.getenv("POSTGRES_DB", "defaultdb"),
+        sslmode="require",
+        connect_timeout=5
+    )
+
+
+def ejecutar_script_sql(conn, archivo_sql, despues=None):
+    """
+    Ejecuta sql/<archivo_sql> y hace commit.
+
+    Args:
+        despues: callable(cur) opcional, corre en la misma transacción
+                 (p.ej. migrar datos a la tabla recién creada)
+    """
+    cur = conn.cursor()
+    with open(os.path.join(SQL_DIR, archivo_sql), 'r', encoding='utf-8') as f:
+        cur.execute(f.read())
+    if despues:
+        despues(cur)
+    conn.commit()
+    cur.close()
+
+
+def conectar_con_esquema(archivo_sql, despues=None):
+    """Conexión con las tablas de sql/<archivo_sql> garantizadas (se crean la primera vez en el proceso)"""
+    conn = obtener_conexion_pg()
+    if archivo_sql not in _esquemas_listos:
+        with _esquemas_lock:
+            if archivo_sql not in _esquemas_listos:
+                try:
+                    ejecutar_script_sql(conn, archivo_sql, despues)
+                except Exception:
+                    conn.close()
+                    raise
+                _esquemas_listos.add(archivo_sql)
+    return conn
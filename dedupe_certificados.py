@@ -0,0 +1,277 @@
+"""
+Anti-reenvío de Certificados por WhatsApp (compartido entre procesos)
+=====================================================================
+
+Ventana de de-duplicación de envíos de certificado guardada fuera del
+proceso, para que varios workers (o un reinicio) no dejen pasar reenvíos:
+
+- postgres: tabla envios_certificado_dedupe (sql/init_envios_certificado_dedupe.sql),
+            reclamo atómico en una sola sentencia INSERT ... ON CONFLICT ...
+            (default); las filas fuera de la ventana se purgan
+- redis:    SET NX EX (REDIS_URL), stand-in local / alternativa liviana
+- memoria:  dict del proceso (comportamiento anterior; fallback si el
+            backend compartido falla)
+
+Cada duplicado detectado es un render de PDF + un mensaje Twilio que no se
+hizo; obtener_metricas_dedupe() reporta cuántos.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import time
+import logging
+import threading
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+VENTANA_DEDUPE_CERTIFICADO_SEG = 10 * 60
+DEDUPE_CERTIFICADO_BACKEND = os.getenv("DEDUPE_CERTIFICADO_BACKEND", "postgres")  # postgres, redis, memoria
+DEDUPE_PURGA_SEG = 10 * 60
+
+_metricas = {
+    'consultas': 0,
+    'duplicados_evitados': 0,   # = renders + envíos Twilio ahorrados
+    'envios_registrados': 0,
+    'errores_backend': 0,
+}
+_metricas_lock = threading.Lock()
+
+
+def _contar(clave):
+    with _metricas_lock:
+        _metricas[clave] += 1
+
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class DedupeMemoria:
+    """Dict del proceso con limpieza oportunista (solo sirve con un worker)."""
+
+    nombre = "memoria"
+
+    def __init__(self):
+        self._ultimo_envio = {}  # wix_id -> timestamp del último envío
+        self._lock = threading.Lock()
+
+    def reclamar(self, wix_id, ventana_seg, marcar=True):
+        ahora = time.time()
+        with self._lock:
+            # Limpieza oportunista para que el dict no crezca sin control
+            if len(self._ultimo_envio) > 500:
+                for k, ts in list(self._ultimo_envio.items()):
+                    if ahora - ts > ventana_seg:
+                        self._ultimo_envio.pop(k, None)
+
+            ultimo = self._ultimo_envio.get(wix_id)
+            if ultimo and (ahora - ultimo) < ventana_seg:
+                return False
+            if marcar:
+                self._ultimo_envio[wix_id] = ahora
+            return True
+
+    def liberar(self, wix_id):
+        with self._lock:
+            self._ultimo_envio.pop(wix_id, None)
+
+    def duplicados_totales(self):
+        return None
+
+
+class DedupePostgres:
+    """Tabla compartida; el reclamo es una sola sentencia atómica."""
+
+    nombre = "postgres"
+
+    # Inserta o, si la fila existe y el último envío salió de la ventana, la renueva.
+    # Dentro de la ventana solo suma el duplicado. sent_at = now() (timestamp de la
+    # transacción) indica si este llamado ganó el envío.
+    SQL_RECLAMAR = """
+        INSERT INTO envios_certificado_dedupe AS d (wix_id, sent_at)
+        VALUES (%(wix_id)s, now())
+        ON CONFLICT (wix_id) DO UPDATE SET
+            sent_at = CASE WHEN d.sent_at < now() - make_interval(secs => %(ventana)s)
+                           THEN now() ELSE d.sent_at END,
+            duplicados_evitados = d.duplicados_evitados +
+                CASE WHEN d.sent_at < now() - make_interval(secs => %(ventana)s) THEN 0 ELSE 1 END
+        RETURNING d.sent_at = now()
+    """
+
+    SQL_CONSULTAR = """
+        SELECT EXISTS (
+            SELECT 1 FROM envios_certificado_dedupe
+            WHERE wix_id = %(wix_id)s AND sent_at >= now() - make_interval(secs => %(ventana)s)
+        )
+    """
+
+    # Las filas fuera de la ventana ya no deciden nada: se borran y sus
+    # duplicados pasan al total histórico
+    SQL_PURGAR = """
+        WITH borradas AS (
+            DELETE FROM envios_certificado_dedupe
+            WHERE sent_at < now() - make_interval(secs => %(ventana)s)
+            RETURNING duplicados_evitados
+        )
+        UPDATE envios_certificado_dedupe_totales
+        SET duplicados_evitados = duplicados_evitados + (SELECT COALESCE(SUM(duplicados_evitados), 0) FROM borradas)
+    """
+
+    SQL_TOTAL = """
+        SELECT (SELECT duplicados_evitados FROM envios_certificado_dedupe_totales)
+             + (SELECT COALESCE(SUM(duplicados_evitados), 0) FROM envios_certificado_dedupe)
+    """
+
+    def __init__(self):
+        self._ultima_purga = 0.0
+
+    def _ejecutar(self, sql, params, commit=True):
+        conn = conectar_con_esquema('init_envios_certificado_dedupe.sql')
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            row = cur.fetchone() if cur.description else None
+            if commit:
+                conn.commit()
+            cur.close()
+            return row
+        finally:
+            conn.close()
+
+    def purgar(self, ventana_seg):
+        """Borra las filas fuera de la ventana (a lo sumo cada DEDUPE_PURGA_SEG por proceso)"""
+        ahora = time.time()
+        if ahora - self._ultima_purga < DEDUPE_PURGA_SEG:
+            return
+        self._ultima_purga = ahora
+        try:
+            self._ejecutar(self.SQL_PURGAR, {'ventana': ventana_seg})
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo purgar la tabla de dedupe: {e}")
+
+    def reclamar(self, wix_id, ventana_seg, marcar=True):
+        params = {'wix_id': wix_id, 'ventana': ventana_seg}
+        if not marcar:
+            return not self._ejecutar(self.SQL_CONSULTAR, params, commit=False)[0]
+        libre = bool(self._ejecutar(self.SQL_RECLAMAR, params)[0])
+        self.purgar(ventana_seg)
+        return libre
+
+    def liberar(self, wix_id):
+        self._ejecutar("DELETE FROM envios_certificado_dedupe WHERE wix_id = %(wix_id)s", {'wix_id': wix_id})
+
+    def duplicados_totales(self):
+        row = self._ejecutar(self.SQL_TOTAL, {}, commit=False)
+        return int(row[0])
+
+
+class DedupeRedis:
+    """SET NX EX: la llave expira sola al cerrar la ventana."""
+
+    nombre = "redis"
+    PREFIJO = "dedupe:certificado:"
+
+    def __init__(self):
+        import redis
+        self.cliente = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+
+    def reclamar(self, wix_id, ventana_seg, marcar=True):
+        llave = self.PREFIJO + str(wix_id)
+        if not marcar:
+            return not self.cliente.exists(llave)
+        if self.cliente.set(llave, int(time.time()), nx=True, ex=int(ventana_seg)):
+            return True
+        self.cliente.incr(self.PREFIJO + "_duplicados")
+        return False
+
+    def liberar(self, wix_id):
+        self.cliente.delete(self.PREFIJO + str(wix_id))
+
+    def duplicados_totales(self):
+        return int(self.cliente.get(self.PREFIJO + "_duplicados") or 0)
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+_respaldo = DedupeMemoria()
+_backend = None
+
+
+def _obtener_backend():
+    global _backend
+    if _backend is None:
+        try:
+            if DEDUPE_CERTIFICADO_BACKEND == "postgres":
+                _backend = DedupePostgres()
+            elif DEDUPE_CERTIFICADO_BACKEND == "redis":
+                _backend = DedupeRedis()
+            else:
+                _backend = _respaldo
+        except Exception as e:
+            logger.error(f"❌ Backend de dedupe '{DEDUPE_CERTIFICADO_BACKEND}' no disponible ({e}) — usando memoria")
+            _backend = _respaldo
+    return _backend
+
+
+def certificado_enviado_recientemente(wix_id, marcar=True, ventana_seg=VENTANA_DEDUPE_CERTIFICADO_SEG):
+    """
+    True si a esta orden ya se le envió el certificado dentro de la ventana.
+    Con marcar=True, si no se había enviado, queda reservado el envío (atómico
+    entre procesos: de dos llamadas simultáneas solo una recibe False).
+
+    Falla abierto: si el backend compartido revienta, decide con la memoria del proceso.
+    """
+    _contar('consultas')
+    backend = _obtener_backend()
+    try:
+        libre = backend.reclamar(wix_id, ventana_seg, marcar)
+    except Exception as e:
+        _contar('errores_backend')
+        logger.warning(f"⚠️ Dedupe {backend.nombre} falló ({e}) — usando memoria del proceso")
+        libre = _respaldo.reclamar(wix_id, ventana_seg, marcar)
+
+    if not libre:
+        _contar('duplicados_evitados')
+        return True
+    if marcar:
+        _contar('envios_registrados')
+    return False
+
+
+def liberar_envio_certificado(wix_id):
+    """Libera la reserva si el envío falló, para que el paciente pueda reintentar ya."""
+    _respaldo.liberar(wix_id)
+    backend = _obtener_backend()
+    if backend is _respaldo:
+        return
+    try:
+        backend.liberar(wix_id)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo liberar dedupe de {wix_id}: {e}")
+
+
+def obtener_metricas_dedupe():
+    """Contadores del proceso + total histórico del backend compartido"""
+    with _metricas_lock:
+        metricas = dict(_metricas)
+    backend = _obtener_backend()
+    metricas['backend'] = backend.nombre
+    metricas['ventana_seg'] = VENTANA_DEDUPE_CERTIFICADO_SEG
+    metricas['tasa_duplicados'] = (
+        round(metricas['duplicados_evitados'] / metricas['consultas'], 4) if metricas['consultas'] else 0.0
+    )
+    # Cada duplicado evitado es un render de PDF + un mensaje Twilio que no se hizo
+    metricas['renders_ahorrados'] = metricas['duplicados_evitados']
+    metricas['envios_ahorrados'] = metricas['duplicados_evitados']
+    try:
+        metricas['duplicados_evitados_total'] = backend.duplicados_totales()
+    except Exception as e:
+        metricas['duplicados_evitados_total'] = None
+        metricas['error_total'] = str(e)
+    return metricas
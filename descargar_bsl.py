@@ -1,4 +1,17 @@
 import os
+
+# Modo alta concurrencia: con gevent hay que parchear la stdlib (y psycopg2)
+# antes de importar cualquier otra cosa
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+if SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
 import requests
 import base64
 from flask import Flask, request, jsonify, send_file, send_from_directory, redirect, render_template, make_response, Response, stream_with_context
@@ -20,6 +33,7 @@ import json as json_module
 import time
 import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import locale
 
 # Configurar locale español para fechas
@@ -37,6 +51,21 @@ from do_spaces_uploader import subir_imagen_a_do_spaces
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from push_notifications import register_push_token, send_new_message_notification
+from twilio_clients import obtener_cliente_twilio
+from dedupe_certificados import certificado_enviado_recientemente, liberar_envio_certificado, obtener_metricas_dedupe
+from envio_masivo_certificados import crear_mensaje_con_limite, crear_trabajo, obtener_trabajo, ENVIO_MASIVO_MAX_ORDENES
+from twilio_estados import registrar_envio, iniciar_worker_reintentos, obtener_metricas_entrega
+from snapshots_informe import guardar_snapshot, obtener_snapshot
+from estadisticas_informe import calcular_estadisticas
+from cache_llm import completar_chat, invalidar_cache_llm, obtener_metricas_llm
+from adc_interpretaciones import (
+    obtener_adc_almacenado, iniciar_worker_adc, obtener_metricas_adc, reencolar_interpretacion
+)
+from certificado_snapshot import obtener_datos_certificado, iniciar_worker_snapshot, verificar_consistencia, obtener_metricas_snapshot
+from informe_adc import calcular_riesgo_psicosocial, trabajos_graficos_adc
+from graficos_informe import (
+    renderizar_graficos, iniciar_pool_graficos, obtener_metricas_graficos, GRAFICOS_FORMATO, MIME_GRAFICOS
+)
 from openai import OpenAI
 
 # Configurar logging
@@ -132,6 +161,7 @@ def obtener_credenciales_twilio_tenant(tenant_id):
                         'whatsapp_from': twilio_cfg.get('whatsapp_from'),
                         'messaging_service_sid': twilio_cfg.get('messaging_service_sid'),
                         'templates': twilio_cfg.get('templates') or {},
+                        'mps': twilio_cfg.get('mps'),  # límite de mensajes/seg de la cuenta
                         'source': f'tenant:{tenant_id}'
                     }
         except Exception as e:
@@ -152,6 +182,7 @@ def obtener_credenciales_twilio_tenant(tenant_id):
                 # var, si está seteado, le gana al default. SID BSL-only.
                 'certificado_pdf_media': os.getenv('TWILIO_TEMPLATE_CERTIFICADO_PDF') or 'HX1f578891413df18b85d5974ad447287e',
             },
+            'mps': os.getenv('TWILIO_MPS'),
             'source': 'env:bsl'
         }
 
@@ -159,6 +190,17 @@ def obtener_credenciales_twilio_tenant(tenant_id):
     return creds
 
 
+def obtener_cliente_twilio_tenant(tenant_id):
+    """
+    Devuelve (cliente, creds) para el tenant. El cliente sale del registro de
+    twilio_clients: se reutiliza entre envíos y comparte el pool HTTP keep-alive.
+    cliente es None si el tenant no tiene credenciales.
+    """
+    creds = obtener_credenciales_twilio_tenant(tenant_id)
+    cliente = obtener_cliente_twilio(creds['account_sid'], creds['auth_token'], tenant_id or 'bsl')
+    return cliente, creds
+
+
 _FIRMA_MEDICO_CACHE = {}
 _FIRMA_MEDICO_TTL = 300  # 5 min
 
@@ -605,24 +647,31 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24).hex())
 # REGISTRAR BLUEPRINT DEL CHAT WHATSAPP
 # ============================================================================
 
-from chat_whatsapp import chat_bp, register_socketio_handlers, set_socketio_instance
+from chat_whatsapp import chat_bp, register_socketio_handlers, set_socketio_instance, MANEJADORES_WEBHOOK
+from cache_asignaciones import iniciar_cache_asignaciones
+from cola_webhooks import WEBHOOK_COLA_ENABLED, iniciar_workers_webhooks
+from socketio_cola_pg import opciones_cola_socketio
 
 # Registrar el Blueprint del chat
 app.register_blueprint(chat_bp)
 logger.info("✅ Blueprint de chat WhatsApp registrado en /twilio-chat")
 
-# Inicializar SocketIO para WebSockets con configuración de keep-alive
+# Inicializar SocketIO para WebSockets con configuración de keep-alive.
+# SOCKETIO_ASYNC_MODE=gevent + SOCKETIO_MESSAGE_QUEUE permiten varios procesos
+# (ver wsgi.py y Procfile.socketio); por defecto, un proceso con hilos.
+SOCKETIO_LOGS_DETALLADOS = os.getenv('SOCKETIO_LOGS_DETALLADOS', 'true').lower() == 'true'
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
-    async_mode='threading',
-    logger=True,
-    engineio_logger=True,
+    async_mode=SOCKETIO_ASYNC_MODE,
+    logger=SOCKETIO_LOGS_DETALLADOS,
+    engineio_logger=SOCKETIO_LOGS_DETALLADOS,
     ping_timeout=30,  # Reducido de 60s a 30s para detectar desconexiones iOS más rápido
     ping_interval=25,  # Enviar ping cada 25 segundos
     max_http_buffer_size=1e8,  # 100 MB buffer
     always_connect=True,
-    transports=['websocket', 'polling']
+    transports=['websocket', 'polling'],
+    **opciones_cola_socketio()
 )
 
 # Inyectar instancia de socketio al módulo de chat
@@ -713,7 +762,7 @@ if TOKEN_B64 and not os.path.exists(TOKEN_PATH):
 
 API2PDF_KEY = os.getenv("API2PDF_KEY")
 ILOVEPDF_PUBLIC_KEY = os.getenv("ILOVEPDF_PUBLIC_KEY")
-DEST = os.getenv("STORAGE_DESTINATION", "drive")  # drive, drive-oauth, gcs
+DEST = os.getenv("STORAGE_DESTINATION", "drive")  # drive, drive-oauth, gcs, spaces, s3, local
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -724,15 +773,39 @@ if OPENAI_API_KEY:
 else:
     logger.warning("⚠️ OPENAI_API_KEY no configurada - las recomendaciones de IA no estarán disponibles")
 
-# --- Importar funciones para almacenamiento externo ---
-if DEST == "drive":
-    from drive_uploader import subir_pdf_a_drive
-elif DEST == "drive-oauth":
-    from upload_to_drive_oauth import subir_pdf_a_drive_oauth
-elif DEST == "gcs":
-    from gcs_uploader import subir_pdf_a_gcs
-else:
-    raise Exception(f"Destino {DEST} no soportado")
+# --- Backend de almacenamiento externo (ver storage_backends.BACKENDS) ---
+# Se crea al primer uso (obtener_backend(DEST) lo deja cacheado en el proceso)
+# o en inicializar_servicios: importar la app no exige credenciales de Drive/GCS
+from storage_backends import obtener_backend
+
+from upload_outbox import (
+    UPLOAD_OUTBOX_ENABLED, encolar_subida, obtener_estado_subida,
+    inicializar_tabla_outbox, iniciar_workers_outbox
+)
+
+def subir_pdf_segun_destino(destino, ruta_local, nombre_visible, folder_id=None, empresa=None):
+    """Sube un PDF al backend indicado y devuelve el enlace público"""
+    backend = obtener_backend(destino)
+    carpeta = folder_id if backend.usa_folder_id else empresa
+    return backend.put(ruta_local, nombre_visible, carpeta)
+
+def subir_o_encolar_pdf(ruta_local, nombre_visible, folder_id=None, empresa=None):
+    """
+    Sube un PDF o, si UPLOAD_OUTBOX_ENABLED, lo encola en upload_outbox para que
+    los workers lo suban en segundo plano (la respuesta HTTP no espera a Drive/GCS).
+
+    Returns:
+        dict: {'estado', 'upload_id', 'url'} — url es None mientras la subida esté pendiente
+    """
+    if UPLOAD_OUTBOX_ENABLED:
+        try:
+            tarea = encolar_subida(ruta_local, DEST, nombre_visible, folder_id, empresa)
+            return {"estado": tarea["estado"], "upload_id": tarea["id"], "url": tarea["enlace"]}
+        except Exception as e:
+            print(f"⚠️ Outbox no disponible, subiendo en línea: {e}")
+
+    enlace = subir_pdf_segun_destino(DEST, ruta_local, nombre_visible, folder_id, empresa)
+    return {"estado": "completado", "upload_id": None, "url": enlace}
 
 def determinar_empresa(request):
     """Determina la empresa basándose en el origen de la solicitud o parámetro"""
@@ -1994,23 +2067,17 @@ RECOMENDACIONES:
 2. [recomendación]
 3. [recomendación]"""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Eres un psicólogo laboral ocupacional experto. Generas interpretaciones objetivas y recomendaciones concretas basadas en resultados de pruebas psicológicas ADC (Ansiedad, Depresión, Congruencia). Usa lenguaje profesional, sin markdown ni introducciones. Tutea al evaluado."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
+        # Mismo perfil = mismo prompt: los re-renders del certificado salen de la caché
+        resultado = completar_chat(
+            openai_client,
+            "gpt-4o-mini",
+            "Eres un psicólogo laboral ocupacional experto. Generas interpretaciones objetivas y recomendaciones concretas basadas en resultados de pruebas psicológicas ADC (Ansiedad, Depresión, Congruencia). Usa lenguaje profesional, sin markdown ni introducciones. Tutea al evaluado.",
+            prompt,
             max_tokens=800,
             temperature=0.7
         )
 
-        contenido = response.choices[0].message.content.strip()
+        contenido = resultado['content'].strip()
 
         # Parsear la respuesta
         interpretacion = ""
@@ -2030,7 +2097,7 @@ RECOMENDACIONES:
         else:
             interpretacion = contenido
 
-        print(f"🧠 [OpenAI] Tokens usados: {response.usage.total_tokens}")
+        print(f"🧠 [OpenAI] Tokens {'ahorrados (caché)' if resultado['cache'] else 'usados'}: {resultado['usage']['total_tokens']}")
 
         return {
             "interpretacion": interpretacion,
@@ -2045,7 +2112,10 @@ RECOMENDACIONES:
 def obtener_adc_postgres(orden_id):
     """
     Consulta los datos de pruebas ADC (Perfil Psicológico) desde PostgreSQL
-    y calcula los puntajes estandarizados con interpretaciones.
+    con el perfil y la interpretación IA guardados para la orden.
+
+    La interpretación la genera el worker de adc_interpretaciones fuera del
+    render; si todavía no está, el perfil sale sin interpretación.
 
     Args:
         orden_id: ID de la orden (_id de HistoriaClinica)
@@ -2054,64 +2124,22 @@ def obtener_adc_postgres(orden_id):
         dict: Perfil ADC calculado para el template o None si no existe
     """
     try:
-        import psycopg2
-        from adc_scoring import calcular_perfil_adc
-
-        postgres_password = os.getenv("POSTGRES_PASSWORD")
-        if not postgres_password:
+        if not os.getenv("POSTGRES_PASSWORD"):
             print("⚠️ [PostgreSQL] POSTGRES_PASSWORD no configurada para ADC")
             return None
 
-        print(f"🔍 [PostgreSQL] Consultando pruebasADC para orden_id: {orden_id}")
-        conn = psycopg2.connect(
-            host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
-            port=int(os.getenv("POSTGRES_PORT", "25060")),
-            user=os.getenv("POSTGRES_USER", "doadmin"),
-            password=postgres_password,
-            database=os.getenv("POSTGRES_DB", "defaultdb"),
-            sslmode="require"
-        )
-        cur = conn.cursor()
-
-        cur.execute('''
-            SELECT
-                an03, an04, an05, an07, an09, an11, an14, an18, an19, an20,
-                an22, an23, an26, an27, an30, an31, an35, an36, an38, an39,
-                de03, de04, de05, de06, de07, de08, de12, de13, de14, de15,
-                de16, de20, de21, de27, de29, de32, de33, de35, de37, de38, de40,
-                cofv01, cofv02, cofv03, cofc06, cofc08, cofc10,
-                corv11, corv12, corv15, corc16, corc17, corc18,
-                coav21, coav24, coav25, coac26, coac27, coac29,
-                coov32, coov34, coov35, cooc39, cooc40
-            FROM "pruebasADC"
-            WHERE orden_id = %s
-            ORDER BY created_at DESC
-            LIMIT 1;
-        ''', (orden_id,))
-
-        row = cur.fetchone()
-        columns = [desc[0] for desc in cur.description]
-        cur.close()
-        conn.close()
+        print(f"🔍 [PostgreSQL] Consultando ADC almacenado para orden_id: {orden_id}")
+        perfil = obtener_adc_almacenado(orden_id)
 
-        if not row:
+        if not perfil:
             print(f"ℹ️ [PostgreSQL] No se encontró ADC para orden_id: {orden_id}")
             return None
 
-        datos_respuestas = dict(zip(columns, row))
-        datos_respuestas['cooc37'] = None  # Columna ausente en PostgreSQL
-
-        perfil = calcular_perfil_adc(datos_respuestas)
-        print(f"✅ [PostgreSQL] Datos ADC calculados exitosamente para orden_id: {orden_id}")
-
-        # Generar interpretación y recomendaciones con OpenAI
-        interpretacion_ia = generar_interpretacion_adc_openai(perfil)
-        if interpretacion_ia:
-            perfil["interpretacion_ia"] = interpretacion_ia
-            print(f"✅ [OpenAI] Interpretación ADC generada exitosamente")
+        interpretacion_ia = perfil.get("interpretacion_ia")
+        if not interpretacion_ia:
+            print(f"⏳ [OpenAI] Interpretación ADC aún no disponible para orden_id: {orden_id}")
         else:
-            perfil["interpretacion_ia"] = None
-            print(f"⚠️ [OpenAI] No se pudo generar interpretación ADC")
+            print(f"✅ [PostgreSQL] Perfil e interpretación ADC almacenados para orden_id: {orden_id}")
 
         return perfil
 
@@ -2575,9 +2603,76 @@ def puppeteer_html_to_pdf_from_url(html_url, output_filename="certificado"):
     Returns:
         bytes: Contenido del PDF generado
     """
+    print(f"🔗 URL a convertir: {html_url}")
+    carga_js = f"""
+    // Configurar User-Agent real para evitar bloqueos de Wix CDN
+    await page.setUserAgent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36');
+
+    // Configurar headers para evitar problemas de CORS
+    await page.setExtraHTTPHeaders({{
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+        'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Referer': '{html_url}'
+    }});
+
+    console.log('🌐 Cargando URL: {html_url}');
+
+    // Cargar la URL directamente - el navegador manejará las imágenes de Wix
+    await page.goto('{html_url}', {{
+        waitUntil: ['load', 'networkidle0'],
+        timeout: 45000
+    }});
+"""
+    return _convertir_con_puppeteer(carga_js, output_filename)
+
+
+def puppeteer_html_to_pdf(html_content, output_filename="certificado"):
+    """
+    Convierte a PDF un HTML ya renderizado en este proceso (page.setContent):
+    no hay vuelta por HTTP al preview ni se repiten sus consultas. Las rutas
+    relativas (/static/...) se resuelven contra BASE_URL.
+
+    Args:
+        html_content: HTML del template ya renderizado
+        output_filename: Nombre del archivo de salida (sin extensión)
+
+    Returns:
+        bytes: Contenido del PDF generado
+    """
+    import re
+    base_url = os.getenv("BASE_URL", "https://bsl-utilidades-yp78a.ondigitalocean.app")
+    html_content = re.sub(r'(<head[^>]*>)', rf'\1<base href="{base_url}/">', html_content, count=1, flags=re.IGNORECASE)
+
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as html_file:
+        html_file.write(html_content)
+        html_path = html_file.name
+
+    carga_js = f"""
+    console.log('📄 Cargando HTML renderizado ({len(html_content)} caracteres)');
+
+    // El HTML ya viene renderizado: el navegador solo descarga las imágenes
+    await page.setContent(require('fs').readFileSync('{html_path}', 'utf-8'), {{
+        waitUntil: ['load', 'networkidle0'],
+        timeout: 45000
+    }});
+"""
+    try:
+        return _convertir_con_puppeteer(carga_js, output_filename)
+    finally:
+        try:
+            os.unlink(html_path)
+        except OSError:
+            pass
+
+
+def _convertir_con_puppeteer(carga_js, output_filename):
+    """
+    Script común de HTML→PDF: carga_js deja la página cargada (goto o
+    setContent); después se esperan las imágenes y se imprime el PDF.
+    """
     try:
         print("🎭 Iniciando conversión HTML→PDF con Puppeteer...")
-        print(f"🔗 URL a convertir: {html_url}")
 
         # Crear archivo temporal para el PDF de salida
         temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
@@ -2587,7 +2682,7 @@ def puppeteer_html_to_pdf_from_url(html_url, output_filename="certificado"):
         print(f"📄 PDF de salida: {temp_pdf_path}")
 
         # Script de Node.js para ejecutar Puppeteer
-        # Carga la URL directamente para que el navegador maneje todas las imágenes
+        # El navegador carga la página (carga_js) y maneja todas las imágenes
         puppeteer_script = f"""
 const puppeteer = require('puppeteer');
 
@@ -2604,25 +2699,7 @@ const puppeteer = require('puppeteer');
 
     const page = await browser.newPage();
 
-    // Configurar User-Agent real para evitar bloqueos de Wix CDN
-    await page.setUserAgent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36');
-
-    // Configurar headers para evitar problemas de CORS
-    await page.setExtraHTTPHeaders({{
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-        'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Referer': '{html_url}'
-    }});
-
-    console.log('🌐 Cargando URL: {html_url}');
-
-    // Cargar la URL directamente - el navegador manejará las imágenes de Wix
-    await page.goto('{html_url}', {{
-        waitUntil: ['load', 'networkidle0'],
-        timeout: 45000
-    }});
-
+{carga_js}
     console.log('✅ Página cargada, esperando renderizado completo...');
 
     // 🔍 LOGGING EXPLÍCITO: Mostrar TODAS las URLs de imágenes en la página
@@ -2782,9 +2859,44 @@ const puppeteer = require('puppeteer');
         print("❌ Timeout ejecutando Puppeteer")
         raise Exception("Timeout en la conversión con Puppeteer")
     except Exception as e:
-        print(f"❌ Error en puppeteer_html_to_pdf_from_url: {e}")
+        print(f"❌ Error en conversión con Puppeteer ({output_filename}): {e}")
         raise
 
+def renderizar_certificado_pdf(wix_id, documento_id=None, tiempos=None):
+    """
+    Ruta de render compartida del certificado: el mismo HTML del preview,
+    renderizado en este proceso y pasado a Puppeteer con setContent.
+
+    La usan /api/generar-certificado-pdf, el envío por WhatsApp y el reenvío
+    por plantilla. Antes Puppeteer cargaba BASE_URL/preview-certificado-html:
+    salía a internet, volvía por el balanceador y otro worker repetía todas
+    las consultas del preview. Ahora hay un solo ensamblado por envío (o una
+    fila del snapshot si está al día).
+
+    Args:
+        wix_id: _id de HistoriaClinica
+        documento_id: para nombrar el archivo (opcional)
+        tiempos: dict opcional donde se anota la duración del HTML ('html') y
+                 del render completo ('render')
+
+    Returns:
+        bytes: Contenido del PDF generado
+    """
+    inicio = time.time()
+    html_content = renderizar_certificado_html(wix_id)
+    if html_content is None:
+        raise Exception(f"No se encontraron datos del paciente en el sistema (ID: {wix_id})")
+    if tiempos is not None:
+        tiempos['html'] = round(time.time() - inicio, 3)
+
+    pdf_content = puppeteer_html_to_pdf(
+        html_content,
+        output_filename=f"certificado_{documento_id or wix_id}"
+    )
+    if tiempos is not None:
+        tiempos['render'] = round(time.time() - inicio, 3)
+    return pdf_content
+
 # ================================================
 # FUNCIONES DE VALIDACIÓN DE SOPORTE DE PAGO
 # ================================================
@@ -2898,61 +3010,18 @@ def buscar_pdf_en_drive(documento, folder_id):
     """Busca un PDF en Google Drive por nombre de documento"""
     try:
         print(f"🔍 Buscando archivo: {documento}.pdf en folder: {folder_id}")
-        
-        # Usar las mismas credenciales que para subir
-        if DEST == "drive":
-            from drive_uploader import service_account, build
-            import tempfile
-            import base64
-            
-            # Recrear el servicio usando las mismas credenciales
-            base64_str = os.getenv("GOOGLE_CREDENTIALS_BASE64")
-            if not base64_str:
-                raise Exception("❌ Falta GOOGLE_CREDENTIALS_BASE64 en .env")
-
-            decoded_bytes = base64.b64decode(base64_str)
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".json")
-            temp_file.write(decoded_bytes)
-            temp_file.close()
-            
-            creds = service_account.Credentials.from_service_account_file(
-                temp_file.name,
-                scopes=['https://www.googleapis.com/auth/drive.file']
-            )
-            service = build('drive', 'v3', credentials=creds)
-            
-        elif DEST == "drive-oauth":
-            from upload_to_drive_oauth import get_authenticated_service
-            service = get_authenticated_service()
-        else:
+
+        storage_backend = obtener_backend(DEST)
+        if not storage_backend.usa_folder_id:
             raise Exception("Búsqueda en Drive solo soportada para DEST=drive o drive-oauth")
-        
-        # Buscar archivos en la carpeta específica
-        query = f"parents in '{folder_id}' and name = '{documento}.pdf' and trashed = false"
-        
-        results = service.files().list(
-            q=query,
-            fields="files(id, name, webViewLink, webContentLink)"
-        ).execute()
-        
-        files = results.get('files', [])
-        
-        if files:
-            file = files[0]  # Tomar el primer resultado
-            print(f"✅ Archivo encontrado: {file['name']}")
-            print(f"📎 WebViewLink: {file.get('webViewLink')}")
-            print(f"📎 WebContentLink: {file.get('webContentLink')}")
-            
-            # Retornar el link de descarga directa
-            return file.get('webContentLink') or file.get('webViewLink')
+
+        enlace = storage_backend.public_url(f"{documento}.pdf", folder_id)
+        if enlace:
+            print(f"✅ Archivo encontrado: {enlace}")
         else:
             print(f"❌ No se encontró el archivo {documento}.pdf en el folder {folder_id}")
-            return None
-            
-        # Limpiar archivo temporal si se creó
-        if DEST == "drive":
-            os.unlink(temp_file.name)
-            
+        return enlace
+
     except Exception as e:
         print(f"❌ Error buscando en Drive: {e}")
         return None
@@ -3076,28 +3145,20 @@ def generar_pdf():
             f.write(r2.content)
         print("💾 PDF descargado correctamente")
 
-        # Subir a almacenamiento según el destino configurado
+        # Subir a almacenamiento según el destino configurado (o encolar en el outbox)
         print(f"☁️ Subiendo a almacenamiento: {DEST}")
-        
-        if DEST == "drive":
-            print("☁️ Usando drive_uploader...")
-            enlace = subir_pdf_a_drive(local, f"{nombre_final}.pdf", folder_id)
-        elif DEST == "drive-oauth":
-            print("☁️ Usando drive_uploader OAuth...")
-            enlace = subir_pdf_a_drive_oauth(local, f"{nombre_final}.pdf", folder_id)
-        elif DEST == "gcs":
-            print("☁️ Usando GCS...")
-            enlace = subir_pdf_a_gcs(local, f"{empresa}/{nombre_final}.pdf")
-        else:
-            raise Exception(f"Destino {DEST} no soportado")
-
-        print(f"☁️ Archivo subido correctamente: {enlace}")
+        subida = subir_o_encolar_pdf(local, f"{nombre_final}.pdf", folder_id, empresa)
+        enlace = subida["url"]
+        print(f"☁️ Subida {subida['estado']}: {enlace or '#' + str(subida['upload_id'])}")
         
         print("🧹 Limpiando archivo local...")
         os.remove(local)
 
         # Respuesta con CORS
-        response = jsonify({"message": "✅ OK", "url": enlace, "empresa": empresa})
+        response = jsonify({
+            "message": "✅ OK", "url": enlace, "empresa": empresa,
+            "estado_subida": subida["estado"], "upload_id": subida["upload_id"]
+        })
         origin = request.headers.get('Origin')
         if origin in get_allowed_origins():
             response.headers["Access-Control-Allow-Origin"] = origin
@@ -3172,29 +3233,21 @@ def subir_pdf_directo():
             f.write(pdf_response.content)
         print(f"💾 PDF descargado como: {local}")
 
-        # Subir a almacenamiento según el destino configurado
+        # Subir a almacenamiento según el destino configurado (o encolar en el outbox)
         print(f"☁️ Subiendo a almacenamiento: {DEST}")
-        
-        if DEST == "drive":
-            print("☁️ Usando drive_uploader...")
-            enlace = subir_pdf_a_drive(local, f"{documento}.pdf", folder_id)
-        elif DEST == "drive-oauth":
-            print("☁️ Usando drive_uploader OAuth...")
-            enlace = subir_pdf_a_drive_oauth(local, f"{documento}.pdf", folder_id)
-        elif DEST == "gcs":
-            print("☁️ Usando GCS...")
-            enlace = subir_pdf_a_gcs(local, f"{empresa}/{documento}.pdf")
-        else:
-            raise Exception(f"Destino {DEST} no soportado")
-
-        print(f"☁️ Archivo subido correctamente: {enlace}")
+        subida = subir_o_encolar_pdf(local, f"{documento}.pdf", folder_id, empresa)
+        enlace = subida["url"]
+        print(f"☁️ Subida {subida['estado']}: {enlace or '#' + str(subida['upload_id'])}")
         
         # Limpiar archivo local
         print("🧹 Limpiando archivo local...")
         os.remove(local)
 
         # Respuesta con CORS
-        response = jsonify({"message": "✅ PDF subido exitosamente", "url": enlace, "empresa": empresa})
+        response = jsonify({
+            "message": "✅ PDF subido exitosamente", "url": enlace, "empresa": empresa,
+            "estado_subida": subida["estado"], "upload_id": subida["upload_id"]
+        })
         origin = request.headers.get('Origin')
         if origin in get_allowed_origins():
             response.headers["Access-Control-Allow-Origin"] = origin
@@ -3366,6 +3419,31 @@ def descargar_pdf_drive(documento):
         print(f"❌ Error buscando PDF: {e}")
         return jsonify({"error": str(e)}), 500
 
+# --- Endpoint: ESTADO DE UNA SUBIDA ENCOLADA (outbox) ---
+@app.route("/estado-subida/<int:upload_id>", methods=["GET"])
+def estado_subida(upload_id):
+    try:
+        estado = obtener_estado_subida(upload_id)
+        if not estado:
+            response, status = jsonify({"error": f"Subida {upload_id} no encontrada"}), 404
+        else:
+            response, status = jsonify(estado), 200
+
+        origin = request.headers.get('Origin')
+        if origin in get_allowed_origins():
+            response.headers["Access-Control-Allow-Origin"] = origin
+        return response, status
+    except Exception as e:
+        print(f"❌ Error consultando estado de subida: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# --- Servir PDFs del backend local (STORAGE_DESTINATION=local) ---
+@app.route("/storage-local/<path:llave>")
+def servir_storage_local(llave):
+    if DEST != "local":
+        return jsonify({"error": "Almacenamiento local no habilitado"}), 404
+    return send_from_directory(obtener_backend(DEST).raiz, llave, mimetype='application/pdf')
+
 # --- Servir el FRONTEND estático ---
 @app.route("/", methods=["OPTIONS"])
 def options_root():
@@ -3643,31 +3721,16 @@ def generar_certificado_medico():
             # Determinar carpeta de destino
             folder_id = data.get("folder_id") or EMPRESA_FOLDERS.get("BSL")
 
-            # Descargar el PDF temporalmente
-            pdf_response = requests.get(pdf_url)
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-            temp_file.write(pdf_response.content)
-            temp_file.close()
-
             # Nombre del archivo
             documento_identidad = datos_certificado.get("documento_identidad", "sin_doc")
             nombre_archivo = data.get("nombre_archivo") or f"certificado_{documento_identidad}_{fecha_actual.strftime('%Y%m%d')}.pdf"
 
-            # Subir a Google Drive según el destino configurado
-            if DEST == "drive":
-                resultado = subir_pdf_a_drive(temp_file.name, nombre_archivo, folder_id)
-            elif DEST == "drive-oauth":
-                resultado = subir_pdf_a_drive_oauth(temp_file.name, nombre_archivo, folder_id)
-            elif DEST == "gcs":
-                resultado = subir_pdf_a_gcs(temp_file.name, nombre_archivo, folder_id)
-            else:
-                resultado = {"success": False, "error": f"Destino {DEST} no soportado"}
-
-            # Limpiar archivo temporal
-            os.unlink(temp_file.name)
-
-            if not resultado.get("success"):
-                print(f"⚠️ Error subiendo a Drive: {resultado.get('error')}")
+            # Subir (o encolar) el PDF ya generado
+            try:
+                resultado = subir_o_encolar_pdf(temp_pdf.name, nombre_archivo, folder_id)
+            except Exception as upload_error:
+                resultado = {"estado": "fallido", "error": str(upload_error)}
+                print(f"⚠️ Error subiendo a Drive: {upload_error}")
 
         # Preparar respuesta
         respuesta = {
@@ -3678,9 +3741,10 @@ def generar_certificado_medico():
         }
 
         # Si se guardó en Drive, agregar información
-        if data.get("guardar_drive", False) and resultado.get("success"):
-            respuesta["drive_file_id"] = resultado.get("fileId")
-            respuesta["drive_web_link"] = resultado.get("webViewLink")
+        if data.get("guardar_drive", False):
+            respuesta["drive_web_link"] = resultado.get("url")
+            respuesta["estado_subida"] = resultado.get("estado")
+            respuesta["upload_id"] = resultado.get("upload_id")
 
         # Configurar headers CORS
         response = jsonify(respuesta)
@@ -3949,21 +4013,12 @@ def generar_certificado_medico_puppeteer():
             documento_identidad = datos_certificado.get("documento_identidad", "sin_doc")
             nombre_archivo = data.get("nombre_archivo") or f"certificado_{documento_identidad}_{fecha_actual.strftime('%Y%m%d')}.pdf"
 
-            # Subir a Google Drive según el destino configurado
-            if DEST == "drive":
-                resultado = subir_pdf_a_drive(temp_pdf.name, nombre_archivo, folder_id)
-            elif DEST == "drive-oauth":
-                resultado = subir_pdf_a_drive_oauth(temp_pdf.name, nombre_archivo, folder_id)
-            elif DEST == "gcs":
-                resultado = subir_pdf_a_gcs(temp_pdf.name, nombre_archivo, folder_id)
-            else:
-                resultado = {"success": False, "error": f"Destino {DEST} no soportado"}
-
-            # Limpiar archivo temporal
-            os.unlink(temp_pdf.name)
-
-            if not resultado.get("success"):
-                print(f"⚠️ Error subiendo a Drive: {resultado.get('error')}")
+            # Subir (o encolar) el PDF ya generado
+            try:
+                resultado = subir_o_encolar_pdf(temp_pdf.name, nombre_archivo, folder_id)
+            except Exception as upload_error:
+                resultado = {"estado": "fallido", "error": str(upload_error)}
+                print(f"⚠️ Error subiendo a Drive: {upload_error}")
 
         # Preparar respuesta
         respuesta = {
@@ -3974,9 +4029,10 @@ def generar_certificado_medico_puppeteer():
         }
 
         # Si se guardó en Drive, agregar información
-        if data.get("guardar_drive", False) and resultado.get("success"):
-            respuesta["drive_file_id"] = resultado.get("fileId")
-            respuesta["drive_web_link"] = resultado.get("webViewLink")
+        if data.get("guardar_drive", False):
+            respuesta["drive_web_link"] = resultado.get("url")
+            respuesta["estado_subida"] = resultado.get("estado")
+            respuesta["upload_id"] = resultado.get("upload_id")
 
         # Configurar headers CORS
         response = jsonify(respuesta)
@@ -5188,839 +5244,104 @@ def api_generar_certificado_pdf(wix_id):
         # Obtener parámetros opcionales
         guardar_drive = request.args.get('guardar_drive', 'false').lower() == 'true'
 
-        print(f"🔧 Motor de conversión: Puppeteer")
+        # El certificado lo arma renderizar_certificado_pdf (snapshot o ensamblado en
+        # vivo); este endpoint solo necesita el documento para nombrar el archivo.
+        # Antes repetía aquí todo el ensamblado por examen sin usar el resultado.
+        datos_wix = obtener_datos_historia_clinica_postgres(wix_id) or {}
+        if not datos_wix.get('numeroId'):
+            wix_base_url = os.getenv("WIX_BASE_URL", "https://www.bsl.com.co/_functions")
+            try:
+                response = requests.get(f"{wix_base_url}/historiaClinicaPorId?_id={wix_id}", timeout=10)
+                if response.status_code == 200:
+                    datos_wix = response.json().get("data", {}) or datos_wix
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️ Error de conexión con Wix: {e}")
 
-        # ===== PRIORIDAD 1: CONSULTAR DATOS DESDE POSTGRESQL =====
-        print(f"🔍 [PRIORIDAD 1] Consultando PostgreSQL para wix_id: {wix_id}")
-        datos_postgres = obtener_datos_formulario_postgres(wix_id)
+        nombre_archivo = f"certificado_{datos_wix.get('numeroId', wix_id)}_{obtener_fecha_colombia().strftime('%Y%m%d')}.pdf"
+        print(f"🆔 Documento: {datos_wix.get('numeroId', '')}")
 
-        # ===== PRIORIDAD 2: CONSULTAR DATOS DESDE WIX (COMPLEMENTO) =====
-        wix_base_url = os.getenv("WIX_BASE_URL", "https://www.bsl.com.co/_functions")
-        print(f"🔍 [PRIORIDAD 2] Consultando Wix HTTP Function: {wix_base_url}/historiaClinicaPorId?_id={wix_id}")
+        # ========== GENERAR PDF CON PUPPETEER ==========
+        print("🎭 Generando PDF con Puppeteer desde el HTML del certificado...")
 
-        datos_wix = {}
         try:
-            # Llamar al endpoint de Wix
-            wix_url = f"{wix_base_url}/historiaClinicaPorId?_id={wix_id}"
-            response = requests.get(wix_url, timeout=10)
-
-            print(f"📡 Respuesta Wix: {response.status_code}")
-
-            if response.status_code == 200:
-                wix_response = response.json()
-                datos_wix = wix_response.get("data", {})
-
-                if not datos_wix:
-                    print(f"⚠️ Wix retornó respuesta vacía, usando solo datos de PostgreSQL")
-                else:
-                    print(f"✅ Datos obtenidos de Wix para ID: {wix_id}")
-                    print(f"📋 Paciente Wix: {datos_wix.get('primerNombre', '')} {datos_wix.get('primerApellido', '')}")
-            else:
-                print(f"⚠️ Error consultando Wix: {response.status_code}, usando solo PostgreSQL")
+            pdf_content = renderizar_certificado_pdf(wix_id, datos_wix.get('numeroId', wix_id))
 
-        except requests.exceptions.RequestException as e:
-            print(f"⚠️ Error de conexión con Wix: {e}, usando solo PostgreSQL")
-            traceback.print_exc()
+            # Guardar PDF localmente para envío directo
+            print("💾 Guardando PDF localmente...")
+            documento_id = datos_wix.get('numeroId', wix_id)
+            documento_sanitized = str(documento_id).replace(" ", "_").replace("/", "_").replace("\\", "_")
+            local = f"certificado_medico_{documento_sanitized}.pdf"
 
-        # ===== MERGE DE DATOS: PostgreSQL SOBRESCRIBE A WIX =====
-        print(f"🔄 Haciendo merge de datos: PostgreSQL (prioridad) → Wix (complemento)")
-
-        if datos_postgres:
-            print(f"✅ Datos de PostgreSQL disponibles, sobrescribiendo datos de Wix...")
-            # PostgreSQL sobrescribe TODOS los campos que tenga
-            if datos_postgres.get('eps'):
-                datos_wix['eps'] = datos_postgres.get('eps')
-                print(f"  ✓ EPS: {datos_postgres.get('eps')}")
-            if datos_postgres.get('arl'):
-                datos_wix['arl'] = datos_postgres.get('arl')
-                print(f"  ✓ ARL: {datos_postgres.get('arl')}")
-            if datos_postgres.get('pensiones'):
-                datos_wix['pensiones'] = datos_postgres.get('pensiones')
-                print(f"  ✓ Pensiones: {datos_postgres.get('pensiones')}")
-            if datos_postgres.get('nivelEducativo'):
-                datos_wix['nivel_educativo'] = datos_postgres.get('nivelEducativo')
-                print(f"  ✓ Nivel Educativo: {datos_postgres.get('nivelEducativo')}")
-            if datos_postgres.get('edad'):
-                datos_wix['edad'] = datos_postgres.get('edad')
-            if datos_postgres.get('genero'):
-                datos_wix['genero'] = datos_postgres.get('genero')
-            if datos_postgres.get('estadoCivil'):
-                datos_wix['estadoCivil'] = datos_postgres.get('estadoCivil')
-            if datos_postgres.get('hijos'):
-                datos_wix['hijos'] = datos_postgres.get('hijos')
-            if datos_postgres.get('email'):
-                datos_wix['email'] = datos_postgres.get('email')
-            if datos_postgres.get('celular'):
-                datos_wix['celular'] = datos_postgres.get('celular')
-                print(f"  ✓ Celular: {datos_postgres.get('celular')}")
-            if datos_postgres.get('profesionUOficio'):
-                datos_wix['profesionUOficio'] = datos_postgres.get('profesionUOficio')
-            if datos_postgres.get('ciudadDeResidencia'):
-                datos_wix['ciudadDeResidencia'] = datos_postgres.get('ciudadDeResidencia')
-            if datos_postgres.get('fechaNacimiento'):
-                datos_wix['fechaNacimiento'] = datos_postgres.get('fechaNacimiento')
-            if datos_postgres.get('foto'):
-                datos_wix['foto_paciente'] = datos_postgres.get('foto')
-                print(f"  ✓ Foto: disponible desde PostgreSQL")
-            if datos_postgres.get('firma'):
-                datos_wix['firma_paciente'] = datos_postgres.get('firma')
-                print(f"  ✓ Firma: disponible desde PostgreSQL")
-
-            print(f"📊 Merge completado: edad={datos_wix.get('edad')}, genero={datos_wix.get('genero')}, eps={datos_wix.get('eps')}, arl={datos_wix.get('arl')}")
-        else:
-            print(f"⚠️ No hay datos de PostgreSQL (formularios), usando solo datos de Wix")
+            with open(local, "wb") as f:
+                f.write(pdf_content)
 
-        # ===== PRIORIDAD 0: CONSULTAR HISTORIA CLÍNICA DESDE POSTGRESQL (EXÁMENES) =====
-        print(f"🔍 [PRIORIDAD 0] Consultando HistoriaClinica en PostgreSQL para wix_id: {wix_id}")
-        datos_historia_postgres = obtener_datos_historia_clinica_postgres(wix_id)
+            print(f"✅ PDF generado y guardado localmente: {local}")
 
-        if datos_historia_postgres:
-            print(f"✅ Datos de HistoriaClinica PostgreSQL disponibles, sobrescribiendo...")
-            # Sobrescribir campos de HistoriaClinica desde PostgreSQL
-            if datos_historia_postgres.get('examenes'):
-                datos_wix['examenes'] = datos_historia_postgres.get('examenes')
-                print(f"  ✓ Exámenes (PostgreSQL): {datos_historia_postgres.get('examenes')}")
-            if datos_historia_postgres.get('primerNombre'):
-                datos_wix['primerNombre'] = datos_historia_postgres.get('primerNombre')
-            if datos_historia_postgres.get('segundoNombre'):
-                datos_wix['segundoNombre'] = datos_historia_postgres.get('segundoNombre')
-            if datos_historia_postgres.get('primerApellido'):
-                datos_wix['primerApellido'] = datos_historia_postgres.get('primerApellido')
-            if datos_historia_postgres.get('segundoApellido'):
-                datos_wix['segundoApellido'] = datos_historia_postgres.get('segundoApellido')
-            if datos_historia_postgres.get('numeroId'):
-                datos_wix['numeroId'] = datos_historia_postgres.get('numeroId')
-            if datos_historia_postgres.get('codEmpresa'):
-                datos_wix['codEmpresa'] = datos_historia_postgres.get('codEmpresa')
-            if datos_historia_postgres.get('empresa'):
-                datos_wix['empresa'] = datos_historia_postgres.get('empresa')
-            if datos_historia_postgres.get('cargo'):
-                datos_wix['cargo'] = datos_historia_postgres.get('cargo')
-            if datos_historia_postgres.get('tipoExamen'):
-                datos_wix['tipoExamen'] = datos_historia_postgres.get('tipoExamen')
-            if datos_historia_postgres.get('mdConceptoFinal'):
-                datos_wix['mdConceptoFinal'] = datos_historia_postgres.get('mdConceptoFinal')
-            if datos_historia_postgres.get('mdObservacionesCertificado'):
-                datos_wix['mdObservacionesCertificado'] = datos_historia_postgres.get('mdObservacionesCertificado')
-            if datos_historia_postgres.get('mdRecomendacionesMedicasAdicionales'):
-                datos_wix['mdRecomendacionesMedicasAdicionales'] = datos_historia_postgres.get('mdRecomendacionesMedicasAdicionales')
-            if datos_historia_postgres.get('mdAntecedentes'):
-                datos_wix['mdAntecedentes'] = datos_historia_postgres.get('mdAntecedentes')
-            if datos_historia_postgres.get('fechaConsulta'):
-                datos_wix['fechaConsulta'] = datos_historia_postgres.get('fechaConsulta')
-            if datos_historia_postgres.get('pvEstado'):
-                datos_wix['pvEstado'] = datos_historia_postgres.get('pvEstado')
-            if datos_historia_postgres.get('pagado'):
-                datos_wix['pagado'] = datos_historia_postgres.get('pagado')
-            if datos_historia_postgres.get('medico'):
-                datos_wix['medico'] = datos_historia_postgres.get('medico')
-                print(f"  ✓ Médico (PostgreSQL HistoriaClinica): {datos_historia_postgres.get('medico')}")
-            if datos_historia_postgres.get('ciudad'):
-                datos_wix['ciudad'] = datos_historia_postgres.get('ciudad')
-                print(f"  ✓ Ciudad (PostgreSQL HistoriaClinica): {datos_historia_postgres.get('ciudad')}")
-        else:
-            print(f"⚠️ No hay datos de HistoriaClinica en PostgreSQL para wix_id: {wix_id}")
+            # Guardar copia en Drive/GCS sin bloquear la descarga (outbox si está habilitado)
+            subida = None
+            if guardar_drive:
+                try:
+                    subida = subir_o_encolar_pdf(local, nombre_archivo, EMPRESA_FOLDERS.get("BSL"))
+                    print(f"☁️ Subida {subida['estado']}: {subida['url'] or '#' + str(subida['upload_id'])}")
+                except Exception as upload_error:
+                    print(f"⚠️ Error subiendo a Drive: {upload_error}")
 
-        # Transformar datos de Wix al formato del endpoint de certificado
-        nombre_completo = f"{datos_wix.get('primerNombre', '')} {datos_wix.get('segundoNombre', '')} {datos_wix.get('primerApellido', '')} {datos_wix.get('segundoApellido', '')}".strip()
+            # Enviar archivo como descarga directa
+            response = send_file(
+                local,
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=f"certificado_medico_{documento_sanitized}.pdf"
+            )
+            if subida and subida.get("upload_id"):
+                response.headers["X-Upload-Id"] = str(subida["upload_id"])
 
-        # Usar fechaConsulta como prioridad, pero si es fecha futura inválida, usar fechaAtencion
-        fecha_consulta = datos_wix.get('fechaConsulta') or datos_wix.get('fechaAtencion')
-        fecha_atencion_fallback = datos_wix.get('fechaAtencion')
+            # Configurar CORS
+            response.headers["Access-Control-Allow-Origin"] = "*"
 
-        def _parsear_fecha(f):
-            if isinstance(f, datetime):
-                return f
-            if isinstance(f, str):
+            # Limpiar archivo temporal después del envío
+            @response.call_on_close
+            def cleanup():
                 try:
-                    return datetime.fromisoformat(f.replace('Z', '+00:00'))
-                except (ValueError, AttributeError):
-                    return None
-            return None
-
-        fecha_obj = _parsear_fecha(fecha_consulta)
-        # Si fechaConsulta es futura (>30 días), probablemente es dato corrupto → usar fechaAtencion
-        if fecha_obj and fecha_obj.replace(tzinfo=None) > datetime.now() + timedelta(days=30) and fecha_atencion_fallback:
-            fecha_obj_fallback = _parsear_fecha(fecha_atencion_fallback)
-            if fecha_obj_fallback:
-                fecha_obj = fecha_obj_fallback
+                    os.remove(local)
+                    print(f"🗑️  Archivo temporal eliminado: {local}")
+                except Exception as e:
+                    print(f"⚠️  Error al eliminar archivo temporal: {e}")
 
-        if fecha_obj:
-            fecha_formateada = formatear_fecha_espanol(fecha_obj)
-        else:
-            fecha_formateada = formatear_fecha_espanol(obtener_fecha_colombia())
-
-        # Construir exámenes realizados
-        # Normalizar lista de exámenes (convierte string a array si viene de PostgreSQL)
-        examenes = normalizar_lista_examenes(datos_wix.get('examenes', []))
-        print(f"📋 Exámenes antes de normalizar: {examenes}")
-        examenes_normalizados = [normalizar_examen(e) for e in examenes]
-        print(f"📋 Exámenes normalizados: {examenes_normalizados}")
-        # SITEL/REMOTE: excluir secciones detalladas de optometría, audiometría y ADC
-        EXAMENES_DETALLE_EXCLUIDOS = {'OPTOMETRÍA', 'VISIOMETRÍA', 'AUDIOMETRÍA', 'PERFIL PSICOLÓGICO ADC'}
-        if datos_wix.get('codEmpresa') in ('SITEL', 'REMOTE'):
-            examenes_para_template = [e for e in examenes_normalizados if e not in EXAMENES_DETALLE_EXCLUIDOS]
-        else:
-            examenes_para_template = examenes_normalizados
+            return response
 
-        # Excluir la batería de riesgo psicosocial del certificado médico:
-        # vive en la app BRS y no aporta al concepto de aptitud laboral.
-        examenes_realizados = []
-        for examen in examenes_normalizados:
-            if 'PSICOSOCIAL' in examen.upper():
-                continue
-            examenes_realizados.append({
-                "nombre": examen,
-                "fecha": fecha_formateada
+        except Exception as e:
+            print(f"❌ Error generando PDF con Puppeteer: {e}")
+            traceback.print_exc()
+            error_response = jsonify({
+                "success": False,
+                "error": f"Error generando PDF: {str(e)}"
             })
+            error_response.headers["Access-Control-Allow-Origin"] = "*"
+            return error_response, 500
 
-        # ===== CONSULTAR DATOS VISUALES (Optometría/Visiometría) =====
-        datos_visual = None
-        # examenes y examenes_normalizados ya están definidos arriba (ahora en MAYÚSCULAS)
-        tiene_examen_visual = any(e in ['OPTOMETRÍA', 'VISIOMETRÍA', 'Optometría', 'Visiometría'] for e in examenes_normalizados)
+    except Exception as e:
+        print(f"❌ Error generando certificado desde Wix: {str(e)}")
+        traceback.print_exc()
 
-        if tiene_examen_visual and datos_wix.get('codEmpresa') != 'SITEL':
-            wix_id_historia = datos_wix.get('_id', '')
+        error_response = jsonify({
+            "success": False,
+            "error": str(e),
+            "wix_id": wix_id
+        })
+        error_response.headers["Access-Control-Allow-Origin"] = "*"
 
-            # PRIORIDAD 1: Consultar PostgreSQL - visiometrias (optometría profesional)
-            print(f"🔍 [PRIORIDAD 1] Consultando visiometrias (optometría profesional) en PostgreSQL para: {wix_id_historia}")
-            datos_visual = obtener_optometria_postgres(wix_id_historia)
+        return error_response, 500
 
-            # PRIORIDAD 2: Consultar PostgreSQL - visiometrias_virtual (examen virtual) como fallback
-            if not datos_visual:
-                print(f"🔍 [PRIORIDAD 2] Consultando visiometrias_virtual en PostgreSQL...")
-                datos_visual = obtener_visiometria_postgres(wix_id_historia)
 
-            # PRIORIDAD 3: Fallback a Wix si PostgreSQL no tiene datos
-            if not datos_visual:
-                print(f"🔍 [PRIORIDAD 3 - Fallback] Consultando datos visuales en Wix...")
-                try:
-                    visual_url = f"https://www.bsl.com.co/_functions/visualPorIdGeneral?idGeneral={wix_id_historia}"
+# ================================================
+# ENDPOINTS PARA DESCARGAS ALEGRA (iLovePDF)
+# ================================================
 
-                    visual_response = requests.get(visual_url, timeout=10)
-
-                    if visual_response.status_code == 200:
-                        visual_data = visual_response.json()
-                        if visual_data.get('success') and visual_data.get('data'):
-                            datos_visual = visual_data['data'][0] if len(visual_data['data']) > 0 else None
-                            print(f"✅ Datos visuales obtenidos desde Wix (fallback)")
-                        else:
-                            print(f"⚠️ No se encontraron datos visuales en Wix para {wix_id_historia}")
-                    else:
-                        print(f"⚠️ Error al consultar datos visuales en Wix: {visual_response.status_code}")
-                except Exception as e:
-                    print(f"❌ Error consultando datos visuales en Wix: {e}")
-
-        # ===== CONSULTAR DATOS DE AUDIOMETRÍA =====
-        datos_audiometria = None
-        tiene_examen_audio = any(e in ['AUDIOMETRÍA', 'Audiometría'] for e in examenes_normalizados)
-
-        if tiene_examen_audio:
-            wix_id_historia = datos_wix.get('_id', '')
-
-            # PRIORIDAD 1: Consultar PostgreSQL (audiometrias)
-            print(f"🔍 [PRIORIDAD 1] Consultando audiometrias en PostgreSQL para: {wix_id_historia}")
-            datos_audiometria = obtener_audiometria_postgres(wix_id_historia)
-
-            # PRIORIDAD 2: Fallback a Wix si PostgreSQL no tiene datos
-            if not datos_audiometria:
-                print(f"🔍 [PRIORIDAD 2 - Fallback] Consultando datos de audiometría en Wix...")
-                try:
-                    audio_url = f"https://www.bsl.com.co/_functions/audiometriaPorIdGeneral?idGeneral={wix_id_historia}"
-
-                    audio_response = requests.get(audio_url, timeout=10)
-
-                    if audio_response.status_code == 200:
-                        audio_data = audio_response.json()
-                        if audio_data.get('success') and audio_data.get('data'):
-                            datos_raw = audio_data['data'][0] if len(audio_data['data']) > 0 else None
-
-                            if datos_raw:
-                                # Transformar datos de Wix al formato esperado
-                                frecuencias = [250, 500, 1000, 2000, 3000, 4000, 6000, 8000]
-                                datosParaTabla = []
-
-                                for freq in frecuencias:
-                                    campo_der = f"auDer{freq}"
-                                    campo_izq = f"auIzq{freq}"
-                                    datosParaTabla.append({
-                                        "frecuencia": freq,
-                                        "oidoDerecho": datos_raw.get(campo_der, 0),
-                                        "oidoIzquierdo": datos_raw.get(campo_izq, 0)
-                                    })
-
-                                # Calcular diagnóstico automático basado en umbrales auditivos
-                                def calcular_diagnostico_audiometria(datos):
-                                    # Detectar umbrales anormalmente bajos (por debajo de 0 dB)
-                                    umbrales_bajos_der = [d for d in datos if d['oidoDerecho'] < 0]
-                                    umbrales_bajos_izq = [d for d in datos if d['oidoIzquierdo'] < 0]
-                                    tiene_umbrales_bajos = len(umbrales_bajos_der) > 0 or len(umbrales_bajos_izq) > 0
-
-                                    # Promedios de frecuencias conversacionales (500, 1000, 2000 Hz)
-                                    freq_conv_indices = [1, 2, 3]  # índices para 500, 1000, 2000 Hz
-                                    valores_der = [datos[i]['oidoDerecho'] for i in freq_conv_indices]
-                                    valores_izq = [datos[i]['oidoIzquierdo'] for i in freq_conv_indices]
-
-                                    prom_der = sum(valores_der) / len(valores_der)
-                                    prom_izq = sum(valores_izq) / len(valores_izq)
-
-                                    def clasificar_umbral(umbral):
-                                        if umbral <= 25:
-                                            return "Normal"
-                                        elif umbral <= 40:
-                                            return "Leve"
-                                        elif umbral <= 55:
-                                            return "Moderada"
-                                        elif umbral <= 70:
-                                            return "Moderadamente Severa"
-                                        elif umbral <= 90:
-                                            return "Severa"
-                                        else:
-                                            return "Profunda"
-
-                                    clasif_der = clasificar_umbral(prom_der)
-                                    clasif_izq = clasificar_umbral(prom_izq)
-
-                                    # Verificar pérdida en frecuencias graves (250 Hz)
-                                    grave_250_der = datos[0]['oidoDerecho']  # 250 Hz es índice 0
-                                    grave_250_izq = datos[0]['oidoIzquierdo']
-
-                                    # Verificar pérdida en frecuencias agudas (6000, 8000 Hz)
-                                    agudas_der = [datos[6]['oidoDerecho'], datos[7]['oidoDerecho']]
-                                    agudas_izq = [datos[6]['oidoIzquierdo'], datos[7]['oidoIzquierdo']]
-                                    tiene_perdida_agudas = any(v > 25 for v in agudas_der + agudas_izq)
-
-                                    # Construir diagnóstico base
-                                    diagnostico_base = ""
-                                    notas_adicionales = []
-
-                                    if clasif_der == "Normal" and clasif_izq == "Normal":
-                                        if tiene_perdida_agudas:
-                                            diagnostico_base = "Audición dentro de parámetros normales en frecuencias conversacionales. Se observa leve disminución en frecuencias agudas."
-                                        else:
-                                            diagnostico_base = "Audición dentro de parámetros normales bilateralmente. Los umbrales auditivos se encuentran en rangos de normalidad en todas las frecuencias evaluadas."
-                                    elif clasif_der == "Normal":
-                                        diagnostico_base = f"Oído derecho con audición normal. Oído izquierdo presenta pérdida auditiva {clasif_izq.lower()} (promedio {prom_izq:.1f} dB HL)."
-                                    elif clasif_izq == "Normal":
-                                        diagnostico_base = f"Oído izquierdo con audición normal. Oído derecho presenta pérdida auditiva {clasif_der.lower()} (promedio {prom_der:.1f} dB HL)."
-                                    else:
-                                        diagnostico_base = f"Pérdida auditiva bilateral: Oído derecho {clasif_der.lower()} (promedio {prom_der:.1f} dB HL), Oído izquierdo {clasif_izq.lower()} (promedio {prom_izq:.1f} dB HL)."
-
-                                    # Agregar nota sobre pérdida en 250 Hz si es significativa
-                                    if grave_250_der > 25 or grave_250_izq > 25:
-                                        if grave_250_der > 25 and grave_250_izq > 25:
-                                            notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) bilateral.")
-                                        elif grave_250_der > 25:
-                                            notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) en oído derecho ({grave_250_der} dB).")
-                                        else:
-                                            notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) en oído izquierdo ({grave_250_izq} dB).")
-
-                                    # Agregar nota sobre umbrales atípicamente bajos si existen
-                                    if tiene_umbrales_bajos:
-                                        frecuencias_afectadas = []
-                                        if umbrales_bajos_der:
-                                            frecuencias_afectadas.append("oído derecho")
-                                        if umbrales_bajos_izq:
-                                            frecuencias_afectadas.append("oído izquierdo")
-                                        notas_adicionales.append(f"Se observan umbrales atípicamente bajos en {' y '.join(frecuencias_afectadas)}.")
-
-                                    # Combinar diagnóstico base con notas adicionales
-                                    if notas_adicionales:
-                                        diagnostico_base += " " + " ".join(notas_adicionales)
-
-                                    return diagnostico_base
-
-                                # Usar diagnóstico de Wix si existe, sino calcular automáticamente
-                                diagnostico_auto = calcular_diagnostico_audiometria(datosParaTabla)
-                                diagnostico_final = datos_raw.get('diagnostico') or diagnostico_auto
-
-                                datos_audiometria = {
-                                    "datosParaTabla": datosParaTabla,
-                                    "diagnostico": diagnostico_final
-                                }
-                                print(f"✅ Datos de audiometría obtenidos desde Wix (fallback)")
-                                print(f"📊 Diagnóstico: {diagnostico_final}")
-                            else:
-                                datos_audiometria = None
-                        else:
-                            print(f"⚠️ No se encontraron datos de audiometría en Wix para {wix_id_historia}")
-                    else:
-                        print(f"⚠️ Error al consultar datos de audiometría en Wix: {audio_response.status_code}")
-                except Exception as e:
-                    print(f"❌ Error consultando datos de audiometría en Wix: {e}")
-
-        # ===== CONSULTAR DATOS DE VOXIMETRÍA =====
-        datos_voximetria = None
-        tiene_examen_voximetria = any(e in ['VOXIMETRÍA', 'Voximetría', 'VOXIMETRIA', 'Voximetria', 'Test Vocal Voximetría'] for e in examenes_normalizados)
-
-        if tiene_examen_voximetria:
-            wix_id_historia_vox = datos_wix.get('_id', '')
-            print(f"🔍 Consultando voximetrias_virtual en PostgreSQL para: {wix_id_historia_vox}")
-            datos_voximetria = obtener_voximetria_postgres(wix_id_historia_vox)
-
-            if not datos_voximetria:
-                print(f"⚠️ No se encontraron datos de voximetría para {wix_id_historia_vox}")
-
-        # ===== CONSULTAR DATOS DE ADC (Perfil Psicológico) =====
-        datos_adc = None
-        cod_empresa_actual = datos_wix.get('codEmpresa', '')
-        tiene_examen_adc = any(e in ['PERFIL PSICOLÓGICO ADC', 'PERFIL PSICOLOGICO ADC', 'Perfil Psicológico ADC'] for e in examenes_normalizados)
-
-        if tiene_examen_adc and cod_empresa_actual != 'SITEL':
-            wix_id_historia_adc = datos_wix.get('_id', '')
-            print(f"🔍 [PRIORIDAD 1] Consultando pruebasADC en PostgreSQL para: {wix_id_historia_adc}")
-            datos_adc = obtener_adc_postgres(wix_id_historia_adc)
-
-            if not datos_adc:
-                print(f"⚠️ No se encontraron datos ADC para {wix_id_historia_adc}")
-        elif cod_empresa_actual == 'SITEL':
-            print(f"ℹ️ ADC excluido para empresa SITEL (codEmpresa={cod_empresa_actual})")
-
-        # ===== LÓGICA DE TEXTOS DINÁMICOS SEGÚN EXÁMENES (como en Wix) =====
-        # Nota: Las claves deben coincidir con los nombres normalizados (MAYÚSCULAS de tabla examenes PostgreSQL)
-        textos_examenes = {
-            # Nombres normalizados (MAYÚSCULAS - coinciden con tabla examenes de PostgreSQL)
-            "EXAMEN MÉDICO OCUPACIONAL OSTEOMUSCULAR": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
-            "OSTEOMUSCULAR": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
-            "ÉNFASIS CARDIOVASCULAR": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
-            "PERFIL LIPÍDICO": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
-            "PERFIL LIPÍDICO COMPLETO": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
-            "ÉNFASIS VASCULAR": "El examen vascular muestra resultados dentro de los límites normales, sin evidencia de enfermedad arterial periférica ni estenosis carotídea significativa. Se recomienda al paciente continuar evitando el tabaquismo y mantener un estilo de vida saludable. Dada la buena condición vascular, no se requieren restricciones laborales en este momento. Se sugiere realizar seguimiento periódico para monitorear la salud vascular y prevenir posibles complicaciones en el futuro.",
-            "ESPIROMETRÍA": "Prueba Espirometría: Función pulmonar normal sin evidencia de obstrucción o restricción significativa. No se requieren medidas adicionales en relación con la función pulmonar para el paciente en este momento.",
-            "ÉNFASIS DERMATOLÓGICO": "Énfasis Dermatológico: Descripción general de la piel: La piel presenta un aspecto saludable, con una textura suave y uniforme. No se observan áreas de enrojecimiento, descamación o inflamación evidentes. El color de la piel es uniforme en todas las áreas evaluadas.\n\nAusencia de lesiones cutáneas: No se detectaron lesiones cutáneas como abrasiones, quemaduras, cortes o irritaciones en ninguna parte del cuerpo del paciente. La piel está íntegra y sin signos de traumatismos recientes.\n\nExposición controlada a agentes ambientales: No se identificaron signos de exposición excesiva a sustancias químicas o agentes ambientales que puedan afectar la piel.",
-            "AUDIOMETRÍA": "No presenta signos de pérdida auditiva o alteraciones en la audición. Los resultados se encuentran dentro de los rangos normales establecidos para la población general y no se observan indicios de daño auditivo relacionado con la exposición laboral a ruido u otros factores.",
-            "OPTOMETRÍA": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "VISIOMETRÍA": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "ELECTROCARDIOGRAMA": "Electrocardiograma: Ritmo sinusal normal. No se observan alteraciones en la conducción cardíaca ni signos de isquemia o hipertrofia ventricular. Los intervalos y segmentos se encuentran dentro de los parámetros normales.",
-            "CUADRO HEMÁTICO": "Cuadro Hemático: Los valores de hemoglobina, hematocrito, leucocitos y plaquetas se encuentran dentro de los rangos normales. No se observan alteraciones que sugieran anemia, infección activa o trastornos de coagulación.",
-            "HEMOGRAMA": "Hemograma: Los valores de hemoglobina, hematocrito, leucocitos y plaquetas se encuentran dentro de los rangos normales. No se observan alteraciones que sugieran anemia, infección activa o trastornos de coagulación.",
-            "GLICEMIA": "Glicemia: Los niveles de glucosa en sangre se encuentran dentro de los parámetros normales, lo que indica un adecuado metabolismo de los carbohidratos.",
-            "GLUCOSA EN SANGRE": "Glucosa en Sangre: Los niveles de glucosa en sangre se encuentran dentro de los parámetros normales, lo que indica un adecuado metabolismo de los carbohidratos.",
-            "PARCIAL DE ORINA": "Parcial de Orina: El examen de orina no muestra alteraciones significativas. No se observan signos de infección urinaria, proteinuria ni glucosuria.",
-            "PANEL DE DROGAS": "Panel de Drogas: Los resultados del panel de detección de sustancias psicoactivas son negativos para todas las sustancias evaluadas.",
-            "EXAMEN DE ALTURAS": "Examen de Alturas: El paciente presenta condiciones físicas y psicológicas adecuadas para realizar trabajo en alturas. No se identifican contraindicaciones médicas para esta actividad.",
-            "MANIPULACIÓN DE ALIMENTOS": "Manipulación de Alimentos: El paciente cumple con los requisitos de salud establecidos para la manipulación de alimentos. No presenta enfermedades infectocontagiosas ni condiciones que representen riesgo para la inocuidad alimentaria.",
-            "KOH / COPROLÓGICO / FROTIS FARÍNGEO": "KOH / Coprológico / Frotis Faríngeo: Los exámenes de laboratorio no evidencian presencia de hongos, parásitos intestinales ni infecciones faríngeas activas.",
-            "SCL-90": "SCL-90: La evaluación psicológica mediante el cuestionario SCL-90 muestra resultados dentro de los rangos normales en todas las dimensiones evaluadas, sin indicadores de psicopatología significativa.",
-            "PRUEBA PSICOSENSOMÉTRICA": "Prueba Psicosensométrica: El usuario comprende rápidamente las indicaciones, realiza las pruebas correctamente y en el tiempo estipulado. La atención, concentración, memoria, velocidad de respuesta y las habilidades psicomotrices no presentan ninguna alteración. Los resultados están dentro de los rangos normales.",
-            "EXAMEN MÉDICO OCUPACIONAL / AUDIOMETRÍA / VISIOMETRÍA": "Examen médico ocupacional completo con audiometría y visiometría. Todos los resultados se encuentran dentro de los parámetros normales.",
-            # Mantener compatibilidad con nombres en formato antiguo (por si acaso)
-            "Examen Médico Osteomuscular": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
-            "Énfasis Cardiovascular": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
-            "É. Cardiovascular": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
-            "Perfil Lipídico": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
-            "É. VASCULAR": "El examen vascular muestra resultados dentro de los límites normales, sin evidencia de enfermedad arterial periférica ni estenosis carotídea significativa. Se recomienda al paciente continuar evitando el tabaquismo y mantener un estilo de vida saludable. Dada la buena condición vascular, no se requieren restricciones laborales en este momento. Se sugiere realizar seguimiento periódico para monitorear la salud vascular y prevenir posibles complicaciones en el futuro.",
-            "Test Vocal Voximetría": "Los resultados obtenidos del test de voximetría muestran que el paciente presenta una saturación de oxígeno adecuada tanto en reposo como durante la actividad laboral. La frecuencia respiratoria y la frecuencia cardíaca se encuentran dentro de los rangos normales, lo que sugiere que no hay signos de hipoxia o alteraciones significativas en la función respiratoria bajo condiciones laborales normales.",
-            "Espirometría": "Prueba Espirometría: Función pulmonar normal sin evidencia de obstrucción o restricción significativa. No se requieren medidas adicionales en relación con la función pulmonar para el paciente en este momento.",
-            "Énfasis Dermatológico": "Énfasis Dermatológico: Descripción general de la piel: La piel presenta un aspecto saludable, con una textura suave y uniforme. No se observan áreas de enrojecimiento, descamación o inflamación evidentes. El color de la piel es uniforme en todas las áreas evaluadas.\n\nAusencia de lesiones cutáneas: No se detectaron lesiones cutáneas como abrasiones, quemaduras, cortes o irritaciones en ninguna parte del cuerpo del paciente. La piel está íntegra y sin signos de traumatismos recientes.\n\nExposición controlada a agentes ambientales: No se identificaron signos de exposición excesiva a sustancias químicas o agentes ambientales que puedan afectar la piel.",
-            "Test R. Psicosocial (Ansiedad,Depresión)": "Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión.\n\nHabilidades de afrontamiento: Se identifican habilidades de afrontamiento efectivas, como la búsqueda de soluciones creativas y la gestión proactiva de situaciones conflictivas, lo que sugiere una capacidad para resolver problemas de manera constructiva.\n\nRelaciones interpersonales: Demuestra habilidades interpersonales excepcionales, estableciendo relaciones sólidas y colaborativas con colegas y superiores, lo que favorece un ambiente laboral armonioso y productivo.\n\nAutoeficacia y autoestima: Se evidencia una autoeficacia alta y una autoestima saludable, reflejando confianza en las propias habilidades y una valoración positiva de sí mismo, aspectos que contribuyen a un desempeño laboral sólido y satisfactorio.",
-            "Audiometría": "No presenta signos de pérdida auditiva o alteraciones en la audición. Los resultados se encuentran dentro de los rangos normales establecidos para la población general y no se observan indicios de daño auditivo relacionado con la exposición laboral a ruido u otros factores.",
-            "Optometría": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "Visiometría": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal."
-        }
-
-        # Construir resultados generales basados en los exámenes
-        resultados_generales = []
-        observaciones_certificado = datos_wix.get('mdObservacionesCertificado', '')
-
-        # Detectar si hay análisis postural en las observaciones
-        analisis_postural = []
-        observaciones_sin_analisis = observaciones_certificado
-
-        if observaciones_certificado and '=== ANÁLISIS POSTURAL ===' in observaciones_certificado:
-            # Separar análisis postural de las observaciones regulares
-            import re
-            patron = r'=== ANÁLISIS POSTURAL ===\s*(.*?)\s*=== FIN ANÁLISIS POSTURAL ==='
-            matches = re.findall(patron, observaciones_certificado, re.DOTALL)
-
-            for match in matches:
-                # Parsear cada ejercicio
-                ejercicio_info = {}
-
-                # Extraer fecha
-                fecha_match = re.search(r'Fecha:\s*(\d{2}/\d{2}/\d{4})', match)
-                if fecha_match:
-                    ejercicio_info['fecha'] = fecha_match.group(1)
-
-                # Extraer número de ejercicio y hora
-                ejercicio_match = re.search(r'EJERCICIO\s+(\d+)\s*\(([^)]+)\)', match)
-                if ejercicio_match:
-                    ejercicio_info['numero'] = ejercicio_match.group(1)
-                    ejercicio_info['hora'] = ejercicio_match.group(2)
-
-                # Extraer ángulo del tronco
-                tronco_match = re.search(r'Ángulo del tronco:\s*([\d.]+)°', match)
-                if tronco_match:
-                    ejercicio_info['angulo_tronco'] = tronco_match.group(1)
-
-                # Extraer alineación
-                alineacion_match = re.search(r'Alineación:\s*(\w+)', match)
-                if alineacion_match:
-                    ejercicio_info['alineacion'] = alineacion_match.group(1)
-
-                # Extraer ángulos articulares
-                codo_izq = re.search(r'Codo izquierdo:\s*([\d.]+)°', match)
-                codo_der = re.search(r'Codo derecho:\s*([\d.]+)°', match)
-                rodilla_izq = re.search(r'Rodilla izquierda:\s*([\d.]+)°', match)
-                rodilla_der = re.search(r'Rodilla derecha:\s*([\d.]+)°', match)
-
-                ejercicio_info['angulos'] = {
-                    'codo_izq': codo_izq.group(1) if codo_izq else 'N/A',
-                    'codo_der': codo_der.group(1) if codo_der else 'N/A',
-                    'rodilla_izq': rodilla_izq.group(1) if rodilla_izq else 'N/A',
-                    'rodilla_der': rodilla_der.group(1) if rodilla_der else 'N/A'
-                }
-
-                # Extraer simetría
-                hombros_match = re.search(r'Hombros:\s*(\w+)\s*\(diferencia:\s*([\d.]+)%\)', match)
-                caderas_match = re.search(r'Caderas:\s*(\w+)\s*\(diferencia:\s*([\d.]+)%\)', match)
-
-                ejercicio_info['simetria'] = {
-                    'hombros': hombros_match.group(1) if hombros_match else 'N/A',
-                    'hombros_diff': hombros_match.group(2) if hombros_match else 'N/A',
-                    'caderas': caderas_match.group(1) if caderas_match else 'N/A',
-                    'caderas_diff': caderas_match.group(2) if caderas_match else 'N/A'
-                }
-
-                analisis_postural.append(ejercicio_info)
-
-            # Remover análisis postural de las observaciones
-            observaciones_sin_analisis = re.sub(r'=== ANÁLISIS POSTURAL ===.*?=== FIN ANÁLISIS POSTURAL ===\s*', '', observaciones_certificado, flags=re.DOTALL).strip()
-
-        # Si el paciente no ha sido atendido, no usar textos genéricos hardcodeados ni firmas
-        paciente_atendido = str(datos_wix.get('atendido', '')).strip().upper() in ('ATENDIDO', 'ATENDIDA')
-
-        # Usar examenes_normalizados que ya fue definido arriba (con normalizar_lista_examenes)
-        # Si hay observaciones del médico, usarlas en lugar del texto hardcodeado
-        for i, examen in enumerate(examenes_normalizados):
-            # ADC tiene su propia sección dedicada con datos calculados, no mostrar texto genérico
-            if "ADC" in examen.upper():
-                continue
-            descripcion = None
-            # Si hay observaciones y este es el examen médico principal, usar las observaciones
-            if observaciones_sin_analisis and ("OSTEOMUSCULAR" in examen.upper() or "OCUPACIONAL" in examen.upper()):
-                descripcion = observaciones_sin_analisis
-            # Si es audiometría y hay datos de audiometría, usar el diagnóstico del audiograma
-            elif "AUDIOMETRÍA" in examen.upper() or "AUDIOMETRIA" in examen.upper():
-                # Excepción puntual: omitir item para cédula 1140837675 (no imprimir nada en Resultados Generales)
-                if str(datos_wix.get('numeroId', '')) == '1140837675':
-                    continue
-                if datos_audiometria and datos_audiometria.get('diagnostico'):
-                    descripcion = datos_audiometria['diagnostico']
-                elif paciente_atendido:
-                    descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-            # Serología: ocultar siempre el resultado en el certificado
-            elif "SEROLOG" in examen.upper():
-                continue
-            # Parcial de orina: usar datos reales de laboratorios o omitir
-            elif "PARCIAL DE ORINA" in examen.upper() or "PARCIAL ORINA" in examen.upper():
-                datos_orina = obtener_parcial_orina_postgres(datos_wix.get('_id', ''))
-                if datos_orina and datos_orina.get('descripcion'):
-                    descripcion = datos_orina['descripcion']
-                else:
-                    continue
-            # Panel de drogas: nunca imprimir resultados en el certificado
-            elif "PANEL DE DROGAS" in examen.upper() or "PANEL DROGAS" in examen.upper():
-                continue
-            # Si es voximetría y hay datos, usar concepto + interpretación de la BD
-            elif "VOXIMETR" in examen.upper():
-                if datos_voximetria:
-                    partes = []
-                    if datos_voximetria.get('concepto'):
-                        partes.append(datos_voximetria['concepto'])
-                    if datos_voximetria.get('interpretacion'):
-                        partes.append(datos_voximetria['interpretacion'])
-                    if partes:
-                        descripcion = '. '.join(partes)
-                    elif paciente_atendido:
-                        descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-                elif paciente_atendido:
-                    descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-            # Optometría/Visiometría: si hay datos reales, mostrar el diagnóstico/concepto real
-            # (los valores numéricos completos van en la sección dedicada). Nunca ocultar la fila:
-            # si no hay datos reales, usar el texto predeterminado como fallback.
-            elif "OPTOMETR" in examen.upper() or "VISIOMETR" in examen.upper():
-                resultado_visual = ''
-                if datos_visual:
-                    resultado_visual = (datos_visual.get('diagnostico') or datos_visual.get('concepto') or '').strip()
-                if resultado_visual:
-                    descripcion = resultado_visual
-                elif paciente_atendido:
-                    descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-            elif paciente_atendido:
-                descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-
-            if descripcion is None:
-                continue
-            resultados_generales.append({
-                "examen": examen,
-                "descripcion": descripcion
-            })
-
-        # Recomendaciones médicas: solo usar texto genérico si el paciente fue atendido
-        recomendaciones = datos_wix.get('mdRecomendacionesMedicasAdicionales', '')
-        if not recomendaciones and paciente_atendido:
-            recomendaciones = "RECOMENDACIONES GENERALES:\n1. PAUSAS ACTIVAS\n2. HIGIENE POSTURAL\n3. MEDIDAS ERGONOMICAS\n4. TÉCNICAS DE MANEJO DE ESTRÉS\n5. ALIMENTACIÓN BALANCEADA"
-
-        # Mapear médico a imagen de firma y datos
-        medico = datos_wix.get('medico', 'JUAN 134')
-        firma_medico_map = {
-            "SIXTA": "FIRMA-SIXTA.png",
-            "JUAN 134": "FIRMA-JUAN134.jpeg",
-            "CESAR": "FIRMA-CESAR.jpeg",
-            "MARY": "FIRMA-MARY.jpeg",
-            "NUBIA": "FIRMA-JUAN134.jpeg",
-            "PRESENCIAL": "FIRMA-PRESENCIAL.jpeg",
-            "PILAR": "FIRMA_PILAR.png"
-        }
-
-        # Datos de cada médico
-        medico_datos_map = {
-            "SIXTA": {
-                "nombre": "SIXTA VIVERO CARRASCAL",
-                "registro": "REGISTRO MÉDICO NO 55300504",
-                "licencia": "LICENCIA SALUD OCUPACIONAL 583",
-                "fecha": "16 DE FEBRERO DE 2021"
-            },
-            "JUAN 134": {
-                "nombre": "JUAN JOSE REATIGA",
-                "registro": "C.C.: 7.472.676 - REGISTRO MEDICO NO 14791",
-                "licencia": "LICENCIA SALUD OCUPACIONAL 460",
-                "fecha": "6 DE JULIO DE 2020"
-            },
-            "CESAR": {
-                "nombre": "CÉSAR ADOLFO ZAMBRANO MARTÍNEZ",
-                "registro": "REGISTRO MEDICO NO 1192803570",
-                "licencia": "LICENCIA SALUD OCUPACIONAL # 3241",
-                "fecha": "13 DE JULIO DE 2021"
-            },
-            "MARY": {
-                "nombre": "",
-                "registro": "",
-                "licencia": "",
-                "fecha": ""
-            },
-            "NUBIA": {
-                "nombre": "JUAN JOSE REATIGA",
-                "registro": "C.C.: 7.472.676 - REGISTRO MEDICO NO 14791",
-                "licencia": "LICENCIA SALUD OCUPACIONAL 460",
-                "fecha": "6 DE JULIO DE 2020"
-            },
-            "PRESENCIAL": {
-                "nombre": "",
-                "registro": "",
-                "licencia": "",
-                "fecha": ""
-            },
-            "PILAR": {
-                "nombre": "DRA. MARIA DEL PILAR PEROZO HERNANDEZ",
-                "registro": "C.C.: 1.090.419.867 - MÉDICO OCUPACIONAL",
-                "licencia": "Resolución No. 27293",
-                "fecha": "05 DE AGOSTO DE 2025"
-            }
-        }
-
-        # Firma del médico: prioridad 1 = medicos.firma en BD (scoped por tenant),
-        # fallback = archivo estático del map hardcodeado.
-        tenant_id_med = datos_wix.get('tenant_id')
-        wix_id_historia = datos_wix.get('_id')
-        firma_db = obtener_firma_medico_db(medico, tenant_id_med, wix_id_historia)
-        if firma_db:
-            firma_medico_url = firma_db  # puede ser data URI o URL, el template acepta ambos
-            print(f"✅ Firma médico: desde BD (tenant={tenant_id_med or 'resuelto via HC'}, alias={medico})")
-        else:
-            firma_medico_filename = firma_medico_map.get(medico)
-            firma_medico_url = f"https://bsl-utilidades-yp78a.ondigitalocean.app/static/{firma_medico_filename}" if firma_medico_filename else ""
-            print(f"✅ Firma médico: static fallback ({firma_medico_filename or 'ninguna'})")
-
-        # Obtener datos del médico: prioridad 1 = map hardcodeado, prioridad 2 = tabla medicos en BD
-        datos_medico = medico_datos_map.get(medico)
-        if not datos_medico:
-            datos_medico_db = obtener_datos_medico_db(medico, tenant_id_med, wix_id_historia)
-            if datos_medico_db:
-                datos_medico = datos_medico_db
-                print(f"✅ Datos médico: desde BD (alias={medico})")
-            else:
-                datos_medico = {"nombre": "", "registro": "", "licencia": "", "fecha": ""}
-        print(f"👨‍⚕️ Médico: {datos_medico['nombre']}")
-
-        # Firma del paciente desde PostgreSQL
-        firma_paciente_url = datos_wix.get('firma_paciente')
-        if firma_paciente_url:
-            print(f"✅ Firma paciente: obtenida desde PostgreSQL (data URI base64)")
-        else:
-            print(f"ℹ️  Firma paciente: no disponible")
-
-        # Firma del optómetra (siempre la misma)
-        firma_optometra_url = "https://bsl-utilidades-yp78a.ondigitalocean.app/static/FIRMA-OPTOMETRA.jpeg"
-        print(f"✅ Firma optómetra: FIRMA-OPTOMETRA.jpeg")
-
-        # Datos del tenant (distintivo, nombre, etc.) para usar en el payload
-        _tenant_data = obtener_datos_tenant(datos_wix.get('tenant_id'))
-
-        # Preparar payload para el endpoint de generación
-        payload_certificado = {
-            # Datos personales
-            "nombres_apellidos": nombre_completo,
-            "documento_identidad": datos_wix.get('numeroId', ''),
-            "cargo": datos_wix.get('cargo', ''),
-            "cod_empresa": datos_wix.get('codEmpresa', ''),
-            "empresa": "PARTICULAR" if datos_wix.get('codEmpresa') in EMPRESAS_COMO_PARTICULAR else ("FOUNDEVER" if datos_wix.get('codEmpresa') == 'SITEL' else datos_wix.get('empresa', '')),
-            "genero": datos_wix.get('genero', ''),
-            "edad": str(datos_wix.get('edad', '')),
-            "fecha_nacimiento": datos_wix.get('fechaNacimiento', ''),
-            "estado_civil": datos_wix.get('estadoCivil', ''),
-            "hijos": str(datos_wix.get('hijos', '0')),
-            "profesion": datos_wix.get('profesionUOficio', ''),
-            "email": datos_wix.get('email', ''),
-            "celular": datos_wix.get('celular', ''),
-            "tipo_examen": datos_wix.get('tipoExamen', ''),
-            "foto_paciente": datos_wix.get('foto_paciente', None),
-
-            # Seguridad social y nivel educativo
-            "eps": datos_wix.get('eps', ''),
-            "arl": datos_wix.get('arl', ''),
-            "pensiones": datos_wix.get('pensiones', ''),
-            "nivel_educativo": datos_wix.get('nivel_educativo', ''),
-
-            # Información de la consulta
-            "fecha_atencion": fecha_formateada,
-            "ciudad": "BOGOTÁ" if datos_wix.get('codEmpresa') in EMPRESAS_COMO_PARTICULAR else (datos_wix.get('ciudadDeResidencia') or datos_wix.get('ciudad', 'Bogotá')),
-            "vigencia": obtener_vigencia_certificado(
-                datos_wix.get('codEmpresa'),
-                datos_wix.get('numeroId'),
-            ),
-            "ips_sede": _tenant_data.get('tenant_distintivo', 'Sede norte DHSS0244914'),
-
-            # Exámenes
-            "examenes_realizados": examenes_realizados,
-            "examenes": examenes_para_template,  # Lista de exámenes para secciones detalladas (filtrada para SITEL)
-
-            # Resultados generales (con textos dinámicos)
-            "resultados_generales": resultados_generales,
-
-            # Análisis postural (si existe)
-            "analisis_postural": analisis_postural,
-
-            # Concepto médico (solo SANITHELP-JJ tiene valor por defecto)
-            "concepto_medico": datos_wix.get('mdConceptoFinal', '') or ('ELEGIBLE PARA EL CARGO' if datos_wix.get('codEmpresa') == 'SANITHELP-JJ' else ''),
-
-            # Recomendaciones médicas
-            "recomendaciones_medicas": recomendaciones,
-
-            # Datos visuales (Optometría/Visiometría)
-            "datos_visual": datos_visual,
-
-            # Datos de audiometría
-            "datos_audiometria": datos_audiometria,
-
-            # Datos de voximetría
-            "datos_voximetria": datos_voximetria,
-
-            # Datos ADC (Perfil Psicológico)
-            "datos_adc": datos_adc,
-
-            # Firmas
-            "medico_nombre": datos_medico['nombre'],
-            "medico_registro": datos_medico['registro'],
-            "medico_licencia": datos_medico['licencia'],
-            "medico_fecha": datos_medico['fecha'],
-            "firma_medico_url": firma_medico_url,
-            "firma_paciente_url": firma_paciente_url,
-            "firma_optometra_url": firma_optometra_url,
-
-            # Almacenamiento
-            "guardar_drive": guardar_drive,
-            "nombre_archivo": f"certificado_{datos_wix.get('numeroId', wix_id)}_{obtener_fecha_colombia().strftime('%Y%m%d')}.pdf"
-        }
-
-        print(f"📄 Datos preparados para generar certificado")
-        print(f"👤 Paciente: {nombre_completo}")
-        print(f"🆔 Documento: {datos_wix.get('numeroId', '')}")
-
-        # ========== GENERAR PDF CON PUPPETEER ==========
-        # Usar Puppeteer con la URL del preview
-
-        print("🎭 Generando PDF con Puppeteer desde URL del preview...")
-
-        # Construir URL del preview HTML con cache-busting
-        import time
-        cache_buster = int(time.time() * 1000)  # timestamp en milisegundos
-        preview_url = f"https://bsl-utilidades-yp78a.ondigitalocean.app/preview-certificado-html/{wix_id}?v={cache_buster}"
-        print(f"🔗 URL del preview: {preview_url}")
-
-        # Generar PDF usando Puppeteer
-        try:
-            pdf_content = puppeteer_html_to_pdf_from_url(
-                html_url=preview_url,
-                output_filename=f"certificado_{datos_wix.get('numeroId', wix_id)}"
-            )
-
-            # Guardar PDF localmente para envío directo
-            print("💾 Guardando PDF localmente...")
-            documento_id = datos_wix.get('numeroId', wix_id)
-            documento_sanitized = str(documento_id).replace(" ", "_").replace("/", "_").replace("\\", "_")
-            local = f"certificado_medico_{documento_sanitized}.pdf"
-
-            with open(local, "wb") as f:
-                f.write(pdf_content)
-
-            print(f"✅ PDF generado y guardado localmente: {local}")
-
-            # Enviar archivo como descarga directa
-            response = send_file(
-                local,
-                mimetype='application/pdf',
-                as_attachment=True,
-                download_name=f"certificado_medico_{documento_sanitized}.pdf"
-            )
-
-            # Configurar CORS
-            response.headers["Access-Control-Allow-Origin"] = "*"
-
-            # Limpiar archivo temporal después del envío
-            @response.call_on_close
-            def cleanup():
-                try:
-                    os.remove(local)
-                    print(f"🗑️  Archivo temporal eliminado: {local}")
-                except Exception as e:
-                    print(f"⚠️  Error al eliminar archivo temporal: {e}")
-
-            return response
-
-        except Exception as e:
-            print(f"❌ Error generando PDF con Puppeteer: {e}")
-            traceback.print_exc()
-            error_response = jsonify({
-                "success": False,
-                "error": f"Error generando PDF: {str(e)}"
-            })
-            error_response.headers["Access-Control-Allow-Origin"] = "*"
-            return error_response, 500
-
-    except Exception as e:
-        print(f"❌ Error generando certificado desde Wix: {str(e)}")
-        traceback.print_exc()
-
-        error_response = jsonify({
-            "success": False,
-            "error": str(e),
-            "wix_id": wix_id
-        })
-        error_response.headers["Access-Control-Allow-Origin"] = "*"
-
-        return error_response, 500
-
-
-# ================================================
-# ENDPOINTS PARA DESCARGAS ALEGRA (iLovePDF)
-# ================================================
-
-@app.route("/generar-certificado-alegra/<wix_id>", methods=["GET", "OPTIONS"])
-def generar_certificado_alegra(wix_id):
-    """
-    Endpoint que muestra loader mientras se genera el certificado con iLovePDF (Descargas Alegra)
+@app.route("/generar-certificado-alegra/<wix_id>", methods=["GET", "OPTIONS"])
+def generar_certificado_alegra(wix_id):
+    """
+    Endpoint que muestra loader mientras se genera el certificado con iLovePDF (Descargas Alegra)
 
     Args:
         wix_id: ID del registro en la colección HistoriaClinica de Wix
@@ -6295,768 +5616,814 @@ def preview_certificado_alegra(wix_id):
         return f"<html><body><h1>Error</h1><p>{str(e)}</p></body></html>", 500
 
 
-# --- Endpoint: PREVIEW CERTIFICADO EN HTML (sin generar PDF) ---
-@app.route("/preview-certificado-html/<wix_id>", methods=["GET", "OPTIONS"])
-def preview_certificado_html(wix_id):
+def ensamblar_datos_certificado(wix_id, datos_wix=None, usar_datos_formulario=False):
     """
-    Endpoint para previsualizar el certificado en HTML sin generar el PDF
+    Arma los datos del template certificado_medico.html consultando Wix,
+    HistoriaClinica y las tablas de cada examen.
+
+    Es lo que guarda certificado_snapshot; el código de seguridad y la fecha
+    de custodia cambian en cada render y los pone el preview.
 
     Args:
         wix_id: ID del registro en la colección HistoriaClinica de Wix
+        datos_wix: datos ya cargados (flujo Alegra); None = consultar Wix y PostgreSQL
+        usar_datos_formulario: los datos ya traen el FORMULARIO (no consultar PostgreSQL)
 
     Returns:
-        HTML renderizado del certificado
+        dict: datos_certificado, o None si no hay datos del paciente
     """
-    if request.method == "OPTIONS":
-        response_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type"
-        }
-        return ("", 204, response_headers)
-
-    try:
-        print(f"🔍 Previsualizando certificado HTML para Wix ID: {wix_id}")
-
-        # Consultar datos desde Wix HTTP Functions
-        wix_base_url = os.getenv("WIX_BASE_URL", "https://www.bsl.com.co/_functions")
-
-        # Verificar si tenemos datos enriquecidos de Alegra (vienen de flask.g)
-        import flask
-        usar_datos_formulario = getattr(flask.g, 'usar_datos_formulario', False)
+    # Consultar datos desde Wix HTTP Functions
+    wix_base_url = os.getenv("WIX_BASE_URL", "https://www.bsl.com.co/_functions")
 
-        if usar_datos_formulario and hasattr(flask.g, 'datos_wix_enriquecidos'):
-            # Usar datos ya enriquecidos con FORMULARIO (vienen de preview_certificado_alegra)
-            datos_wix = flask.g.datos_wix_enriquecidos
-            print(f"✅ [ALEGRA] Usando datos enriquecidos con FORMULARIO para preview")
-        else:
-            # Consultar normalmente desde Wix (flujo original de Puppeteer)
-            datos_wix = {}
-            try:
-                wix_url = f"{wix_base_url}/historiaClinicaPorId?_id={wix_id}"
-                response = requests.get(wix_url, timeout=10)
+    datos_historia_postgres = None
+    if datos_wix is None:
+        # Consultar normalmente desde Wix (flujo original de Puppeteer)
+        datos_wix = {}
+        try:
+            wix_url = f"{wix_base_url}/historiaClinicaPorId?_id={wix_id}"
+            response = requests.get(wix_url, timeout=10)
 
-                if response.status_code == 200:
-                    wix_response = response.json()
-                    datos_wix = wix_response.get("data", {})
+            if response.status_code == 200:
+                wix_response = response.json()
+                datos_wix = wix_response.get("data", {})
 
-                    if datos_wix:
-                        print(f"✅ Datos obtenidos de Wix para ID: {wix_id}")
-                    else:
-                        print(f"⚠️ Wix retornó respuesta vacía, intentando PostgreSQL...")
+                if datos_wix:
+                    print(f"✅ Datos obtenidos de Wix para ID: {wix_id}")
                 else:
-                    print(f"⚠️ Error consultando Wix: {response.status_code}, intentando PostgreSQL...")
-
-            except Exception as e:
-                print(f"⚠️ Error de conexión a Wix: {str(e)}, intentando PostgreSQL...")
+                    print(f"⚠️ Wix retornó respuesta vacía, intentando PostgreSQL...")
+            else:
+                print(f"⚠️ Error consultando Wix: {response.status_code}, intentando PostgreSQL...")
 
-            # SIEMPRE consultar PostgreSQL primero (tiene prioridad sobre Wix)
-            print(f"🔍 Consultando HistoriaClinica desde PostgreSQL (prioridad)...")
-            datos_historia_postgres = obtener_datos_historia_clinica_postgres(wix_id)
+        except Exception as e:
+            print(f"⚠️ Error de conexión a Wix: {str(e)}, intentando PostgreSQL...")
 
-            if datos_historia_postgres:
-                print(f"✅ Datos obtenidos de HistoriaClinica PostgreSQL")
-                # PostgreSQL sobrescribe TODOS los datos de Wix
-                for key, value in datos_historia_postgres.items():
-                    if value is not None:
-                        datos_wix[key] = value
-                        print(f"  ✓ {key} sobrescrito desde PostgreSQL")
-            elif not datos_wix:
-                print(f"❌ No se encontraron datos ni en Wix ni en PostgreSQL")
-                return f"<html><body><h1>Error</h1><p>No se encontraron datos del paciente en el sistema (ID: {wix_id})</p></body></html>", 404
+        # SIEMPRE consultar PostgreSQL primero (tiene prioridad sobre Wix)
+        print(f"🔍 Consultando HistoriaClinica desde PostgreSQL (prioridad)...")
+        datos_historia_postgres = obtener_datos_historia_clinica_postgres(wix_id)
 
-        # Transformar datos de Wix al formato del certificado
-        nombre_completo = f"{datos_wix.get('primerNombre', '')} {datos_wix.get('segundoNombre', '')} {datos_wix.get('primerApellido', '')} {datos_wix.get('segundoApellido', '')}".strip()
+        if datos_historia_postgres:
+            print(f"✅ Datos obtenidos de HistoriaClinica PostgreSQL")
+            # PostgreSQL sobrescribe TODOS los datos de Wix
+            for key, value in datos_historia_postgres.items():
+                if value is not None:
+                    datos_wix[key] = value
+                    print(f"  ✓ {key} sobrescrito desde PostgreSQL")
+        elif not datos_wix:
+            print(f"❌ No se encontraron datos ni en Wix ni en PostgreSQL")
+            return None
 
-        # Usar fechaConsulta como prioridad, pero si es fecha futura inválida, usar fechaAtencion
-        fecha_consulta = datos_wix.get('fechaConsulta') or datos_wix.get('fechaAtencion')
-        fecha_atencion_fallback = datos_wix.get('fechaAtencion')
+    # Transformar datos de Wix al formato del certificado
+    nombre_completo = f"{datos_wix.get('primerNombre', '')} {datos_wix.get('segundoNombre', '')} {datos_wix.get('primerApellido', '')} {datos_wix.get('segundoApellido', '')}".strip()
 
-        def _parsear_fecha(f):
-            if isinstance(f, datetime):
-                return f
-            if isinstance(f, str):
-                try:
-                    return datetime.fromisoformat(f.replace('Z', '+00:00'))
-                except (ValueError, AttributeError):
-                    return None
-            return None
+    # Usar fechaConsulta como prioridad, pero si es fecha futura inválida, usar fechaAtencion
+    fecha_consulta = datos_wix.get('fechaConsulta') or datos_wix.get('fechaAtencion')
+    fecha_atencion_fallback = datos_wix.get('fechaAtencion')
 
-        fecha_obj = _parsear_fecha(fecha_consulta)
-        # Si fechaConsulta es futura (>30 días), probablemente es dato corrupto → usar fechaAtencion
-        if fecha_obj and fecha_obj.replace(tzinfo=None) > datetime.now() + timedelta(days=30) and fecha_atencion_fallback:
-            fecha_obj_fallback = _parsear_fecha(fecha_atencion_fallback)
-            if fecha_obj_fallback:
-                fecha_obj = fecha_obj_fallback
+    def _parsear_fecha(f):
+        if isinstance(f, datetime):
+            return f
+        if isinstance(f, str):
+            try:
+                return datetime.fromisoformat(f.replace('Z', '+00:00'))
+            except (ValueError, AttributeError):
+                return None
+        return None
 
-        if fecha_obj:
-            fecha_formateada = formatear_fecha_espanol(fecha_obj)
-        else:
-            fecha_formateada = formatear_fecha_espanol(obtener_fecha_colombia())
-
-        # Construir exámenes realizados
-        # Normalizar lista de exámenes (convierte string a array si viene de PostgreSQL)
-        examenes = normalizar_lista_examenes(datos_wix.get('examenes', []))
-        examenes_normalizados = [normalizar_examen(e) for e in examenes]
-        # SITEL/REMOTE: excluir secciones detalladas de optometría, audiometría y ADC
-        EXAMENES_DETALLE_EXCLUIDOS = {'OPTOMETRÍA', 'VISIOMETRÍA', 'AUDIOMETRÍA', 'PERFIL PSICOLÓGICO ADC'}
-        if datos_wix.get('codEmpresa') in ('SITEL', 'REMOTE'):
-            examenes_para_template = [e for e in examenes_normalizados if e not in EXAMENES_DETALLE_EXCLUIDOS]
-        else:
-            examenes_para_template = examenes_normalizados
+    fecha_obj = _parsear_fecha(fecha_consulta)
+    # Si fechaConsulta es futura (>30 días), probablemente es dato corrupto → usar fechaAtencion
+    if fecha_obj and fecha_obj.replace(tzinfo=None) > datetime.now() + timedelta(days=30) and fecha_atencion_fallback:
+        fecha_obj_fallback = _parsear_fecha(fecha_atencion_fallback)
+        if fecha_obj_fallback:
+            fecha_obj = fecha_obj_fallback
 
-        # Excluir la batería de riesgo psicosocial del certificado médico:
-        # vive en la app BRS y no aporta al concepto de aptitud laboral.
-        examenes_realizados = []
-        for examen in examenes_normalizados:
-            if 'PSICOSOCIAL' in examen.upper():
-                continue
-            examenes_realizados.append({
-                "nombre": examen,
-                "fecha": fecha_formateada
-            })
+    if fecha_obj:
+        fecha_formateada = formatear_fecha_espanol(fecha_obj)
+    else:
+        fecha_formateada = formatear_fecha_espanol(obtener_fecha_colombia())
+
+    # Construir exámenes realizados
+    # Normalizar lista de exámenes (convierte string a array si viene de PostgreSQL)
+    examenes = normalizar_lista_examenes(datos_wix.get('examenes', []))
+    examenes_normalizados = [normalizar_examen(e) for e in examenes]
+    # SITEL/REMOTE: excluir secciones detalladas de optometría, audiometría y ADC
+    EXAMENES_DETALLE_EXCLUIDOS = {'OPTOMETRÍA', 'VISIOMETRÍA', 'AUDIOMETRÍA', 'PERFIL PSICOLÓGICO ADC'}
+    if datos_wix.get('codEmpresa') in ('SITEL', 'REMOTE'):
+        examenes_para_template = [e for e in examenes_normalizados if e not in EXAMENES_DETALLE_EXCLUIDOS]
+    else:
+        examenes_para_template = examenes_normalizados
+
+    # Excluir la batería de riesgo psicosocial del certificado médico:
+    # vive en la app BRS y no aporta al concepto de aptitud laboral.
+    examenes_realizados = []
+    for examen in examenes_normalizados:
+        if 'PSICOSOCIAL' in examen.upper():
+            continue
+        examenes_realizados.append({
+            "nombre": examen,
+            "fecha": fecha_formateada
+        })
 
-        # ===== CONSULTAR DATOS VISUALES (Optometría/Visiometría) =====
-        datos_visual = None
-        # examenes y examenes_normalizados ya están definidos arriba (ahora en MAYÚSCULAS)
-        tiene_examen_visual = any(e in ['OPTOMETRÍA', 'VISIOMETRÍA', 'Optometría', 'Visiometría'] for e in examenes_normalizados)
+    # ===== CONSULTAR DATOS VISUALES (Optometría/Visiometría) =====
+    datos_visual = None
+    # examenes y examenes_normalizados ya están definidos arriba (ahora en MAYÚSCULAS)
+    tiene_examen_visual = any(e in ['OPTOMETRÍA', 'VISIOMETRÍA', 'Optometría', 'Visiometría'] for e in examenes_normalizados)
 
-        if tiene_examen_visual and datos_wix.get('codEmpresa') != 'SITEL':
-            wix_id_historia = datos_wix.get('_id', wix_id)  # Usar wix_id del parámetro si no viene en datos_wix
+    if tiene_examen_visual and datos_wix.get('codEmpresa') != 'SITEL':
+        wix_id_historia = datos_wix.get('_id', wix_id)  # Usar wix_id del parámetro si no viene en datos_wix
 
-            # PRIORIDAD 1: Consultar PostgreSQL - visiometrias (optometría profesional)
-            print(f"🔍 [PRIORIDAD 1] Consultando visiometrias (optometría profesional) en PostgreSQL para: {wix_id_historia}", flush=True)
-            datos_visual = obtener_optometria_postgres(wix_id_historia)
+        # PRIORIDAD 1: Consultar PostgreSQL - visiometrias (optometría profesional)
+        print(f"🔍 [PRIORIDAD 1] Consultando visiometrias (optometría profesional) en PostgreSQL para: {wix_id_historia}", flush=True)
+        datos_visual = obtener_optometria_postgres(wix_id_historia)
 
-            # PRIORIDAD 2: Consultar PostgreSQL - visiometrias_virtual (examen virtual) como fallback
-            if not datos_visual:
-                print(f"🔍 [PRIORIDAD 2] Consultando visiometrias_virtual en PostgreSQL...", flush=True)
-                datos_visual = obtener_visiometria_postgres(wix_id_historia)
+        # PRIORIDAD 2: Consultar PostgreSQL - visiometrias_virtual (examen virtual) como fallback
+        if not datos_visual:
+            print(f"🔍 [PRIORIDAD 2] Consultando visiometrias_virtual en PostgreSQL...", flush=True)
+            datos_visual = obtener_visiometria_postgres(wix_id_historia)
 
-            # PRIORIDAD 3: Fallback a Wix si PostgreSQL no tiene datos
-            if not datos_visual:
-                print(f"🔍 [PRIORIDAD 3 - Fallback] Consultando datos visuales en Wix...", flush=True)
-                try:
-                    visual_url = f"https://www.bsl.com.co/_functions/visualPorIdGeneral?idGeneral={wix_id_historia}"
+        # PRIORIDAD 3: Fallback a Wix si PostgreSQL no tiene datos
+        if not datos_visual:
+            print(f"🔍 [PRIORIDAD 3 - Fallback] Consultando datos visuales en Wix...", flush=True)
+            try:
+                visual_url = f"https://www.bsl.com.co/_functions/visualPorIdGeneral?idGeneral={wix_id_historia}"
 
-                    visual_response = requests.get(visual_url, timeout=10)
+                visual_response = requests.get(visual_url, timeout=10)
 
-                    if visual_response.status_code == 200:
-                        visual_data = visual_response.json()
-                        if visual_data.get('success') and visual_data.get('data'):
-                            datos_visual = visual_data['data'][0] if len(visual_data['data']) > 0 else None
-                            print(f"✅ Datos visuales obtenidos desde Wix (fallback)", flush=True)
-                            print(f"📊 Datos: {datos_visual}", flush=True)
-                        else:
-                            print(f"⚠️ No se encontraron datos visuales en Wix para {wix_id_historia}", flush=True)
-                            datos_visual = None
+                if visual_response.status_code == 200:
+                    visual_data = visual_response.json()
+                    if visual_data.get('success') and visual_data.get('data'):
+                        datos_visual = visual_data['data'][0] if len(visual_data['data']) > 0 else None
+                        print(f"✅ Datos visuales obtenidos desde Wix (fallback)", flush=True)
+                        print(f"📊 Datos: {datos_visual}", flush=True)
                     else:
-                        print(f"⚠️ Error al consultar datos visuales en Wix: {visual_response.status_code}", flush=True)
+                        print(f"⚠️ No se encontraron datos visuales en Wix para {wix_id_historia}", flush=True)
                         datos_visual = None
-                except Exception as e:
-                    print(f"❌ Error consultando datos visuales en Wix: {e}", flush=True)
+                else:
+                    print(f"⚠️ Error al consultar datos visuales en Wix: {visual_response.status_code}", flush=True)
                     datos_visual = None
+            except Exception as e:
+                print(f"❌ Error consultando datos visuales en Wix: {e}", flush=True)
+                datos_visual = None
 
-        # ===== CONSULTAR DATOS DE AUDIOMETRÍA =====
-        datos_audiometria = None
-        tiene_examen_audio = any(e in ['AUDIOMETRÍA', 'Audiometría'] for e in examenes_normalizados)
+    # ===== CONSULTAR DATOS DE AUDIOMETRÍA =====
+    datos_audiometria = None
+    tiene_examen_audio = any(e in ['AUDIOMETRÍA', 'Audiometría'] for e in examenes_normalizados)
 
-        if tiene_examen_audio:
-            wix_id_historia = datos_wix.get('_id', wix_id)  # Usar wix_id del parámetro si no viene en datos_wix
+    if tiene_examen_audio:
+        wix_id_historia = datos_wix.get('_id', wix_id)  # Usar wix_id del parámetro si no viene en datos_wix
 
-            # PRIORIDAD 1: Consultar PostgreSQL (audiometrias)
-            print(f"🔍 [PRIORIDAD 1] Consultando audiometrias en PostgreSQL para: {wix_id_historia}", flush=True)
-            datos_audiometria = obtener_audiometria_postgres(wix_id_historia)
+        # PRIORIDAD 1: Consultar PostgreSQL (audiometrias)
+        print(f"🔍 [PRIORIDAD 1] Consultando audiometrias en PostgreSQL para: {wix_id_historia}", flush=True)
+        datos_audiometria = obtener_audiometria_postgres(wix_id_historia)
 
-            # PRIORIDAD 2: Fallback a Wix si PostgreSQL no tiene datos
-            if not datos_audiometria:
-                print(f"🔍 [PRIORIDAD 2 - Fallback] Consultando datos de audiometría en Wix...", flush=True)
-                try:
-                    audio_url = f"https://www.bsl.com.co/_functions/audiometriaPorIdGeneral?idGeneral={wix_id_historia}"
-
-                    audio_response = requests.get(audio_url, timeout=10)
-
-                    if audio_response.status_code == 200:
-                        audio_data = audio_response.json()
-                        if audio_data.get('success') and audio_data.get('data'):
-                            datos_raw = audio_data['data'][0] if len(audio_data['data']) > 0 else None
-
-                            if datos_raw:
-                                # Transformar datos de Wix al formato esperado
-                                frecuencias = [250, 500, 1000, 2000, 3000, 4000, 6000, 8000]
-                                datosParaTabla = []
-
-                                for freq in frecuencias:
-                                    campo_der = f"auDer{freq}"
-                                    campo_izq = f"auIzq{freq}"
-                                    datosParaTabla.append({
-                                        "frecuencia": freq,
-                                        "oidoDerecho": datos_raw.get(campo_der, 0),
-                                        "oidoIzquierdo": datos_raw.get(campo_izq, 0)
-                                    })
-
-                                # Calcular diagnóstico automático basado en umbrales auditivos
-                                def calcular_diagnostico_audiometria(datos):
-                                    # Detectar umbrales anormalmente bajos (por debajo de 0 dB)
-                                    umbrales_bajos_der = [d for d in datos if d['oidoDerecho'] < 0]
-                                    umbrales_bajos_izq = [d for d in datos if d['oidoIzquierdo'] < 0]
-                                    tiene_umbrales_bajos = len(umbrales_bajos_der) > 0 or len(umbrales_bajos_izq) > 0
-
-                                    # Promedios de frecuencias conversacionales (500, 1000, 2000 Hz)
-                                    freq_conv_indices = [1, 2, 3]  # índices para 500, 1000, 2000 Hz
-                                    valores_der = [datos[i]['oidoDerecho'] for i in freq_conv_indices]
-                                    valores_izq = [datos[i]['oidoIzquierdo'] for i in freq_conv_indices]
-
-                                    prom_der = sum(valores_der) / len(valores_der)
-                                    prom_izq = sum(valores_izq) / len(valores_izq)
-
-                                    def clasificar_umbral(umbral):
-                                        if umbral <= 25:
-                                            return "Normal"
-                                        elif umbral <= 40:
-                                            return "Leve"
-                                        elif umbral <= 55:
-                                            return "Moderada"
-                                        elif umbral <= 70:
-                                            return "Moderadamente Severa"
-                                        elif umbral <= 90:
-                                            return "Severa"
-                                        else:
-                                            return "Profunda"
-
-                                    clasif_der = clasificar_umbral(prom_der)
-                                    clasif_izq = clasificar_umbral(prom_izq)
-
-                                    # Verificar pérdida en frecuencias graves (250 Hz)
-                                    grave_250_der = datos[0]['oidoDerecho']  # 250 Hz es índice 0
-                                    grave_250_izq = datos[0]['oidoIzquierdo']
-
-                                    # Verificar pérdida en frecuencias agudas (6000, 8000 Hz)
-                                    agudas_der = [datos[6]['oidoDerecho'], datos[7]['oidoDerecho']]
-                                    agudas_izq = [datos[6]['oidoIzquierdo'], datos[7]['oidoIzquierdo']]
-                                    tiene_perdida_agudas = any(v > 25 for v in agudas_der + agudas_izq)
-
-                                    # Construir diagnóstico base
-                                    diagnostico_base = ""
-                                    notas_adicionales = []
-
-                                    if clasif_der == "Normal" and clasif_izq == "Normal":
-                                        if tiene_perdida_agudas:
-                                            diagnostico_base = "Audición dentro de parámetros normales en frecuencias conversacionales. Se observa leve disminución en frecuencias agudas."
-                                        else:
-                                            diagnostico_base = "Audición dentro de parámetros normales bilateralmente. Los umbrales auditivos se encuentran en rangos de normalidad en todas las frecuencias evaluadas."
-                                    elif clasif_der == "Normal":
-                                        diagnostico_base = f"Oído derecho con audición normal. Oído izquierdo presenta pérdida auditiva {clasif_izq.lower()} (promedio {prom_izq:.1f} dB HL)."
-                                    elif clasif_izq == "Normal":
-                                        diagnostico_base = f"Oído izquierdo con audición normal. Oído derecho presenta pérdida auditiva {clasif_der.lower()} (promedio {prom_der:.1f} dB HL)."
+        # PRIORIDAD 2: Fallback a Wix si PostgreSQL no tiene datos
+        if not datos_audiometria:
+            print(f"🔍 [PRIORIDAD 2 - Fallback] Consultando datos de audiometría en Wix...", flush=True)
+            try:
+                audio_url = f"https://www.bsl.com.co/_functions/audiometriaPorIdGeneral?idGeneral={wix_id_historia}"
+
+                audio_response = requests.get(audio_url, timeout=10)
+
+                if audio_response.status_code == 200:
+                    audio_data = audio_response.json()
+                    if audio_data.get('success') and audio_data.get('data'):
+                        datos_raw = audio_data['data'][0] if len(audio_data['data']) > 0 else None
+
+                        if datos_raw:
+                            # Transformar datos de Wix al formato esperado
+                            frecuencias = [250, 500, 1000, 2000, 3000, 4000, 6000, 8000]
+                            datosParaTabla = []
+
+                            for freq in frecuencias:
+                                campo_der = f"auDer{freq}"
+                                campo_izq = f"auIzq{freq}"
+                                datosParaTabla.append({
+                                    "frecuencia": freq,
+                                    "oidoDerecho": datos_raw.get(campo_der, 0),
+                                    "oidoIzquierdo": datos_raw.get(campo_izq, 0)
+                                })
+
+                            # Calcular diagnóstico automático basado en umbrales auditivos
+                            def calcular_diagnostico_audiometria(datos):
+                                # Detectar umbrales anormalmente bajos (por debajo de 0 dB)
+                                umbrales_bajos_der = [d for d in datos if d['oidoDerecho'] < 0]
+                                umbrales_bajos_izq = [d for d in datos if d['oidoIzquierdo'] < 0]
+                                tiene_umbrales_bajos = len(umbrales_bajos_der) > 0 or len(umbrales_bajos_izq) > 0
+
+                                # Promedios de frecuencias conversacionales (500, 1000, 2000 Hz)
+                                freq_conv_indices = [1, 2, 3]  # índices para 500, 1000, 2000 Hz
+                                valores_der = [datos[i]['oidoDerecho'] for i in freq_conv_indices]
+                                valores_izq = [datos[i]['oidoIzquierdo'] for i in freq_conv_indices]
+
+                                prom_der = sum(valores_der) / len(valores_der)
+                                prom_izq = sum(valores_izq) / len(valores_izq)
+
+                                def clasificar_umbral(umbral):
+                                    if umbral <= 25:
+                                        return "Normal"
+                                    elif umbral <= 40:
+                                        return "Leve"
+                                    elif umbral <= 55:
+                                        return "Moderada"
+                                    elif umbral <= 70:
+                                        return "Moderadamente Severa"
+                                    elif umbral <= 90:
+                                        return "Severa"
                                     else:
-                                        diagnostico_base = f"Pérdida auditiva bilateral: Oído derecho {clasif_der.lower()} (promedio {prom_der:.1f} dB HL), Oído izquierdo {clasif_izq.lower()} (promedio {prom_izq:.1f} dB HL)."
-
-                                    # Agregar nota sobre pérdida en 250 Hz si es significativa
-                                    if grave_250_der > 25 or grave_250_izq > 25:
-                                        if grave_250_der > 25 and grave_250_izq > 25:
-                                            notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) bilateral.")
-                                        elif grave_250_der > 25:
-                                            notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) en oído derecho ({grave_250_der} dB).")
-                                        else:
-                                            notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) en oído izquierdo ({grave_250_izq} dB).")
-
-                                    # Agregar nota sobre umbrales atípicamente bajos si existen
-                                    if tiene_umbrales_bajos:
-                                        frecuencias_afectadas = []
-                                        if umbrales_bajos_der:
-                                            frecuencias_afectadas.append("oído derecho")
-                                        if umbrales_bajos_izq:
-                                            frecuencias_afectadas.append("oído izquierdo")
-                                        notas_adicionales.append(f"Se observan umbrales atípicamente bajos en {' y '.join(frecuencias_afectadas)}.")
-
-                                    # Combinar diagnóstico base con notas adicionales
-                                    if notas_adicionales:
-                                        diagnostico_base += " " + " ".join(notas_adicionales)
-
-                                    return diagnostico_base
-
-                                # Usar diagnóstico de Wix si existe, sino calcular automáticamente
-                                diagnostico_auto = calcular_diagnostico_audiometria(datosParaTabla)
-                                diagnostico_final = datos_raw.get('diagnostico') or diagnostico_auto
-
-                                datos_audiometria = {
-                                    "datosParaTabla": datosParaTabla,
-                                    "diagnostico": diagnostico_final
-                                }
-                                print(f"✅ Datos de audiometría obtenidos desde Wix (fallback)", flush=True)
-                                print(f"📊 Diagnóstico: {diagnostico_final}", flush=True)
-                            else:
-                                datos_audiometria = None
+                                        return "Profunda"
+
+                                clasif_der = clasificar_umbral(prom_der)
+                                clasif_izq = clasificar_umbral(prom_izq)
+
+                                # Verificar pérdida en frecuencias graves (250 Hz)
+                                grave_250_der = datos[0]['oidoDerecho']  # 250 Hz es índice 0
+                                grave_250_izq = datos[0]['oidoIzquierdo']
+
+                                # Verificar pérdida en frecuencias agudas (6000, 8000 Hz)
+                                agudas_der = [datos[6]['oidoDerecho'], datos[7]['oidoDerecho']]
+                                agudas_izq = [datos[6]['oidoIzquierdo'], datos[7]['oidoIzquierdo']]
+                                tiene_perdida_agudas = any(v > 25 for v in agudas_der + agudas_izq)
+
+                                # Construir diagnóstico base
+                                diagnostico_base = ""
+                                notas_adicionales = []
+
+                                if clasif_der == "Normal" and clasif_izq == "Normal":
+                                    if tiene_perdida_agudas:
+                                        diagnostico_base = "Audición dentro de parámetros normales en frecuencias conversacionales. Se observa leve disminución en frecuencias agudas."
+                                    else:
+                                        diagnostico_base = "Audición dentro de parámetros normales bilateralmente. Los umbrales auditivos se encuentran en rangos de normalidad en todas las frecuencias evaluadas."
+                                elif clasif_der == "Normal":
+                                    diagnostico_base = f"Oído derecho con audición normal. Oído izquierdo presenta pérdida auditiva {clasif_izq.lower()} (promedio {prom_izq:.1f} dB HL)."
+                                elif clasif_izq == "Normal":
+                                    diagnostico_base = f"Oído izquierdo con audición normal. Oído derecho presenta pérdida auditiva {clasif_der.lower()} (promedio {prom_der:.1f} dB HL)."
+                                else:
+                                    diagnostico_base = f"Pérdida auditiva bilateral: Oído derecho {clasif_der.lower()} (promedio {prom_der:.1f} dB HL), Oído izquierdo {clasif_izq.lower()} (promedio {prom_izq:.1f} dB HL)."
+
+                                # Agregar nota sobre pérdida en 250 Hz si es significativa
+                                if grave_250_der > 25 or grave_250_izq > 25:
+                                    if grave_250_der > 25 and grave_250_izq > 25:
+                                        notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) bilateral.")
+                                    elif grave_250_der > 25:
+                                        notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) en oído derecho ({grave_250_der} dB).")
+                                    else:
+                                        notas_adicionales.append(f"Se observa disminución en frecuencias graves (250 Hz) en oído izquierdo ({grave_250_izq} dB).")
+
+                                # Agregar nota sobre umbrales atípicamente bajos si existen
+                                if tiene_umbrales_bajos:
+                                    frecuencias_afectadas = []
+                                    if umbrales_bajos_der:
+                                        frecuencias_afectadas.append("oído derecho")
+                                    if umbrales_bajos_izq:
+                                        frecuencias_afectadas.append("oído izquierdo")
+                                    notas_adicionales.append(f"Se observan umbrales atípicamente bajos en {' y '.join(frecuencias_afectadas)}.")
+
+                                # Combinar diagnóstico base con notas adicionales
+                                if notas_adicionales:
+                                    diagnostico_base += " " + " ".join(notas_adicionales)
+
+                                return diagnostico_base
+
+                            # Usar diagnóstico de Wix si existe, sino calcular automáticamente
+                            diagnostico_auto = calcular_diagnostico_audiometria(datosParaTabla)
+                            diagnostico_final = datos_raw.get('diagnostico') or diagnostico_auto
+
+                            datos_audiometria = {
+                                "datosParaTabla": datosParaTabla,
+                                "diagnostico": diagnostico_final
+                            }
+                            print(f"✅ Datos de audiometría obtenidos desde Wix (fallback)", flush=True)
+                            print(f"📊 Diagnóstico: {diagnostico_final}", flush=True)
                         else:
-                            print(f"⚠️ No se encontraron datos de audiometría en Wix para {wix_id_historia}", flush=True)
                             datos_audiometria = None
                     else:
-                        print(f"⚠️ Error al consultar datos de audiometría en Wix: {audio_response.status_code}", flush=True)
+                        print(f"⚠️ No se encontraron datos de audiometría en Wix para {wix_id_historia}", flush=True)
                         datos_audiometria = None
-                except Exception as e:
-                    print(f"❌ Error consultando datos de audiometría en Wix: {e}", flush=True)
+                else:
+                    print(f"⚠️ Error al consultar datos de audiometría en Wix: {audio_response.status_code}", flush=True)
                     datos_audiometria = None
+            except Exception as e:
+                print(f"❌ Error consultando datos de audiometría en Wix: {e}", flush=True)
+                datos_audiometria = None
 
-        # ===== CONSULTAR DATOS DE VOXIMETRÍA =====
-        datos_voximetria = None
-        tiene_examen_voximetria = any(e in ['VOXIMETRÍA', 'Voximetría', 'VOXIMETRIA', 'Voximetria', 'Test Vocal Voximetría'] for e in examenes_normalizados)
+    # ===== CONSULTAR DATOS DE VOXIMETRÍA =====
+    datos_voximetria = None
+    tiene_examen_voximetria = any(e in ['VOXIMETRÍA', 'Voximetría', 'VOXIMETRIA', 'Voximetria', 'Test Vocal Voximetría'] for e in examenes_normalizados)
 
-        if tiene_examen_voximetria:
-            wix_id_historia_vox = datos_wix.get('_id', wix_id)
-            print(f"🔍 Consultando voximetrias_virtual en PostgreSQL para: {wix_id_historia_vox}", flush=True)
-            datos_voximetria = obtener_voximetria_postgres(wix_id_historia_vox)
+    if tiene_examen_voximetria:
+        wix_id_historia_vox = datos_wix.get('_id', wix_id)
+        print(f"🔍 Consultando voximetrias_virtual en PostgreSQL para: {wix_id_historia_vox}", flush=True)
+        datos_voximetria = obtener_voximetria_postgres(wix_id_historia_vox)
 
-            if not datos_voximetria:
-                print(f"⚠️ No se encontraron datos de voximetría para {wix_id_historia_vox}", flush=True)
+        if not datos_voximetria:
+            print(f"⚠️ No se encontraron datos de voximetría para {wix_id_historia_vox}", flush=True)
 
-        # ===== CONSULTAR DATOS DE ADC (Perfil Psicológico) =====
-        datos_adc = None
-        cod_empresa_actual = datos_wix.get('codEmpresa', '')
-        tiene_examen_adc = any(e in ['PERFIL PSICOLÓGICO ADC', 'PERFIL PSICOLOGICO ADC', 'Perfil Psicológico ADC'] for e in examenes_normalizados)
+    # ===== CONSULTAR DATOS DE ADC (Perfil Psicológico) =====
+    datos_adc = None
+    cod_empresa_actual = datos_wix.get('codEmpresa', '')
+    tiene_examen_adc = any(e in ['PERFIL PSICOLÓGICO ADC', 'PERFIL PSICOLOGICO ADC', 'Perfil Psicológico ADC'] for e in examenes_normalizados)
 
-        if tiene_examen_adc and cod_empresa_actual != 'SITEL':
-            wix_id_historia_adc = datos_wix.get('_id', wix_id)
-            print(f"🔍 [PRIORIDAD 1] Consultando pruebasADC en PostgreSQL para: {wix_id_historia_adc}", flush=True)
-            datos_adc = obtener_adc_postgres(wix_id_historia_adc)
+    if tiene_examen_adc and cod_empresa_actual != 'SITEL':
+        wix_id_historia_adc = datos_wix.get('_id', wix_id)
+        print(f"🔍 [PRIORIDAD 1] Consultando pruebasADC en PostgreSQL para: {wix_id_historia_adc}", flush=True)
+        datos_adc = obtener_adc_postgres(wix_id_historia_adc)
 
-            if not datos_adc:
-                print(f"⚠️ No se encontraron datos ADC para {wix_id_historia_adc}", flush=True)
-        elif cod_empresa_actual == 'SITEL':
-            print(f"ℹ️ ADC excluido para empresa SITEL (codEmpresa={cod_empresa_actual})", flush=True)
+        if not datos_adc:
+            print(f"⚠️ No se encontraron datos ADC para {wix_id_historia_adc}", flush=True)
+    elif cod_empresa_actual == 'SITEL':
+        print(f"ℹ️ ADC excluido para empresa SITEL (codEmpresa={cod_empresa_actual})", flush=True)
 
-        # ===== CONSULTAR DATOS DEL FORMULARIO DESDE POSTGRESQL =====
-        # Solo consultar PostgreSQL si NO venimos de Alegra con datos ya cargados
-        if not usar_datos_formulario:
-            wix_id_historia = datos_wix.get('_id', wix_id)
-            print(f"🔍 Consultando datos del formulario desde PostgreSQL para wix_id: {wix_id_historia}", flush=True)
+    # ===== CONSULTAR DATOS DEL FORMULARIO DESDE POSTGRESQL =====
+    # Solo consultar PostgreSQL si NO venimos de Alegra con datos ya cargados
+    if not usar_datos_formulario:
+        wix_id_historia = datos_wix.get('_id', wix_id)
+        print(f"🔍 Consultando datos del formulario desde PostgreSQL para wix_id: {wix_id_historia}", flush=True)
 
-            datos_formulario = obtener_datos_formulario_postgres(wix_id_historia)
+        datos_formulario = obtener_datos_formulario_postgres(wix_id_historia)
 
-            if datos_formulario:
-                print(f"✅ Datos del formulario obtenidos desde PostgreSQL", flush=True)
-
-                # Sobrescribir los datos de HistoriaClinica con los de PostgreSQL si existen
-                if datos_formulario.get('edad'):
-                    datos_wix['edad'] = datos_formulario.get('edad')
-                if datos_formulario.get('genero'):
-                    datos_wix['genero'] = datos_formulario.get('genero')
-                if datos_formulario.get('estadoCivil'):
-                    datos_wix['estadoCivil'] = datos_formulario.get('estadoCivil')
-                if datos_formulario.get('hijos'):
-                    datos_wix['hijos'] = datos_formulario.get('hijos')
-                if datos_formulario.get('email'):
-                    datos_wix['email'] = datos_formulario.get('email')
-                if datos_formulario.get('profesionUOficio'):
-                    datos_wix['profesionUOficio'] = datos_formulario.get('profesionUOficio')
-                if datos_formulario.get('ciudadDeResidencia'):
-                    datos_wix['ciudadDeResidencia'] = datos_formulario.get('ciudadDeResidencia')
-                if datos_formulario.get('fechaNacimiento'):
-                    datos_wix['fechaNacimiento'] = datos_formulario.get('fechaNacimiento')
-
-                # ===== MERGE DE NUEVOS CAMPOS: EPS, ARL, PENSIONES, NIVEL EDUCATIVO =====
-                if datos_formulario.get('eps'):
-                    datos_wix['eps'] = datos_formulario.get('eps')
-                    print(f"  ✓ EPS: {datos_formulario.get('eps')}", flush=True)
-                if datos_formulario.get('arl'):
-                    datos_wix['arl'] = datos_formulario.get('arl')
-                    print(f"  ✓ ARL: {datos_formulario.get('arl')}", flush=True)
-                if datos_formulario.get('pensiones'):
-                    datos_wix['pensiones'] = datos_formulario.get('pensiones')
-                    print(f"  ✓ Pensiones: {datos_formulario.get('pensiones')}", flush=True)
-                if datos_formulario.get('nivelEducativo'):
-                    datos_wix['nivel_educativo'] = datos_formulario.get('nivelEducativo')
-                    print(f"  ✓ Nivel Educativo: {datos_formulario.get('nivelEducativo')}", flush=True)
-
-                # Foto del paciente
-                if datos_formulario.get('foto'):
-                    datos_wix['foto_paciente'] = datos_formulario.get('foto')
-                    print(f"✅ Usando foto de PostgreSQL (data URI base64)", flush=True)
-                else:
-                    datos_wix['foto_paciente'] = None
-                    print(f"ℹ️  No hay foto disponible en PostgreSQL", flush=True)
+        if datos_formulario:
+            print(f"✅ Datos del formulario obtenidos desde PostgreSQL", flush=True)
 
-                # Firma del paciente
-                if datos_formulario.get('firma'):
-                    datos_wix['firma_paciente'] = datos_formulario.get('firma')
-                    print(f"✅ Usando firma de PostgreSQL (data URI base64)", flush=True)
-                else:
-                    datos_wix['firma_paciente'] = None
-                    print(f"ℹ️  No hay firma disponible en PostgreSQL", flush=True)
+            # Sobrescribir los datos de HistoriaClinica con los de PostgreSQL si existen
+            if datos_formulario.get('edad'):
+                datos_wix['edad'] = datos_formulario.get('edad')
+            if datos_formulario.get('genero'):
+                datos_wix['genero'] = datos_formulario.get('genero')
+            if datos_formulario.get('estadoCivil'):
+                datos_wix['estadoCivil'] = datos_formulario.get('estadoCivil')
+            if datos_formulario.get('hijos'):
+                datos_wix['hijos'] = datos_formulario.get('hijos')
+            if datos_formulario.get('email'):
+                datos_wix['email'] = datos_formulario.get('email')
+            if datos_formulario.get('profesionUOficio'):
+                datos_wix['profesionUOficio'] = datos_formulario.get('profesionUOficio')
+            if datos_formulario.get('ciudadDeResidencia'):
+                datos_wix['ciudadDeResidencia'] = datos_formulario.get('ciudadDeResidencia')
+            if datos_formulario.get('fechaNacimiento'):
+                datos_wix['fechaNacimiento'] = datos_formulario.get('fechaNacimiento')
 
-                print(f"📊 Merge completado (preview): edad={datos_wix.get('edad')}, genero={datos_wix.get('genero')}, eps={datos_wix.get('eps')}, arl={datos_wix.get('arl')}", flush=True)
-            else:
-                print(f"⚠️ No se encontraron datos del formulario en PostgreSQL para wix_id: {wix_id_historia}", flush=True)
-                datos_wix['foto_paciente'] = None
-                datos_wix['firma_paciente'] = None
-        else:
-            print(f"✅ [ALEGRA] Usando datos de formulario ya cargados (PostgreSQL o Wix fallback)", flush=True)
-
-        # Textos dinámicos según exámenes (MAYÚSCULAS para coincidir con normalización)
-        textos_examenes = {
-            # Nombres normalizados (MAYÚSCULAS)
-            "EXAMEN MÉDICO OCUPACIONAL OSTEOMUSCULAR": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
-            "OSTEOMUSCULAR": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
-            "ÉNFASIS CARDIOVASCULAR": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
-            "PERFIL LIPÍDICO": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
-            "PERFIL LIPÍDICO COMPLETO": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
-            "ÉNFASIS VASCULAR": "El examen vascular muestra resultados dentro de los límites normales, sin evidencia de enfermedad arterial periférica ni estenosis carotídea significativa. Se recomienda al paciente continuar evitando el tabaquismo y mantener un estilo de vida saludable. Dada la buena condición vascular, no se requieren restricciones laborales en este momento. Se sugiere realizar seguimiento periódico para monitorear la salud vascular y prevenir posibles complicaciones en el futuro.",
-            "ESPIROMETRÍA": "Prueba Espirometría: Función pulmonar normal sin evidencia de obstrucción o restricción significativa. No se requieren medidas adicionales en relación con la función pulmonar para el paciente en este momento.",
-            "ÉNFASIS DERMATOLÓGICO": "Énfasis Dermatológico: Descripción general de la piel: La piel presenta un aspecto saludable, con una textura suave y uniforme. No se observan áreas de enrojecimiento, descamación o inflamación evidentes. El color de la piel es uniforme en todas las áreas evaluadas.\n\nAusencia de lesiones cutáneas: No se detectaron lesiones cutáneas como abrasiones, quemaduras, cortes o irritaciones en ninguna parte del cuerpo del paciente. La piel está íntegra y sin signos de traumatismos recientes.\n\nExposición controlada a agentes ambientales: No se identificaron signos de exposición excesiva a sustancias químicas o agentes ambientales que puedan afectar la piel.",
-            "AUDIOMETRÍA": "No presenta signos de pérdida auditiva o alteraciones en la audición. Los resultados se encuentran dentro de los rangos normales establecidos para la población general y no se observan indicios de daño auditivo relacionado con la exposición laboral a ruido u otros factores.",
-            "OPTOMETRÍA": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "VISIOMETRÍA": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "ELECTROCARDIOGRAMA": "Electrocardiograma: Ritmo sinusal normal. No se observan alteraciones en la conducción cardíaca ni signos de isquemia o hipertrofia ventricular. Los intervalos y segmentos se encuentran dentro de los parámetros normales.",
-            "CUADRO HEMÁTICO": "Cuadro Hemático: Los valores de hemoglobina, hematocrito, leucocitos y plaquetas se encuentran dentro de los rangos normales. No se observan alteraciones que sugieran anemia, infección activa o trastornos de coagulación.",
-            "HEMOGRAMA": "Hemograma: Los valores de hemoglobina, hematocrito, leucocitos y plaquetas se encuentran dentro de los rangos normales. No se observan alteraciones que sugieran anemia, infección activa o trastornos de coagulación.",
-            "GLICEMIA": "Glicemia: Los niveles de glucosa en sangre se encuentran dentro de los parámetros normales, lo que indica un adecuado metabolismo de los carbohidratos.",
-            "GLUCOSA EN SANGRE": "Glucosa en Sangre: Los niveles de glucosa en sangre se encuentran dentro de los parámetros normales, lo que indica un adecuado metabolismo de los carbohidratos.",
-            "PARCIAL DE ORINA": "Parcial de Orina: El examen de orina no muestra alteraciones significativas. No se observan signos de infección urinaria, proteinuria ni glucosuria.",
-            "PANEL DE DROGAS": "Panel de Drogas: Los resultados del panel de detección de sustancias psicoactivas son negativos para todas las sustancias evaluadas.",
-            "EXAMEN DE ALTURAS": "Examen de Alturas: El paciente presenta condiciones físicas y psicológicas adecuadas para realizar trabajo en alturas. No se identifican contraindicaciones médicas para esta actividad.",
-            "MANIPULACIÓN DE ALIMENTOS": "Manipulación de Alimentos: El paciente cumple con los requisitos de salud establecidos para la manipulación de alimentos. No presenta enfermedades infectocontagiosas ni condiciones que representen riesgo para la inocuidad alimentaria.",
-            "KOH / COPROLÓGICO / FROTIS FARÍNGEO": "KOH / Coprológico / Frotis Faríngeo: Los exámenes de laboratorio no evidencian presencia de hongos, parásitos intestinales ni infecciones faríngeas activas.",
-            "SCL-90": "SCL-90: La evaluación psicológica mediante el cuestionario SCL-90 muestra resultados dentro de los rangos normales en todas las dimensiones evaluadas, sin indicadores de psicopatología significativa.",
-            "PRUEBA PSICOSENSOMÉTRICA": "Prueba Psicosensométrica: El usuario comprende rápidamente las indicaciones, realiza las pruebas correctamente y en el tiempo estipulado. La atención, concentración, memoria, velocidad de respuesta y las habilidades psicomotrices no presentan ninguna alteración. Los resultados están dentro de los rangos normales.",
-            "PERFIL PSICOLÓGICO ADC": "Perfil Psicológico ADC: Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión.\n\nHabilidades de afrontamiento: Se identifican habilidades de afrontamiento efectivas, como la búsqueda de soluciones creativas y la gestión proactiva de situaciones conflictivas, lo que sugiere una capacidad para resolver problemas de manera constructiva.\n\nRelaciones interpersonales: Demuestra habilidades interpersonales excepcionales, estableciendo relaciones sólidas y colaborativas con colegas y superiores, lo que favorece un ambiente laboral armonioso y productivo.\n\nAutoeficacia y autoestima: Se evidencia una autoeficacia alta y una autoestima saludable, reflejando confianza en las propias habilidades y una valoración positiva de sí mismo, aspectos que contribuyen a un desempeño laboral sólido y satisfactorio.",
-            "EXAMEN MÉDICO OCUPACIONAL / AUDIOMETRÍA / VISIOMETRÍA": "Examen médico ocupacional completo con audiometría y visiometría. Todos los resultados se encuentran dentro de los parámetros normales.",
-            # Compatibilidad con nombres en formato antiguo (Title Case)
-            "Examen Médico Osteomuscular": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
-            "Énfasis Cardiovascular": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
-            "É. Cardiovascular": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
-            "Perfil Lipídico": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
-            "É. VASCULAR": "El examen vascular muestra resultados dentro de los límites normales, sin evidencia de enfermedad arterial periférica ni estenosis carotídea significativa. Se recomienda al paciente continuar evitando el tabaquismo y mantener un estilo de vida saludable. Dada la buena condición vascular, no se requieren restricciones laborales en este momento. Se sugiere realizar seguimiento periódico para monitorear la salud vascular y prevenir posibles complicaciones en el futuro.",
-            "Test Vocal Voximetría": "Los resultados obtenidos del test de voximetría muestran que el paciente presenta una saturación de oxígeno adecuada tanto en reposo como durante la actividad laboral. La frecuencia respiratoria y la frecuencia cardíaca se encuentran dentro de los rangos normales, lo que sugiere que no hay signos de hipoxia o alteraciones significativas en la función respiratoria bajo condiciones laborales normales.",
-            "Espirometría": "Prueba Espirometría: Función pulmonar normal sin evidencia de obstrucción o restricción significativa. No se requieren medidas adicionales en relación con la función pulmonar para el paciente en este momento.",
-            "Énfasis Dermatológico": "Énfasis Dermatológico: Descripción general de la piel: La piel presenta un aspecto saludable, con una textura suave y uniforme. No se observan áreas de enrojecimiento, descamación o inflamación evidentes. El color de la piel es uniforme en todas las áreas evaluadas.\n\nAusencia de lesiones cutáneas: No se detectaron lesiones cutáneas como abrasiones, quemaduras, cortes o irritaciones en ninguna parte del cuerpo del paciente. La piel está íntegra y sin signos de traumatismos recientes.\n\nExposición controlada a agentes ambientales: No se identificaron signos de exposición excesiva a sustancias químicas o agentes ambientales que puedan afectar la piel.",
-            "Test R. Psicosocial (Ansiedad,Depresión)": "Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión.\n\nHabilidades de afrontamiento: Se identifican habilidades de afrontamiento efectivas, como la búsqueda de soluciones creativas y la gestión proactiva de situaciones conflictivas, lo que sugiere una capacidad para resolver problemas de manera constructiva.\n\nRelaciones interpersonales: Demuestra habilidades interpersonales excepcionales, estableciendo relaciones sólidas y colaborativas con colegas y superiores, lo que favorece un ambiente laboral armonioso y productivo.\n\nAutoeficacia y autoestima: Se evidencia una autoeficacia alta y una autoestima saludable, reflejando confianza en las propias habilidades y una valoración positiva de sí mismo, aspectos que contribuyen a un desempeño laboral sólido y satisfactorio.",
-            "Audiometría": "No presenta signos de pérdida auditiva o alteraciones en la audición. Los resultados se encuentran dentro de los rangos normales establecidos para la población general y no se observan indicios de daño auditivo relacionado con la exposición laboral a ruido u otros factores.",
-            "Optometría": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "Visiometría": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
-            "Perfil Psicológico ADC": "Perfil Psicológico ADC: Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión."
-        }
+            # ===== MERGE DE NUEVOS CAMPOS: EPS, ARL, PENSIONES, NIVEL EDUCATIVO =====
+            if datos_formulario.get('eps'):
+                datos_wix['eps'] = datos_formulario.get('eps')
+                print(f"  ✓ EPS: {datos_formulario.get('eps')}", flush=True)
+            if datos_formulario.get('arl'):
+                datos_wix['arl'] = datos_formulario.get('arl')
+                print(f"  ✓ ARL: {datos_formulario.get('arl')}", flush=True)
+            if datos_formulario.get('pensiones'):
+                datos_wix['pensiones'] = datos_formulario.get('pensiones')
+                print(f"  ✓ Pensiones: {datos_formulario.get('pensiones')}", flush=True)
+            if datos_formulario.get('nivelEducativo'):
+                datos_wix['nivel_educativo'] = datos_formulario.get('nivelEducativo')
+                print(f"  ✓ Nivel Educativo: {datos_formulario.get('nivelEducativo')}", flush=True)
 
-        # Construir resultados generales
-        resultados_generales = []
-        observaciones_certificado = datos_wix.get('mdObservacionesCertificado', '')
-
-        # Detectar si hay análisis postural en las observaciones
-        analisis_postural = []
-        observaciones_sin_analisis = observaciones_certificado
-
-        if observaciones_certificado and '=== ANÁLISIS POSTURAL ===' in observaciones_certificado:
-            # Separar análisis postural de las observaciones regulares
-            import re
-            patron = r'=== ANÁLISIS POSTURAL ===\s*(.*?)\s*=== FIN ANÁLISIS POSTURAL ==='
-            matches = re.findall(patron, observaciones_certificado, re.DOTALL)
-
-            for match in matches:
-                # Parsear cada ejercicio
-                ejercicio_info = {}
-
-                # Extraer fecha
-                fecha_match = re.search(r'Fecha:\s*(\d{2}/\d{2}/\d{4})', match)
-                if fecha_match:
-                    ejercicio_info['fecha'] = fecha_match.group(1)
-
-                # Extraer número de ejercicio y hora
-                ejercicio_match = re.search(r'EJERCICIO\s+(\d+)\s*\(([^)]+)\)', match)
-                if ejercicio_match:
-                    ejercicio_info['numero'] = ejercicio_match.group(1)
-                    ejercicio_info['hora'] = ejercicio_match.group(2)
-
-                # Extraer ángulo del tronco
-                tronco_match = re.search(r'Ángulo del tronco:\s*([\d.]+)°', match)
-                if tronco_match:
-                    ejercicio_info['angulo_tronco'] = tronco_match.group(1)
-
-                # Extraer alineación
-                alineacion_match = re.search(r'Alineación:\s*(\w+)', match)
-                if alineacion_match:
-                    ejercicio_info['alineacion'] = alineacion_match.group(1)
-
-                # Extraer ángulos articulares
-                codo_izq = re.search(r'Codo izquierdo:\s*([\d.]+)°', match)
-                codo_der = re.search(r'Codo derecho:\s*([\d.]+)°', match)
-                rodilla_izq = re.search(r'Rodilla izquierda:\s*([\d.]+)°', match)
-                rodilla_der = re.search(r'Rodilla derecha:\s*([\d.]+)°', match)
-
-                ejercicio_info['angulos'] = {
-                    'codo_izq': codo_izq.group(1) if codo_izq else 'N/A',
-                    'codo_der': codo_der.group(1) if codo_der else 'N/A',
-                    'rodilla_izq': rodilla_izq.group(1) if rodilla_izq else 'N/A',
-                    'rodilla_der': rodilla_der.group(1) if rodilla_der else 'N/A'
-                }
+            # Foto del paciente
+            if datos_formulario.get('foto'):
+                datos_wix['foto_paciente'] = datos_formulario.get('foto')
+                print(f"✅ Usando foto de PostgreSQL (data URI base64)", flush=True)
+            else:
+                datos_wix['foto_paciente'] = None
+                print(f"ℹ️  No hay foto disponible en PostgreSQL", flush=True)
 
-                # Extraer simetría
-                hombros_match = re.search(r'Hombros:\s*(\w+)\s*\(diferencia:\s*([\d.]+)%\)', match)
-                caderas_match = re.search(r'Caderas:\s*(\w+)\s*\(diferencia:\s*([\d.]+)%\)', match)
+            # Firma del paciente
+            if datos_formulario.get('firma'):
+                datos_wix['firma_paciente'] = datos_formulario.get('firma')
+                print(f"✅ Usando firma de PostgreSQL (data URI base64)", flush=True)
+            else:
+                datos_wix['firma_paciente'] = None
+                print(f"ℹ️  No hay firma disponible en PostgreSQL", flush=True)
 
-                ejercicio_info['simetria'] = {
-                    'hombros': hombros_match.group(1) if hombros_match else 'N/A',
-                    'hombros_diff': hombros_match.group(2) if hombros_match else 'N/A',
-                    'caderas': caderas_match.group(1) if caderas_match else 'N/A',
-                    'caderas_diff': caderas_match.group(2) if caderas_match else 'N/A'
-                }
+            print(f"📊 Merge completado (preview): edad={datos_wix.get('edad')}, genero={datos_wix.get('genero')}, eps={datos_wix.get('eps')}, arl={datos_wix.get('arl')}", flush=True)
+        else:
+            print(f"⚠️ No se encontraron datos del formulario en PostgreSQL para wix_id: {wix_id_historia}", flush=True)
+            datos_wix['foto_paciente'] = None
+            datos_wix['firma_paciente'] = None
+    else:
+        print(f"✅ [ALEGRA] Usando datos de formulario ya cargados (PostgreSQL o Wix fallback)", flush=True)
+
+    # Textos dinámicos según exámenes (MAYÚSCULAS para coincidir con normalización)
+    textos_examenes = {
+        # Nombres normalizados (MAYÚSCULAS)
+        "EXAMEN MÉDICO OCUPACIONAL OSTEOMUSCULAR": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
+        "OSTEOMUSCULAR": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
+        "ÉNFASIS CARDIOVASCULAR": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
+        "PERFIL LIPÍDICO": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
+        "PERFIL LIPÍDICO COMPLETO": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
+        "ÉNFASIS VASCULAR": "El examen vascular muestra resultados dentro de los límites normales, sin evidencia de enfermedad arterial periférica ni estenosis carotídea significativa. Se recomienda al paciente continuar evitando el tabaquismo y mantener un estilo de vida saludable. Dada la buena condición vascular, no se requieren restricciones laborales en este momento. Se sugiere realizar seguimiento periódico para monitorear la salud vascular y prevenir posibles complicaciones en el futuro.",
+        "ESPIROMETRÍA": "Prueba Espirometría: Función pulmonar normal sin evidencia de obstrucción o restricción significativa. No se requieren medidas adicionales en relación con la función pulmonar para el paciente en este momento.",
+        "ÉNFASIS DERMATOLÓGICO": "Énfasis Dermatológico: Descripción general de la piel: La piel presenta un aspecto saludable, con una textura suave y uniforme. No se observan áreas de enrojecimiento, descamación o inflamación evidentes. El color de la piel es uniforme en todas las áreas evaluadas.\n\nAusencia de lesiones cutáneas: No se detectaron lesiones cutáneas como abrasiones, quemaduras, cortes o irritaciones en ninguna parte del cuerpo del paciente. La piel está íntegra y sin signos de traumatismos recientes.\n\nExposición controlada a agentes ambientales: No se identificaron signos de exposición excesiva a sustancias químicas o agentes ambientales que puedan afectar la piel.",
+        "AUDIOMETRÍA": "No presenta signos de pérdida auditiva o alteraciones en la audición. Los resultados se encuentran dentro de los rangos normales establecidos para la población general y no se observan indicios de daño auditivo relacionado con la exposición laboral a ruido u otros factores.",
+        "OPTOMETRÍA": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
+        "VISIOMETRÍA": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
+        "ELECTROCARDIOGRAMA": "Electrocardiograma: Ritmo sinusal normal. No se observan alteraciones en la conducción cardíaca ni signos de isquemia o hipertrofia ventricular. Los intervalos y segmentos se encuentran dentro de los parámetros normales.",
+        "CUADRO HEMÁTICO": "Cuadro Hemático: Los valores de hemoglobina, hematocrito, leucocitos y plaquetas se encuentran dentro de los rangos normales. No se observan alteraciones que sugieran anemia, infección activa o trastornos de coagulación.",
+        "HEMOGRAMA": "Hemograma: Los valores de hemoglobina, hematocrito, leucocitos y plaquetas se encuentran dentro de los rangos normales. No se observan alteraciones que sugieran anemia, infección activa o trastornos de coagulación.",
+        "GLICEMIA": "Glicemia: Los niveles de glucosa en sangre se encuentran dentro de los parámetros normales, lo que indica un adecuado metabolismo de los carbohidratos.",
+        "GLUCOSA EN SANGRE": "Glucosa en Sangre: Los niveles de glucosa en sangre se encuentran dentro de los parámetros normales, lo que indica un adecuado metabolismo de los carbohidratos.",
+        "PARCIAL DE ORINA": "Parcial de Orina: El examen de orina no muestra alteraciones significativas. No se observan signos de infección urinaria, proteinuria ni glucosuria.",
+        "PANEL DE DROGAS": "Panel de Drogas: Los resultados del panel de detección de sustancias psicoactivas son negativos para todas las sustancias evaluadas.",
+        "EXAMEN DE ALTURAS": "Examen de Alturas: El paciente presenta condiciones físicas y psicológicas adecuadas para realizar trabajo en alturas. No se identifican contraindicaciones médicas para esta actividad.",
+        "MANIPULACIÓN DE ALIMENTOS": "Manipulación de Alimentos: El paciente cumple con los requisitos de salud establecidos para la manipulación de alimentos. No presenta enfermedades infectocontagiosas ni condiciones que representen riesgo para la inocuidad alimentaria.",
+        "KOH / COPROLÓGICO / FROTIS FARÍNGEO": "KOH / Coprológico / Frotis Faríngeo: Los exámenes de laboratorio no evidencian presencia de hongos, parásitos intestinales ni infecciones faríngeas activas.",
+        "SCL-90": "SCL-90: La evaluación psicológica mediante el cuestionario SCL-90 muestra resultados dentro de los rangos normales en todas las dimensiones evaluadas, sin indicadores de psicopatología significativa.",
+        "PRUEBA PSICOSENSOMÉTRICA": "Prueba Psicosensométrica: El usuario comprende rápidamente las indicaciones, realiza las pruebas correctamente y en el tiempo estipulado. La atención, concentración, memoria, velocidad de respuesta y las habilidades psicomotrices no presentan ninguna alteración. Los resultados están dentro de los rangos normales.",
+        "PERFIL PSICOLÓGICO ADC": "Perfil Psicológico ADC: Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión.\n\nHabilidades de afrontamiento: Se identifican habilidades de afrontamiento efectivas, como la búsqueda de soluciones creativas y la gestión proactiva de situaciones conflictivas, lo que sugiere una capacidad para resolver problemas de manera constructiva.\n\nRelaciones interpersonales: Demuestra habilidades interpersonales excepcionales, estableciendo relaciones sólidas y colaborativas con colegas y superiores, lo que favorece un ambiente laboral armonioso y productivo.\n\nAutoeficacia y autoestima: Se evidencia una autoeficacia alta y una autoestima saludable, reflejando confianza en las propias habilidades y una valoración positiva de sí mismo, aspectos que contribuyen a un desempeño laboral sólido y satisfactorio.",
+        "EXAMEN MÉDICO OCUPACIONAL / AUDIOMETRÍA / VISIOMETRÍA": "Examen médico ocupacional completo con audiometría y visiometría. Todos los resultados se encuentran dentro de los parámetros normales.",
+        # Compatibilidad con nombres en formato antiguo (Title Case)
+        "Examen Médico Osteomuscular": "Basándonos en los resultados obtenidos de la evaluación osteomuscular, certificamos que el paciente presenta un sistema osteomuscular en condiciones óptimas de salud. Esta condición le permite llevar a cabo una variedad de actividades físicas y cotidianas sin restricciones notables y con un riesgo mínimo de lesiones osteomusculares.",
+        "Énfasis Cardiovascular": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
+        "É. Cardiovascular": "Énfasis cardiovascular: El examen médico laboral de ingreso con énfasis cardiovascular revela que presenta un estado cardiovascular dentro de los parámetros normales. No se observan hallazgos que indiquen la presencia de enfermedades cardiovasculares significativas o limitaciones funcionales para el desempeño laboral.",
+        "Perfil Lipídico": "Perfil Lipídico: Los resultados del perfil lipídico indican un buen control de los lípidos en sangre. Los niveles de colesterol total, LDL, HDL y triglicéridos se encuentran dentro de los rangos de referencia, lo cual sugiere un bajo riesgo cardiovascular en este momento.",
+        "É. VASCULAR": "El examen vascular muestra resultados dentro de los límites normales, sin evidencia de enfermedad arterial periférica ni estenosis carotídea significativa. Se recomienda al paciente continuar evitando el tabaquismo y mantener un estilo de vida saludable. Dada la buena condición vascular, no se requieren restricciones laborales en este momento. Se sugiere realizar seguimiento periódico para monitorear la salud vascular y prevenir posibles complicaciones en el futuro.",
+        "Test Vocal Voximetría": "Los resultados obtenidos del test de voximetría muestran que el paciente presenta una saturación de oxígeno adecuada tanto en reposo como durante la actividad laboral. La frecuencia respiratoria y la frecuencia cardíaca se encuentran dentro de los rangos normales, lo que sugiere que no hay signos de hipoxia o alteraciones significativas en la función respiratoria bajo condiciones laborales normales.",
+        "Espirometría": "Prueba Espirometría: Función pulmonar normal sin evidencia de obstrucción o restricción significativa. No se requieren medidas adicionales en relación con la función pulmonar para el paciente en este momento.",
+        "Énfasis Dermatológico": "Énfasis Dermatológico: Descripción general de la piel: La piel presenta un aspecto saludable, con una textura suave y uniforme. No se observan áreas de enrojecimiento, descamación o inflamación evidentes. El color de la piel es uniforme en todas las áreas evaluadas.\n\nAusencia de lesiones cutáneas: No se detectaron lesiones cutáneas como abrasiones, quemaduras, cortes o irritaciones en ninguna parte del cuerpo del paciente. La piel está íntegra y sin signos de traumatismos recientes.\n\nExposición controlada a agentes ambientales: No se identificaron signos de exposición excesiva a sustancias químicas o agentes ambientales que puedan afectar la piel.",
+        "Test R. Psicosocial (Ansiedad,Depresión)": "Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión.\n\nHabilidades de afrontamiento: Se identifican habilidades de afrontamiento efectivas, como la búsqueda de soluciones creativas y la gestión proactiva de situaciones conflictivas, lo que sugiere una capacidad para resolver problemas de manera constructiva.\n\nRelaciones interpersonales: Demuestra habilidades interpersonales excepcionales, estableciendo relaciones sólidas y colaborativas con colegas y superiores, lo que favorece un ambiente laboral armonioso y productivo.\n\nAutoeficacia y autoestima: Se evidencia una autoeficacia alta y una autoestima saludable, reflejando confianza en las propias habilidades y una valoración positiva de sí mismo, aspectos que contribuyen a un desempeño laboral sólido y satisfactorio.",
+        "Audiometría": "No presenta signos de pérdida auditiva o alteraciones en la audición. Los resultados se encuentran dentro de los rangos normales establecidos para la población general y no se observan indicios de daño auditivo relacionado con la exposición laboral a ruido u otros factores.",
+        "Optometría": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
+        "Visiometría": "Presión intraocular (PIO): 15 mmHg en ambos ojos\nReflejos pupilares: Respuesta pupilar normal a la luz en ambos ojos\nCampo visual: Normal en ambos ojos\nVisión de colores: Normal\nFondo de ojo: Normal.",
+        "Perfil Psicológico ADC": "Perfil Psicológico ADC: Nivel de estrés percibido: Muestra un nivel de estrés bajo en su vida cotidiana, con preocupaciones manejables y una actitud tranquila frente a las demandas laborales.\n\nCapacidad de adaptación: Destaca una excepcional capacidad de adaptación a diferentes entornos y escenarios laborales, evidenciando flexibilidad y disposición para aprender ante nuevos desafíos.\n\nResiliencia emocional: Exhibe una resiliencia emocional notable, enfrentando las dificultades con calma y manteniendo una perspectiva optimista incluso en momentos de presión."
+    }
 
-                analisis_postural.append(ejercicio_info)
+    # Construir resultados generales
+    resultados_generales = []
+    observaciones_certificado = datos_wix.get('mdObservacionesCertificado', '')
+
+    # Detectar si hay análisis postural en las observaciones
+    analisis_postural = []
+    observaciones_sin_analisis = observaciones_certificado
+
+    if observaciones_certificado and '=== ANÁLISIS POSTURAL ===' in observaciones_certificado:
+        # Separar análisis postural de las observaciones regulares
+        import re
+        patron = r'=== ANÁLISIS POSTURAL ===\s*(.*?)\s*=== FIN ANÁLISIS POSTURAL ==='
+        matches = re.findall(patron, observaciones_certificado, re.DOTALL)
+
+        for match in matches:
+            # Parsear cada ejercicio
+            ejercicio_info = {}
+
+            # Extraer fecha
+            fecha_match = re.search(r'Fecha:\s*(\d{2}/\d{2}/\d{4})', match)
+            if fecha_match:
+                ejercicio_info['fecha'] = fecha_match.group(1)
+
+            # Extraer número de ejercicio y hora
+            ejercicio_match = re.search(r'EJERCICIO\s+(\d+)\s*\(([^)]+)\)', match)
+            if ejercicio_match:
+                ejercicio_info['numero'] = ejercicio_match.group(1)
+                ejercicio_info['hora'] = ejercicio_match.group(2)
+
+            # Extraer ángulo del tronco
+            tronco_match = re.search(r'Ángulo del tronco:\s*([\d.]+)°', match)
+            if tronco_match:
+                ejercicio_info['angulo_tronco'] = tronco_match.group(1)
+
+            # Extraer alineación
+            alineacion_match = re.search(r'Alineación:\s*(\w+)', match)
+            if alineacion_match:
+                ejercicio_info['alineacion'] = alineacion_match.group(1)
+
+            # Extraer ángulos articulares
+            codo_izq = re.search(r'Codo izquierdo:\s*([\d.]+)°', match)
+            codo_der = re.search(r'Codo derecho:\s*([\d.]+)°', match)
+            rodilla_izq = re.search(r'Rodilla izquierda:\s*([\d.]+)°', match)
+            rodilla_der = re.search(r'Rodilla derecha:\s*([\d.]+)°', match)
+
+            ejercicio_info['angulos'] = {
+                'codo_izq': codo_izq.group(1) if codo_izq else 'N/A',
+                'codo_der': codo_der.group(1) if codo_der else 'N/A',
+                'rodilla_izq': rodilla_izq.group(1) if rodilla_izq else 'N/A',
+                'rodilla_der': rodilla_der.group(1) if rodilla_der else 'N/A'
+            }
 
-            # Remover análisis postural de las observaciones
-            observaciones_sin_analisis = re.sub(r'=== ANÁLISIS POSTURAL ===.*?=== FIN ANÁLISIS POSTURAL ===\s*', '', observaciones_certificado, flags=re.DOTALL).strip()
+            # Extraer simetría
+            hombros_match = re.search(r'Hombros:\s*(\w+)\s*\(diferencia:\s*([\d.]+)%\)', match)
+            caderas_match = re.search(r'Caderas:\s*(\w+)\s*\(diferencia:\s*([\d.]+)%\)', match)
 
-        # Si el paciente no ha sido atendido, no usar textos genéricos hardcodeados ni firmas
-        paciente_atendido = str(datos_wix.get('atendido', '')).strip().upper() in ('ATENDIDO', 'ATENDIDA')
+            ejercicio_info['simetria'] = {
+                'hombros': hombros_match.group(1) if hombros_match else 'N/A',
+                'hombros_diff': hombros_match.group(2) if hombros_match else 'N/A',
+                'caderas': caderas_match.group(1) if caderas_match else 'N/A',
+                'caderas_diff': caderas_match.group(2) if caderas_match else 'N/A'
+            }
 
-        # Usar examenes_normalizados que ya fue definido arriba (con normalizar_lista_examenes)
-        # Si hay observaciones del médico, usarlas en lugar del texto hardcodeado
-        for i, examen in enumerate(examenes_normalizados):
-            # ADC tiene su propia sección dedicada con datos calculados, no mostrar texto genérico
-            if "ADC" in examen.upper():
+            analisis_postural.append(ejercicio_info)
+
+        # Remover análisis postural de las observaciones
+        observaciones_sin_analisis = re.sub(r'=== ANÁLISIS POSTURAL ===.*?=== FIN ANÁLISIS POSTURAL ===\s*', '', observaciones_certificado, flags=re.DOTALL).strip()
+
+    # Si el paciente no ha sido atendido, no usar textos genéricos hardcodeados ni firmas
+    paciente_atendido = str(datos_wix.get('atendido', '')).strip().upper() in ('ATENDIDO', 'ATENDIDA')
+
+    # Usar examenes_normalizados que ya fue definido arriba (con normalizar_lista_examenes)
+    # Si hay observaciones del médico, usarlas en lugar del texto hardcodeado
+    for i, examen in enumerate(examenes_normalizados):
+        # ADC tiene su propia sección dedicada con datos calculados, no mostrar texto genérico
+        if "ADC" in examen.upper():
+            continue
+        descripcion = None
+        # Si hay observaciones y este es el examen médico principal, usar las observaciones
+        if observaciones_sin_analisis and ("OSTEOMUSCULAR" in examen.upper() or "OCUPACIONAL" in examen.upper()):
+            descripcion = observaciones_sin_analisis
+        # Si es audiometría y hay datos de audiometría, usar el diagnóstico del audiograma
+        elif "AUDIOMETRÍA" in examen.upper() or "AUDIOMETRIA" in examen.upper():
+            # Excepción puntual: omitir item para cédula 1140837675 (no imprimir nada en Resultados Generales)
+            if str(datos_wix.get('numeroId', '')) == '1140837675':
                 continue
-            descripcion = None
-            # Si hay observaciones y este es el examen médico principal, usar las observaciones
-            if observaciones_sin_analisis and ("OSTEOMUSCULAR" in examen.upper() or "OCUPACIONAL" in examen.upper()):
-                descripcion = observaciones_sin_analisis
-            # Si es audiometría y hay datos de audiometría, usar el diagnóstico del audiograma
-            elif "AUDIOMETRÍA" in examen.upper() or "AUDIOMETRIA" in examen.upper():
-                # Excepción puntual: omitir item para cédula 1140837675 (no imprimir nada en Resultados Generales)
-                if str(datos_wix.get('numeroId', '')) == '1140837675':
-                    continue
-                if datos_audiometria and datos_audiometria.get('diagnostico'):
-                    descripcion = datos_audiometria['diagnostico']
-                elif paciente_atendido:
-                    descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-            # Serología: ocultar siempre el resultado en el certificado
-            elif "SEROLOG" in examen.upper():
-                continue
-            # Parcial de orina: usar datos reales de laboratorios o omitir
-            elif "PARCIAL DE ORINA" in examen.upper() or "PARCIAL ORINA" in examen.upper():
-                datos_orina = obtener_parcial_orina_postgres(datos_wix.get('_id', ''))
-                if datos_orina and datos_orina.get('descripcion'):
-                    descripcion = datos_orina['descripcion']
-                else:
-                    continue
-            # Panel de drogas: nunca imprimir resultados en el certificado
-            elif "PANEL DE DROGAS" in examen.upper() or "PANEL DROGAS" in examen.upper():
+            if datos_audiometria and datos_audiometria.get('diagnostico'):
+                descripcion = datos_audiometria['diagnostico']
+            elif paciente_atendido:
+                descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
+        # Serología: ocultar siempre el resultado en el certificado
+        elif "SEROLOG" in examen.upper():
+            continue
+        # Parcial de orina: usar datos reales de laboratorios o omitir
+        elif "PARCIAL DE ORINA" in examen.upper() or "PARCIAL ORINA" in examen.upper():
+            datos_orina = obtener_parcial_orina_postgres(datos_wix.get('_id', ''))
+            if datos_orina and datos_orina.get('descripcion'):
+                descripcion = datos_orina['descripcion']
+            else:
                 continue
-            # Si es voximetría y hay datos, usar concepto + interpretación de la BD
-            elif "VOXIMETR" in examen.upper():
-                if datos_voximetria:
-                    partes = []
-                    if datos_voximetria.get('concepto'):
-                        partes.append(datos_voximetria['concepto'])
-                    if datos_voximetria.get('interpretacion'):
-                        partes.append(datos_voximetria['interpretacion'])
-                    if partes:
-                        descripcion = '. '.join(partes)
-                    elif paciente_atendido:
-                        descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-                elif paciente_atendido:
-                    descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
-            # Optometría/Visiometría: si hay datos reales, mostrar el diagnóstico/concepto real
-            # (los valores numéricos completos van en la sección dedicada). Nunca ocultar la fila:
-            # si no hay datos reales, usar el texto predeterminado como fallback.
-            elif "OPTOMETR" in examen.upper() or "VISIOMETR" in examen.upper():
-                resultado_visual = ''
-                if datos_visual:
-                    resultado_visual = (datos_visual.get('diagnostico') or datos_visual.get('concepto') or '').strip()
-                if resultado_visual:
-                    descripcion = resultado_visual
+        # Panel de drogas: nunca imprimir resultados en el certificado
+        elif "PANEL DE DROGAS" in examen.upper() or "PANEL DROGAS" in examen.upper():
+            continue
+        # Si es voximetría y hay datos, usar concepto + interpretación de la BD
+        elif "VOXIMETR" in examen.upper():
+            if datos_voximetria:
+                partes = []
+                if datos_voximetria.get('concepto'):
+                    partes.append(datos_voximetria['concepto'])
+                if datos_voximetria.get('interpretacion'):
+                    partes.append(datos_voximetria['interpretacion'])
+                if partes:
+                    descripcion = '. '.join(partes)
                 elif paciente_atendido:
                     descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
             elif paciente_atendido:
                 descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
+        # Optometría/Visiometría: si hay datos reales, mostrar el diagnóstico/concepto real
+        # (los valores numéricos completos van en la sección dedicada). Nunca ocultar la fila:
+        # si no hay datos reales, usar el texto predeterminado como fallback.
+        elif "OPTOMETR" in examen.upper() or "VISIOMETR" in examen.upper():
+            resultado_visual = ''
+            if datos_visual:
+                resultado_visual = (datos_visual.get('diagnostico') or datos_visual.get('concepto') or '').strip()
+            if resultado_visual:
+                descripcion = resultado_visual
+            elif paciente_atendido:
+                descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
+        elif paciente_atendido:
+            descripcion = textos_examenes.get(examen, "Resultados dentro de parámetros normales.")
+
+        if descripcion is None:
+            continue
+        resultados_generales.append({
+            "examen": examen,
+            "descripcion": descripcion
+        })
 
-            if descripcion is None:
-                continue
-            resultados_generales.append({
-                "examen": examen,
-                "descripcion": descripcion
-            })
-
-        # Recomendaciones médicas: solo usar texto genérico si el paciente fue atendido
-        recomendaciones = datos_wix.get('mdRecomendacionesMedicasAdicionales', '')
-        if not recomendaciones and paciente_atendido:
-            recomendaciones = "RECOMENDACIONES GENERALES:\n1. PAUSAS ACTIVAS\n2. HIGIENE POSTURAL\n3. MEDIDAS ERGONOMICAS\n4. TÉCNICAS DE MANEJO DE ESTRÉS\n5. ALIMENTACIÓN BALANCEADA"
-
-        # Mapear médico a imagen de firma y datos
-        medico = datos_wix.get('medico', 'JUAN 134')
-        firma_medico_map = {
-            "SIXTA": "FIRMA-SIXTA.png",
-            "JUAN 134": "FIRMA-JUAN134.jpeg",
-            "CESAR": "FIRMA-CESAR.jpeg",
-            "MARY": "FIRMA-MARY.jpeg",
-            "NUBIA": "FIRMA-JUAN134.jpeg",
-            "PRESENCIAL": "FIRMA-PRESENCIAL.jpeg",
-            "PILAR": "FIRMA_PILAR.png"
-        }
+    # Recomendaciones médicas: solo usar texto genérico si el paciente fue atendido
+    recomendaciones = datos_wix.get('mdRecomendacionesMedicasAdicionales', '')
+    if not recomendaciones and paciente_atendido:
+        recomendaciones = "RECOMENDACIONES GENERALES:\n1. PAUSAS ACTIVAS\n2. HIGIENE POSTURAL\n3. MEDIDAS ERGONOMICAS\n4. TÉCNICAS DE MANEJO DE ESTRÉS\n5. ALIMENTACIÓN BALANCEADA"
+
+    # Mapear médico a imagen de firma y datos
+    medico = datos_wix.get('medico', 'JUAN 134')
+    firma_medico_map = {
+        "SIXTA": "FIRMA-SIXTA.png",
+        "JUAN 134": "FIRMA-JUAN134.jpeg",
+        "CESAR": "FIRMA-CESAR.jpeg",
+        "MARY": "FIRMA-MARY.jpeg",
+        "NUBIA": "FIRMA-JUAN134.jpeg",
+        "PRESENCIAL": "FIRMA-PRESENCIAL.jpeg",
+        "PILAR": "FIRMA_PILAR.png"
+    }
 
-        # Datos de cada médico
-        medico_datos_map = {
-            "SIXTA": {
-                "nombre": "SIXTA VIVERO CARRASCAL",
-                "registro": "REGISTRO MÉDICO NO 55300504",
-                "licencia": "LICENCIA SALUD OCUPACIONAL 583",
-                "fecha": "16 DE FEBRERO DE 2021"
-            },
-            "JUAN 134": {
-                "nombre": "JUAN JOSE REATIGA",
-                "registro": "C.C.: 7.472.676 - REGISTRO MEDICO NO 14791",
-                "licencia": "LICENCIA SALUD OCUPACIONAL 460",
-                "fecha": "6 DE JULIO DE 2020"
-            },
-            "CESAR": {
-                "nombre": "CÉSAR ADOLFO ZAMBRANO MARTÍNEZ",
-                "registro": "REGISTRO MEDICO NO 1192803570",
-                "licencia": "LICENCIA SALUD OCUPACIONAL # 3241",
-                "fecha": "13 DE JULIO DE 2021"
-            },
-            "MARY": {
-                "nombre": "",
-                "registro": "",
-                "licencia": "",
-                "fecha": ""
-            },
-            "NUBIA": {
-                "nombre": "JUAN JOSE REATIGA",
-                "registro": "C.C.: 7.472.676 - REGISTRO MEDICO NO 14791",
-                "licencia": "LICENCIA SALUD OCUPACIONAL 460",
-                "fecha": "6 DE JULIO DE 2020"
-            },
-            "PRESENCIAL": {
-                "nombre": "",
-                "registro": "",
-                "licencia": "",
-                "fecha": ""
-            },
-            "PILAR": {
-                "nombre": "DRA. MARIA DEL PILAR PEROZO HERNANDEZ",
-                "registro": "C.C.: 1.090.419.867 - MÉDICO OCUPACIONAL",
-                "licencia": "Resolución No. 27293",
-                "fecha": "05 DE AGOSTO DE 2025"
-            }
+    # Datos de cada médico
+    medico_datos_map = {
+        "SIXTA": {
+            "nombre": "SIXTA VIVERO CARRASCAL",
+            "registro": "REGISTRO MÉDICO NO 55300504",
+            "licencia": "LICENCIA SALUD OCUPACIONAL 583",
+            "fecha": "16 DE FEBRERO DE 2021"
+        },
+        "JUAN 134": {
+            "nombre": "JUAN JOSE REATIGA",
+            "registro": "C.C.: 7.472.676 - REGISTRO MEDICO NO 14791",
+            "licencia": "LICENCIA SALUD OCUPACIONAL 460",
+            "fecha": "6 DE JULIO DE 2020"
+        },
+        "CESAR": {
+            "nombre": "CÉSAR ADOLFO ZAMBRANO MARTÍNEZ",
+            "registro": "REGISTRO MEDICO NO 1192803570",
+            "licencia": "LICENCIA SALUD OCUPACIONAL # 3241",
+            "fecha": "13 DE JULIO DE 2021"
+        },
+        "MARY": {
+            "nombre": "",
+            "registro": "",
+            "licencia": "",
+            "fecha": ""
+        },
+        "NUBIA": {
+            "nombre": "JUAN JOSE REATIGA",
+            "registro": "C.C.: 7.472.676 - REGISTRO MEDICO NO 14791",
+            "licencia": "LICENCIA SALUD OCUPACIONAL 460",
+            "fecha": "6 DE JULIO DE 2020"
+        },
+        "PRESENCIAL": {
+            "nombre": "",
+            "registro": "",
+            "licencia": "",
+            "fecha": ""
+        },
+        "PILAR": {
+            "nombre": "DRA. MARIA DEL PILAR PEROZO HERNANDEZ",
+            "registro": "C.C.: 1.090.419.867 - MÉDICO OCUPACIONAL",
+            "licencia": "Resolución No. 27293",
+            "fecha": "05 DE AGOSTO DE 2025"
         }
+    }
 
-        # Firma del médico: prioridad 1 = medicos.firma en BD (scoped por tenant),
-        # fallback = archivo estático del map hardcodeado.
-        tenant_id_med = datos_wix.get('tenant_id')
-        wix_id_historia = datos_wix.get('_id')
-        firma_db = obtener_firma_medico_db(medico, tenant_id_med, wix_id_historia)
-        if firma_db:
-            firma_medico_url = firma_db  # puede ser data URI o URL, el template acepta ambos
-            print(f"✅ Firma médico: desde BD (tenant={tenant_id_med or 'resuelto via HC'}, alias={medico})")
+    # Firma del médico: prioridad 1 = medicos.firma en BD (scoped por tenant),
+    # fallback = archivo estático del map hardcodeado.
+    tenant_id_med = datos_wix.get('tenant_id')
+    wix_id_historia = datos_wix.get('_id')
+    firma_db = obtener_firma_medico_db(medico, tenant_id_med, wix_id_historia)
+    if firma_db:
+        firma_medico_url = firma_db  # puede ser data URI o URL, el template acepta ambos
+        print(f"✅ Firma médico: desde BD (tenant={tenant_id_med or 'resuelto via HC'}, alias={medico})")
+    else:
+        firma_medico_filename = firma_medico_map.get(medico)
+        firma_medico_url = f"https://bsl-utilidades-yp78a.ondigitalocean.app/static/{firma_medico_filename}" if firma_medico_filename else ""
+        print(f"✅ Firma médico: static fallback ({firma_medico_filename or 'ninguna'})")
+
+    # Obtener datos del médico: prioridad 1 = map hardcodeado, prioridad 2 = tabla medicos en BD
+    datos_medico = medico_datos_map.get(medico)
+    if not datos_medico:
+        datos_medico_db = obtener_datos_medico_db(medico, tenant_id_med, wix_id_historia)
+        if datos_medico_db:
+            datos_medico = datos_medico_db
+            print(f"✅ Datos médico: desde BD (alias={medico})")
         else:
-            firma_medico_filename = firma_medico_map.get(medico)
-            firma_medico_url = f"https://bsl-utilidades-yp78a.ondigitalocean.app/static/{firma_medico_filename}" if firma_medico_filename else ""
-            print(f"✅ Firma médico: static fallback ({firma_medico_filename or 'ninguna'})")
-
-        # Obtener datos del médico: prioridad 1 = map hardcodeado, prioridad 2 = tabla medicos en BD
-        datos_medico = medico_datos_map.get(medico)
-        if not datos_medico:
-            datos_medico_db = obtener_datos_medico_db(medico, tenant_id_med, wix_id_historia)
-            if datos_medico_db:
-                datos_medico = datos_medico_db
-                print(f"✅ Datos médico: desde BD (alias={medico})")
-            else:
-                datos_medico = {"nombre": "", "registro": "", "licencia": "", "fecha": ""}
-        print(f"👨‍⚕️ Médico: {datos_medico['nombre']}")
+            datos_medico = {"nombre": "", "registro": "", "licencia": "", "fecha": ""}
+    print(f"👨‍⚕️ Médico: {datos_medico['nombre']}")
 
-        # Firma del paciente desde PostgreSQL
-        firma_paciente_url = datos_wix.get('firma_paciente')
-        if firma_paciente_url:
-            print(f"✅ Firma paciente: obtenida desde PostgreSQL (data URI base64)")
-        else:
-            print(f"ℹ️  Firma paciente: no disponible")
+    # Firma del paciente desde PostgreSQL
+    firma_paciente_url = datos_wix.get('firma_paciente')
+    if firma_paciente_url:
+        print(f"✅ Firma paciente: obtenida desde PostgreSQL (data URI base64)")
+    else:
+        print(f"ℹ️  Firma paciente: no disponible")
+
+    # Firma del optómetra (siempre la misma)
+    firma_optometra_url = "https://bsl-utilidades-yp78a.ondigitalocean.app/static/FIRMA-OPTOMETRA.jpeg"
+    print(f"✅ Firma optómetra: FIRMA-OPTOMETRA.jpeg")
+
+    # Datos del tenant (distintivo = ips_sede)
+    _tenant_id_cert = datos_historia_postgres.get('tenant_id') if datos_historia_postgres else None
+    _tenant_data = obtener_datos_tenant(_tenant_id_cert)
+
+    # Preparar datos para el template
+    datos_certificado = {
+        "nombres_apellidos": nombre_completo,
+        "documento_identidad": datos_wix.get('numeroId', ''),
+        "cargo": datos_wix.get('cargo', ''),
+        "cod_empresa": datos_wix.get('codEmpresa', ''),
+        "empresa": "PARTICULAR" if datos_wix.get('codEmpresa') in EMPRESAS_COMO_PARTICULAR else ("FOUNDEVER" if datos_wix.get('codEmpresa') == 'SITEL' else datos_wix.get('empresa', '')),
+        "genero": datos_wix.get('genero', ''),
+        "edad": str(datos_wix.get('edad', '')),
+        "fecha_nacimiento": datos_wix.get('fechaNacimiento', ''),
+        "estado_civil": datos_wix.get('estadoCivil', ''),
+        "hijos": str(datos_wix.get('hijos', '0')),
+        "profesion": datos_wix.get('profesionUOficio', ''),
+        "email": datos_wix.get('email', ''),
+        "celular": datos_wix.get('celular', ''),
+        "tipo_examen": datos_wix.get('tipoExamen', ''),
+        "foto_paciente": datos_wix.get('foto_paciente', None),
+        "fecha_atencion": fecha_formateada,
+        "ciudad": "BOGOTÁ" if datos_wix.get('codEmpresa') in EMPRESAS_COMO_PARTICULAR else (datos_wix.get('ciudadDeResidencia') or datos_wix.get('ciudad', 'Bogotá')),
+        "vigencia": obtener_vigencia_certificado(
+            datos_wix.get('codEmpresa'),
+            datos_wix.get('numeroId'),
+        ),
+        "ips_sede": _tenant_data.get('tenant_distintivo', 'Sede norte DHSS0244914'),
+        "examenes_realizados": examenes_realizados,
+        "examenes": examenes_para_template,  # Lista de exámenes para secciones detalladas (filtrada para SITEL)
+        "resultados_generales": resultados_generales,
+        "paciente_atendido": paciente_atendido,
+        "analisis_postural": analisis_postural,
+        "concepto_medico": datos_wix.get('mdConceptoFinal', '') or ('ELEGIBLE PARA EL CARGO' if datos_wix.get('codEmpresa') == 'SANITHELP-JJ' else ''),
+        "recomendaciones_medicas": recomendaciones,
+        "datos_visual": datos_visual,  # Datos visuales (Optometría/Visiometría)
+        "datos_audiometria": datos_audiometria,  # Datos de audiometría
+        "datos_voximetria": datos_voximetria,  # Datos de voximetría
+        "datos_adc": datos_adc,  # Datos ADC (Perfil Psicológico)
+        "medico_nombre": datos_medico['nombre'],
+        "medico_registro": datos_medico['registro'],
+        "medico_licencia": datos_medico['licencia'],
+        "medico_fecha": datos_medico['fecha'],
+        "firma_medico_url": firma_medico_url,
+        "firma_paciente_url": firma_paciente_url,
+        "optometra_nombre": "Dr. Miguel Garzón Rincón",
+        "optometra_registro": "C.C.: 79.569.881 - Optómetra Ocupacional Res. 6473 04/07/2017",
+        "firma_optometra_url": firma_optometra_url,
+        "fono_nombre": "JENNY MARCELA MARTINEZ HIGUERA",
+        "fono_registro": "TP Resolución 4502 Dic 2012 - C.C.: 1.024.479.059",
+        "firma_fono_url": "https://bsl-utilidades-yp78a.ondigitalocean.app/static/firmaFono.jpeg",
+        "examenes_detallados": [],
+        # Datos del tenant (logo + nombre/nit/licencia/direccion para encabezado PDF)
+        **_tenant_data,
+        # ===== NUEVOS CAMPOS DESDE POSTGRESQL =====
+        "eps": datos_wix.get('eps', ''),
+        "arl": datos_wix.get('arl', ''),
+        "pensiones": datos_wix.get('pensiones', ''),
+        "nivel_educativo": datos_wix.get('nivel_educativo', '')
+    }
 
-        # Firma del optómetra (siempre la misma)
-        firma_optometra_url = "https://bsl-utilidades-yp78a.ondigitalocean.app/static/FIRMA-OPTOMETRA.jpeg"
-        print(f"✅ Firma optómetra: FIRMA-OPTOMETRA.jpeg")
+    # Determinar si mostrar aviso de sin soporte
+    mostrar_aviso, texto_aviso = determinar_mostrar_sin_soporte(datos_wix)
+    datos_certificado["mostrar_sin_soporte"] = mostrar_aviso
+    datos_certificado["texto_sin_soporte"] = texto_aviso
 
-        # Generar código de seguridad
-        codigo_seguridad = str(uuid.uuid4())
+    if mostrar_aviso:
+        print(f"⚠️ Preview mostrará aviso de pago pendiente para {datos_wix.get('codEmpresa', 'N/A')}")
 
-        # Datos del tenant (distintivo = ips_sede)
-        _tenant_id_cert = datos_historia_postgres.get('tenant_id') if datos_historia_postgres else None
-        _tenant_data = obtener_datos_tenant(_tenant_id_cert)
+    # Datos para página de custodia
+    datos_certificado["empresa_nit_custodia"] = obtener_nit_empresa(datos_wix.get("codEmpresa", ""))
 
-        # Preparar datos para el template
-        datos_certificado = {
-            "codigo_seguridad": codigo_seguridad,
-            "nombres_apellidos": nombre_completo,
-            "documento_identidad": datos_wix.get('numeroId', ''),
-            "cargo": datos_wix.get('cargo', ''),
-            "cod_empresa": datos_wix.get('codEmpresa', ''),
-            "empresa": "PARTICULAR" if datos_wix.get('codEmpresa') in EMPRESAS_COMO_PARTICULAR else ("FOUNDEVER" if datos_wix.get('codEmpresa') == 'SITEL' else datos_wix.get('empresa', '')),
-            "genero": datos_wix.get('genero', ''),
-            "edad": str(datos_wix.get('edad', '')),
-            "fecha_nacimiento": datos_wix.get('fechaNacimiento', ''),
-            "estado_civil": datos_wix.get('estadoCivil', ''),
-            "hijos": str(datos_wix.get('hijos', '0')),
-            "profesion": datos_wix.get('profesionUOficio', ''),
-            "email": datos_wix.get('email', ''),
-            "celular": datos_wix.get('celular', ''),
-            "tipo_examen": datos_wix.get('tipoExamen', ''),
-            "foto_paciente": datos_wix.get('foto_paciente', None),
-            "fecha_atencion": fecha_formateada,
-            "ciudad": "BOGOTÁ" if datos_wix.get('codEmpresa') in EMPRESAS_COMO_PARTICULAR else (datos_wix.get('ciudadDeResidencia') or datos_wix.get('ciudad', 'Bogotá')),
-            "vigencia": obtener_vigencia_certificado(
-                datos_wix.get('codEmpresa'),
-                datos_wix.get('numeroId'),
-            ),
-            "ips_sede": _tenant_data.get('tenant_distintivo', 'Sede norte DHSS0244914'),
-            "examenes_realizados": examenes_realizados,
-            "examenes": examenes_para_template,  # Lista de exámenes para secciones detalladas (filtrada para SITEL)
-            "resultados_generales": resultados_generales,
-            "paciente_atendido": paciente_atendido,
-            "analisis_postural": analisis_postural,
-            "concepto_medico": datos_wix.get('mdConceptoFinal', '') or ('ELEGIBLE PARA EL CARGO' if datos_wix.get('codEmpresa') == 'SANITHELP-JJ' else ''),
-            "recomendaciones_medicas": recomendaciones,
-            "datos_visual": datos_visual,  # Datos visuales (Optometría/Visiometría)
-            "datos_audiometria": datos_audiometria,  # Datos de audiometría
-            "datos_voximetria": datos_voximetria,  # Datos de voximetría
-            "datos_adc": datos_adc,  # Datos ADC (Perfil Psicológico)
-            "medico_nombre": datos_medico['nombre'],
-            "medico_registro": datos_medico['registro'],
-            "medico_licencia": datos_medico['licencia'],
-            "medico_fecha": datos_medico['fecha'],
-            "firma_medico_url": firma_medico_url,
-            "firma_paciente_url": firma_paciente_url,
-            "optometra_nombre": "Dr. Miguel Garzón Rincón",
-            "optometra_registro": "C.C.: 79.569.881 - Optómetra Ocupacional Res. 6473 04/07/2017",
-            "firma_optometra_url": firma_optometra_url,
-            "fono_nombre": "JENNY MARCELA MARTINEZ HIGUERA",
-            "fono_registro": "TP Resolución 4502 Dic 2012 - C.C.: 1.024.479.059",
-            "firma_fono_url": "https://bsl-utilidades-yp78a.ondigitalocean.app/static/firmaFono.jpeg",
-            "examenes_detallados": [],
-            # Datos del tenant (logo + nombre/nit/licencia/direccion para encabezado PDF)
-            **_tenant_data,
-            # ===== NUEVOS CAMPOS DESDE POSTGRESQL =====
-            "eps": datos_wix.get('eps', ''),
-            "arl": datos_wix.get('arl', ''),
-            "pensiones": datos_wix.get('pensiones', ''),
-            "nivel_educativo": datos_wix.get('nivel_educativo', '')
-        }
+    # Flags de visualización parcial del certificado (config por empresa en PLATAFORMA2)
+    _cfg_cert = obtener_config_certificado_empresa(datos_wix.get("codEmpresa", ""))
+    datos_certificado["ocultar_audiometria"] = bool(_cfg_cert.get("ocultar_audiometria", False))
+    datos_certificado["ocultar_visiometria"] = bool(_cfg_cert.get("ocultar_visiometria", False))
 
-        # Determinar si mostrar aviso de sin soporte
-        mostrar_aviso, texto_aviso = determinar_mostrar_sin_soporte(datos_wix)
-        datos_certificado["mostrar_sin_soporte"] = mostrar_aviso
-        datos_certificado["texto_sin_soporte"] = texto_aviso
+    return datos_certificado
 
-        if mostrar_aviso:
-            print(f"⚠️ Preview mostrará aviso de pago pendiente para {datos_wix.get('codEmpresa', 'N/A')}")
 
-        # Datos para página de custodia
-        datos_certificado["fecha_custodia_texto"] = generar_fecha_custodia_texto()
-        datos_certificado["empresa_nit_custodia"] = obtener_nit_empresa(datos_wix.get("codEmpresa", ""))
+def _renderizar_template_certificado(datos_certificado):
+    """certificado_medico.html con los campos de cada render (no se guardan en el snapshot)"""
+    datos_certificado["codigo_seguridad"] = str(uuid.uuid4())
+    datos_certificado["fecha_custodia_texto"] = generar_fecha_custodia_texto()
 
-        # Flags de visualización parcial del certificado (config por empresa en PLATAFORMA2)
-        _cfg_cert = obtener_config_certificado_empresa(datos_wix.get("codEmpresa", ""))
-        datos_certificado["ocultar_audiometria"] = bool(_cfg_cert.get("ocultar_audiometria", False))
-        datos_certificado["ocultar_visiometria"] = bool(_cfg_cert.get("ocultar_visiometria", False))
+    print("🎨 Renderizando plantilla HTML del certificado...")
+    # Con app_context: el reenvío por plantilla corre en un hilo sin request
+    with app.app_context():
+        return render_template("certificado_medico.html", **datos_certificado)
 
-        # Renderizar template HTML
-        print("🎨 Renderizando plantilla HTML para preview...")
-        html_content = render_template("certificado_medico.html", **datos_certificado)
+
+def renderizar_certificado_html(wix_id):
+    """
+    HTML del certificado de la orden: snapshot al día o ensamblado en vivo.
+    Lo usan el preview y renderizar_certificado_pdf.
+
+    Returns:
+        str: HTML renderizado, o None si no hay datos del paciente
+    """
+    datos_certificado = obtener_datos_certificado(wix_id, ensamblar_datos_certificado)
+    if datos_certificado is None:
+        return None
+    return _renderizar_template_certificado(datos_certificado)
+
+
+# --- Endpoint: PREVIEW CERTIFICADO EN HTML (sin generar PDF) ---
+@app.route("/preview-certificado-html/<wix_id>", methods=["GET", "OPTIONS"])
+def preview_certificado_html(wix_id):
+    """
+    Endpoint para previsualizar el certificado en HTML sin generar el PDF
+
+    Args:
+        wix_id: ID del registro en la colección HistoriaClinica de Wix
+
+    Returns:
+        HTML renderizado del certificado
+    """
+    if request.method == "OPTIONS":
+        response_headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type"
+        }
+        return ("", 204, response_headers)
+
+    try:
+        print(f"🔍 Previsualizando certificado HTML para Wix ID: {wix_id}")
+
+        # Verificar si tenemos datos enriquecidos de Alegra (vienen de flask.g)
+        import flask
+        usar_datos_formulario = getattr(flask.g, 'usar_datos_formulario', False)
+
+        if usar_datos_formulario:
+            # Flujo Alegra: los datos vienen de la petición, siempre se ensambla en vivo
+            datos_wix = getattr(flask.g, 'datos_wix_enriquecidos', None)
+            if datos_wix is not None:
+                print(f"✅ [ALEGRA] Usando datos enriquecidos con FORMULARIO para preview")
+            datos_certificado = ensamblar_datos_certificado(wix_id, datos_wix, usar_datos_formulario=True)
+            html_content = _renderizar_template_certificado(datos_certificado) if datos_certificado else None
+        else:
+            # Flujo normal: snapshot de la orden si está al día
+            html_content = renderizar_certificado_html(wix_id)
+
+        if html_content is None:
+            return f"<html><body><h1>Error</h1><p>No se encontraron datos del paciente en el sistema (ID: {wix_id})</p></body></html>", 404
 
         print(f"✅ HTML generado exitosamente para preview")
 
@@ -7081,6 +6448,9 @@ def preview_certificado_html(wix_id):
 # --- Endpoint: SERVIR PDF TEMPORAL PARA TWILIO ---
 CERTIFICADOS_WHATSAPP_DIR = os.path.join("/tmp", "certificados-whatsapp")
 os.makedirs(CERTIFICADOS_WHATSAPP_DIR, exist_ok=True)
+TWILIO_MEDIA_BASE_URL = os.getenv("BASE_URL", "https://bsl-utilidades-yp78a.ondigitalocean.app")
+# Mismo callback que usa el chat: guarda el estado de entrega por SID (twilio_estados)
+TWILIO_STATUS_CALLBACK_URL = f"{TWILIO_MEDIA_BASE_URL}/twilio-chat/webhook/twilio/status"
 
 @app.route("/certificado-whatsapp-media/<filename>")
 def serve_certificado_whatsapp_media(filename):
@@ -7157,31 +6527,414 @@ def api_tenant_info(historia_id):
 # link vive en el chat del paciente. Sin esto, cada toque/recarga = un PDF más
 # (medido: 783 envíos a 426 pacientes en 7 días; uno recibió 14).
 #
-# Memoria del proceso: el Procfile corre `python descargar_bsl.py` (un solo proceso),
-# así que alcanza. Si algún día se pasa a gunicorn con varios workers, hay que moverlo
-# a la BD o a Redis.
+# La ventana vive en un store compartido (ver dedupe_certificados: tabla Postgres por
+# defecto, Redis opcional) para que varios workers o un reinicio no dejen pasar
+# reenvíos. Si el store falla, se decide con la memoria del proceso.
 # ============================================================
-_ULTIMO_ENVIO_CERTIFICADO = {}          # wix_id -> timestamp del último envío
-VENTANA_DEDUPE_CERTIFICADO_SEG = 10 * 60
-
-
 def _certificado_enviado_recientemente(wix_id, marcar=True):
     """True si a esta orden ya se le envió el certificado dentro de la ventana."""
-    ahora = time.time()
+    return certificado_enviado_recientemente(wix_id, marcar=marcar)
 
-    # Limpieza oportunista para que el dict no crezca sin control
-    if len(_ULTIMO_ENVIO_CERTIFICADO) > 500:
-        for k, ts in list(_ULTIMO_ENVIO_CERTIFICADO.items()):
-            if ahora - ts > VENTANA_DEDUPE_CERTIFICADO_SEG:
-                _ULTIMO_ENVIO_CERTIFICADO.pop(k, None)
 
-    ultimo = _ULTIMO_ENVIO_CERTIFICADO.get(wix_id)
-    if ultimo and (ahora - ultimo) < VENTANA_DEDUPE_CERTIFICADO_SEG:
-        return True
+@app.route("/api/metricas/dedupe-certificados", methods=["GET"])
+def metricas_dedupe_certificados():
+    """Cuántos renders y envíos de WhatsApp ahorró el anti-reenvío"""
+    return jsonify(obtener_metricas_dedupe())
 
-    if marcar:
-        _ULTIMO_ENVIO_CERTIFICADO[wix_id] = ahora
-    return False
+
+def _datos_envio_desde_fila(row):
+    """
+    datos_wix mínimo para el envío a partir de una fila con las columnas:
+    _id, numeroId, celular, tenant_id, nombres (4), pvEstado, codEmpresa, pagado, tipoExamen
+    """
+    return {
+        '_id': row[0],
+        'numeroId': row[1],
+        'celular': row[2],
+        'tenant_id': row[3] or 'bsl',
+        'primerNombre': row[4] or '',
+        'segundoNombre': row[5] or '',
+        'primerApellido': row[6] or '',
+        'segundoApellido': row[7] or '',
+        'pvEstado': row[8] or '',
+        'codEmpresa': row[9] or '',
+        'pagado': row[10] is True,
+        'tipoExamen': row[11] or '',
+        # Marca que estos datos vienen de Postgres (fuente autoritativa).
+        # El fallback de Wix no trae 'pagado', y sin esa marca no se puede
+        # distinguir "confirmado impago" de "no pude averiguarlo".
+        '_fuente': 'postgres'
+    }
+
+
+def procesar_envio_certificado_whatsapp(datos_wix, wix_id, numero_id=None, tiempos=None, inicio_envio=None):
+    """
+    Envía por WhatsApp el certificado de una orden ya resuelta (datos_wix con
+    celular, tenant, pago). Aplica las guardas de pago y dedupe, renderiza por la
+    ruta compartida y envía respetando el límite Twilio del tenant.
+
+    Returns:
+        tuple: (dict de resultado, status HTTP)
+    """
+    tiempos = {} if tiempos is None else tiempos
+    inicio_envio = inicio_envio or time.time()
+
+    # Obtener celular del registro de HistoriaClinica
+    celular_raw = datos_wix.get('celular', '')
+    if not celular_raw:
+        return {
+            "success": False,
+            "message": "No se encontró número de celular registrado para esta cédula"
+        }, 400
+
+    # Limpiar y formatear el celular (agregar prefijo 57 si no lo tiene)
+    # Normalización robusta: se quita TODO lo que no sea dígito, el '+' incluido.
+    # Antes solo se limpiaban espacios y guiones, así que un celular guardado como
+    # "+573008021701" no empezaba por "57" (empezaba por "+") y terminaba como
+    # "57+573008021701" — número inválido que Twilio rechaza. Afecta a 655 registros
+    # con el celular guardado con prefijo '+': para ellos el certificado por WhatsApp
+    # nunca pudo salir.
+    # `re` NO está importado a nivel de módulo en este archivo (solo dentro de
+    # funciones puntuales), así que hay que importarlo acá o revienta con NameError.
+    import re as _re
+    solo_digitos = _re.sub(r'\D', '', str(celular_raw))
+    if len(solo_digitos) == 10:
+        celular = '57' + solo_digitos          # colombiano sin indicativo
+    elif solo_digitos.startswith('57'):
+        celular = solo_digitos                 # ya viene con indicativo
+    else:
+        celular = solo_digitos                 # extranjero u otro formato: que valide Twilio
+
+    if not celular:
+        return {
+            "success": False,
+            "message": "El número de celular registrado no es válido"
+        }, 400
+
+    print(f"✅ Certificado encontrado: {wix_id}")
+    print(f"📱 Celular de envío: {celular}")
+
+    # ============================================================
+    # GUARDA 1 — no generar un "certificado" que en realidad es un muñón.
+    #
+    # Antes, si la orden no registraba pago, igual se generaba y enviaba el PDF:
+    # el renderizador le estampa un banner rojo y BORRA concepto médico, resultados
+    # y firmas (ver determinar_mostrar_sin_soporte + certificado_medico.html), pero
+    # el mensaje de WhatsApp igual decía "✅ Tu certificado está listo". El paciente
+    # recibía un documento inservible anunciado como bueno, no entendía qué hacer, y
+    # recargaba el link una y otra vez (medido: 783 envíos a 426 pacientes en 7 días).
+    #
+    # Ahora se corta acá y se le manda instrucciones de pago concretas.
+    # ============================================================
+    # FALLA ABIERTO a propósito: solo se bloquea con datos de Postgres en la mano
+    # (la fila que ya trajimos arriba). Si vino por el fallback de Wix, o si algo
+    # revienta, se envía el certificado igual. Un paciente que pagó y no recibe su
+    # certificado es MUCHO peor que uno que no pagó y lo recibe: eso último ya lo
+    # cubre el banner rojo del renderizador.
+    # Las exclusiones son las MISMAS que usa la generación del PDF, vía
+    # debe_colapsar_soporte: empresas de EMPRESAS_SIN_SOPORTE, códigos numéricos de
+    # 6+ dígitos, y tipos de examen de TIPOS_EXAMEN_SIN_AVISO. Se reusa la función en
+    # vez de duplicar la lista para que no se puedan desincronizar.
+    sin_pago_confirmado = False
+    try:
+        if datos_wix.get('_fuente') == 'postgres' and not debe_colapsar_soporte(datos_wix):
+            pagado_pg = datos_wix.get('pagado') is True
+            pagado_pv = datos_wix.get('pvEstado', '') == 'Pagado'
+            sin_pago_confirmado = not (pagado_pg or pagado_pv)
+    except Exception as e:
+        print(f"⚠️  No se pudo verificar el pago ({e}) — se envía el certificado igual")
+        sin_pago_confirmado = False
+
+    if sin_pago_confirmado:
+        print(f"🚫 Orden {wix_id} SIN PAGO — no se genera PDF ni se envía WhatsApp")
+
+        # NO se envía WhatsApp: el aviso vive solo en la página ("Comunícate con un
+        # asesor"). Antes se mandaban los medios de pago por texto libre, pero eso solo
+        # se entrega dentro de la ventana de 24h de Twilio → medido, >50% caía como
+        # undelivered (error 63016) porque el paciente abría el link fuera de esa
+        # ventana. Un mensaje que llega a la mitad confunde más de lo que ayuda.
+        return {
+            "success": False,
+            "motivo": "sin_pago",
+            "message": "Tu certificado aún no registra el pago. Comunícate con un asesor."
+        }, 402  # 402 Payment Required
+
+    # ============================================================
+    # GUARDA 2 — dedupe. La página solicitar-certificado.html dispara este endpoint
+    # sola en cada `load`, y el link queda guardado en el chat del paciente: cada
+    # toque o recarga era un PDF más. Con esto, reabrir el link dentro de la ventana
+    # no reenvía nada (el paciente ya tiene el documento en su chat).
+    # ============================================================
+    if _certificado_enviado_recientemente(wix_id):
+        print(f"⏭️  Certificado de {wix_id} ya enviado hace poco — no se reenvía (dedupe)")
+        return {
+            "success": True,
+            "duplicado": True,
+            "message": "Ya te enviamos el certificado por WhatsApp hace un momento. "
+                       "Revisa tu chat: el archivo PDF está ahí."
+        }, 200
+
+    tiempos['busqueda'] = round(time.time() - inicio_envio, 3)
+
+    # Generar el PDF en proceso por la ruta de render compartida. Antes se hacía un
+    # requests.get a /api/generar-certificado-pdf de esta misma app: salía a internet,
+    # volvía por el balanceador, ocupaba dos workers y repetía todas las consultas
+    # que ese endpoint hace antes de llamar a Puppeteer (y que el render no usa).
+    documento_id = numero_id if numero_id else datos_wix.get('numeroId', wix_id)
+    print(f"📄 Generando certificado en proceso para {wix_id}")
+    try:
+        pdf_bytes = renderizar_certificado_pdf(wix_id, documento_id, tiempos)
+    except Exception as render_error:
+        print(f"❌ Error generando el certificado PDF: {render_error}")
+        liberar_envio_certificado(wix_id)
+        return {
+            "success": False,
+            "message": "Error al generar el certificado PDF"
+        }, 500
+
+    # Guardar PDF localmente para que Twilio lo descargue al instante (URL estática)
+    inicio_etapa = time.time()
+    cache_buster = int(time.time() * 1000)
+    pdf_temp_name = f"cert_wa_{documento_id}_{cache_buster}.pdf"
+    pdf_temp_path = os.path.join(CERTIFICADOS_WHATSAPP_DIR, pdf_temp_name)
+    with open(pdf_temp_path, "wb") as f:
+        f.write(pdf_bytes)
+    tiempos['guardado'] = round(time.time() - inicio_etapa, 3)
+    print(f"✅ PDF guardado localmente para Twilio: {pdf_temp_path} ({len(pdf_bytes)} bytes)")
+    certificado_url = f"{TWILIO_MEDIA_BASE_URL}/certificado-whatsapp-media/{pdf_temp_name}"
+
+    # Enviar por WhatsApp usando Twilio
+    print(f"📤 Enviando certificado por WhatsApp via Twilio a {celular}")
+
+    # Obtener nombre del paciente y cédula
+    nombre_completo = f"{datos_wix.get('primerNombre', '')} {datos_wix.get('segundoNombre', '')} {datos_wix.get('primerApellido', '')} {datos_wix.get('segundoApellido', '')}".strip()
+    cedula = numero_id if numero_id else datos_wix.get('numeroId', 'N/A')
+
+    # Mensaje con el certificado (firma según tenant del paciente)
+    tenant_id_mensaje = datos_wix.get('tenant_id', 'bsl') if isinstance(datos_wix, dict) else 'bsl'
+    nombre_firma = obtener_nombre_tenant(tenant_id_mensaje)
+    mensaje_whatsapp = f"🏥 *Certificado Médico Ocupacional*\n\n*Paciente:* {nombre_completo}\n*Cédula:* {cedula}\n\n✅ Tu certificado está listo.\n\n_{nombre_firma}_"
+
+    inicio_etapa = time.time()
+    try:
+        # Multi-tenant: usar credenciales del tenant del paciente (no de BSL).
+        # El cliente sale del registro: reutiliza la conexión TLS a api.twilio.com.
+        tenant_id_paciente = datos_wix.get('tenant_id', 'bsl') if isinstance(datos_wix, dict) else 'bsl'
+        twilio_client, creds = obtener_cliente_twilio_tenant(tenant_id_paciente)
+        twilio_whatsapp_from = creds['whatsapp_from']
+        print(f"🔑 Twilio credenciales: {creds['source']} (from={twilio_whatsapp_from})")
+
+        if twilio_client is None:
+            print(f"❌ Credenciales de Twilio no configuradas para tenant {tenant_id_paciente}")
+            liberar_envio_certificado(wix_id)
+            return {
+                "success": False,
+                "message": "Error de configuración del servicio de WhatsApp"
+            }, 500
+
+        # Formatear número de destino
+        formatted_number = celular
+        if not formatted_number.startswith('whatsapp:'):
+            if not formatted_number.startswith('+'):
+                formatted_number = f'+{formatted_number}' if formatted_number.startswith('57') else f'+57{formatted_number}'
+            formatted_number = f'whatsapp:{formatted_number}'
+
+        # Resolver template del tenant (BSL: env var TWILIO_TEMPLATE_CERTIFICADO_PDF;
+        # tenants no-BSL: tenants.credenciales.twilio.templates.certificado_pdf_media).
+        # Si el tenant no tiene template configurado, fallback a free-text + media (zero-regression).
+        template_sid = (creds.get('templates') or {}).get('certificado_pdf_media')
+
+        if template_sid:
+            message = crear_mensaje_con_limite(
+                twilio_client, creds,
+                from_=twilio_whatsapp_from,
+                to=formatted_number,
+                content_sid=template_sid,
+                content_variables=json_module.dumps({
+                    "1": nombre_completo,
+                    "2": cedula,
+                    "3": certificado_url
+                }),
+                status_callback=TWILIO_STATUS_CALLBACK_URL
+            )
+            print(f"✅ Certificado enviado via template {template_sid}. SID: {message.sid}")
+        else:
+            print(f"⚠️  Tenant {tenant_id_paciente} sin template certificado_pdf_media — fallback a free-text")
+            message = crear_mensaje_con_limite(
+                twilio_client, creds,
+                from_=twilio_whatsapp_from,
+                to=formatted_number,
+                body=mensaje_whatsapp,
+                media_url=[certificado_url],
+                status_callback=TWILIO_STATUS_CALLBACK_URL
+            )
+            print(f"✅ Certificado enviado exitosamente por WhatsApp via Twilio. SID: {message.sid}")
+        tiempos['twilio'] = round(time.time() - inicio_etapa, 3)
+
+        # Si Twilio lo reporta failed/undelivered (p.ej. 63016 con free-text fuera de
+        # la ventana de 24h), el worker de reintentos lo reenvía por plantilla.
+        registrar_envio(
+            message.sid, 'certificado',
+            tenant_id=tenant_id_paciente,
+            destino=formatted_number,
+            wix_id=wix_id,
+            usa_template=bool(template_sid),
+            variables={'nombre': nombre_completo, 'cedula': cedula, 'documento_id': documento_id, 'url': certificado_url},
+            estado=getattr(message, 'status', None)
+        )
+
+        # Guardar mensaje en base de datos para que aparezca en BSL-PLATAFORMA
+        inicio_etapa = time.time()
+        try:
+            import psycopg2
+
+            # Normalizar número
+            numero_limpio = celular.replace('whatsapp:', '').replace('+', '').strip()
+            if not numero_limpio.startswith('57') and len(numero_limpio) == 10:
+                numero_limpio = '57' + numero_limpio
+            numero_normalizado = '+' + numero_limpio
+
+            conn = psycopg2.connect(
+                host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
+                port=int(os.getenv("POSTGRES_PORT", "25060")),
+                user=os.getenv("POSTGRES_USER", "doadmin"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                database=os.getenv("POSTGRES_DB", "defaultdb"),
+                sslmode="require"
+            )
+            cur = conn.cursor()
+
+            # Buscar o crear conversación (scoped por tenant — ver CLAUDE.md multi-tenant)
+            cur.execute(
+                "SELECT id FROM conversaciones_whatsapp WHERE celular = %s AND tenant_id = %s",
+                (numero_normalizado, tenant_id_paciente)
+            )
+            result = cur.fetchone()
+
+            if result:
+                conversacion_id = result[0]
+                cur.execute("UPDATE conversaciones_whatsapp SET fecha_ultima_actividad = NOW() WHERE id = %s", (conversacion_id,))
+            else:
+                cur.execute("""
+                    INSERT INTO conversaciones_whatsapp (celular, nombre_paciente, estado_actual, fecha_inicio, fecha_ultima_actividad, bot_activo, tenant_id)
+                    VALUES (%s, %s, 'activa', NOW(), NOW(), false, %s) RETURNING id
+                """, (numero_normalizado, nombre_completo or 'Cliente WhatsApp', tenant_id_paciente))
+                conversacion_id = cur.fetchone()[0]
+
+            # Guardar mensaje saliente (scoped por tenant)
+            cur.execute("""
+                INSERT INTO mensajes_whatsapp (conversacion_id, contenido, direccion, sid_twilio, tipo_mensaje, media_url, timestamp, tenant_id)
+                VALUES (%s, %s, 'saliente', %s, 'document', %s, NOW(), %s)
+            """, (conversacion_id, mensaje_whatsapp, message.sid, certificado_url, tenant_id_paciente))
+
+            conn.commit()
+            cur.close()
+            conn.close()
+            print(f"✅ Mensaje guardado en BD para conversación {conversacion_id}")
+
+        except Exception as db_error:
+            print(f"⚠️ Error guardando mensaje en BD (no crítico): {db_error}")
+        tiempos['registro_bd'] = round(time.time() - inicio_etapa, 3)
+        tiempos['total'] = round(time.time() - inicio_envio, 3)
+        print(f"⏱️ Tiempos envío certificado {wix_id}: {tiempos}")
+
+        return {
+            "success": True,
+            "message": "Certificado enviado exitosamente por WhatsApp",
+            "sid": message.sid,
+            "tiempos": tiempos
+        }, 200
+
+    except ImportError:
+        print("❌ Twilio no está instalado")
+        return {
+            "success": False,
+            "message": "Error de configuración del servicio de WhatsApp"
+        }, 500
+
+    except Exception as twilio_error:
+        print(f"❌ Error enviando por WhatsApp via Twilio: {str(twilio_error)}")
+        import traceback
+        traceback.print_exc()
+        liberar_envio_certificado(wix_id)
+        return {
+            "success": False,
+            "message": "Error al enviar el mensaje por WhatsApp. Verifica el número."
+        }, 500
+
+
+def reintentar_certificado_por_plantilla(fila):
+    """
+    Reenvío automático (worker de twilio_estados) de un certificado que Twilio
+    reportó failed/undelivered. Sale siempre por la plantilla certificado_pdf_media
+    del tenant, que Meta entrega fuera de la ventana de 24h. Si el PDF temporal ya
+    no está en disco (reinicio, limpieza de /tmp) se vuelve a renderizar.
+
+    Returns:
+        str: SID del nuevo mensaje, o None si el tenant no tiene plantilla
+    """
+    variables = fila['variables']
+    twilio_client, creds = obtener_cliente_twilio_tenant(fila['tenant_id'])
+    template_sid = (creds.get('templates') or {}).get('certificado_pdf_media')
+    if twilio_client is None or not template_sid:
+        print(f"⚠️  Tenant {fila['tenant_id']} sin plantilla certificado_pdf_media — no se reintenta {fila['sid']}")
+        return None
+
+    certificado_url = variables.get('url') or ''
+    pdf_temp_name = certificado_url.rsplit('/', 1)[-1]
+    if not pdf_temp_name or not os.path.exists(os.path.join(CERTIFICADOS_WHATSAPP_DIR, pdf_temp_name)):
+        documento_id = variables.get('documento_id') or variables.get('cedula')
+        pdf_bytes = renderizar_certificado_pdf(fila['wix_id'], documento_id)
+        pdf_temp_name = f"cert_wa_{documento_id}_{int(time.time() * 1000)}.pdf"
+        with open(os.path.join(CERTIFICADOS_WHATSAPP_DIR, pdf_temp_name), "wb") as f:
+            f.write(pdf_bytes)
+        certificado_url = f"{TWILIO_MEDIA_BASE_URL}/certificado-whatsapp-media/{pdf_temp_name}"
+        variables = dict(variables, url=certificado_url)
+
+    message = crear_mensaje_con_limite(
+        twilio_client, creds,
+        from_=creds['whatsapp_from'],
+        to=fila['destino'],
+        content_sid=template_sid,
+        content_variables=json_module.dumps({
+            "1": variables.get('nombre', ''),
+            "2": variables.get('cedula', ''),
+            "3": certificado_url
+        }),
+        status_callback=TWILIO_STATUS_CALLBACK_URL
+    )
+    registrar_envio(
+        message.sid, 'certificado',
+        tenant_id=fila['tenant_id'],
+        destino=fila['destino'],
+        wix_id=fila['wix_id'],
+        usa_template=True,
+        variables=variables,
+        estado=getattr(message, 'status', None),
+        reintento_de=fila['sid']
+    )
+    return message.sid
+
+
+@app.route("/api/metricas/entrega-whatsapp", methods=["GET"])
+def metricas_entrega_whatsapp():
+    """
+    Tasa de entrega de WhatsApp según los status callbacks de Twilio.
+
+    Query params: desde, hasta (YYYY-MM-DD, default últimos 7 días), tenant_id, tipo (certificado/otro)
+    """
+    hoy = datetime.now().date()
+    desde = request.args.get('desde') or (hoy - timedelta(days=7)).isoformat()
+    hasta = request.args.get('hasta') or hoy.isoformat()
+    try:
+        return jsonify(obtener_metricas_entrega(
+            desde, hasta,
+            tenant_id=request.args.get('tenant_id'),
+            tipo=request.args.get('tipo')
+        ))
+    except Exception as e:
+        print(f"❌ Error calculando métricas de entrega: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route("/enviar-certificado-whatsapp", methods=["POST", "OPTIONS"])
@@ -7213,6 +6966,10 @@ def enviar_certificado_whatsapp():
 
         print(f"📱 Solicitud de certificado por WhatsApp")
 
+        # Tiempos por etapa (segundos): busqueda, render, guardado, twilio, registro_bd
+        inicio_envio = time.time()
+        tiempos = {}
+
         datos_wix = None
         wix_id = None
 
@@ -7268,27 +7025,9 @@ def enviar_certificado_whatsapp():
             conn.close()
 
             if row:
-                wix_id = row[0]
-                tenant_id_paciente = row[3] or 'bsl'
-                datos_wix = {
-                    '_id': row[0],
-                    'numeroId': row[1],
-                    'celular': row[2],
-                    'tenant_id': tenant_id_paciente,
-                    'primerNombre': row[4] or '',
-                    'segundoNombre': row[5] or '',
-                    'primerApellido': row[6] or '',
-                    'segundoApellido': row[7] or '',
-                    'pvEstado': row[8] or '',
-                    'codEmpresa': row[9] or '',
-                    'pagado': row[10] is True,
-                    'tipoExamen': row[11] or '',
-                    # Marca que estos datos vienen de Postgres (fuente autoritativa).
-                    # El fallback de Wix no trae 'pagado', y sin esa marca no se puede
-                    # distinguir "confirmado impago" de "no pude averiguarlo".
-                    '_fuente': 'postgres'
-                }
-                print(f"✅ Encontrado en PostgreSQL: {wix_id} (tenant={tenant_id_paciente})")
+                datos_wix = _datos_envio_desde_fila(row)
+                wix_id = datos_wix['_id']
+                print(f"✅ Encontrado en PostgreSQL: {wix_id} (tenant={datos_wix['tenant_id']})")
             else:
                 print(f"⚠️ No se encontró registro en PostgreSQL")
         except Exception as e:
@@ -7330,278 +7069,120 @@ def enviar_certificado_whatsapp():
             except Exception as e:
                 print(f"⚠️ Error consultando Wix: {e}")
 
-        # Si no se encontró en ninguna fuente, retornar error
-        if not datos_wix or not wix_id:
-            mensaje = "No se encontró certificado para este registro" if historia_id else f"No se encontró certificado para cédula: {numero_id}"
-            print(f"❌ {mensaje}")
-            return jsonify({
-                "success": False,
-                "message": mensaje + ". Verifica los datos ingresados."
-            }), 404
-
-        # Obtener celular del registro de HistoriaClinica
-        celular_raw = datos_wix.get('celular', '')
-        if not celular_raw:
-            return jsonify({
-                "success": False,
-                "message": "No se encontró número de celular registrado para esta cédula"
-            }), 400
-
-        # Limpiar y formatear el celular (agregar prefijo 57 si no lo tiene)
-        # Normalización robusta: se quita TODO lo que no sea dígito, el '+' incluido.
-        # Antes solo se limpiaban espacios y guiones, así que un celular guardado como
-        # "+573008021701" no empezaba por "57" (empezaba por "+") y terminaba como
-        # "57+573008021701" — número inválido que Twilio rechaza. Afecta a 655 registros
-        # con el celular guardado con prefijo '+': para ellos el certificado por WhatsApp
-        # nunca pudo salir.
-        # `re` NO está importado a nivel de módulo en este archivo (solo dentro de
-        # funciones puntuales), así que hay que importarlo acá o revienta con NameError.
-        import re as _re
-        solo_digitos = _re.sub(r'\D', '', str(celular_raw))
-        if len(solo_digitos) == 10:
-            celular = '57' + solo_digitos          # colombiano sin indicativo
-        elif solo_digitos.startswith('57'):
-            celular = solo_digitos                 # ya viene con indicativo
-        else:
-            celular = solo_digitos                 # extranjero u otro formato: que valide Twilio
-
-        if not celular:
-            return jsonify({
-                "success": False,
-                "message": "El número de celular registrado no es válido"
-            }), 400
-
-        print(f"✅ Certificado encontrado: {wix_id}")
-        print(f"📱 Celular de envío: {celular}")
-
-        # ============================================================
-        # GUARDA 1 — no generar un "certificado" que en realidad es un muñón.
-        #
-        # Antes, si la orden no registraba pago, igual se generaba y enviaba el PDF:
-        # el renderizador le estampa un banner rojo y BORRA concepto médico, resultados
-        # y firmas (ver determinar_mostrar_sin_soporte + certificado_medico.html), pero
-        # el mensaje de WhatsApp igual decía "✅ Tu certificado está listo". El paciente
-        # recibía un documento inservible anunciado como bueno, no entendía qué hacer, y
-        # recargaba el link una y otra vez (medido: 783 envíos a 426 pacientes en 7 días).
-        #
-        # Ahora se corta acá y se le manda instrucciones de pago concretas.
-        # ============================================================
-        # FALLA ABIERTO a propósito: solo se bloquea con datos de Postgres en la mano
-        # (la fila que ya trajimos arriba). Si vino por el fallback de Wix, o si algo
-        # revienta, se envía el certificado igual. Un paciente que pagó y no recibe su
-        # certificado es MUCHO peor que uno que no pagó y lo recibe: eso último ya lo
-        # cubre el banner rojo del renderizador.
-        # Las exclusiones son las MISMAS que usa la generación del PDF, vía
-        # debe_colapsar_soporte: empresas de EMPRESAS_SIN_SOPORTE, códigos numéricos de
-        # 6+ dígitos, y tipos de examen de TIPOS_EXAMEN_SIN_AVISO. Se reusa la función en
-        # vez de duplicar la lista para que no se puedan desincronizar.
-        sin_pago_confirmado = False
-        try:
-            if datos_wix.get('_fuente') == 'postgres' and not debe_colapsar_soporte(datos_wix):
-                pagado_pg = datos_wix.get('pagado') is True
-                pagado_pv = datos_wix.get('pvEstado', '') == 'Pagado'
-                sin_pago_confirmado = not (pagado_pg or pagado_pv)
-        except Exception as e:
-            print(f"⚠️  No se pudo verificar el pago ({e}) — se envía el certificado igual")
-            sin_pago_confirmado = False
-
-        if sin_pago_confirmado:
-            print(f"🚫 Orden {wix_id} SIN PAGO — no se genera PDF ni se envía WhatsApp")
-
-            # NO se envía WhatsApp: el aviso vive solo en la página ("Comunícate con un
-            # asesor"). Antes se mandaban los medios de pago por texto libre, pero eso solo
-            # se entrega dentro de la ventana de 24h de Twilio → medido, >50% caía como
-            # undelivered (error 63016) porque el paciente abría el link fuera de esa
-            # ventana. Un mensaje que llega a la mitad confunde más de lo que ayuda.
-            return jsonify({
-                "success": False,
-                "motivo": "sin_pago",
-                "message": "Tu certificado aún no registra el pago. Comunícate con un asesor."
-            }), 402  # 402 Payment Required
-
-        # ============================================================
-        # GUARDA 2 — dedupe. La página solicitar-certificado.html dispara este endpoint
-        # sola en cada `load`, y el link queda guardado en el chat del paciente: cada
-        # toque o recarga era un PDF más. Con esto, reabrir el link dentro de la ventana
-        # no reenvía nada (el paciente ya tiene el documento en su chat).
-        # ============================================================
-        if _certificado_enviado_recientemente(wix_id):
-            print(f"⏭️  Certificado de {wix_id} ya enviado hace poco — no se reenvía (dedupe)")
-            return jsonify({
-                "success": True,
-                "duplicado": True,
-                "message": "Ya te enviamos el certificado por WhatsApp hace un momento. "
-                           "Revisa tu chat: el archivo PDF está ahí."
-            })
-
-        # Generar URL del certificado PDF
-        pdf_url = f"https://bsl-utilidades-yp78a.ondigitalocean.app/generar-certificado-desde-wix/{wix_id}"
-
-        print(f"📄 Generando certificado: {pdf_url}")
-
-        # Cache-busting para evitar PDFs antiguos
-        cache_buster = int(time.time() * 1000)  # timestamp en milisegundos
-
-        # Generar el PDF (hacer request al endpoint) - Timeout aumentado a 180s por certificados complejos
-        pdf_response = requests.get(f"https://bsl-utilidades-yp78a.ondigitalocean.app/api/generar-certificado-pdf/{wix_id}?v={cache_buster}", timeout=180)
-
-        if pdf_response.status_code != 200:
-            return jsonify({
-                "success": False,
-                "message": "Error al generar el certificado PDF"
-            }), 500
-
-        # Guardar PDF localmente para que Twilio lo descargue al instante (URL estática)
-        pdf_bytes = pdf_response.content
-        documento_id = numero_id if numero_id else datos_wix.get('numeroId', wix_id)
-        pdf_temp_name = f"cert_wa_{documento_id}_{cache_buster}.pdf"
-        pdf_temp_path = os.path.join(CERTIFICADOS_WHATSAPP_DIR, pdf_temp_name)
-        with open(pdf_temp_path, "wb") as f:
-            f.write(pdf_bytes)
-        print(f"✅ PDF guardado localmente para Twilio: {pdf_temp_path} ({len(pdf_bytes)} bytes)")
-        certificado_url = f"https://bsl-utilidades-yp78a.ondigitalocean.app/certificado-whatsapp-media/{pdf_temp_name}"
-
-        # Enviar por WhatsApp usando Twilio
-        print(f"📤 Enviando certificado por WhatsApp via Twilio a {celular}")
-
-        # Obtener nombre del paciente y cédula
-        nombre_completo = f"{datos_wix.get('primerNombre', '')} {datos_wix.get('segundoNombre', '')} {datos_wix.get('primerApellido', '')} {datos_wix.get('segundoApellido', '')}".strip()
-        cedula = numero_id if numero_id else datos_wix.get('numeroId', 'N/A')
-
-        # Mensaje con el certificado (firma según tenant del paciente)
-        tenant_id_mensaje = datos_wix.get('tenant_id', 'bsl') if isinstance(datos_wix, dict) else 'bsl'
-        nombre_firma = obtener_nombre_tenant(tenant_id_mensaje)
-        mensaje_whatsapp = f"🏥 *Certificado Médico Ocupacional*\n\n*Paciente:* {nombre_completo}\n*Cédula:* {cedula}\n\n✅ Tu certificado está listo.\n\n_{nombre_firma}_"
-
-        try:
-            # Importar y usar cliente Twilio
-            from twilio.rest import Client as TwilioClient
-
-            # Multi-tenant: usar credenciales del tenant del paciente (no de BSL)
-            tenant_id_paciente = datos_wix.get('tenant_id', 'bsl') if isinstance(datos_wix, dict) else 'bsl'
-            creds = obtener_credenciales_twilio_tenant(tenant_id_paciente)
-            twilio_account_sid = creds['account_sid']
-            twilio_auth_token = creds['auth_token']
-            twilio_whatsapp_from = creds['whatsapp_from']
-            print(f"🔑 Twilio credenciales: {creds['source']} (from={twilio_whatsapp_from})")
-
-            if not twilio_account_sid or not twilio_auth_token:
-                print(f"❌ Credenciales de Twilio no configuradas para tenant {tenant_id_paciente}")
-                return jsonify({
-                    "success": False,
-                    "message": "Error de configuración del servicio de WhatsApp"
-                }), 500
-
-            twilio_client = TwilioClient(twilio_account_sid, twilio_auth_token)
-
-            # Formatear número de destino
-            formatted_number = celular
-            if not formatted_number.startswith('whatsapp:'):
-                if not formatted_number.startswith('+'):
-                    formatted_number = f'+{formatted_number}' if formatted_number.startswith('57') else f'+57{formatted_number}'
-                formatted_number = f'whatsapp:{formatted_number}'
-
-            # Resolver template del tenant (BSL: env var TWILIO_TEMPLATE_CERTIFICADO_PDF;
-            # tenants no-BSL: tenants.credenciales.twilio.templates.certificado_pdf_media).
-            # Si el tenant no tiene template configurado, fallback a free-text + media (zero-regression).
-            template_sid = (creds.get('templates') or {}).get('certificado_pdf_media')
-
-            if template_sid:
-                message = twilio_client.messages.create(
-                    from_=twilio_whatsapp_from,
-                    to=formatted_number,
-                    content_sid=template_sid,
-                    content_variables=json_module.dumps({
-                        "1": nombre_completo,
-                        "2": cedula,
-                        "3": certificado_url
-                    })
-                )
-                print(f"✅ Certificado enviado via template {template_sid}. SID: {message.sid}")
-            else:
-                print(f"⚠️  Tenant {tenant_id_paciente} sin template certificado_pdf_media — fallback a free-text")
-                message = twilio_client.messages.create(
-                    from_=twilio_whatsapp_from,
-                    to=formatted_number,
-                    body=mensaje_whatsapp,
-                    media_url=[certificado_url]
-                )
-                print(f"✅ Certificado enviado exitosamente por WhatsApp via Twilio. SID: {message.sid}")
-
-            # Guardar mensaje en base de datos para que aparezca en BSL-PLATAFORMA
-            try:
-                import psycopg2
-
-                # Normalizar número
-                numero_limpio = celular.replace('whatsapp:', '').replace('+', '').strip()
-                if not numero_limpio.startswith('57') and len(numero_limpio) == 10:
-                    numero_limpio = '57' + numero_limpio
-                numero_normalizado = '+' + numero_limpio
+        # Si no se encontró en ninguna fuente, retornar error
+        if not datos_wix or not wix_id:
+            mensaje = "No se encontró certificado para este registro" if historia_id else f"No se encontró certificado para cédula: {numero_id}"
+            print(f"❌ {mensaje}")
+            return jsonify({
+                "success": False,
+                "message": mensaje + ". Verifica los datos ingresados."
+            }), 404
 
-                conn = psycopg2.connect(
-                    host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
-                    port=int(os.getenv("POSTGRES_PORT", "25060")),
-                    user=os.getenv("POSTGRES_USER", "doadmin"),
-                    password=os.getenv("POSTGRES_PASSWORD"),
-                    database=os.getenv("POSTGRES_DB", "defaultdb"),
-                    sslmode="require"
-                )
-                cur = conn.cursor()
+        resultado, status = procesar_envio_certificado_whatsapp(datos_wix, wix_id, numero_id, tiempos, inicio_envio)
+        return jsonify(resultado), status
 
-                # Buscar o crear conversación (scoped por tenant — ver CLAUDE.md multi-tenant)
-                cur.execute(
-                    "SELECT id FROM conversaciones_whatsapp WHERE celular = %s AND tenant_id = %s",
-                    (numero_normalizado, tenant_id_paciente)
-                )
-                result = cur.fetchone()
+    except Exception as e:
+        print(f"❌ Error en enviar_certificado_whatsapp: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            "success": False,
+            "message": f"Error interno: {str(e)}"
+        }), 500
 
-                if result:
-                    conversacion_id = result[0]
-                    cur.execute("UPDATE conversaciones_whatsapp SET fecha_ultima_actividad = NOW() WHERE id = %s", (conversacion_id,))
-                else:
-                    cur.execute("""
-                        INSERT INTO conversaciones_whatsapp (celular, nombre_paciente, estado_actual, fecha_inicio, fecha_ultima_actividad, bot_activo, tenant_id)
-                        VALUES (%s, %s, 'activa', NOW(), NOW(), false, %s) RETURNING id
-                    """, (numero_normalizado, nombre_completo or 'Cliente WhatsApp', tenant_id_paciente))
-                    conversacion_id = cur.fetchone()[0]
 
-                # Guardar mensaje saliente (scoped por tenant)
-                cur.execute("""
-                    INSERT INTO mensajes_whatsapp (conversacion_id, contenido, direccion, sid_twilio, tipo_mensaje, media_url, timestamp, tenant_id)
-                    VALUES (%s, %s, 'saliente', %s, 'document', %s, NOW(), %s)
-                """, (conversacion_id, mensaje_whatsapp, message.sid, certificado_url, tenant_id_paciente))
+# --- Endpoint: ENVÍO MASIVO DE CERTIFICADOS POR WHATSAPP ---
+@app.route("/api/enviar-certificados-whatsapp-masivo", methods=["POST", "OPTIONS"])
+def enviar_certificados_whatsapp_masivo():
+    """
+    Lanza el envío de certificados por WhatsApp para muchas órdenes.
 
-                conn.commit()
-                cur.close()
-                conn.close()
-                print(f"✅ Mensaje guardado en BD para conversación {conversacion_id}")
+    Body JSON (una de las dos formas):
+    - historiaIds: lista de _id de HistoriaClinica
+    - codEmpresa + fechaInicio + fechaFin (YYYY-MM-DD, sobre fechaAtencion)
 
-            except Exception as db_error:
-                print(f"⚠️ Error guardando mensaje en BD (no crítico): {db_error}")
+    Las órdenes se resuelven en una sola consulta; cada una pasa por las mismas
+    guardas (pago vía debe_colapsar_soporte, dedupe) y el mismo render que el envío
+    individual, y los mensajes salen al ritmo del límite Twilio de cada tenant.
+    Responde 202 con el id del trabajo; el progreso se consulta en
+    GET /api/enviar-certificados-whatsapp-masivo/<trabajo_id>.
+    """
+    if request.method == "OPTIONS":
+        response_headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type"
+        }
+        return ("", 204, response_headers)
 
-            return jsonify({
-                "success": True,
-                "message": "Certificado enviado exitosamente por WhatsApp"
-            }), 200
+    try:
+        data = request.get_json() or {}
+        historia_ids = data.get('historiaIds') or []
+        cod_empresa = data.get('codEmpresa')
+        fecha_inicio = data.get('fechaInicio')
+        fecha_fin = data.get('fechaFin')
 
-        except ImportError:
-            print("❌ Twilio no está instalado")
+        if not historia_ids and not (cod_empresa and fecha_inicio and fecha_fin):
             return jsonify({
                 "success": False,
-                "message": "Error de configuración del servicio de WhatsApp"
-            }), 500
+                "message": "Envía historiaIds o codEmpresa + fechaInicio + fechaFin"
+            }), 400
 
-        except Exception as twilio_error:
-            print(f"❌ Error enviando por WhatsApp via Twilio: {str(twilio_error)}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({
-                "success": False,
-                "message": "Error al enviar el mensaje por WhatsApp. Verifica el número."
-            }), 500
+        import psycopg2
+        conn = psycopg2.connect(
+            host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
+            port=int(os.getenv("POSTGRES_PORT", "25060")),
+            user=os.getenv("POSTGRES_USER", "doadmin"),
+            password=os.getenv("POSTGRES_PASSWORD"),
+            database=os.getenv("POSTGRES_DB", "defaultdb"),
+            sslmode="require"
+        )
+        cur = conn.cursor()
+        columnas = '''
+            SELECT _id, "numeroId", celular, tenant_id,
+                   "primerNombre", "segundoNombre", "primerApellido", "segundoApellido",
+                   "pvEstado", "codEmpresa", pagado, "tipoExamen"
+            FROM "HistoriaClinica"
+        '''
+        if historia_ids:
+            cur.execute(columnas + ' WHERE _id = ANY(%s) LIMIT %s', (list(historia_ids), ENVIO_MASIVO_MAX_ORDENES))
+        else:
+            cur.execute(columnas + '''
+                WHERE "codEmpresa" = %s
+                  AND "fechaAtencion" >= %s::date
+                  AND "fechaAtencion" < %s::date + INTERVAL '1 day'
+                ORDER BY "fechaAtencion"
+                LIMIT %s
+            ''', (cod_empresa, fecha_inicio, fecha_fin, ENVIO_MASIVO_MAX_ORDENES))
+        ordenes = [_datos_envio_desde_fila(row) for row in cur.fetchall()]
+        cur.close()
+        conn.close()
+
+        if not ordenes:
+            return jsonify({"success": False, "message": "No se encontraron órdenes para enviar"}), 404
+
+        print(f"📦 Envío masivo: {len(ordenes)} órdenes")
+        trabajo_id = crear_trabajo(
+            ordenes,
+            lambda datos: procesar_envio_certificado_whatsapp(datos, datos['_id']),
+            descripcion={
+                'historiaIds': len(historia_ids) or None,
+                'codEmpresa': cod_empresa,
+                'fechaInicio': fecha_inicio,
+                'fechaFin': fecha_fin
+            }
+        )
+
+        response = jsonify({
+            "success": True,
+            "trabajo_id": trabajo_id,
+            "total": len(ordenes),
+            "reporte_url": f"/api/enviar-certificados-whatsapp-masivo/{trabajo_id}"
+        })
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        return response, 202
 
     except Exception as e:
-        print(f"❌ Error en enviar_certificado_whatsapp: {str(e)}")
+        print(f"❌ Error en enviar_certificados_whatsapp_masivo: {str(e)}")
         traceback.print_exc()
         return jsonify({
             "success": False,
@@ -7609,6 +7190,21 @@ def enviar_certificado_whatsapp():
         }), 500
 
 
+@app.route("/api/enviar-certificados-whatsapp-masivo/<trabajo_id>", methods=["GET"])
+def reporte_envio_certificados_masivo(trabajo_id):
+    """Progreso y resultado por orden de un trabajo de envío masivo (desde cualquier instancia)"""
+    try:
+        reporte = obtener_trabajo(trabajo_id)
+    except Exception as e:
+        print(f"❌ Error consultando trabajo {trabajo_id}: {str(e)}")
+        return jsonify({"success": False, "message": f"Error interno: {str(e)}"}), 500
+    if not reporte:
+        return jsonify({"success": False, "message": "Trabajo no encontrado"}), 404
+    response = jsonify({"success": True, **reporte})
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
 # --- Endpoint: MEDIDATA PANEL PRINCIPAL ---
 @app.route("/medidata-principal")
 def medidata_principal():
@@ -9574,14 +9170,9 @@ def api_generar_certificado_pdf_v2_drive(wix_id):
         print(f"☁️ [V2-Drive] Subiendo a Google Drive...")
         nombre_drive = f"certificado_medico_{documento_sanitized}.pdf"
 
-        if DEST == "drive":
-            drive_link = subir_pdf_a_drive(local_filename, nombre_drive, GOOGLE_DRIVE_FOLDER_ID_CERTIFICADOS_V2)
-        elif DEST == "drive-oauth":
-            drive_link = subir_pdf_a_drive_oauth(local_filename, nombre_drive, GOOGLE_DRIVE_FOLDER_ID_CERTIFICADOS_V2)
-        else:
-            # Fallback a drive normal si el destino es GCS u otro
-            from drive_uploader import subir_pdf_a_drive
-            drive_link = subir_pdf_a_drive(local_filename, nombre_drive, GOOGLE_DRIVE_FOLDER_ID_CERTIFICADOS_V2)
+        # Este flujo siempre va a Drive: si el destino es GCS u otro, usar drive normal
+        destino_drive = DEST if DEST in ("drive", "drive-oauth") else "drive"
+        drive_link = subir_pdf_segun_destino(destino_drive, local_filename, nombre_drive, GOOGLE_DRIVE_FOLDER_ID_CERTIFICADOS_V2)
 
         print(f"✅ [V2-Drive] Subido a Drive: {drive_link}")
 
@@ -9619,37 +9210,6 @@ def api_generar_certificado_pdf_v2_drive(wix_id):
 # ENDPOINT PARA INFORME DE CONDICIONES DE SALUD
 # ============================================================================
 
-# Condiciones para SVE (Sistema de Vigilancia Epidemiológica)
-SVE_VISUAL_CONDITIONS = [
-    'ASTIGMATISMO H522',
-    "ALTERACION VISUAL  NO ESPECIFICADA H539",
-    'ALTERACIONES VISUALES SUBJETIVAS H531',
-    'CONJUNTIVITIS  NO ESPECIFICADA H109',
-    'DISMINUCION DE LA AGUDEZA VISUAL SIN ESPECIFICACION H547',
-    'DISMINUCION INDETERMINADA DE LA AGUDEZA VISUAL EN AMBOS OJOS (AMETROPÍA) H543',
-    'MIOPIA H521',
-    'PRESBICIA H524',
-    'VISION SUBNORMAL DE AMBOS OJOS H542',
-    'DEFECTOS DEL CAMPO VISUAL H534'
-]
-
-SVE_AUDITORY_CONDITIONS = [
-    'EFECTOS DEL RUIDO SOBRE EL OIDO INTERNO H833',
-    'PRESBIACUSIA H911',
-    'HIPOACUSIA  NO ESPECIFICADA H919',
-    'OTITIS MEDIA  NO ESPECIFICADA H669',
-    'OTRAS ENFERMEDADES DE LAS CUERDAS VOCALES J383',
-    'OTROS TRASTORNOS DE LA VISION BINOCULAR H533'
-]
-
-SVE_WEIGHT_CONDITIONS = [
-    'AUMENTO ANORMAL DE PESO',
-    'OBESIDAD ALIMENTARIA, E66.0',
-    'OBESIDAD CONSTITUCIONAL, E66.8',
-    'HIPOTIROIDISMO  NO ESPECIFICADO E039'
-]
-
-
 @app.route('/api/informe-condiciones-salud', methods=['GET', 'OPTIONS'])
 def informe_condiciones_salud():
     """
@@ -9762,18 +9322,7 @@ def informe_condiciones_salud():
         logger.info(f"✅ Total formularios encontrados: {total_formularios}")
 
         # Paso 4: Generar estadísticas
-        estadisticas = {
-            'genero': contar_genero(formulario_items),
-            'edad': contar_edad(formulario_items),
-            'estadoCivil': contar_estado_civil(formulario_items),
-            'nivelEducativo': contar_nivel_educativo(formulario_items),
-            'hijos': contar_hijos(formulario_items),
-            'ciudadResidencia': contar_ciudad_residencia(formulario_items),
-            'profesionUOficio': contar_profesion(formulario_items),
-            'encuestaSalud': contar_encuesta_salud(formulario_items),
-            'diagnosticos': contar_diagnosticos(historia_clinica_items),
-            'sve': generar_sve(historia_clinica_items)
-        }
+        estadisticas = calcular_estadisticas(formulario_items, historia_clinica_items)
 
         # Agregar información teórica del informe
         informacion_teorica = {
@@ -9876,8 +9425,27 @@ def informe_condiciones_salud():
             ]
         }
 
+        # Snapshot de lo calculado: las recomendaciones IA y el PDF lo reciben
+        # por id y no vuelven a consultar la base
+        snapshot_id = None
+        try:
+            # El riesgo psicosocial ADC solo lo usa el PDF: va en el snapshot
+            # para que el PDF no lo vuelva a consultar
+            riesgo_adc = None
+            try:
+                riesgo_adc = calcular_riesgo_psicosocial(cod_empresa, fecha_inicio, fecha_fin)
+            except Exception as e:
+                logger.error(f"❌ Error calculando riesgo psicosocial ADC para el snapshot: {e}")
+            snapshot_id = guardar_snapshot(
+                cod_empresa, fecha_inicio, fecha_fin, empresa_info,
+                total_atenciones, total_formularios, estadisticas, riesgo_adc
+            )
+        except Exception as e:
+            logger.error(f"❌ No se pudo guardar el snapshot del informe: {e}")
+
         response_data = {
             'success': True,
+            'snapshotId': snapshot_id,
             'totalAtenciones': total_atenciones,
             'totalFormularios': total_formularios,
             'empresaInfo': empresa_info,
@@ -10074,661 +9642,165 @@ def obtener_historia_clinica_wix(cod_empresa, fecha_inicio, fecha_fin):
             'codEmpresa': cod_empresa,
             'fechaInicio': fecha_inicio,
             'fechaFin': fecha_fin
-        }
-
-        response = requests_session.get(url, params=params, timeout=60)
-
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('success'):
-                return data.get('items', [])
-
-        # Si el endpoint no existe, usar consulta alternativa
-        logger.warning(f"⚠️ Endpoint historiaClinicaPorEmpresa no disponible, usando alternativa")
-        return consultar_historia_clinica_directo(cod_empresa, fecha_inicio, fecha_fin)
-
-    except Exception as e:
-        logger.error(f"Error obteniendo HistoriaClinica: {e}")
-        return []
-
-
-def consultar_historia_clinica_directo(cod_empresa, fecha_inicio, fecha_fin):
-    """
-    Consulta directa a Wix para obtener HistoriaClinica.
-    """
-    try:
-        url = f"https://www.bsl.com.co/_functions/pacientesPorEmpresa"
-        params = {
-            'codEmpresa': cod_empresa,
-            'fechaInicio': fecha_inicio,
-            'fechaFin': fecha_fin,
-            'limit': 1000
-        }
-
-        response = requests_session.get(url, params=params, timeout=60)
-
-        if response.status_code == 200:
-            data = response.json()
-            return data.get('items', data.get('data', []))
-
-        logger.warning(f"⚠️ No se pudo obtener datos de HistoriaClinica: {response.status_code}")
-        return []
-
-    except Exception as e:
-        logger.error(f"Error en consulta directa: {e}")
-        return []
-
-
-def obtener_empresa_wix(cod_empresa):
-    """Obtiene información de la empresa desde Wix"""
-    try:
-        return {
-            'codEmpresa': cod_empresa,
-            'empresa': cod_empresa,
-            'nit': None
-        }
-    except Exception as e:
-        logger.error(f"Error obteniendo empresa: {e}")
-        return None
-
-
-def obtener_formularios_por_ids_wix(historia_ids):
-    """Obtiene formularios por IDs de HistoriaClinica desde Wix"""
-    try:
-        if not historia_ids:
-            return []
-
-        all_formularios = []
-        batch_size = 50
-
-        for i in range(0, len(historia_ids), batch_size):
-            batch_ids = historia_ids[i:i + batch_size]
-
-            url = f"https://www.bsl.com.co/_functions/formulariosPorIds"
-            response = requests_session.post(url, json={'ids': batch_ids}, timeout=60)
-
-            if response.status_code == 200:
-                data = response.json()
-                items = data.get('items', data.get('data', []))
-                all_formularios.extend(items)
-
-        return all_formularios
-
-    except Exception as e:
-        logger.error(f"Error obteniendo formularios: {e}")
-        return []
-
-
-# Funciones de conteo de estadísticas
-def contar_genero(items):
-    total = len(items)
-    masculino = sum(1 for item in items if str(item.get('genero', '')).upper().strip() == 'MASCULINO')
-    femenino = sum(1 for item in items if str(item.get('genero', '')).upper().strip() == 'FEMENINO')
-
-    return {
-        'total': total,
-        'masculino': {
-            'cantidad': masculino,
-            'porcentaje': (masculino / total * 100) if total > 0 else 0
-        },
-        'femenino': {
-            'cantidad': femenino,
-            'porcentaje': (femenino / total * 100) if total > 0 else 0
-        }
-    }
-
-
-def contar_edad(items):
-    total = len(items)
-    rangos = {'15-20': 0, '21-30': 0, '31-40': 0, '41-50': 0, 'mayor50': 0}
-
-    for item in items:
-        try:
-            edad = int(item.get('edad', 0))
-            if 15 <= edad <= 20:
-                rangos['15-20'] += 1
-            elif 21 <= edad <= 30:
-                rangos['21-30'] += 1
-            elif 31 <= edad <= 40:
-                rangos['31-40'] += 1
-            elif 41 <= edad <= 50:
-                rangos['41-50'] += 1
-            elif edad > 50:
-                rangos['mayor50'] += 1
-        except (ValueError, TypeError):
-            pass
-
-    return {
-        'total': total,
-        'rangos': {
-            key: {
-                'cantidad': value,
-                'porcentaje': (value / total * 100) if total > 0 else 0
-            } for key, value in rangos.items()
-        }
-    }
-
-
-def contar_estado_civil(items):
-    total = len(items)
-    estados = {'soltero': 0, 'casado': 0, 'divorciado': 0, 'viudo': 0, 'unionLibre': 0}
-
-    for item in items:
-        # PostgreSQL usa estado_civil, Wix usa estadoCivil
-        estado = str(item.get('estado_civil', item.get('estadoCivil', ''))).upper().strip()
-        if estado == 'SOLTERO':
-            estados['soltero'] += 1
-        elif estado == 'CASADO':
-            estados['casado'] += 1
-        elif estado == 'DIVORCIADO':
-            estados['divorciado'] += 1
-        elif estado == 'VIUDO':
-            estados['viudo'] += 1
-        elif estado in ['UNIÓN LIBRE', 'UNION LIBRE']:
-            estados['unionLibre'] += 1
-
-    return {
-        'total': total,
-        'estados': {
-            key: {
-                'cantidad': value,
-                'porcentaje': (value / total * 100) if total > 0 else 0
-            } for key, value in estados.items()
-        }
-    }
-
-
-def contar_nivel_educativo(items):
-    total = len(items)
-    niveles = {'primaria': 0, 'secundaria': 0, 'universitario': 0, 'postgrado': 0}
-
-    for item in items:
-        # PostgreSQL usa nivel_educativo, Wix usa nivelEducativo
-        nivel = str(item.get('nivel_educativo', item.get('nivelEducativo', ''))).upper().strip()
-        if nivel == 'PRIMARIA':
-            niveles['primaria'] += 1
-        elif nivel == 'SECUNDARIA':
-            niveles['secundaria'] += 1
-        elif nivel == 'UNIVERSITARIO':
-            niveles['universitario'] += 1
-        elif nivel == 'POSTGRADO':
-            niveles['postgrado'] += 1
-
-    return {
-        'total': total,
-        'niveles': {
-            key: {
-                'cantidad': value,
-                'porcentaje': (value / total * 100) if total > 0 else 0
-            } for key, value in niveles.items()
-        }
-    }
-
-
-def contar_hijos(items):
-    total = len(items)
-    grupos = {'sinHijos': 0, 'unHijo': 0, 'dosHijos': 0, 'tresOMas': 0}
-
-    for item in items:
-        try:
-            hijos = int(item.get('hijos', 0))
-            if hijos == 0:
-                grupos['sinHijos'] += 1
-            elif hijos == 1:
-                grupos['unHijo'] += 1
-            elif hijos == 2:
-                grupos['dosHijos'] += 1
-            elif hijos >= 3:
-                grupos['tresOMas'] += 1
-        except (ValueError, TypeError):
-            pass
-
-    return {
-        'total': total,
-        'grupos': {
-            key: {
-                'cantidad': value,
-                'porcentaje': (value / total * 100) if total > 0 else 0
-            } for key, value in grupos.items()
-        }
-    }
-
-
-def contar_ciudad_residencia(items):
-    total = len(items)
-    ciudades_map = {}
-
-    for item in items:
-        # PostgreSQL usa ciudad_residencia, Wix usa ciudadDeResidencia
-        ciudad = str(item.get('ciudad_residencia', item.get('ciudadDeResidencia', ''))).upper().strip()
-        if ciudad:
-            ciudades_map[ciudad] = ciudades_map.get(ciudad, 0) + 1
-
-    ciudades = sorted([
-        {
-            'nombre': ciudad,
-            'cantidad': cantidad,
-            'porcentaje': (cantidad / total * 100) if total > 0 else 0
-        }
-        for ciudad, cantidad in ciudades_map.items()
-    ], key=lambda x: x['cantidad'], reverse=True)
-
-    return {'total': total, 'ciudades': ciudades}
-
-
-def contar_profesion(items):
-    total = len(items)
-    profesiones_map = {}
-
-    for item in items:
-        # PostgreSQL usa profesion_oficio, Wix usa profesionUOficio
-        profesion = str(item.get('profesion_oficio', item.get('profesionUOficio', ''))).upper().strip()
-        if profesion:
-            profesiones_map[profesion] = profesiones_map.get(profesion, 0) + 1
-
-    profesiones = sorted([
-        {
-            'nombre': profesion,
-            'cantidad': cantidad,
-            'porcentaje': (cantidad / total * 100) if total > 0 else 0
-        }
-        for profesion, cantidad in profesiones_map.items()
-    ], key=lambda x: x['cantidad'], reverse=True)
-
-    return {'total': total, 'profesiones': profesiones}
-
-
-def contar_encuesta_salud(items):
-    total = len(items)
-    respuestas_map = {}
-
-    # Campos de salud en PostgreSQL (snake_case) vs Wix (camelCase o array)
-    campos_salud_postgres = [
-        ('dolor_cabeza', 'Dolor de Cabeza'),
-        ('dolor_espalda', 'Dolor de Espalda'),
-        ('ruido_jaqueca', 'Ruido/Jaqueca'),
-        ('problemas_sueno', 'Problemas de Sueño'),
-        ('presion_alta', 'Presión Alta'),
-        ('problemas_azucar', 'Problemas de Azúcar'),
-        ('problemas_cardiacos', 'Problemas Cardíacos'),
-        ('enfermedad_pulmonar', 'Enfermedad Pulmonar'),
-        ('enfermedad_higado', 'Enfermedad del Hígado'),
-        ('hernias', 'Hernias'),
-        ('hormigueos', 'Hormigueos'),
-        ('varices', 'Varices'),
-        ('hepatitis', 'Hepatitis'),
-        ('cirugia_ocular', 'Cirugía Ocular'),
-        ('cirugia_programada', 'Cirugía Programada'),
-        ('condicion_medica', 'Condición Médica'),
-        ('embarazo', 'Embarazo'),
-        ('fuma', 'Fuma'),
-        ('consumo_licor', 'Consumo de Licor'),
-        ('ejercicio', 'Ejercicio'),
-        ('usa_anteojos', 'Usa Anteojos'),
-        ('usa_lentes_contacto', 'Usa Lentes de Contacto')
-    ]
-
-    for item in items:
-        # Intentar primero el formato Wix (array encuestaSalud)
-        encuesta = item.get('encuestaSalud', [])
-        if isinstance(encuesta, list) and len(encuesta) > 0:
-            for respuesta in encuesta:
-                resp = str(respuesta).upper().strip()
-                if resp:
-                    respuestas_map[resp] = respuestas_map.get(resp, 0) + 1
-        else:
-            # Formato PostgreSQL (campos individuales)
-            for campo_db, nombre_display in campos_salud_postgres:
-                valor = str(item.get(campo_db, '')).upper().strip()
-                # Solo contar respuestas afirmativas (SÍ, SI, S, TRUE, 1, etc.)
-                if valor in ['SÍ', 'SI', 'S', 'TRUE', '1', 'YES', 'Y']:
-                    respuestas_map[nombre_display.upper()] = respuestas_map.get(nombre_display.upper(), 0) + 1
-
-    respuestas = sorted([
-        {
-            'nombre': respuesta,
-            'cantidad': cantidad,
-            'porcentaje': (cantidad / total * 100) if total > 0 else 0
-        }
-        for respuesta, cantidad in respuestas_map.items()
-    ], key=lambda x: x['cantidad'], reverse=True)
-
-    return {'total': total, 'respuestas': respuestas}
-
-
-def contar_diagnosticos(items):
-    total = len(items)
-    diagnosticos_map = {}
-
-    for item in items:
-        md_dx1 = str(item.get('mdDx1', '')).strip()
-        if md_dx1:
-            for dx in md_dx1.replace(';', ',').split(','):
-                dx_clean = dx.strip().upper()
-                if dx_clean:
-                    diagnosticos_map[dx_clean] = diagnosticos_map.get(dx_clean, 0) + 1
-
-    diagnosticos = sorted([
-        {
-            'nombre': dx,
-            'cantidad': cantidad,
-            'porcentaje': (cantidad / total * 100) if total > 0 else 0
-        }
-        for dx, cantidad in diagnosticos_map.items()
-    ], key=lambda x: x['cantidad'], reverse=True)
-
-    return {'total': total, 'diagnosticos': diagnosticos}
-
-
-def generar_sve(items):
-    """Genera datos del Sistema de Vigilancia Epidemiológica"""
-    pacientes = []
-    resumen = {'visual': 0, 'auditivo': 0, 'controlPeso': 0}
-
-    for item in items:
-        nombres = f"{item.get('primerNombre', '')} {item.get('primerApellido', '')}".strip()
-        documento = item.get('numeroId', '')
-
-        all_dx = []
-        for dx_field in ['mdDx1', 'mdDx2']:
-            dx_value = str(item.get(dx_field, '')).strip()
-            if dx_value:
-                all_dx.extend([d.strip().upper() for d in dx_value.replace(';', ',').split(',')])
-
-        for dx in all_dx:
-            sistema = None
-            if dx in SVE_VISUAL_CONDITIONS:
-                sistema = 'Visual'
-                resumen['visual'] += 1
-            elif dx in SVE_AUDITORY_CONDITIONS:
-                sistema = 'Auditivo'
-                resumen['auditivo'] += 1
-            elif dx in SVE_WEIGHT_CONDITIONS:
-                sistema = 'Control de Peso'
-                resumen['controlPeso'] += 1
-
-            if sistema:
-                pacientes.append({
-                    'nombres': nombres,
-                    'documento': documento,
-                    'sistema': sistema,
-                    'diagnostico': dx
-                })
-
-    return {
-        'pacientes': pacientes,
-        'resumen': resumen,
-        'totalPacientesAfectados': len(pacientes)
-    }
-
-
-@app.route('/informes.html', methods=['GET'])
-def serve_informes():
-    """Sirve la página de informes"""
-    return send_from_directory('static', 'informes.html')
-
-
-def generar_grafico_pie(datos, titulo, colores=None):
-    """
-    Genera un gráfico de torta (pie chart) y retorna la imagen en base64.
-
-    Args:
-        datos: dict con formato {'label': valor}
-        titulo: str con el título del gráfico
-        colores: list de colores hexadecimales (opcional)
-
-    Returns:
-        str: imagen en formato base64
-    """
-    import matplotlib
-    matplotlib.use('Agg')  # Backend sin GUI
-    import matplotlib.pyplot as plt
-    from io import BytesIO
-
-    # Filtrar valores vacíos o cero
-    datos_filtrados = {k: v for k, v in datos.items() if v > 0}
-
-    if not datos_filtrados:
-        return None
-
-    # Configurar figura con fondo blanco
-    fig, ax = plt.subplots(figsize=(8, 6), facecolor='white')
-
-    labels = list(datos_filtrados.keys())
-    sizes = list(datos_filtrados.values())
-
-    # Paleta de colores profesional para salud ocupacional (tonos azules, verdes, naranjas suaves)
-    if not colores:
-        colores = ['#0ea5e9', '#10b981', '#f59e0b', '#8b5cf6', '#ef4444', '#14b8a6', '#ec4899', '#6366f1']
-
-    # Crear el gráfico con efecto de explosión sutil en el segmento más grande
-    explode = [0.05 if size == max(sizes) else 0 for size in sizes]
+        }
 
-    wedges, texts, autotexts = ax.pie(
-        sizes,
-        labels=labels,
-        autopct='%1.1f%%',
-        colors=colores[:len(sizes)],
-        startangle=90,
-        explode=explode,
-        textprops={'fontsize': 11, 'weight': '600', 'family': 'sans-serif'},
-        wedgeprops={'edgecolor': 'white', 'linewidth': 2, 'antialiased': True}
-    )
+        response = requests_session.get(url, params=params, timeout=60)
 
-    # Hacer el texto de porcentaje blanco y más legible
-    for autotext in autotexts:
-        autotext.set_color('white')
-        autotext.set_fontsize(10)
-        autotext.set_weight('bold')
+        if response.status_code == 200:
+            data = response.json()
+            if data.get('success'):
+                return data.get('items', [])
 
-    # Mejorar etiquetas de categorías
-    for text in texts:
-        text.set_fontsize(11)
-        text.set_weight('600')
-        text.set_color('#1f2937')
+        # Si el endpoint no existe, usar consulta alternativa
+        logger.warning(f"⚠️ Endpoint historiaClinicaPorEmpresa no disponible, usando alternativa")
+        return consultar_historia_clinica_directo(cod_empresa, fecha_inicio, fecha_fin)
 
-    # Título moderno con mejor tipografía
-    ax.set_title(titulo, fontsize=15, weight='bold', pad=25, color='#1f2937', family='sans-serif')
+    except Exception as e:
+        logger.error(f"Error obteniendo HistoriaClinica: {e}")
+        return []
 
-    # Convertir a base64
-    buffer = BytesIO()
-    plt.tight_layout(pad=1.5)
-    plt.savefig(buffer, format='png', dpi=200, bbox_inches='tight', facecolor='white', edgecolor='none')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-    plt.close(fig)
 
-    return image_base64
+def consultar_historia_clinica_directo(cod_empresa, fecha_inicio, fecha_fin):
+    """
+    Consulta directa a Wix para obtener HistoriaClinica.
+    """
+    try:
+        url = f"https://www.bsl.com.co/_functions/pacientesPorEmpresa"
+        params = {
+            'codEmpresa': cod_empresa,
+            'fechaInicio': fecha_inicio,
+            'fechaFin': fecha_fin,
+            'limit': 1000
+        }
 
+        response = requests_session.get(url, params=params, timeout=60)
 
-def generar_grafico_barras(datos, titulo, xlabel='', ylabel='Cantidad', colores=None):
-    """
-    Genera un gráfico de barras y retorna la imagen en base64.
+        if response.status_code == 200:
+            data = response.json()
+            return data.get('items', data.get('data', []))
 
-    Args:
-        datos: dict con formato {'label': valor}
-        titulo: str con el título del gráfico
-        xlabel: str con etiqueta del eje X
-        ylabel: str con etiqueta del eje Y
-        colores: list de colores hexadecimales (opcional)
+        logger.warning(f"⚠️ No se pudo obtener datos de HistoriaClinica: {response.status_code}")
+        return []
 
-    Returns:
-        str: imagen en formato base64
-    """
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    from io import BytesIO
-    import numpy as np
+    except Exception as e:
+        logger.error(f"Error en consulta directa: {e}")
+        return []
 
-    # Filtrar valores vacíos o cero
-    datos_filtrados = {k: v for k, v in datos.items() if v > 0}
 
-    if not datos_filtrados:
+def obtener_empresa_wix(cod_empresa):
+    """Obtiene información de la empresa desde Wix"""
+    try:
+        return {
+            'codEmpresa': cod_empresa,
+            'empresa': cod_empresa,
+            'nit': None
+        }
+    except Exception as e:
+        logger.error(f"Error obteniendo empresa: {e}")
         return None
 
-    # Configurar figura con fondo blanco
-    fig, ax = plt.subplots(figsize=(10, 6), facecolor='white')
-
-    labels = list(datos_filtrados.keys())
-    values = list(datos_filtrados.values())
-
-    # Gradiente de colores moderno (azul a verde)
-    if not colores:
-        colores = ['#0ea5e9', '#06b6d4', '#14b8a6', '#10b981', '#22c55e', '#84cc16', '#eab308', '#f59e0b']
-
-    # Crear el gráfico con bordes redondeados y sombra
-    x_pos = np.arange(len(labels))
-    bars = ax.bar(x_pos, values, color=colores[:len(values)],
-                   edgecolor='white', linewidth=2.5, alpha=0.9,
-                   width=0.7)
-
-    # Agregar valores encima de las barras con mejor formato
-    for i, (bar, value) in enumerate(zip(bars, values)):
-        height = bar.get_height()
-        ax.text(
-            bar.get_x() + bar.get_width() / 2.,
-            height + (max(values) * 0.01),
-            f'{int(height)}',
-            ha='center',
-            va='bottom',
-            fontsize=11,
-            weight='bold',
-            color='#374151'
-        )
 
-    # Títulos y etiquetas con mejor tipografía
-    ax.set_title(titulo, fontsize=15, weight='bold', pad=25, color='#1f2937', family='sans-serif')
-    if xlabel:
-        ax.set_xlabel(xlabel, fontsize=12, weight='600', color='#374151', labelpad=10)
-    ax.set_ylabel(ylabel, fontsize=12, weight='600', color='#374151', labelpad=10)
+def obtener_formularios_por_ids_wix(historia_ids):
+    """Obtiene formularios por IDs de HistoriaClinica desde Wix"""
+    try:
+        if not historia_ids:
+            return []
+
+        all_formularios = []
+        batch_size = 50
 
-    # Grid más sutil y profesional
-    ax.grid(axis='y', alpha=0.2, linestyle='-', linewidth=0.8, color='#cbd5e1')
-    ax.set_axisbelow(True)
+        for i in range(0, len(historia_ids), batch_size):
+            batch_ids = historia_ids[i:i + batch_size]
 
-    # Mejorar ejes
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_color('#cbd5e1')
-    ax.spines['bottom'].set_color('#cbd5e1')
+            url = f"https://www.bsl.com.co/_functions/formulariosPorIds"
+            response = requests_session.post(url, json={'ids': batch_ids}, timeout=60)
 
-    # Etiquetas del eje X
-    ax.set_xticks(x_pos)
-    ax.set_xticklabels(labels, rotation=45, ha='right', fontsize=10, color='#4b5563')
-    ax.tick_params(axis='y', labelsize=10, colors='#4b5563')
+            if response.status_code == 200:
+                data = response.json()
+                items = data.get('items', data.get('data', []))
+                all_formularios.extend(items)
 
-    # Convertir a base64
-    buffer = BytesIO()
-    plt.tight_layout(pad=1.5)
-    plt.savefig(buffer, format='png', dpi=200, bbox_inches='tight', facecolor='white', edgecolor='none')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-    plt.close(fig)
+        return all_formularios
 
-    return image_base64
+    except Exception as e:
+        logger.error(f"Error obteniendo formularios: {e}")
+        return []
 
 
-def generar_grafico_barras_horizontales(datos, titulo, xlabel='Cantidad', ylabel='', colores=None, max_items=15):
-    """
-    Genera un gráfico de barras horizontales y retorna la imagen en base64.
-    Útil para datos con muchas categorías o etiquetas largas.
+@app.route("/api/metricas/llm-cache", methods=["GET"])
+def metricas_llm_cache():
+    """Aciertos y tokens ahorrados de la caché de respuestas OpenAI (este proceso)"""
+    return jsonify(obtener_metricas_llm())
 
-    Args:
-        datos: dict con formato {'label': valor}
-        titulo: str con el título del gráfico
-        xlabel: str con etiqueta del eje X
-        ylabel: str con etiqueta del eje Y
-        colores: list de colores hexadecimales (opcional)
-        max_items: int número máximo de items a mostrar
 
-    Returns:
-        str: imagen en formato base64
-    """
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-    from io import BytesIO
-    import numpy as np
+@app.route("/api/metricas/adc-interpretaciones", methods=["GET"])
+def metricas_adc_interpretaciones():
+    """Interpretaciones ADC servidas desde lo guardado vs. pendientes, y filas por estado"""
+    return jsonify(obtener_metricas_adc())
 
-    # Filtrar valores vacíos o cero
-    datos_filtrados = {k: v for k, v in datos.items() if v > 0}
 
-    if not datos_filtrados:
-        return None
+@app.route("/api/adc-interpretaciones/<orden_id>/reintentar", methods=["POST"])
+def reintentar_interpretacion_adc(orden_id):
+    """Vuelve a encolar la interpretación ADC de una orden en error (intentos en cero)"""
+    try:
+        reencolada = reencolar_interpretacion(orden_id)
+    except Exception as e:
+        logger.error(f"❌ Error reencolando interpretación ADC de {orden_id}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if not reencolada:
+        return jsonify({'success': False, 'error': 'La orden no tiene interpretación ADC en error'}), 404
+    return jsonify({'success': True, 'orden_id': orden_id})
 
-    # Ordenar por valor descendente y tomar top N
-    datos_ordenados = dict(sorted(datos_filtrados.items(), key=lambda x: x[1], reverse=True)[:max_items])
 
-    labels = list(datos_ordenados.keys())
-    values = list(datos_ordenados.values())
+@app.route("/api/metricas/certificado-snapshot", methods=["GET"])
+def metricas_certificado_snapshot():
+    """Previews servidos desde snapshot vs. ensamblados, y snapshots al día/pendientes"""
+    return jsonify(obtener_metricas_snapshot())
 
-    # Ajustar altura de figura según número de items
-    altura = max(6, len(labels) * 0.5)
-    fig, ax = plt.subplots(figsize=(10, altura), facecolor='white')
 
-    # Crear gradiente de colores del más oscuro al más claro
-    if not colores:
-        # Gradiente azul-turquesa para barras horizontales
-        base_colors = ['#0369a1', '#0284c7', '#0ea5e9', '#38bdf8', '#7dd3fc']
-        n_bars = len(values)
-        if n_bars <= len(base_colors):
-            colores = base_colors[:n_bars]
-        else:
-            # Interpolar colores si hay muchas barras
-            colores = [base_colors[int(i * (len(base_colors) - 1) / (n_bars - 1))] for i in range(n_bars)]
-
-    # Crear el gráfico (invertir para que el mayor esté arriba)
-    y_pos = np.arange(len(labels))
-    bars = ax.barh(y_pos, values, color=colores[:len(values)],
-                    edgecolor='white', linewidth=2.5, alpha=0.9,
-                    height=0.7)
-
-    # Agregar valores al final de las barras con mejor formato
-    for i, (bar, value) in enumerate(zip(bars, values)):
-        width = bar.get_width()
-        ax.text(
-            width + (max(values) * 0.01),
-            bar.get_y() + bar.get_height() / 2.,
-            f' {int(value)}',
-            ha='left',
-            va='center',
-            fontsize=10,
-            weight='bold',
-            color='#374151'
-        )
+@app.route("/api/certificado-snapshot/verificar", methods=["GET"])
+def verificar_certificado_snapshot():
+    """
+    Compara una muestra de snapshots con el ensamblado en vivo.
+    Query: muestra (default 20, máximo 200)
+    """
+    try:
+        muestra = min(max(int(request.args.get('muestra', 20)), 1), 200)
+        return jsonify(verificar_consistencia(ensamblar_datos_certificado, muestra))
+    except Exception as e:
+        print(f"❌ Error verificando snapshots de certificado: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
 
-    # Configurar ejes y etiquetas
-    ax.set_yticks(y_pos)
-    ax.set_yticklabels(labels, fontsize=10, color='#4b5563')
-    ax.invert_yaxis()  # Mayor valor arriba
 
-    # Títulos con mejor tipografía
-    ax.set_title(titulo, fontsize=15, weight='bold', pad=25, color='#1f2937', family='sans-serif')
-    ax.set_xlabel(xlabel, fontsize=12, weight='600', color='#374151', labelpad=10)
-    if ylabel:
-        ax.set_ylabel(ylabel, fontsize=12, weight='600', color='#374151', labelpad=10)
+@app.route("/api/llm-cache/invalidar", methods=["POST"])
+def invalidar_llm_cache():
+    """
+    Borra respuestas cacheadas de OpenAI.
+    Body: { clave?: string, modelo?: string, todo?: bool } (todo=true para vaciarla entera)
+    """
+    data = request.get_json(silent=True) or {}
+    clave = data.get('clave')
+    modelo = data.get('modelo')
+    if not clave and not modelo and data.get('todo') is not True:
+        return jsonify({'success': False, 'error': 'Indique clave, modelo o todo=true'}), 400
+    try:
+        borradas = invalidar_cache_llm(clave=clave, modelo=modelo)
+    except Exception as e:
+        logger.error(f"❌ Error invalidando caché LLM: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'borradas': borradas})
 
-    # Grid más sutil
-    ax.grid(axis='x', alpha=0.2, linestyle='-', linewidth=0.8, color='#cbd5e1')
-    ax.set_axisbelow(True)
 
-    # Mejorar ejes
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_color('#cbd5e1')
-    ax.spines['bottom'].set_color('#cbd5e1')
-    ax.tick_params(axis='x', labelsize=10, colors='#4b5563')
+@app.route("/api/metricas/graficos-informe", methods=["GET"])
+def metricas_graficos_informe():
+    """Aciertos de la caché de gráficos del informe PDF (este proceso)"""
+    return jsonify(obtener_metricas_graficos())
 
-    # Convertir a base64
-    buffer = BytesIO()
-    plt.tight_layout(pad=1.5)
-    plt.savefig(buffer, format='png', dpi=200, bbox_inches='tight', facecolor='white', edgecolor='none')
-    buffer.seek(0)
-    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-    plt.close(fig)
 
-    return image_base64
+@app.route('/informes.html', methods=['GET'])
+def serve_informes():
+    """Sirve la página de informes"""
+    return send_from_directory('static', 'informes.html')
 
 
 def generar_conclusiones_informe(estadisticas, total_atenciones, cod_empresa):
@@ -10838,6 +9910,39 @@ def generar_conclusiones_informe(estadisticas, total_atenciones, cod_empresa):
     return conclusiones
 
 
+@app.route('/api/informe-riesgo-psicosocial', methods=['GET', 'OPTIONS'])
+def informe_riesgo_psicosocial():
+    """
+    Distribución de niveles ADC (ansiedad, depresión, congruencia) de los
+    trabajadores de una empresa en un período, calificados por lotes.
+    Parámetros: codEmpresa, fechaInicio, fechaFin
+    """
+    if request.method == 'OPTIONS':
+        response = make_response()
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        return response
+
+    cod_empresa = request.args.get('codEmpresa')
+    fecha_inicio = request.args.get('fechaInicio')
+    fecha_fin = request.args.get('fechaFin')
+
+    if not cod_empresa or not fecha_inicio or not fecha_fin:
+        return jsonify({
+            'success': False,
+            'error': 'Parámetros requeridos: codEmpresa, fechaInicio, fechaFin'
+        }), 400
+
+    try:
+        resultado = calcular_riesgo_psicosocial(cod_empresa, fecha_inicio, fecha_fin)
+        return jsonify({'success': True, **resultado})
+    except Exception as e:
+        logger.error(f"❌ Error generando riesgo psicosocial ADC de {cod_empresa}: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/generar-pdf-informe', methods=['POST', 'OPTIONS'])
 def generar_pdf_informe():
     """
@@ -10847,6 +9952,9 @@ def generar_pdf_informe():
         - codEmpresa: Código de la empresa
         - fechaInicio: Fecha de inicio del período
         - fechaFin: Fecha fin del período
+        - snapshotId: (opcional) id devuelto por /api/informe-condiciones-salud;
+          si está vigente se usan esas estadísticas y su riesgo psicosocial
+          sin consultar la base
 
     Retorna:
         - PDF file para descarga directa
@@ -10861,6 +9969,17 @@ def generar_pdf_informe():
         fecha_fin = data.get('fechaFin')
         recomendaciones_ia = data.get('recomendacionesIA', {})  # Recomendaciones generadas por OpenAI (opcional)
 
+        # Snapshot del endpoint JSON: solo si corresponde a la misma empresa y rango
+        snapshot = obtener_snapshot(data.get('snapshotId'))
+        if snapshot and cod_empresa and (cod_empresa, fecha_inicio, fecha_fin) != (
+                snapshot['codEmpresa'], snapshot['fechaInicio'], snapshot['fechaFin']):
+            logger.warning(f"⚠️ Snapshot {snapshot['id']} no corresponde a {cod_empresa} ({fecha_inicio} - {fecha_fin}), se recalcula")
+            snapshot = None
+        if snapshot:
+            cod_empresa = snapshot['codEmpresa']
+            fecha_inicio = snapshot['fechaInicio']
+            fecha_fin = snapshot['fechaFin']
+
         if not cod_empresa or not fecha_inicio or not fecha_fin:
             return jsonify({
                 'success': False,
@@ -10874,76 +9993,85 @@ def generar_pdf_informe():
         else:
             logger.info(f"⚠️ No se recibieron recomendaciones de IA")
 
-        # 1. Obtener información de la empresa desde PostgreSQL
-        empresa_razon_social = cod_empresa  # Default fallback
-        empresa_nit = ''
+        if snapshot:
+            # 1-2. Empresa y estadísticas del snapshot: sin consultas a la base
+            logger.info(f"♻️ Usando snapshot de informe {snapshot['id']}")
+            empresa_razon_social = snapshot['empresaInfo'].get('empresa') or cod_empresa
+            empresa_nit = snapshot['empresaInfo'].get('nit') or ''
+            total_atenciones = snapshot['totalAtenciones']
+            total_formularios = snapshot['totalFormularios']
+            estadisticas = snapshot['estadisticas']
+        else:
+            # 1. Obtener información de la empresa desde PostgreSQL
+            empresa_razon_social = cod_empresa  # Default fallback
+            empresa_nit = ''
 
-        try:
-            import psycopg2
-            from psycopg2.extras import RealDictCursor
+            try:
+                import psycopg2
+                from psycopg2.extras import RealDictCursor
+
+                postgres_password = os.getenv("POSTGRES_PASSWORD")
+                if postgres_password:
+                    conn_empresa = psycopg2.connect(
+                        host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
+                        port=int(os.getenv("POSTGRES_PORT", "25060")),
+                        user=os.getenv("POSTGRES_USER", "doadmin"),
+                        password=postgres_password,
+                        database=os.getenv("POSTGRES_DB", "defaultdb"),
+                        sslmode='require'
+                    )
+                    cursor_pg = conn_empresa.cursor(cursor_factory=RealDictCursor)
+                    cursor_pg.execute(
+                        "SELECT empresa, nit FROM empresas WHERE cod_empresa = %s",
+                        (cod_empresa,)
+                    )
+                    empresa_row = cursor_pg.fetchone()
+                    cursor_pg.close()
+                    conn_empresa.close()
+
+                    if empresa_row:
+                        empresa_razon_social = empresa_row.get('empresa') or cod_empresa
+                        empresa_nit = empresa_row.get('nit') or ''
+                        logger.info(f"✅ Empresa encontrada: {empresa_razon_social} (NIT: {empresa_nit})")
+                    else:
+                        logger.warning(f"⚠️ No se encontró empresa con código {cod_empresa}, usando código como nombre")
+                else:
+                    logger.warning(f"⚠️ POSTGRES_PASSWORD no configurada, usando codEmpresa como nombre")
+            except Exception as e:
+                logger.error(f"❌ Error al obtener datos de empresa: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
 
-            postgres_password = os.getenv("POSTGRES_PASSWORD")
-            if postgres_password:
-                conn_empresa = psycopg2.connect(
-                    host=os.getenv("POSTGRES_HOST", "bslpostgres-do-user-19197755-0.k.db.ondigitalocean.com"),
-                    port=int(os.getenv("POSTGRES_PORT", "25060")),
-                    user=os.getenv("POSTGRES_USER", "doadmin"),
-                    password=postgres_password,
-                    database=os.getenv("POSTGRES_DB", "defaultdb"),
-                    sslmode='require'
-                )
-                cursor_pg = conn_empresa.cursor(cursor_factory=RealDictCursor)
-                cursor_pg.execute(
-                    "SELECT empresa, nit FROM empresas WHERE cod_empresa = %s",
-                    (cod_empresa,)
-                )
-                empresa_row = cursor_pg.fetchone()
-                cursor_pg.close()
-                conn_empresa.close()
+            # 2. Obtener los datos del informe (reutilizar la lógica existente)
+            historia_clinica_items = obtener_historia_clinica_postgres(cod_empresa, fecha_inicio, fecha_fin)
+            total_atenciones = len(historia_clinica_items)
 
-                if empresa_row:
-                    empresa_razon_social = empresa_row.get('empresa') or cod_empresa
-                    empresa_nit = empresa_row.get('nit') or ''
-                    logger.info(f"✅ Empresa encontrada: {empresa_razon_social} (NIT: {empresa_nit})")
-                else:
-                    logger.warning(f"⚠️ No se encontró empresa con código {cod_empresa}, usando código como nombre")
-            else:
-                logger.warning(f"⚠️ POSTGRES_PASSWORD no configurada, usando codEmpresa como nombre")
-        except Exception as e:
-            logger.error(f"❌ Error al obtener datos de empresa: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            # Obtener formularios por empresa y fecha
+            formulario_items = obtener_formularios_por_empresa_postgres(cod_empresa, fecha_inicio, fecha_fin)
+            total_formularios = len(formulario_items)
 
-        # 2. Obtener los datos del informe (reutilizar la lógica existente)
-        historia_clinica_items = obtener_historia_clinica_postgres(cod_empresa, fecha_inicio, fecha_fin)
-        total_atenciones = len(historia_clinica_items)
+            # Fallback: si no hay formularios con Strategy 1, intentar Strategy 2
+            if total_formularios == 0:
+                logger.info("⚠️ Strategy 1 (cod_empresa + fecha) retornó 0 formularios. Intentando Strategy 2 (wix_id)...")
+                historia_ids = [item.get('_id') for item in historia_clinica_items if item.get('_id')]
+                formulario_items = obtener_formularios_por_ids_postgres(historia_ids)
+                total_formularios = len(formulario_items)
 
-        # Obtener formularios por empresa y fecha
-        formulario_items = obtener_formularios_por_empresa_postgres(cod_empresa, fecha_inicio, fecha_fin)
-        total_formularios = len(formulario_items)
+            logger.info(f"✅ Encontrados {total_atenciones} atenciones y {total_formularios} formularios")
 
-        # Fallback: si no hay formularios con Strategy 1, intentar Strategy 2
-        if total_formularios == 0:
-            logger.info("⚠️ Strategy 1 (cod_empresa + fecha) retornó 0 formularios. Intentando Strategy 2 (wix_id)...")
-            historia_ids = [item.get('_id') for item in historia_clinica_items if item.get('_id')]
-            formulario_items = obtener_formularios_por_ids_postgres(historia_ids)
-            total_formularios = len(formulario_items)
+            # Calcular estadísticas
+            estadisticas = calcular_estadisticas(formulario_items, historia_clinica_items)
 
-        logger.info(f"✅ Encontrados {total_atenciones} atenciones y {total_formularios} formularios")
-
-        # Calcular estadísticas (usando las funciones existentes)
-        estadisticas = {
-            'genero': contar_genero(formulario_items),
-            'edad': contar_edad(formulario_items),
-            'estadoCivil': contar_estado_civil(formulario_items),
-            'nivelEducativo': contar_nivel_educativo(formulario_items),
-            'hijos': contar_hijos(formulario_items),
-            'ciudadResidencia': contar_ciudad_residencia(formulario_items),
-            'profesionUOficio': contar_profesion(formulario_items),
-            'encuestaSalud': contar_encuesta_salud(formulario_items),
-            'diagnosticos': contar_diagnosticos(historia_clinica_items),
-            'sve': generar_sve(historia_clinica_items)
-        }
+        # Riesgo psicosocial ADC de la empresa (opcional: sin pruebas ADC la sección no aparece).
+        # Con snapshot viene calculado con las estadísticas
+        riesgo_adc = None
+        if snapshot:
+            riesgo_adc = snapshot.get('riesgoPsicosocial')
+        else:
+            try:
+                riesgo_adc = calcular_riesgo_psicosocial(cod_empresa, fecha_inicio, fecha_fin)
+            except Exception as e:
+                logger.error(f"❌ Error calculando riesgo psicosocial ADC: {e}")
 
         # Información teórica (copiada del endpoint existente)
         info_teorica = {
@@ -11069,6 +10197,7 @@ def generar_pdf_informe():
         # 2.5 Generar gráficos con matplotlib
         logger.info("📊 Generando gráficos con matplotlib...")
         graficos = {}
+        trabajos_graficos = {}
 
         try:
             # Gráfico de género (pie chart)
@@ -11077,10 +10206,10 @@ def generar_pdf_informe():
                     'Masculino': estadisticas['genero'].get('masculino', {}).get('cantidad', 0),
                     'Femenino': estadisticas['genero'].get('femenino', {}).get('cantidad', 0)
                 }
-                graficos['genero'] = generar_grafico_pie(
+                trabajos_graficos['genero'] = ('pie', (
                     genero_data,
-                    'Distribución por Género'
-                )
+                    'Distribución por Género',
+                ), {})
 
             # Gráfico de edad (bar chart)
             if estadisticas.get('edad'):
@@ -11092,12 +10221,10 @@ def generar_pdf_informe():
                     '41-50': edad_rangos.get('41-50', {}).get('cantidad', 0),
                     'Mayor 50': edad_rangos.get('mayor50', {}).get('cantidad', 0)
                 }
-                graficos['edad'] = generar_grafico_barras(
+                trabajos_graficos['edad'] = ('barras', (
                     edad_data,
                     'Distribución por Edad',
-                    xlabel='Rango de Edad',
-                    ylabel='Cantidad de Trabajadores'
-                )
+                ), {'xlabel': 'Rango de Edad', 'ylabel': 'Cantidad de Trabajadores'})
 
             # Gráfico de estado civil (pie chart)
             if estadisticas.get('estadoCivil'):
@@ -11109,10 +10236,10 @@ def generar_pdf_informe():
                     'Divorciado': estados.get('divorciado', {}).get('cantidad', 0),
                     'Viudo': estados.get('viudo', {}).get('cantidad', 0)
                 }
-                graficos['estadoCivil'] = generar_grafico_pie(
+                trabajos_graficos['estadoCivil'] = ('pie', (
                     estado_civil_data,
-                    'Distribución por Estado Civil'
-                )
+                    'Distribución por Estado Civil',
+                ), {})
 
             # Gráfico de nivel educativo (bar chart)
             if estadisticas.get('nivelEducativo'):
@@ -11123,12 +10250,10 @@ def generar_pdf_informe():
                     'Universitario': niveles.get('universitario', {}).get('cantidad', 0),
                     'Postgrado': niveles.get('postgrado', {}).get('cantidad', 0)
                 }
-                graficos['nivelEducativo'] = generar_grafico_barras(
+                trabajos_graficos['nivelEducativo'] = ('barras', (
                     nivel_educativo_data,
                     'Distribución por Nivel Educativo',
-                    xlabel='Nivel Educativo',
-                    ylabel='Cantidad de Trabajadores'
-                )
+                ), {'xlabel': 'Nivel Educativo', 'ylabel': 'Cantidad de Trabajadores'})
 
             # Gráfico de hijos (bar chart)
             if estadisticas.get('hijos'):
@@ -11139,46 +10264,44 @@ def generar_pdf_informe():
                     '2 hijos': grupos.get('dosHijos', {}).get('cantidad', 0),
                     '3+ hijos': grupos.get('tresOMas', {}).get('cantidad', 0)
                 }
-                graficos['hijos'] = generar_grafico_barras(
+                trabajos_graficos['hijos'] = ('barras', (
                     hijos_data,
                     'Distribución por Número de Hijos',
-                    xlabel='Número de Hijos',
-                    ylabel='Cantidad de Trabajadores'
-                )
+                ), {'xlabel': 'Número de Hijos', 'ylabel': 'Cantidad de Trabajadores'})
 
             # Gráfico de ciudad de residencia (barras horizontales - puede haber muchas)
             if estadisticas.get('ciudadResidencia'):
                 ciudades_list = estadisticas['ciudadResidencia'].get('ciudades', [])
                 ciudad_data = {ciudad['nombre']: ciudad['cantidad'] for ciudad in ciudades_list if ciudad.get('cantidad', 0) > 0}
-                graficos['ciudadResidencia'] = generar_grafico_barras_horizontales(
+                trabajos_graficos['ciudadResidencia'] = ('barras_horizontales', (
                     ciudad_data,
                     'Top 15 Ciudades de Residencia',
-                    xlabel='Cantidad de Trabajadores',
-                    max_items=15
-                )
+                ), {'xlabel': 'Cantidad de Trabajadores', 'max_items': 15})
 
             # Gráfico de profesión (barras horizontales - puede haber muchas)
             if estadisticas.get('profesionUOficio'):
                 profesiones_list = estadisticas['profesionUOficio'].get('profesiones', [])
                 profesion_data = {prof['nombre']: prof['cantidad'] for prof in profesiones_list if prof.get('cantidad', 0) > 0}
-                graficos['profesionUOficio'] = generar_grafico_barras_horizontales(
+                trabajos_graficos['profesionUOficio'] = ('barras_horizontales', (
                     profesion_data,
                     'Top 15 Profesiones u Oficios',
-                    xlabel='Cantidad de Trabajadores',
-                    max_items=15
-                )
+                ), {'xlabel': 'Cantidad de Trabajadores', 'max_items': 15})
 
             # Gráfico de diagnósticos (barras horizontales - suelen ser muchos)
             if estadisticas.get('diagnosticos'):
                 diagnosticos_list = estadisticas['diagnosticos'].get('diagnosticos', [])
                 # Convertir lista a dict para el gráfico
                 diagnosticos_data = {diag['diagnostico']: diag['total'] for diag in diagnosticos_list if diag.get('total', 0) > 0}
-                graficos['diagnosticos'] = generar_grafico_barras_horizontales(
+                trabajos_graficos['diagnosticos'] = ('barras_horizontales', (
                     diagnosticos_data,
                     'Top 15 Diagnósticos Encontrados',
-                    xlabel='Número de Casos',
-                    max_items=15
-                )
+                ), {'xlabel': 'Número de Casos', 'max_items': 15})
+
+            # Distribuciones ADC por subdimensión (barras apiladas)
+            trabajos_graficos.update(trabajos_graficos_adc(riesgo_adc))
+
+            # Todos a la vez en el pool de procesos, en el mismo orden (SVG por defecto)
+            graficos = renderizar_graficos(trabajos_graficos, formato=GRAFICOS_FORMATO)
 
             logger.info(f"✅ Gráficos generados: {list(graficos.keys())}")
 
@@ -11251,6 +10374,7 @@ def generar_pdf_informe():
             info_teorica=info_teorica,
             stats=estadisticas,
             graficos=graficos,
+            graficos_mime=MIME_GRAFICOS.get(GRAFICOS_FORMATO, 'image/png'),
             conclusiones_finales=conclusiones_finales,
             medico_firmante=medico_firmante,
             firma_medico_base64=firma_reatiga_base64,
@@ -11258,7 +10382,8 @@ def generar_pdf_informe():
             firma_representante_base64=firma_representante_base64,
             fecha_custodia_mes=fecha_custodia_mes,
             fecha_custodia_dia=fecha_custodia_dia,
-            fecha_custodia_anio=fecha_custodia_anio
+            fecha_custodia_anio=fecha_custodia_anio,
+            riesgo_adc=riesgo_adc
         )
 
         # 5. Guardar HTML temporal
@@ -11355,30 +10480,21 @@ def call_openai(prompt, max_tokens=1500):
         return None
 
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Eres un médico laboral experto en salud ocupacional. Generas recomendaciones concisas y profesionales para informes de condiciones de salud empresariales. No uses markdown ni introducciones."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
+        # Mismo prompt (mismas estadísticas) = misma respuesta desde la caché
+        resultado = completar_chat(
+            openai_client,
+            "gpt-4o-mini",
+            "Eres un médico laboral experto en salud ocupacional. Generas recomendaciones concisas y profesionales para informes de condiciones de salud empresariales. No uses markdown ni introducciones.",
+            prompt,
             max_tokens=max_tokens,
             temperature=0.7
         )
 
         return {
             'success': True,
-            'content': response.choices[0].message.content,
-            'usage': {
-                'prompt_tokens': response.usage.prompt_tokens,
-                'completion_tokens': response.usage.completion_tokens,
-                'total_tokens': response.usage.total_tokens
-            }
+            'content': resultado['content'],
+            'usage': resultado['usage'],
+            'cache': resultado['cache']
         }
 
     except Exception as e:
@@ -11482,11 +10598,101 @@ def generar_prompt_diagnosticos(cod_empresa, diagnosticos):
     return prompt
 
 
+# Dónde está, dentro de `estadisticas` del snapshot, el objeto `datos` de cada
+# tipo de recomendación (el mismo que arma el frontend)
+RUTAS_DATOS_RECOMENDACION = {
+    'genero': ('genero',),
+    'edad': ('edad',),
+    'estadoCivil': ('estadoCivil', 'estados'),
+    'nivelEducativo': ('nivelEducativo', 'niveles'),
+    'hijos': ('hijos', 'grupos'),
+    'ciudad': ('ciudadResidencia',),
+    'profesion': ('profesionUOficio',),
+    'encuestaSalud': ('encuestaSalud',),
+    'diagnosticos': ('diagnosticos',),
+}
+
+
+# Recomendaciones que corren a la vez en /api/informe-recomendaciones-ia/lote
+INFORME_IA_PARALELISMO = int(os.getenv('INFORME_IA_PARALELISMO', '4'))
+
+
+def datos_recomendacion(estadisticas, tipo):
+    """Objeto `datos` de un tipo de recomendación dentro de `estadisticas` (None si no está)"""
+    datos = estadisticas
+    for clave in RUTAS_DATOS_RECOMENDACION[tipo]:
+        datos = (datos or {}).get(clave)
+    return datos
+
+
+def construir_prompt_recomendacion(tipo, cod_empresa, datos):
+    """
+    Prompt de recomendaciones IA para un tipo de estadística del informe.
+    datos es el mismo objeto que manda el frontend (ver RUTAS_DATOS_RECOMENDACION).
+    Retorna None si el tipo no es válido.
+    """
+    if tipo == 'genero':
+        return generar_prompt_genero(
+            cod_empresa,
+            datos.get('masculino', {}).get('porcentaje', 0),
+            datos.get('femenino', {}).get('porcentaje', 0)
+        )
+    elif tipo == 'edad':
+        rangos = datos.get('rangos', {})
+        return generar_prompt_edad(cod_empresa, {
+            '15-20': rangos.get('15-20', {}).get('porcentaje', 0),
+            '21-30': rangos.get('21-30', {}).get('porcentaje', 0),
+            '31-40': rangos.get('31-40', {}).get('porcentaje', 0),
+            '41-50': rangos.get('41-50', {}).get('porcentaje', 0),
+            'mayor50': rangos.get('mayor50', {}).get('porcentaje', 0)
+        })
+    elif tipo == 'estadoCivil':
+        return generar_prompt_estado_civil(cod_empresa, {
+            'soltero': datos.get('soltero', {}).get('porcentaje', 0),
+            'casado': datos.get('casado', {}).get('porcentaje', 0),
+            'divorciado': datos.get('divorciado', {}).get('porcentaje', 0),
+            'viudo': datos.get('viudo', {}).get('porcentaje', 0),
+            'unionLibre': datos.get('unionLibre', {}).get('porcentaje', 0)
+        })
+    elif tipo == 'nivelEducativo':
+        return generar_prompt_nivel_educativo(cod_empresa, {
+            'primaria': datos.get('primaria', {}).get('porcentaje', 0),
+            'secundaria': datos.get('secundaria', {}).get('porcentaje', 0),
+            'universitario': datos.get('universitario', {}).get('porcentaje', 0),
+            'postgrado': datos.get('postgrado', {}).get('porcentaje', 0)
+        })
+    elif tipo == 'hijos':
+        return generar_prompt_hijos(cod_empresa, {
+            'sinHijos': datos.get('sinHijos', {}).get('porcentaje', 0),
+            'unHijo': datos.get('unHijo', {}).get('porcentaje', 0),
+            'dosHijos': datos.get('dosHijos', {}).get('porcentaje', 0),
+            'tresOMas': datos.get('tresOMas', {}).get('porcentaje', 0)
+        })
+    elif tipo == 'ciudad':
+        # datos puede ser un array directamente o un objeto con propiedad 'ciudades'
+        ciudades = datos if isinstance(datos, list) else datos.get('ciudades', [])
+        return generar_prompt_ciudad(cod_empresa, ciudades)
+    elif tipo == 'profesion':
+        # datos puede ser un array directamente o un objeto con propiedad 'profesiones'
+        profesiones = datos if isinstance(datos, list) else datos.get('profesiones', [])
+        return generar_prompt_profesion(cod_empresa, profesiones)
+    elif tipo == 'encuestaSalud':
+        # datos puede ser un array/objeto directamente o un objeto con propiedad 'respuestas'
+        respuestas = datos if isinstance(datos, (list, dict)) and 'respuestas' not in datos else datos.get('respuestas', datos)
+        return generar_prompt_encuesta_salud(cod_empresa, respuestas)
+    elif tipo == 'diagnosticos':
+        # datos puede ser un array directamente o un objeto con propiedad 'diagnosticos'
+        diagnosticos = datos if isinstance(datos, list) else datos.get('diagnosticos', [])
+        return generar_prompt_diagnosticos(cod_empresa, diagnosticos)
+    return None
+
+
 @app.route('/api/informe-recomendaciones-ia', methods=['POST', 'OPTIONS'])
 def generar_recomendaciones_ia():
     """
     Genera recomendaciones de IA para un tipo específico de estadística.
-    Body: { tipo: string, codEmpresa: string, datos: object }
+    Body: { tipo: string, codEmpresa: string, datos: object, snapshotId?: string }
+    Con snapshotId vigente, codEmpresa y datos salen del snapshot del informe.
     Tipos válidos: genero, edad, estadoCivil, nivelEducativo, hijos, ciudad, profesion, encuestaSalud, diagnosticos
     """
     if request.method == 'OPTIONS':
@@ -11508,72 +10714,24 @@ def generar_recomendaciones_ia():
         cod_empresa = data.get('codEmpresa', 'N/A')
         datos = data.get('datos', {})
 
+        snapshot = obtener_snapshot(data.get('snapshotId'))
+        if snapshot and tipo in RUTAS_DATOS_RECOMENDACION:
+            cod_empresa = snapshot['codEmpresa']
+            datos_snapshot = datos_recomendacion(snapshot['estadisticas'], tipo)
+            if datos_snapshot is not None:
+                datos = datos_snapshot
+
         if not tipo:
             return jsonify({
                 'success': False,
                 'error': 'El parámetro "tipo" es requerido'
             }), 400
 
-        prompt = None
-
-        # Generar el prompt según el tipo de estadística
-        if tipo == 'genero':
-            prompt = generar_prompt_genero(
-                cod_empresa,
-                datos.get('masculino', {}).get('porcentaje', 0),
-                datos.get('femenino', {}).get('porcentaje', 0)
-            )
-        elif tipo == 'edad':
-            rangos = datos.get('rangos', {})
-            prompt = generar_prompt_edad(cod_empresa, {
-                '15-20': rangos.get('15-20', {}).get('porcentaje', 0),
-                '21-30': rangos.get('21-30', {}).get('porcentaje', 0),
-                '31-40': rangos.get('31-40', {}).get('porcentaje', 0),
-                '41-50': rangos.get('41-50', {}).get('porcentaje', 0),
-                'mayor50': rangos.get('mayor50', {}).get('porcentaje', 0)
-            })
-        elif tipo == 'estadoCivil':
-            prompt = generar_prompt_estado_civil(cod_empresa, {
-                'soltero': datos.get('soltero', {}).get('porcentaje', 0),
-                'casado': datos.get('casado', {}).get('porcentaje', 0),
-                'divorciado': datos.get('divorciado', {}).get('porcentaje', 0),
-                'viudo': datos.get('viudo', {}).get('porcentaje', 0),
-                'unionLibre': datos.get('unionLibre', {}).get('porcentaje', 0)
-            })
-        elif tipo == 'nivelEducativo':
-            prompt = generar_prompt_nivel_educativo(cod_empresa, {
-                'primaria': datos.get('primaria', {}).get('porcentaje', 0),
-                'secundaria': datos.get('secundaria', {}).get('porcentaje', 0),
-                'universitario': datos.get('universitario', {}).get('porcentaje', 0),
-                'postgrado': datos.get('postgrado', {}).get('porcentaje', 0)
-            })
-        elif tipo == 'hijos':
-            prompt = generar_prompt_hijos(cod_empresa, {
-                'sinHijos': datos.get('sinHijos', {}).get('porcentaje', 0),
-                'unHijo': datos.get('unHijo', {}).get('porcentaje', 0),
-                'dosHijos': datos.get('dosHijos', {}).get('porcentaje', 0),
-                'tresOMas': datos.get('tresOMas', {}).get('porcentaje', 0)
-            })
-        elif tipo == 'ciudad':
-            # datos puede ser un array directamente o un objeto con propiedad 'ciudades'
-            ciudades = datos if isinstance(datos, list) else datos.get('ciudades', [])
-            prompt = generar_prompt_ciudad(cod_empresa, ciudades)
-        elif tipo == 'profesion':
-            # datos puede ser un array directamente o un objeto con propiedad 'profesiones'
-            profesiones = datos if isinstance(datos, list) else datos.get('profesiones', [])
-            prompt = generar_prompt_profesion(cod_empresa, profesiones)
-        elif tipo == 'encuestaSalud':
-            # datos puede ser un array/objeto directamente o un objeto con propiedad 'respuestas'
-            respuestas = datos if isinstance(datos, (list, dict)) and 'respuestas' not in datos else datos.get('respuestas', datos)
-            prompt = generar_prompt_encuesta_salud(cod_empresa, respuestas)
-        elif tipo == 'diagnosticos':
-            # datos puede ser un array directamente o un objeto con propiedad 'diagnosticos'
-            diagnosticos = datos if isinstance(datos, list) else datos.get('diagnosticos', [])
-            prompt = generar_prompt_diagnosticos(cod_empresa, diagnosticos)
-        else:
+        prompt = construir_prompt_recomendacion(tipo, cod_empresa, datos)
+        if prompt is None:
             return jsonify({
                 'success': False,
-                'error': f'Tipo "{tipo}" no válido. Tipos permitidos: genero, edad, estadoCivil, nivelEducativo, hijos, ciudad, profesion, encuestaSalud, diagnosticos'
+                'error': f'Tipo "{tipo}" no válido. Tipos permitidos: {", ".join(RUTAS_DATOS_RECOMENDACION)}'
             }), 400
 
         logger.info(f"🤖 Generando recomendación IA para tipo: {tipo}, empresa: {cod_empresa}")
@@ -11586,7 +10744,8 @@ def generar_recomendaciones_ia():
                 'success': True,
                 'tipo': tipo,
                 'recomendacion': resultado['content'],
-                'usage': resultado.get('usage')
+                'usage': resultado.get('usage'),
+                'cache': resultado.get('cache', False)
             })
         else:
             response = jsonify({
@@ -11605,6 +10764,126 @@ def generar_recomendaciones_ia():
             'error': str(e)
         }), 500
 
+@app.route('/api/informe-recomendaciones-ia/lote', methods=['POST', 'OPTIONS'])
+def generar_recomendaciones_ia_lote():
+    """
+    Genera las recomendaciones de IA de todos los tipos a la vez.
+    Body: { codEmpresa: string, estadisticas: object, snapshotId?: string, tipos?: [string] }
+    Con snapshotId vigente, codEmpresa y estadisticas salen del snapshot del informe.
+
+    Las llamadas a OpenAI corren en paralelo (INFORME_IA_PARALELISMO a la vez) y
+    la respuesta es NDJSON: una línea por tipo apenas termina, en el orden en
+    que terminan, y una línea final con el total de tokens (los que salieron
+    de la caché LLM van en tokensAhorrados):
+        {"tipo": "edad", "success": true, "recomendacion": "...", "usage": {...}, "cache": false, "duracionMs": 2100}
+        {"fin": true, "total": 9, "exitosos": 9, "usage": {...}, "tokensAhorrados": 0, "duracionMs": 4300}
+    """
+    if request.method == 'OPTIONS':
+        response = make_response()
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        return response
+
+    if not openai_client:
+        return jsonify({
+            'success': False,
+            'error': 'OpenAI no está configurado. Configure la variable de entorno OPENAI_API_KEY'
+        }), 503
+
+    data = request.get_json(silent=True) or {}
+    cod_empresa = data.get('codEmpresa', 'N/A')
+    estadisticas = data.get('estadisticas') or {}
+
+    snapshot = obtener_snapshot(data.get('snapshotId'))
+    if snapshot:
+        cod_empresa = snapshot['codEmpresa']
+        estadisticas = snapshot['estadisticas']
+
+    tipos = data.get('tipos') or list(RUTAS_DATOS_RECOMENDACION)
+    if not isinstance(tipos, list):
+        return jsonify({'success': False, 'error': 'El parámetro "tipos" debe ser una lista'}), 400
+    invalidos = [t for t in tipos if not isinstance(t, str) or t not in RUTAS_DATOS_RECOMENDACION]
+    if invalidos:
+        return jsonify({
+            'success': False,
+            'error': f'Tipos no válidos: {", ".join(map(str, invalidos))}. Tipos permitidos: {", ".join(RUTAS_DATOS_RECOMENDACION)}'
+        }), 400
+
+    # Los prompts se arman antes de responder: un error de datos sale como 400
+    try:
+        prompts = {
+            tipo: construir_prompt_recomendacion(tipo, cod_empresa, datos_recomendacion(estadisticas, tipo) or {})
+            for tipo in dict.fromkeys(tipos)
+        }
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        logger.error(f"❌ Estadísticas inválidas para recomendaciones IA: {e}")
+        return jsonify({'success': False, 'error': f'Estadísticas inválidas: {e}'}), 400
+
+    logger.info(f"🤖 Generando {len(prompts)} recomendaciones IA en paralelo ({INFORME_IA_PARALELISMO} a la vez), empresa: {cod_empresa}")
+
+    def generar():
+        inicio = time.time()
+        usage_total = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        tokens_ahorrados = 0
+        exitosos = 0
+
+        def recomendar(tipo, prompt):
+            inicio_tipo = time.time()
+            try:
+                resultado = call_openai(prompt)
+            except Exception as e:
+                resultado = {'success': False, 'error': str(e)}
+            return tipo, resultado or {}, int((time.time() - inicio_tipo) * 1000)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(INFORME_IA_PARALELISMO, len(prompts)))) as pool:
+            futuros = [pool.submit(recomendar, tipo, prompt) for tipo, prompt in prompts.items()]
+            for futuro in as_completed(futuros):
+                tipo, resultado, duracion_ms = futuro.result()
+                if resultado.get('success'):
+                    exitosos += 1
+                    usage = resultado.get('usage') or {}
+                    if resultado.get('cache'):
+                        tokens_ahorrados += usage.get('total_tokens', 0)
+                    else:
+                        for clave in usage_total:
+                            usage_total[clave] += usage.get(clave, 0)
+                    linea = {
+                        'tipo': tipo,
+                        'success': True,
+                        'recomendacion': resultado['content'],
+                        'usage': resultado.get('usage'),
+                        'cache': bool(resultado.get('cache')),
+                        'duracionMs': duracion_ms
+                    }
+                else:
+                    linea = {
+                        'tipo': tipo,
+                        'success': False,
+                        'error': resultado.get('error', 'Error desconocido al llamar a OpenAI'),
+                        'duracionMs': duracion_ms
+                    }
+                yield json_module.dumps(linea, ensure_ascii=False) + '\n'
+
+        duracion_ms = int((time.time() - inicio) * 1000)
+        logger.info(f"✅ Recomendaciones IA: {exitosos}/{len(prompts)} en {duracion_ms}ms, {usage_total['total_tokens']} tokens")
+        yield json_module.dumps({
+            'fin': True,
+            'total': len(prompts),
+            'exitosos': exitosos,
+            'usage': usage_total,
+            'tokensAhorrados': tokens_ahorrados,
+            'duracionMs': duracion_ms
+        }) + '\n'
+
+    response = Response(stream_with_context(generar()), mimetype='application/x-ndjson')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    # Que ningún proxy acumule la respuesta: cada línea debe llegar al terminar
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # ============================================================================
 # SECOP - BÚSQUEDA DE LICITACIONES (datos.gov.co / Socrata)
 # ============================================================================
@@ -11900,7 +11179,30 @@ def inicializar_tablas_conversaciones():
         import traceback
         traceback.print_exc()
 
-if __name__ == "__main__":
+_servicios_iniciados = False
+
+
+def inicializar_servicios():
+    """
+    Tablas y workers en segundo plano. Se llama al arrancar con
+    `python descargar_bsl.py` y desde wsgi.py (gunicorn); solo corre una vez.
+    """
+    global _servicios_iniciados
+    if _servicios_iniciados:
+        return
+    _servicios_iniciados = True
+
+    # Pool de procesos para los gráficos del informe: se hace fork antes de
+    # arrancar los hilos de fondo
+    iniciar_pool_graficos()
+
+    # Backend de almacenamiento: una credencial faltante se ve al arrancar,
+    # sin impedir que la app levante
+    try:
+        obtener_backend(DEST)
+    except Exception as e:
+        logger.error(f"❌ Backend de almacenamiento '{DEST}' no disponible: {e}")
+
     # Inicializar tablas de conversaciones al arrancar
     print("\n" + "=" * 70)
     print("🔧 INICIALIZANDO TABLAS DE CONVERSACIONES WHATSAPP")
@@ -11908,5 +11210,35 @@ if __name__ == "__main__":
     inicializar_tablas_conversaciones()
     print("=" * 70 + "\n")
 
+    # Cache en memoria de asignaciones del chat (después de crear las tablas)
+    iniciar_cache_asignaciones()
+
+    # Cola durable de webhooks de Whapi: drena lo que quedó pendiente antes del
+    # reinicio sin esperar a que llegue un webhook nuevo
+    if WEBHOOK_COLA_ENABLED:
+        iniciar_workers_webhooks(MANEJADORES_WEBHOOK)
+
+    # Outbox de subidas a Drive/GCS (opcional)
+    if UPLOAD_OUTBOX_ENABLED:
+        inicializar_tabla_outbox()
+        iniciar_workers_outbox(subir_pdf_segun_destino)
+
+    # Reenvío por plantilla de certificados que Twilio reporta como no entregados
+    iniciar_worker_reintentos(reintentar_certificado_por_plantilla)
+
+    # Interpretaciones ADC generadas fuera del render del certificado
+    iniciar_worker_adc(generar_interpretacion_adc_openai)
+
+    # Snapshots del certificado reconstruidos cuando cambia un examen (opcional;
+    # desactivado, apaga los triggers que haya dejado una activación anterior)
+    iniciar_worker_snapshot(ensamblar_datos_certificado)
+
+
+if __name__ == "__main__":
+    inicializar_servicios()
+
     # Usar socketio.run() en lugar de app.run() para soportar WebSockets
-    socketio.run(app, host="0.0.0.0", port=8080, allow_unsafe_werkzeug=True)
+    if SOCKETIO_ASYNC_MODE == 'threading':
+        socketio.run(app, host="0.0.0.0", port=8080, allow_unsafe_werkzeug=True)
+    else:
+        socketio.run(app, host="0.0.0.0", port=8080)
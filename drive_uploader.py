@@ -26,6 +26,14 @@ else:
 # Mantener compatibilidad con la variable original
 DEFAULT_DRIVE_FOLDER_ID = os.getenv("GOOGLE_DRIVE_FOLDER_ID")
 
+def obtener_servicio_drive():
+    """Construye el cliente de Drive v3 con las credenciales del service account"""
+    creds = service_account.Credentials.from_service_account_file(
+        CREDENTIALS_FILE,
+        scopes=['https://www.googleapis.com/auth/drive.file']
+    )
+    return build('drive', 'v3', credentials=creds)
+
 def subir_pdf_a_drive(nombre_archivo_local, nombre_visible, folder_id=None):
     """
     Sube un PDF a Google Drive
@@ -48,11 +56,7 @@ def subir_pdf_a_drive(nombre_archivo_local, nombre_visible, folder_id=None):
 
     print(f"🚀 Subiendo {nombre_visible} a Google Drive (carpeta: {target_folder_id})...")
 
-    creds = service_account.Credentials.from_service_account_file(
-        CREDENTIALS_FILE,
-        scopes=['https://www.googleapis.com/auth/drive.file']
-    )
-    service = build('drive', 'v3', credentials=creds)
+    service = obtener_servicio_drive()
 
     file_metadata = {
         'name': nombre_visible,
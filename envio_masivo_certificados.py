@@ -0,0 +1,315 @@
+"""
+Envío Masivo de Certificados por WhatsApp
+=========================================
+
+- Token bucket por tenant: cada cuenta Twilio tiene su propio límite de
+  mensajes por segundo (tenants.credenciales.twilio.mps o TWILIO_MPS_DEFAULT).
+  Todos los envíos de certificado pasan por aquí, individuales o masivos.
+- Reintento con espera ante 429 (Too Many Requests) de Twilio.
+- Trabajos masivos registrados en PostgreSQL (sql/init_envios_masivos.sql):
+  el progreso se consulta desde cualquier instancia y los trabajos de más
+  de ENVIO_MASIVO_RETENCION_DIAS se purgan.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+TWILIO_MPS_DEFAULT = float(os.getenv("TWILIO_MPS_DEFAULT", "10"))
+ENVIO_MASIVO_RENDERS_PARALELOS = int(os.getenv("ENVIO_MASIVO_RENDERS_PARALELOS", "3"))
+ENVIO_MASIVO_MAX_ORDENES = 2000
+ENVIO_MASIVO_RETENCION_DIAS = int(os.getenv("ENVIO_MASIVO_RETENCION_DIAS", "30"))
+TWILIO_REINTENTOS_429 = 4
+
+
+# ============================================================================
+# TOKEN BUCKET POR TENANT
+# ============================================================================
+
+class TokenBucket:
+    """Bucket clásico: 'tasa' tokens por segundo, ráfaga de hasta 'capacidad'."""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad or max(tasa, 1))
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def tomar(self):
+        """Bloquea hasta que haya un token disponible"""
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.tasa
+            time.sleep(espera)
+
+    def penalizar(self, segundos):
+        """Tras un 429, vacía el bucket para frenar a todos los que comparten la cuenta"""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - segundos * self.tasa
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def obtener_bucket(llave, mps=None):
+    """Bucket por cuenta Twilio (account_sid); se recrea si cambia el límite configurado"""
+    mps = float(mps or TWILIO_MPS_DEFAULT)
+    with _buckets_lock:
+        bucket = _buckets.get(llave)
+        if bucket is None or bucket.tasa != mps:
+            bucket = TokenBucket(mps)
+            _buckets[llave] = bucket
+        return bucket
+
+
+def crear_mensaje_con_limite(twilio_client, creds, **params):
+    """
+    messages.create respetando el límite de la cuenta Twilio del tenant.
+    Ante un 429 espera (Retry-After o backoff exponencial) y reintenta.
+    """
+    bucket = obtener_bucket(creds.get('account_sid'), creds.get('mps'))
+    for intento in range(TWILIO_REINTENTOS_429 + 1):
+        bucket.tomar()
+        try:
+            return twilio_client.messages.create(**params)
+        except Exception as e:
+            if getattr(e, 'status', None) != 429 or intento == TWILIO_REINTENTOS_429:
+                raise
+            espera = 2 ** intento
+            logger.warning(f"⚠️ Twilio 429 para {creds.get('source')} — reintento en {espera}s")
+            bucket.penalizar(espera)
+
+
+# ============================================================================
+# TRABAJOS MASIVOS
+# ============================================================================
+
+RESULTADOS_TRABAJO = ('enviados', 'duplicados', 'sin_pago', 'errores')
+
+
+def _conectar():
+    """Conexión con las tablas garantizadas (se crean la primera vez en el proceso)"""
+    return conectar_con_esquema('init_envios_masivos.sql')
+
+
+def purgar_trabajos():
+    """
+    Borra los trabajos (y sus resultados) con más de ENVIO_MASIVO_RETENCION_DIAS.
+
+    Returns:
+        int: trabajos borrados
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM envios_masivos_trabajos WHERE inicio < now() - make_interval(days => %s)",
+            (ENVIO_MASIVO_RETENCION_DIAS,)
+        )
+        borrados = cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if borrados:
+        logger.info(f"🧹 {borrados} trabajos de envío masivo purgados")
+    return borrados
+
+
+def crear_trabajo(ordenes, enviar_fn, descripcion=None):
+    """
+    Registra el trabajo en PostgreSQL y lanza en segundo plano el envío de
+    una lista de órdenes. Se aprovecha para purgar los trabajos viejos.
+
+    Args:
+        ordenes: lista de dicts ya resueltos (datos_wix con '_id')
+        enviar_fn: callable(datos_wix) -> (resultado_dict, status_http)
+        descripcion: dict con los filtros originales (para el reporte)
+
+    Returns:
+        str: id del trabajo
+    """
+    trabajo_id = uuid.uuid4().hex[:12]
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO envios_masivos_trabajos (id, descripcion, total) VALUES (%s, %s, %s)",
+            (trabajo_id, json.dumps(descripcion or {}), len(ordenes))
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    try:
+        purgar_trabajos()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron purgar trabajos de envío masivo: {e}")
+
+    threading.Thread(
+        target=_ejecutar_trabajo, args=(trabajo_id, ordenes, enviar_fn),
+        name=f"envio-masivo-{trabajo_id}", daemon=True
+    ).start()
+    logger.info(f"📦 Trabajo de envío masivo {trabajo_id}: {len(ordenes)} órdenes")
+    return trabajo_id
+
+
+def _registrar_resultado(trabajo_id, clave, fila):
+    """Guarda el resultado de una orden y suma al contador. Nunca frena el envío."""
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO envios_masivos_resultados
+                    (trabajo_id, historia_id, resultado, status, sid, message, segundos)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                (trabajo_id, fila['historiaId'], clave, fila['status'], fila['sid'],
+                 fila['message'], fila['segundos'])
+            )
+            # clave sale de RESULTADOS_TRABAJO, nunca de la entrada
+            cur.execute(
+                f"UPDATE envios_masivos_trabajos SET procesados = procesados + 1, {clave} = {clave} + 1 WHERE id = %s",
+                (trabajo_id,)
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo registrar el resultado de {fila['historiaId']} en {trabajo_id}: {e}")
+
+
+def _ejecutar_trabajo(trabajo_id, ordenes, enviar_fn):
+    conteos = dict.fromkeys(RESULTADOS_TRABAJO, 0)
+    conteos_lock = threading.Lock()
+
+    def procesar(datos):
+        inicio = time.time()
+        try:
+            resultado, status = enviar_fn(datos)
+        except Exception as e:
+            resultado, status = {'success': False, 'message': str(e)}, 500
+
+        if resultado.get('duplicado'):
+            clave = 'duplicados'
+        elif resultado.get('motivo') == 'sin_pago':
+            clave = 'sin_pago'
+        elif status == 200 and resultado.get('success'):
+            clave = 'enviados'
+        else:
+            clave = 'errores'
+
+        with conteos_lock:
+            conteos[clave] += 1
+        _registrar_resultado(trabajo_id, clave, {
+            'historiaId': datos.get('_id'),
+            'status': status,
+            'sid': resultado.get('sid'),
+            'message': resultado.get('message'),
+            'segundos': round(time.time() - inicio, 2),
+        })
+
+    # Los renders (Puppeteer) son la etapa pesada: se acotan en paralelo; el ritmo
+    # de los envíos lo pone el token bucket de cada tenant.
+    with ThreadPoolExecutor(max_workers=ENVIO_MASIVO_RENDERS_PARALELOS) as pool:
+        list(pool.map(procesar, ordenes))
+
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE envios_masivos_trabajos SET estado = 'completado', fin = now() WHERE id = %s",
+                (trabajo_id,)
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"❌ No se pudo cerrar el trabajo {trabajo_id}: {e}")
+    logger.info(
+        f"✅ Trabajo {trabajo_id} completado: {conteos['enviados']} enviados, "
+        f"{conteos['duplicados']} duplicados, {conteos['sin_pago']} sin pago, {conteos['errores']} errores"
+    )
+
+
+def obtener_trabajo(trabajo_id):
+    """Reporte de un trabajo desde PostgreSQL (None si no existe o ya se purgó)"""
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT estado, descripcion, total, procesados, enviados, duplicados,
+                   sin_pago, errores, inicio, fin
+            FROM envios_masivos_trabajos WHERE id = %s
+            """,
+            (trabajo_id,)
+        )
+        fila = cur.fetchone()
+        if not fila:
+            cur.close()
+            return None
+        cur.execute(
+            """
+            SELECT historia_id, resultado, status, sid, message, segundos
+            FROM envios_masivos_resultados WHERE trabajo_id = %s ORDER BY id
+            """,
+            (trabajo_id,)
+        )
+        resultados = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    estado, descripcion, total, procesados, enviados, duplicados, sin_pago, errores, inicio, fin = fila
+    return {
+        'id': trabajo_id,
+        'estado': estado,
+        'descripcion': descripcion or {},
+        'total': total,
+        'procesados': procesados,
+        'enviados': enviados,
+        'duplicados': duplicados,
+        'sin_pago': sin_pago,
+        'errores': errores,
+        'inicio': inicio.isoformat(),
+        'fin': fin.isoformat() if fin else None,
+        'resultados': [
+            {
+                'historiaId': historia_id,
+                'resultado': resultado,
+                'status': status,
+                'sid': sid,
+                'message': message,
+                'segundos': float(segundos) if segundos is not None else None,
+            }
+            for historia_id, resultado, status, sid, message, segundos in resultados
+        ],
+        'progreso': round(procesados / total, 4) if total else 1.0,
+    }
@@ -0,0 +1,242 @@
+"""
+Motor de Estadísticas del Informe de Condiciones de Salud
+=========================================================
+
+Reemplaza la familia contar_* / generar_sve: cada una recorría la lista
+completa, normalizaba de nuevo los mismos strings (str().upper().strip()) y
+probaba la clave snake_case (PostgreSQL) y la camelCase (Wix) en cada fila.
+
+Aquí cada lista se recorre una sola vez y todas las distribuciones se
+acumulan en la misma pasada; cada mdDx1/mdDx2 distinto se divide una sola
+vez y se comparte entre diagnósticos y SVE. La salida es
+exactamente el esquema anterior, incluido el orden de las listas (por
+cantidad desc., empates en orden de aparición) y los porcentajes.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+from collections import Counter
+
+# Condiciones para SVE (Sistema de Vigilancia Epidemiológica)
+SVE_VISUAL_CONDITIONS = [
+    'ASTIGMATISMO H522',
+    "ALTERACION VISUAL  NO ESPECIFICADA H539",
+    'ALTERACIONES VISUALES SUBJETIVAS H531',
+    'CONJUNTIVITIS  NO ESPECIFICADA H109',
+    'DISMINUCION DE LA AGUDEZA VISUAL SIN ESPECIFICACION H547',
+    'DISMINUCION INDETERMINADA DE LA AGUDEZA VISUAL EN AMBOS OJOS (AMETROPÍA) H543',
+    'MIOPIA H521',
+    'PRESBICIA H524',
+    'VISION SUBNORMAL DE AMBOS OJOS H542',
+    'DEFECTOS DEL CAMPO VISUAL H534'
+]
+
+SVE_AUDITORY_CONDITIONS = [
+    'EFECTOS DEL RUIDO SOBRE EL OIDO INTERNO H833',
+    'PRESBIACUSIA H911',
+    'HIPOACUSIA  NO ESPECIFICADA H919',
+    'OTITIS MEDIA  NO ESPECIFICADA H669',
+    'OTRAS ENFERMEDADES DE LAS CUERDAS VOCALES J383',
+    'OTROS TRASTORNOS DE LA VISION BINOCULAR H533'
+]
+
+SVE_WEIGHT_CONDITIONS = [
+    'AUMENTO ANORMAL DE PESO',
+    'OBESIDAD ALIMENTARIA, E66.0',
+    'OBESIDAD CONSTITUCIONAL, E66.8',
+    'HIPOTIROIDISMO  NO ESPECIFICADO E039'
+]
+
+# Índice de sistema SVE por diagnóstico (el primero que coincide gana, como antes)
+_SISTEMA_POR_DX = {}
+for _sistema, _resumen, _condiciones in [('Visual', 'visual', SVE_VISUAL_CONDITIONS),
+                                         ('Auditivo', 'auditivo', SVE_AUDITORY_CONDITIONS),
+                                         ('Control de Peso', 'controlPeso', SVE_WEIGHT_CONDITIONS)]:
+    for _dx in _condiciones:
+        _SISTEMA_POR_DX.setdefault(_dx, (_sistema, _resumen))
+
+# Campos de salud en PostgreSQL (snake_case) vs Wix (camelCase o array)
+CAMPOS_SALUD_POSTGRES = [
+    ('dolor_cabeza', 'Dolor de Cabeza'),
+    ('dolor_espalda', 'Dolor de Espalda'),
+    ('ruido_jaqueca', 'Ruido/Jaqueca'),
+    ('problemas_sueno', 'Problemas de Sueño'),
+    ('presion_alta', 'Presión Alta'),
+    ('problemas_azucar', 'Problemas de Azúcar'),
+    ('problemas_cardiacos', 'Problemas Cardíacos'),
+    ('enfermedad_pulmonar', 'Enfermedad Pulmonar'),
+    ('enfermedad_higado', 'Enfermedad del Hígado'),
+    ('hernias', 'Hernias'),
+    ('hormigueos', 'Hormigueos'),
+    ('varices', 'Varices'),
+    ('hepatitis', 'Hepatitis'),
+    ('cirugia_ocular', 'Cirugía Ocular'),
+    ('cirugia_programada', 'Cirugía Programada'),
+    ('condicion_medica', 'Condición Médica'),
+    ('embarazo', 'Embarazo'),
+    ('fuma', 'Fuma'),
+    ('consumo_licor', 'Consumo de Licor'),
+    ('ejercicio', 'Ejercicio'),
+    ('usa_anteojos', 'Usa Anteojos'),
+    ('usa_lentes_contacto', 'Usa Lentes de Contacto')
+]
+_CAMPOS_SALUD = [(campo, nombre.upper()) for campo, nombre in CAMPOS_SALUD_POSTGRES]
+# Solo se cuentan respuestas afirmativas
+RESPUESTAS_AFIRMATIVAS = frozenset(['SÍ', 'SI', 'S', 'TRUE', '1', 'YES', 'Y'])
+
+RANGOS_EDAD = [('15-20', 15, 20), ('21-30', 21, 30), ('31-40', 31, 40), ('41-50', 41, 50)]
+
+
+class _Diagnosticos(dict):
+    """Texto de mdDx1/mdDx2 → diagnósticos normalizados; cada texto distinto se divide una vez"""
+
+    def __missing__(self, texto):
+        dx = texto.strip()
+        partes = self[texto] = [d.strip().upper() for d in dx.replace(';', ',').split(',')] if dx else []
+        return partes
+
+    def __call__(self, valor):
+        return self[valor if valor.__class__ is str else str(valor)]
+
+
+def _entero(valor):
+    """int() como antes; None si no es numérico"""
+    try:
+        return int(valor)
+    except (ValueError, TypeError):
+        return None
+
+
+def _porcentaje(cantidad, total):
+    return (cantidad / total * 100) if total > 0 else 0
+
+
+def _distribucion(total, conteos):
+    return {
+        clave: {'cantidad': cantidad, 'porcentaje': _porcentaje(cantidad, total)}
+        for clave, cantidad in conteos.items()
+    }
+
+
+def _ranking(conteos, total):
+    """Lista por cantidad desc.; sorted es estable, así que los empates quedan en orden de aparición"""
+    return sorted([
+        {'nombre': nombre, 'cantidad': cantidad, 'porcentaje': _porcentaje(cantidad, total)}
+        for nombre, cantidad in conteos.items() if nombre
+    ], key=lambda x: x['cantidad'], reverse=True)
+
+
+def _sve(historias, dividir):
+    """Pacientes con diagnósticos SVE (mdDx1 y luego mdDx2, en orden)"""
+    pacientes = []
+    resumen = {'visual': 0, 'auditivo': 0, 'controlPeso': 0}
+
+    for item in historias:
+        coincidencias = [dx for campo in ('mdDx1', 'mdDx2') for dx in dividir(item.get(campo, ''))
+                         if dx in _SISTEMA_POR_DX]
+        if not coincidencias:
+            continue
+        nombres = f"{item.get('primerNombre', '')} {item.get('primerApellido', '')}".strip()
+        documento = item.get('numeroId', '')
+        for dx in coincidencias:
+            sistema, clave = _SISTEMA_POR_DX[dx]
+            resumen[clave] += 1
+            pacientes.append({
+                'nombres': nombres,
+                'documento': documento,
+                'sistema': sistema,
+                'diagnostico': dx
+            })
+
+    return {
+        'pacientes': pacientes,
+        'resumen': resumen,
+        'totalPacientesAfectados': len(pacientes)
+    }
+
+
+def calcular_estadisticas(formulario_items, historia_clinica_items):
+    """
+    Todas las estadísticas del informe en una pasada por lista.
+
+    Args:
+        formulario_items: filas de formularios (PostgreSQL o Wix)
+        historia_clinica_items: filas de HistoriaClinica
+
+    Returns:
+        dict: genero, edad, estadoCivil, nivelEducativo, hijos, ciudadResidencia,
+              profesionUOficio, encuestaSalud, diagnosticos, sve (mismo esquema
+              que las funciones contar_* anteriores)
+    """
+    genero, estado, nivel, ciudades, profesiones, respuestas = (Counter() for _ in range(6))
+    rangos_edad = dict.fromkeys([clave for clave, _, _ in RANGOS_EDAD] + ['mayor50'], 0)
+    grupos_hijos = {'sinHijos': 0, 'unHijo': 0, 'dosHijos': 0, 'tresOMas': 0}
+
+    for item in formulario_items:
+        genero[str(item.get('genero', '')).upper().strip()] += 1
+        # PostgreSQL usa snake_case, Wix camelCase
+        estado[str(item.get('estado_civil', item.get('estadoCivil', ''))).upper().strip()] += 1
+        nivel[str(item.get('nivel_educativo', item.get('nivelEducativo', ''))).upper().strip()] += 1
+        ciudades[str(item.get('ciudad_residencia', item.get('ciudadDeResidencia', ''))).upper().strip()] += 1
+        profesiones[str(item.get('profesion_oficio', item.get('profesionUOficio', ''))).upper().strip()] += 1
+
+        edad = _entero(item.get('edad', 0))
+        if edad is not None:
+            for clave, desde, hasta in RANGOS_EDAD:
+                if desde <= edad <= hasta:
+                    rangos_edad[clave] += 1
+                    break
+            else:
+                if edad > 50:
+                    rangos_edad['mayor50'] += 1
+
+        hijos = _entero(item.get('hijos', 0))
+        if hijos is not None and hijos >= 0:
+            grupos_hijos[('sinHijos', 'unHijo', 'dosHijos', 'tresOMas')[min(hijos, 3)]] += 1
+
+        # Encuesta: array encuestaSalud (Wix) o campos individuales (PostgreSQL)
+        encuesta = item.get('encuestaSalud', [])
+        if isinstance(encuesta, list) and len(encuesta) > 0:
+            for respuesta in encuesta:
+                respuestas[str(respuesta).upper().strip()] += 1
+        else:
+            for campo, nombre in _CAMPOS_SALUD:
+                if str(item.get(campo, '')).upper().strip() in RESPUESTAS_AFIRMATIVAS:
+                    respuestas[nombre] += 1
+
+    # mdDx1 se divide una sola vez por texto distinto para diagnósticos y SVE
+    dividir = _Diagnosticos()
+    diagnosticos = Counter()
+    for item in historia_clinica_items:
+        diagnosticos.update(dividir(item.get('mdDx1', '')))
+
+    total = len(formulario_items)
+    total_historias = len(historia_clinica_items)
+    return {
+        'genero': {
+            'total': total,
+            'masculino': {'cantidad': genero['MASCULINO'], 'porcentaje': _porcentaje(genero['MASCULINO'], total)},
+            'femenino': {'cantidad': genero['FEMENINO'], 'porcentaje': _porcentaje(genero['FEMENINO'], total)},
+        },
+        'edad': {'total': total, 'rangos': _distribucion(total, rangos_edad)},
+        'estadoCivil': {'total': total, 'estados': _distribucion(total, {
+            'soltero': estado['SOLTERO'],
+            'casado': estado['CASADO'],
+            'divorciado': estado['DIVORCIADO'],
+            'viudo': estado['VIUDO'],
+            'unionLibre': estado['UNIÓN LIBRE'] + estado['UNION LIBRE'],
+        })},
+        'nivelEducativo': {'total': total, 'niveles': _distribucion(total, {
+            'primaria': nivel['PRIMARIA'],
+            'secundaria': nivel['SECUNDARIA'],
+            'universitario': nivel['UNIVERSITARIO'],
+            'postgrado': nivel['POSTGRADO'],
+        })},
+        'hijos': {'total': total, 'grupos': _distribucion(total, grupos_hijos)},
+        'ciudadResidencia': {'total': total, 'ciudades': _ranking(ciudades, total)},
+        'profesionUOficio': {'total': total, 'profesiones': _ranking(profesiones, total)},
+        'encuestaSalud': {'total': total, 'respuestas': _ranking(respuestas, total)},
+        'diagnosticos': {'total': total_historias, 'diagnosticos': _ranking(diagnosticos, total_historias)},
+        'sve': _sve(historia_clinica_items, dividir),
+    }
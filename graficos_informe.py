@@ -0,0 +1,682 @@
+"""
+Gráficos del Informe de Condiciones de Salud
+============================================
+
+Funciones matplotlib del PDF del informe (torta, barras, barras
+horizontales y barras apiladas por porcentaje) y un ejecutor que las dibuja
+en paralelo.
+
+matplotlib dibuja con el GIL tomado, así que ocho gráficos en hilos siguen
+saliendo uno detrás de otro. renderizar_graficos() los reparte en un pool de
+procesos ya calentado (matplotlib importado y caché de fuentes cargada): la
+latencia queda acotada por el gráfico más lento y no por la suma.
+
+- GRAFICOS_PROCESOS: tamaño del pool (0 = dibujar en el proceso, como antes)
+- El pool solo se crea en iniciar_pool_graficos(), al arrancar y antes de
+  los hilos de fondo; sin él se dibuja en el proceso, nunca hay un fork tardío.
+- Si el pool falla, los gráficos se dibujan en el proceso hasta reiniciar:
+  el pool no se recrea porque sería un fork de un proceso con hilos.
+- Con gevent no hay fork (los hijos heredarían el hub parcheado): se dibuja
+  en un hilo nativo del threadpool de gevent, así matplotlib no bloquea el
+  hub mientras dibuja.
+
+Formato: PNG a 200 DPI o SVG vectorial (GRAFICOS_FORMATO, por defecto svg
+para el PDF): el HTML y el PDF pesan menos y WeasyPrint parsea menos.
+
+Caché por contenido: la clave es un hash de (tipo, datos, título, opciones,
+GRAFICOS_ESTILO_VERSION). Regenerar el mismo informe ajustando solo el texto
+IA no vuelve a dibujar nada. Dos niveles: LRU en memoria acotado por bytes y
+un directorio en disco compartido por los procesos del mismo host.
+obtener_metricas_graficos() expone los aciertos.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import base64
+import hashlib
+import logging
+import multiprocessing
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+# Con gevent los hijos heredarían el hub parcheado: ahí no hay pool de procesos
+_EN_GEVENT = os.getenv('SOCKETIO_ASYNC_MODE') == 'gevent'
+GRAFICOS_PROCESOS = 0 if _EN_GEVENT else int(os.getenv("GRAFICOS_PROCESOS", str(min(4, os.cpu_count() or 1))))
+GRAFICOS_TIMEOUT_SEG = 60
+# Formato de los gráficos del PDF del informe: 'svg' (vectorial) o 'png'
+GRAFICOS_FORMATO = os.getenv("GRAFICOS_FORMATO", "svg")
+MIME_GRAFICOS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Subir al cambiar el estilo de cualquier gráfico (colores por defecto, tamaños,
+# fuentes): invalida todo lo cacheado
+GRAFICOS_ESTILO_VERSION = 1
+GRAFICOS_CACHE_MEMORIA_MB = int(os.getenv("GRAFICOS_CACHE_MEMORIA_MB", "64"))
+GRAFICOS_CACHE_DISCO_MB = int(os.getenv("GRAFICOS_CACHE_DISCO_MB", "512"))
+GRAFICOS_CACHE_DIR = os.getenv("GRAFICOS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bsl_graficos_cache"))
+
+_pool = None
+_hilo_gevent = None  # gevent.threadpool.ThreadPool(1): un hilo nativo para matplotlib
+_pool_lock = threading.Lock()
+
+_cache = OrderedDict()        # clave -> imagen (str), orden LRU
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_escrituras_disco = 0
+_metricas = {'hits_memoria': 0, 'hits_disco': 0, 'misses': 0, 'escrituras_disco': 0, 'errores_disco': 0}
+
+
+# ============================================================================
+# GRÁFICOS
+# ============================================================================
+
+def _exportar(fig, formato='png'):
+    """
+    Exporta la figura a base64 y la cierra.
+
+    SVG: el texto va como trazos (svg.fonttype='path'): cada glifo usado se
+    define una vez y se reutiliza, que es un subset de la fuente embebido y
+    no depende de las fuentes instaladas donde corre WeasyPrint. Sin fecha y
+    con ids fijos, el mismo gráfico produce los mismos bytes (caché).
+    """
+    import matplotlib
+    import matplotlib.pyplot as plt
+    from io import BytesIO
+
+    buffer = BytesIO()
+    plt.tight_layout(pad=1.5)
+    if formato == 'svg':
+        with matplotlib.rc_context({'svg.fonttype': 'path', 'svg.hashsalt': 'bsl-informe'}):
+            plt.savefig(buffer, format='svg', bbox_inches='tight', facecolor='white', edgecolor='none',
+                        metadata={'Date': None})
+    else:
+        plt.savefig(buffer, format='png', dpi=200, bbox_inches='tight', facecolor='white', edgecolor='none')
+    buffer.seek(0)
+    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
+    plt.close(fig)
+
+    return image_base64
+
+
+def generar_grafico_pie(datos, titulo, colores=None, formato='png'):
+    """
+    Genera un gráfico de torta (pie chart) y retorna la imagen en base64.
+
+    Args:
+        datos: dict con formato {'label': valor}
+        titulo: str con el título del gráfico
+        colores: list de colores hexadecimales (opcional)
+        formato: 'png' (200 DPI) o 'svg' (vectorial)
+
+    Returns:
+        str: imagen en formato base64
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # Backend sin GUI
+    import matplotlib.pyplot as plt
+
+    # Filtrar valores vacíos o cero
+    datos_filtrados = {k: v for k, v in datos.items() if v > 0}
+
+    if not datos_filtrados:
+        return None
+
+    # Configurar figura con fondo blanco
+    fig, ax = plt.subplots(figsize=(8, 6), facecolor='white')
+
+    labels = list(datos_filtrados.keys())
+    sizes = list(datos_filtrados.values())
+
+    # Paleta de colores profesional para salud ocupacional (tonos azules, verdes, naranjas suaves)
+    if not colores:
+        colores = ['#0ea5e9', '#10b981', '#f59e0b', '#8b5cf6', '#ef4444', '#14b8a6', '#ec4899', '#6366f1']
+
+    # Crear el gráfico con efecto de explosión sutil en el segmento más grande
+    explode = [0.05 if size == max(sizes) else 0 for size in sizes]
+
+    wedges, texts, autotexts = ax.pie(
+        sizes,
+        labels=labels,
+        autopct='%1.1f%%',
+        colors=colores[:len(sizes)],
+        startangle=90,
+        explode=explode,
+        textprops={'fontsize': 11, 'weight': '600', 'family': 'sans-serif'},
+        wedgeprops={'edgecolor': 'white', 'linewidth': 2, 'antialiased': True}
+    )
+
+    # Hacer el texto de porcentaje blanco y más legible
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontsize(10)
+        autotext.set_weight('bold')
+
+    # Mejorar etiquetas de categorías
+    for text in texts:
+        text.set_fontsize(11)
+        text.set_weight('600')
+        text.set_color('#1f2937')
+
+    # Título moderno con mejor tipografía
+    ax.set_title(titulo, fontsize=15, weight='bold', pad=25, color='#1f2937', family='sans-serif')
+
+    return _exportar(fig, formato)
+
+
+def generar_grafico_barras(datos, titulo, xlabel='', ylabel='Cantidad', colores=None, formato='png'):
+    """
+    Genera un gráfico de barras y retorna la imagen en base64.
+
+    Args:
+        datos: dict con formato {'label': valor}
+        titulo: str con el título del gráfico
+        xlabel: str con etiqueta del eje X
+        ylabel: str con etiqueta del eje Y
+        colores: list de colores hexadecimales (opcional)
+        formato: 'png' (200 DPI) o 'svg' (vectorial)
+
+    Returns:
+        str: imagen en formato base64
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    # Filtrar valores vacíos o cero
+    datos_filtrados = {k: v for k, v in datos.items() if v > 0}
+
+    if not datos_filtrados:
+        return None
+
+    # Configurar figura con fondo blanco
+    fig, ax = plt.subplots(figsize=(10, 6), facecolor='white')
+
+    labels = list(datos_filtrados.keys())
+    values = list(datos_filtrados.values())
+
+    # Gradiente de colores moderno (azul a verde)
+    if not colores:
+        colores = ['#0ea5e9', '#06b6d4', '#14b8a6', '#10b981', '#22c55e', '#84cc16', '#eab308', '#f59e0b']
+
+    # Crear el gráfico con bordes redondeados y sombra
+    x_pos = np.arange(len(labels))
+    bars = ax.bar(x_pos, values, color=colores[:len(values)],
+                   edgecolor='white', linewidth=2.5, alpha=0.9,
+                   width=0.7)
+
+    # Agregar valores encima de las barras con mejor formato
+    for i, (bar, value) in enumerate(zip(bars, values)):
+        height = bar.get_height()
+        ax.text(
+            bar.get_x() + bar.get_width() / 2.,
+            height + (max(values) * 0.01),
+            f'{int(height)}',
+            ha='center',
+            va='bottom',
+            fontsize=11,
+            weight='bold',
+            color='#374151'
+        )
+
+    # Títulos y etiquetas con mejor tipografía
+    ax.set_title(titulo, fontsize=15, weight='bold', pad=25, color='#1f2937', family='sans-serif')
+    if xlabel:
+        ax.set_xlabel(xlabel, fontsize=12, weight='600', color='#374151', labelpad=10)
+    ax.set_ylabel(ylabel, fontsize=12, weight='600', color='#374151', labelpad=10)
+
+    # Grid más sutil y profesional
+    ax.grid(axis='y', alpha=0.2, linestyle='-', linewidth=0.8, color='#cbd5e1')
+    ax.set_axisbelow(True)
+
+    # Mejorar ejes
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_color('#cbd5e1')
+    ax.spines['bottom'].set_color('#cbd5e1')
+
+    # Etiquetas del eje X
+    ax.set_xticks(x_pos)
+    ax.set_xticklabels(labels, rotation=45, ha='right', fontsize=10, color='#4b5563')
+    ax.tick_params(axis='y', labelsize=10, colors='#4b5563')
+
+    return _exportar(fig, formato)
+
+
+def generar_grafico_barras_horizontales(datos, titulo, xlabel='Cantidad', ylabel='', colores=None, max_items=15, formato='png'):
+    """
+    Genera un gráfico de barras horizontales y retorna la imagen en base64.
+    Útil para datos con muchas categorías o etiquetas largas.
+
+    Args:
+        datos: dict con formato {'label': valor}
+        titulo: str con el título del gráfico
+        xlabel: str con etiqueta del eje X
+        ylabel: str con etiqueta del eje Y
+        colores: list de colores hexadecimales (opcional)
+        max_items: int número máximo de items a mostrar
+        formato: 'png' (200 DPI) o 'svg' (vectorial)
+
+    Returns:
+        str: imagen en formato base64
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    # Filtrar valores vacíos o cero
+    datos_filtrados = {k: v for k, v in datos.items() if v > 0}
+
+    if not datos_filtrados:
+        return None
+
+    # Ordenar por valor descendente y tomar top N
+    datos_ordenados = dict(sorted(datos_filtrados.items(), key=lambda x: x[1], reverse=True)[:max_items])
+
+    labels = list(datos_ordenados.keys())
+    values = list(datos_ordenados.values())
+
+    # Ajustar altura de figura según número de items
+    altura = max(6, len(labels) * 0.5)
+    fig, ax = plt.subplots(figsize=(10, altura), facecolor='white')
+
+    # Crear gradiente de colores del más oscuro al más claro
+    if not colores:
+        # Gradiente azul-turquesa para barras horizontales
+        base_colors = ['#0369a1', '#0284c7', '#0ea5e9', '#38bdf8', '#7dd3fc']
+        n_bars = len(values)
+        if n_bars <= len(base_colors):
+            colores = base_colors[:n_bars]
+        else:
+            # Interpolar colores si hay muchas barras
+            colores = [base_colors[int(i * (len(base_colors) - 1) / (n_bars - 1))] for i in range(n_bars)]
+
+    # Crear el gráfico (invertir para que el mayor esté arriba)
+    y_pos = np.arange(len(labels))
+    bars = ax.barh(y_pos, values, color=colores[:len(values)],
+                    edgecolor='white', linewidth=2.5, alpha=0.9,
+                    height=0.7)
+
+    # Agregar valores al final de las barras con mejor formato
+    for i, (bar, value) in enumerate(zip(bars, values)):
+        width = bar.get_width()
+        ax.text(
+            width + (max(values) * 0.01),
+            bar.get_y() + bar.get_height() / 2.,
+            f' {int(value)}',
+            ha='left',
+            va='center',
+            fontsize=10,
+            weight='bold',
+            color='#374151'
+        )
+
+    # Configurar ejes y etiquetas
+    ax.set_yticks(y_pos)
+    ax.set_yticklabels(labels, fontsize=10, color='#4b5563')
+    ax.invert_yaxis()  # Mayor valor arriba
+
+    # Títulos con mejor tipografía
+    ax.set_title(titulo, fontsize=15, weight='bold', pad=25, color='#1f2937', family='sans-serif')
+    ax.set_xlabel(xlabel, fontsize=12, weight='600', color='#374151', labelpad=10)
+    if ylabel:
+        ax.set_ylabel(ylabel, fontsize=12, weight='600', color='#374151', labelpad=10)
+
+    # Grid más sutil
+    ax.grid(axis='x', alpha=0.2, linestyle='-', linewidth=0.8, color='#cbd5e1')
+    ax.set_axisbelow(True)
+
+    # Mejorar ejes
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_color('#cbd5e1')
+    ax.spines['bottom'].set_color('#cbd5e1')
+    ax.tick_params(axis='x', labelsize=10, colors='#4b5563')
+
+    return _exportar(fig, formato)
+
+
+def generar_grafico_barras_apiladas(datos, titulo, colores=None, formato='png'):
+    """
+    Genera barras horizontales apiladas al 100% y retorna la imagen en base64.
+    Útil para distribuciones por niveles de varias escalas a la vez.
+
+    Args:
+        datos: dict con formato {'barra': {'segmento': porcentaje}}; todas las
+               barras con los mismos segmentos y en el mismo orden
+        titulo: str con el título del gráfico
+        colores: list de colores hexadecimales, uno por segmento (opcional)
+        formato: 'png' (200 DPI) o 'svg' (vectorial)
+
+    Returns:
+        str: imagen en formato base64
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    if not datos or not any(sum(segmentos.values()) > 0 for segmentos in datos.values()):
+        return None
+
+    labels = list(datos.keys())
+    segmentos = list(next(iter(datos.values())).keys())
+    valores = np.array([[datos[label].get(seg, 0) for seg in segmentos] for label in labels], dtype=float)
+
+    # De verde (bajo) a rojo (alto)
+    if not colores:
+        colores = ['#10b981', '#84cc16', '#eab308', '#f59e0b', '#f97316', '#ef4444']
+
+    altura = max(4, len(labels) * 0.8 + 2)
+    fig, ax = plt.subplots(figsize=(10, altura), facecolor='white')
+
+    y_pos = np.arange(len(labels))
+    izquierda = np.zeros(len(labels))
+    for j, seg in enumerate(segmentos):
+        bars = ax.barh(y_pos, valores[:, j], left=izquierda, color=colores[j % len(colores)],
+                       edgecolor='white', linewidth=1.5, height=0.65, label=seg)
+        # Porcentaje dentro del segmento si cabe
+        for bar, valor in zip(bars, valores[:, j]):
+            if valor >= 6:
+                ax.text(bar.get_x() + bar.get_width() / 2., bar.get_y() + bar.get_height() / 2.,
+                        f'{valor:.0f}%', ha='center', va='center', fontsize=9, weight='bold', color='white')
+        izquierda += valores[:, j]
+
+    ax.set_yticks(y_pos)
+    ax.set_yticklabels(labels, fontsize=10, color='#4b5563')
+    ax.invert_yaxis()
+    ax.set_xlim(0, 100)
+    ax.set_xlabel('Porcentaje de Trabajadores', fontsize=12, weight='600', color='#374151', labelpad=10)
+
+    # Leyenda entre el título y las barras
+    ax.set_title(titulo, fontsize=15, weight='bold', pad=40, color='#1f2937', family='sans-serif')
+    ax.legend(loc='lower center', bbox_to_anchor=(0.5, 1.0), ncol=min(len(segmentos), 6),
+              fontsize=9, frameon=False)
+
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_color('#cbd5e1')
+    ax.spines['bottom'].set_color('#cbd5e1')
+    ax.tick_params(axis='x', labelsize=10, colors='#4b5563')
+
+    return _exportar(fig, formato)
+
+
+GENERADORES = {
+    'pie': generar_grafico_pie,
+    'barras': generar_grafico_barras,
+    'barras_horizontales': generar_grafico_barras_horizontales,
+    'barras_apiladas': generar_grafico_barras_apiladas,
+}
+
+
+# ============================================================================
+# POOL DE PROCESOS
+# ============================================================================
+
+def _precalentar():
+    """Importa matplotlib y carga la caché de fuentes con un gráfico mínimo"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib import font_manager
+    from io import BytesIO
+
+    for weight in ('normal', 'bold'):
+        font_manager.findfont(font_manager.FontProperties(family='sans-serif', weight=weight))
+    fig, ax = plt.subplots(figsize=(1, 1))
+    ax.set_title('.', weight='bold')
+    fig.savefig(BytesIO(), format='png', dpi=50)
+    plt.close(fig)
+
+
+def _dibujar(tipo, args, kwargs):
+    return GENERADORES[tipo](*args, **kwargs)
+
+
+def _crear_pool():
+    """Crea el pool y lo calienta lanzando una tarea por proceso"""
+    global _pool
+    # Calentar en el padre antes del fork: los hijos heredan matplotlib
+    # y la caché de fuentes ya cargados
+    _precalentar()
+    _pool = ProcessPoolExecutor(
+        max_workers=GRAFICOS_PROCESOS,
+        mp_context=multiprocessing.get_context('fork'),
+        initializer=_precalentar
+    )
+    for futuro in [_pool.submit(int) for _ in range(GRAFICOS_PROCESOS)]:
+        futuro.result()
+    logger.info(f"✅ Pool de gráficos listo ({GRAFICOS_PROCESOS} procesos)")
+
+
+def _descartar_pool():
+    """
+    Cierra el pool y deja el dibujo en el proceso hasta reiniciar: recrearlo
+    sería un fork de un proceso que ya tiene hilos de fondo, y un hijo puede
+    quedar bloqueado en un lock heredado (logging, psycopg2).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def iniciar_pool_graficos():
+    """
+    Crea y calienta el pool al arrancar (antes de que haya hilos de fondo).
+    Es el único lugar donde se crea; con gevent crea el hilo nativo de dibujo.
+    """
+    global _pool, _hilo_gevent
+    with _pool_lock:
+        if _pool is not None or _hilo_gevent is not None:
+            return
+        if _EN_GEVENT:
+            from gevent.threadpool import ThreadPool
+            _hilo_gevent = ThreadPool(1)
+            _hilo_gevent.apply(_precalentar)
+            logger.info("✅ Gráficos en el threadpool de gevent (1 hilo nativo)")
+            return
+        if GRAFICOS_PROCESOS <= 0:
+            return
+        try:
+            _crear_pool()
+        except Exception as e:
+            logger.error(f"❌ No se pudo iniciar el pool de gráficos: {e}")
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+# ============================================================================
+# CACHÉ POR CONTENIDO
+# ============================================================================
+
+def clave_grafico(tipo, args, kwargs):
+    """
+    Hash del contenido de un gráfico. Los datos se serializan en su orden
+    (el orden de las etiquetas cambia el dibujo); las opciones, ordenadas.
+    """
+    contenido = json.dumps(
+        [GRAFICOS_ESTILO_VERSION, tipo, list(args), sorted(kwargs.items())],
+        ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def _ruta_disco(clave):
+    return os.path.join(GRAFICOS_CACHE_DIR, clave[:2], f"{clave}.txt")
+
+
+def _guardar_memoria(clave, imagen):
+    global _cache_bytes
+    limite = GRAFICOS_CACHE_MEMORIA_MB * 1024 * 1024
+    with _cache_lock:
+        if clave in _cache:
+            _cache.move_to_end(clave)
+            return
+        _cache[clave] = imagen
+        _cache_bytes += len(imagen)
+        while _cache_bytes > limite and _cache:
+            _, vieja = _cache.popitem(last=False)
+            _cache_bytes -= len(vieja)
+
+
+def _podar_disco():
+    """Borra los archivos menos usados hasta quedar bajo GRAFICOS_CACHE_DISCO_MB"""
+    archivos = []
+    for raiz, _, nombres in os.walk(GRAFICOS_CACHE_DIR):
+        for nombre in nombres:
+            ruta = os.path.join(raiz, nombre)
+            try:
+                st = os.stat(ruta)
+                archivos.append((st.st_atime, st.st_size, ruta))
+            except OSError:
+                pass
+    total = sum(tamano for _, tamano, _ in archivos)
+    limite = GRAFICOS_CACHE_DISCO_MB * 1024 * 1024
+    for _, tamano, ruta in sorted(archivos):
+        if total <= limite:
+            break
+        try:
+            os.remove(ruta)
+            total -= tamano
+        except OSError:
+            pass
+
+
+def _contar(clave, n=1):
+    with _cache_lock:
+        _metricas[clave] += n
+
+
+def leer_cache(clave):
+    """Imagen cacheada (memoria y luego disco) o None"""
+    with _cache_lock:
+        imagen = _cache.get(clave)
+        if imagen is not None:
+            _cache.move_to_end(clave)
+            _metricas['hits_memoria'] += 1
+            return imagen
+
+    try:
+        with open(_ruta_disco(clave), 'r', encoding='utf-8') as f:
+            imagen = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo leer el gráfico cacheado {clave[:12]}: {e}")
+        _contar('errores_disco')
+        return None
+
+    _contar('hits_disco')
+    _guardar_memoria(clave, imagen)
+    return imagen
+
+
+def guardar_cache(clave, imagen):
+    """Guarda en memoria y en disco (escritura atómica: otro proceso nunca lee un archivo a medias)"""
+    global _escrituras_disco
+    _guardar_memoria(clave, imagen)
+    ruta = _ruta_disco(clave)
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(imagen)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudo guardar el gráfico en disco: {e}")
+        _contar('errores_disco')
+        return
+
+    with _cache_lock:
+        _metricas['escrituras_disco'] += 1
+        _escrituras_disco += 1
+        podar = _escrituras_disco % 200 == 0
+    if podar:
+        _podar_disco()
+
+
+def obtener_metricas_graficos():
+    """Aciertos de la caché de gráficos en este proceso"""
+    with _cache_lock:
+        metricas = dict(_metricas)
+        metricas['entradas_memoria'] = len(_cache)
+        metricas['bytes_memoria'] = _cache_bytes
+    consultas = metricas['hits_memoria'] + metricas['hits_disco'] + metricas['misses']
+    metricas['tasa_aciertos'] = round((metricas['hits_memoria'] + metricas['hits_disco']) / consultas, 3) if consultas else None
+    metricas['procesos_pool'] = GRAFICOS_PROCESOS
+    metricas['pool_activo'] = _pool is not None
+    metricas['hilo_gevent'] = _hilo_gevent is not None
+    return metricas
+
+
+# ============================================================================
+# RENDER
+# ============================================================================
+
+def _dibujar_en_serie(trabajos):
+    return {clave: _dibujar(*trabajo) for clave, trabajo in trabajos.items()}
+
+
+def _dibujar_todos(trabajos):
+    pool = _pool
+    if pool is not None:
+        try:
+            futuros = {clave: pool.submit(_dibujar, *trabajo) for clave, trabajo in trabajos.items()}
+            return {clave: futuro.result(timeout=GRAFICOS_TIMEOUT_SEG) for clave, futuro in futuros.items()}
+        except (BrokenProcessPool, FuturesTimeoutError, OSError) as e:
+            # Un error de datos en un gráfico se propaga; aquí solo fallas del pool
+            logger.error(f"❌ Pool de gráficos falló, se dibuja en el proceso hasta reiniciar: {e!r}")
+            _descartar_pool()
+
+    if _hilo_gevent is not None:
+        # El greenlet espera sin bloquear el hub; un solo hilo, así que pyplot
+        # nunca dibuja dos informes a la vez
+        return _hilo_gevent.apply(_dibujar_en_serie, (trabajos,))
+    return _dibujar_en_serie(trabajos)
+
+
+def renderizar_graficos(trabajos, formato=None):
+    """
+    Dibuja varios gráficos en paralelo; los que ya están en caché no se redibujan.
+
+    Args:
+        trabajos: dict clave -> (tipo, args, kwargs); tipo es una clave de GENERADORES
+        formato: 'png' o 'svg' para todos los trabajos (None = lo que diga cada uno)
+
+    Returns:
+        dict: clave -> imagen base64 (o None), en el mismo orden que trabajos
+    """
+    if not trabajos:
+        return {}
+    if formato:
+        trabajos = {clave: (tipo, args, {**kwargs, 'formato': formato})
+                    for clave, (tipo, args, kwargs) in trabajos.items()}
+
+    hashes = {clave: clave_grafico(*trabajo) for clave, trabajo in trabajos.items()}
+    resultado = {clave: leer_cache(h) for clave, h in hashes.items()}
+    faltantes = {clave: trabajos[clave] for clave, imagen in resultado.items() if imagen is None}
+
+    if faltantes:
+        _contar('misses', len(faltantes))
+        for clave, imagen in _dibujar_todos(faltantes).items():
+            resultado[clave] = imagen
+            if imagen is not None:
+                guardar_cache(hashes[clave], imagen)
+
+    return resultado
@@ -0,0 +1,244 @@
+"""
+Riesgo Psicosocial ADC por Empresa
+==================================
+
+Vista agregada de las pruebas ADC (Ansiedad, Depresión, Congruencia) de los
+trabajadores de una empresa en un período: distribución de niveles por
+subdimensión y escala general, y cuántos quedan en riesgo alto.
+
+Califica todas las filas de "pruebasADC" de la empresa con la calificación
+por lotes de adc_scoring, leyendo con un cursor del lado del servidor por
+bloques de ADC_INFORME_LOTE filas: la memoria no crece con el tamaño de la
+empresa y no se arma un perfil por certificado.
+
+- calcular_riesgo_psicosocial(): consulta y agrega (endpoint y PDF)
+- trabajos_graficos_adc(): gráficos para renderizar_graficos del informe
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import time
+import logging
+
+import numpy as np
+
+from adc_scoring import (
+    codificar_respuestas, puntuar_lote, estandarizar_lote,
+    ANSIEDAD_ITEMS, DEPRESION_ITEMS, AREAS_CONGRUENCIA, COLUMNAS_ADC, ESCALAS_ADC, ETIQUETAS_NIVEL
+)
+from conexion_pg import obtener_conexion_pg
+
+logger = logging.getLogger(__name__)
+
+ADC_INFORME_LOTE = int(os.getenv("ADC_INFORME_LOTE", "5000"))
+
+# cooc37 no existe en PostgreSQL: codificar_respuestas la cuenta vacía
+COLUMNAS_PG = [col for col in COLUMNAS_ADC if col != 'cooc37']
+
+# Niveles de ansiedad/depresión general que cuentan como riesgo
+NIVELES_RIESGO = ('ALTO', 'MUY ALTO')
+
+_N_NIVELES = len(ETIQUETAS_NIVEL)
+_COL_ESCALA = {escala: i for i, escala in enumerate(ESCALAS_ADC)}
+
+
+# ============================================================================
+# AGREGACIÓN
+# ============================================================================
+
+def nuevo_acumulado():
+    """Conteos por escala x nivel, suma de estandarizados y riesgo, en cero"""
+    return {
+        'total': 0,
+        'niveles': np.zeros((len(ESCALAS_ADC), _N_NIVELES), dtype=np.int64),
+        'suma_estandarizado': np.zeros(len(ESCALAS_ADC), dtype=np.int64),
+        'congruencia': np.zeros((len(AREAS_CONGRUENCIA), _N_NIVELES), dtype=np.int64),
+        'riesgo_ansiedad': 0,
+        'riesgo_depresion': 0,
+        'riesgo_ambas': 0,
+    }
+
+
+def _conteos(indices):
+    """Matriz N x C de índices de nivel -> matriz C x niveles de conteos"""
+    columnas = indices.shape[1]
+    desplazados = indices + np.arange(columnas) * _N_NIVELES
+    return np.bincount(desplazados.ravel(), minlength=columnas * _N_NIVELES).reshape(columnas, _N_NIVELES)
+
+
+def agregar_lote(acumulado, filas, columnas=None):
+    """
+    Suma un bloque de pruebas al acumulado.
+
+    Args:
+        acumulado: dict de nuevo_acumulado()
+        filas: tuplas del cursor (con columnas) o dicts columna -> respuesta
+        columnas: nombres de las columnas de las tuplas
+    """
+    brutos = puntuar_lote(codificar_respuestas(filas, columnas))
+    if not len(brutos):
+        return acumulado
+    estandarizados, niveles, congruencia = estandarizar_lote(brutos)
+
+    acumulado['total'] += len(brutos)
+    acumulado['niveles'] += _conteos(niveles)
+    acumulado['suma_estandarizado'] += estandarizados.sum(axis=0)
+    acumulado['congruencia'] += _conteos(congruencia)
+
+    riesgo = np.isin(niveles, [ETIQUETAS_NIVEL.index(n) for n in NIVELES_RIESGO])
+    ansiedad = riesgo[:, _COL_ESCALA[("ansiedad", "general")]]
+    depresion = riesgo[:, _COL_ESCALA[("depresion", "general")]]
+    acumulado['riesgo_ansiedad'] += int(ansiedad.sum())
+    acumulado['riesgo_depresion'] += int(depresion.sum())
+    acumulado['riesgo_ambas'] += int((ansiedad & depresion).sum())
+    return acumulado
+
+
+def _porcentaje(cantidad, total):
+    return (cantidad / total * 100) if total > 0 else 0
+
+
+def _distribucion(conteos, total, suma=None):
+    distribucion = {
+        'niveles': {
+            etiqueta: {'cantidad': int(cantidad), 'porcentaje': _porcentaje(int(cantidad), total)}
+            for etiqueta, cantidad in zip(ETIQUETAS_NIVEL, conteos)
+        },
+    }
+    if suma is not None:
+        distribucion['promedioEstandarizado'] = round(int(suma) / total, 1) if total else 0
+    return distribucion
+
+
+def resumir(acumulado):
+    """Acumulado -> dict para JSON y template, con la forma del perfil ADC"""
+    total = acumulado['total']
+    niveles, sumas = acumulado['niveles'], acumulado['suma_estandarizado']
+
+    def escala(clave, nombre):
+        j = _COL_ESCALA[(clave, nombre)]
+        return _distribucion(niveles[j], total, sumas[j])
+
+    cantidad_alguna = acumulado['riesgo_ansiedad'] + acumulado['riesgo_depresion'] - acumulado['riesgo_ambas']
+    return {
+        'total': total,
+        'etiquetasNivel': list(ETIQUETAS_NIVEL),
+        'ansiedad': {
+            'subdimensiones': {nombre: escala('ansiedad', nombre) for nombre in ANSIEDAD_ITEMS},
+            'general': escala('ansiedad', 'general'),
+        },
+        'depresion': {
+            'subdimensiones': {nombre: escala('depresion', nombre) for nombre in DEPRESION_ITEMS},
+            'general': escala('depresion', 'general'),
+        },
+        'congruencia': {
+            'areas': {
+                nombre_area: {
+                    'valoracion': escala('congruencia', key_val),
+                    'conducta': escala('congruencia', key_con),
+                    'congruencia': _distribucion(acumulado['congruencia'][a], total),
+                }
+                for a, (nombre_area, key_val, key_con) in enumerate(AREAS_CONGRUENCIA)
+            },
+        },
+        'riesgo': {
+            'ansiedad': {'cantidad': acumulado['riesgo_ansiedad'],
+                         'porcentaje': _porcentaje(acumulado['riesgo_ansiedad'], total)},
+            'depresion': {'cantidad': acumulado['riesgo_depresion'],
+                          'porcentaje': _porcentaje(acumulado['riesgo_depresion'], total)},
+            'ambas': {'cantidad': acumulado['riesgo_ambas'],
+                      'porcentaje': _porcentaje(acumulado['riesgo_ambas'], total)},
+            'alguna': {'cantidad': cantidad_alguna, 'porcentaje': _porcentaje(cantidad_alguna, total)},
+        },
+    }
+
+
+# ============================================================================
+# CONSULTA
+# ============================================================================
+
+def calcular_riesgo_psicosocial(cod_empresa, fecha_inicio, fecha_fin):
+    """
+    Distribución de niveles ADC de los trabajadores atendidos de una empresa.
+
+    Toma la última prueba de cada orden cuya HistoriaClinica es de la empresa
+    y tiene fechaAtencion en el rango (el mismo filtro del informe).
+
+    Returns:
+        dict: resumir() + codEmpresa, fechaInicio, fechaFin y duracionMs
+    """
+    inicio = time.perf_counter()
+    acumulado = nuevo_acumulado()
+
+    conn = obtener_conexion_pg()
+    try:
+        # Cursor con nombre: PostgreSQL entrega las filas por bloques
+        cur = conn.cursor(name='informe_riesgo_adc')
+        cur.itersize = ADC_INFORME_LOTE
+        cur.execute(
+            f'''
+            SELECT DISTINCT ON (p.orden_id) {", ".join("p." + col for col in COLUMNAS_PG)}
+            FROM "pruebasADC" p
+            JOIN "HistoriaClinica" h ON h._id = p.orden_id
+            WHERE h."codEmpresa" = %s
+              AND h."fechaAtencion" >= %s::date
+              AND h."fechaAtencion" <= %s::date
+            ORDER BY p.orden_id, p.created_at DESC
+            ''',
+            (cod_empresa, fecha_inicio, fecha_fin)
+        )
+        while True:
+            filas = cur.fetchmany(ADC_INFORME_LOTE)
+            if not filas:
+                break
+            agregar_lote(acumulado, filas, COLUMNAS_PG)
+        cur.close()
+    finally:
+        conn.close()
+
+    resultado = resumir(acumulado)
+    resultado.update({
+        'codEmpresa': cod_empresa,
+        'fechaInicio': fecha_inicio,
+        'fechaFin': fecha_fin,
+        'duracionMs': round((time.perf_counter() - inicio) * 1000),
+    })
+    logger.info(f"🧠 Riesgo psicosocial ADC de {cod_empresa}: {resultado['total']} pruebas en {resultado['duracionMs']}ms")
+    return resultado
+
+
+# ============================================================================
+# GRÁFICOS
+# ============================================================================
+
+def _porcentajes(distribucion):
+    return {etiqueta: round(nivel['porcentaje'], 1) for etiqueta, nivel in distribucion['niveles'].items()}
+
+
+def trabajos_graficos_adc(resultado):
+    """
+    Trabajos de renderizar_graficos para la sección ADC del PDF: una barra
+    apilada por subdimensión (más la general) con el porcentaje en cada nivel.
+    """
+    if not resultado or not resultado.get('total'):
+        return {}
+
+    trabajos = {}
+    for clave, titulo in (('ansiedad', 'Ansiedad'), ('depresion', 'Depresión')):
+        escala = resultado[clave]
+        datos = {nombre: _porcentajes(dist) for nombre, dist in escala['subdimensiones'].items()}
+        datos['General'] = _porcentajes(escala['general'])
+        trabajos['adc_' + clave] = ('barras_apiladas', (
+            datos,
+            f'{titulo}: Niveles por Subdimensión',
+        ), {})
+
+    datos = {nombre: _porcentajes(area['congruencia']) for nombre, area in resultado['congruencia']['areas'].items()}
+    # En congruencia un nivel alto es favorable: de rojo a verde
+    trabajos['adc_congruencia'] = ('barras_apiladas', (
+        datos,
+        'Congruencia entre Valoración y Conducta',
+    ), {'colores': ['#ef4444', '#f97316', '#f59e0b', '#eab308', '#84cc16', '#10b981']})
+    return trabajos
@@ -1,49 +1,84 @@
 """
 Push Notifications Module for Expo Push Notifications
 Handles registration and sending of push notifications to iOS/Android devices
+
+- Tokens en Postgres (push_tokens), por agente, compartidos entre procesos.
+- send_new_message_notification solo encola: un despachador en segundo plano
+  agrupa las notificaciones de una misma conversación, envía a Expo en
+  bloques de 100 mensajes y guarda los tickets.
+- Los recibos se consultan ~15 min después; los tokens DeviceNotRegistered
+  se desactivan.
 """
 import requests
 import logging
 import json
 import os
+import threading
+import time
 from typing import List, Dict, Optional
 
+from conexion_pg import conectar_con_esquema
+
 logger = logging.getLogger(__name__)
 
-# Archivo para persistir tokens
+EXPO_PUSH_URL = 'https://exp.host/--/api/v2/push/send'
+EXPO_RECEIPTS_URL = 'https://exp.host/--/api/v2/push/getReceipts'
+EXPO_MAX_MENSAJES = 100          # límite de Expo por request de envío
+EXPO_MAX_RECIBOS = 1000          # límite de Expo por request de recibos
+
+PUSH_COALESCER_SEG = 2           # ventana para juntar mensajes de la misma conversación
+PUSH_RECIBOS_INTERVALO_SEG = 5 * 60
+PUSH_RECIBOS_ESPERA_SEG = 15 * 60  # Expo recomienda esperar ~15 min antes de pedir recibos
+PUSH_TICKETS_RETENCION_SEG = 24 * 3600  # Expo guarda los recibos 24 h
+
+# Archivo donde se guardaban los tokens antes de Postgres (se importa una vez)
 TOKENS_FILE = os.path.join(os.path.dirname(__file__), 'push_tokens.json')
 
-def load_tokens() -> Dict[str, Dict[str, str]]:
-    """Cargar tokens desde archivo JSON"""
-    try:
-        if os.path.exists(TOKENS_FILE):
-            with open(TOKENS_FILE, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logger.error(f"Error cargando tokens: {e}")
-        return {}
+_pendientes: Dict[str, Dict] = {}     # conversation_id -> notificación agrupada
+_pendientes_lock = threading.Lock()
+_despertar = threading.Event()
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_metricas = {'encoladas': 0, 'agrupadas': 0, 'enviadas': 0, 'errores': 0, 'tokens_desactivados': 0}
+_metricas_lock = threading.Lock()
+
 
-def save_tokens():
-    """Guardar tokens en archivo JSON"""
+def _importar_tokens_json(cur):
+    """Trae a Postgres los tokens de push_tokens.json (instalaciones anteriores)"""
+    if not os.path.exists(TOKENS_FILE):
+        return
     try:
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump(push_tokens, f, indent=2)
-        logger.info(f"✅ Tokens guardados en {TOKENS_FILE}")
+        with open(TOKENS_FILE, 'r') as f:
+            tokens = json.load(f)
+        for token, info in tokens.items():
+            cur.execute(
+                "INSERT INTO push_tokens (token, platform) VALUES (%s, %s) ON CONFLICT (token) DO NOTHING",
+                (token, (info or {}).get('platform', 'ios'))
+            )
+        os.replace(TOKENS_FILE, TOKENS_FILE + '.migrado')
+        logger.info(f"📦 {len(tokens)} tokens importados de {TOKENS_FILE}")
     except Exception as e:
-        logger.error(f"Error guardando tokens: {e}")
+        logger.error(f"Error importando tokens de {TOKENS_FILE}: {e}")
 
-# Cargar tokens al iniciar el módulo
-push_tokens: Dict[str, Dict[str, str]] = load_tokens()
-logger.info(f"📊 Tokens cargados al iniciar: {len(push_tokens)}")
 
-def register_push_token(token: str, platform: str = 'ios') -> bool:
+def _conectar():
+    """Conexión con las tablas garantizadas (se crean la primera vez en el proceso)"""
+    return conectar_con_esquema('init_push_tokens.sql', despues=_importar_tokens_json)
+
+
+def _contar(clave, n=1):
+    with _metricas_lock:
+        _metricas[clave] += n
+
+
+def register_push_token(token: str, platform: str = 'ios', agente: Optional[str] = None) -> bool:
     """
     Register a push notification token
 
     Args:
         token: Expo push token (format: ExponentPushToken[...])
         platform: Device platform ('ios' or 'android')
+        agente: Username of the agent that owns the device
 
     Returns:
         bool: True if successful
@@ -54,24 +89,126 @@ def register_push_token(token: str, platform: str = 'ios') -> bool:
             logger.error(f"Invalid Expo push token format: {token}")
             return False
 
-        # Store token
-        push_tokens[token] = {
-            'platform': platform,
-            'registered_at': str(__import__('datetime').datetime.now())
-        }
-
-        # ✅ Guardar tokens en archivo para persistencia
-        save_tokens()
-
-        logger.info(f"✅ Registered push token: {token[:20]}... (platform: {platform})")
-        logger.info(f"📊 Total registered tokens: {len(push_tokens)}")
+        # Un dispositivo que vuelve a registrarse se reactiva y pasa al agente actual
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO push_tokens (token, agente, platform)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (token) DO UPDATE
+                SET agente = EXCLUDED.agente, platform = EXCLUDED.platform, activo = true,
+                    ultimo_error = NULL, actualizado_en = CURRENT_TIMESTAMP
+                """,
+                (token, agente, platform)
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
 
+        logger.info(f"✅ Registered push token: {token[:20]}... (platform: {platform}, agente: {agente})")
         return True
     except Exception as e:
         logger.error(f"❌ Error registering push token: {e}")
         return False
 
 
+def _desactivar_tokens(errores: Dict[str, str]):
+    """Desactiva tokens que Expo rechazó de forma permanente (token -> código de error)"""
+    if not errores:
+        return
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        for token, error in errores.items():
+            cur.execute(
+                "UPDATE push_tokens SET activo = false, ultimo_error = %s, actualizado_en = CURRENT_TIMESTAMP WHERE token = %s",
+                (error, token)
+            )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    _contar('tokens_desactivados', len(errores))
+    logger.info(f"🧹 {len(errores)} push token(s) desactivados ({', '.join(sorted(set(errores.values())))})")
+
+
+def _enviar_mensajes(messages: List[Dict]) -> Dict:
+    """
+    Envía mensajes ya armados a Expo en bloques de 100, guarda los tickets
+    para revisar los recibos y desactiva los tokens DeviceNotRegistered.
+    """
+    success_count, failure_count, tickets, no_registrados = 0, 0, [], {}
+
+    for i in range(0, len(messages), EXPO_MAX_MENSAJES):
+        bloque = messages[i:i + EXPO_MAX_MENSAJES]
+        try:
+            response = requests.post(EXPO_PUSH_URL, json=bloque, timeout=10)
+            response.raise_for_status()
+            resultados = response.json().get('data', [])
+        except requests.exceptions.RequestException as e:
+            logger.error(f"❌ Error sending push notifications: {e}")
+            failure_count += len(bloque)
+            continue
+
+        for mensaje, resultado in zip(bloque, resultados):
+            if resultado.get('status') == 'ok':
+                success_count += 1
+                if resultado.get('id'):
+                    tickets.append((resultado['id'], mensaje['to']))
+            else:
+                failure_count += 1
+                error = (resultado.get('details') or {}).get('error')
+                if error == 'DeviceNotRegistered':
+                    no_registrados[mensaje['to']] = error
+
+    if tickets:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.executemany(
+                "INSERT INTO push_tickets (ticket_id, token) VALUES (%s, %s) ON CONFLICT (ticket_id) DO NOTHING",
+                tickets
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    _desactivar_tokens(no_registrados)
+
+    _contar('enviadas', success_count)
+    _contar('errores', failure_count)
+    logger.info(f"✅ Push: {success_count} enviados, {failure_count} fallidos ({len(messages)} mensajes)")
+    return {'success': success_count, 'failure': failure_count}
+
+
+def _tokens_activos() -> List[tuple]:
+    """[(token, agente)] de todos los dispositivos activos"""
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT token, agente FROM push_tokens WHERE activo")
+        filas = cur.fetchall()
+        cur.close()
+        return filas
+    finally:
+        conn.close()
+
+
+def _armar_mensaje(token: str, title: str, body: str, data: Optional[Dict]) -> Dict:
+    return {
+        'to': token,
+        'title': title,
+        'body': body,
+        'data': data or {},
+        'sound': 'default',
+        'priority': 'high',
+        'channelId': 'default',
+    }
+
+
 def send_push_notification(
     title: str,
     body: str,
@@ -79,89 +216,210 @@ def send_push_notification(
     tokens: Optional[List[str]] = None
 ) -> Dict:
     """
-    Send push notifications via Expo Push Notification API
+    Send push notifications via Expo Push Notification API (synchronous)
 
     Args:
         title: Notification title
         body: Notification body text
         data: Optional data payload
-        tokens: List of tokens to send to (if None, sends to all registered tokens)
+        tokens: List of tokens to send to (if None, sends to all active tokens)
 
     Returns:
-        dict: Response from Expo API with success/failure counts
+        dict: success/failure counts
     """
     try:
-        # Use provided tokens or all registered tokens
-        target_tokens = tokens if tokens else list(push_tokens.keys())
+        target_tokens = tokens if tokens else [token for token, _ in _tokens_activos()]
 
         if not target_tokens:
             logger.warning("⚠️ No push tokens registered, skipping notification")
             return {'success': 0, 'failure': 0}
 
-        # Prepare messages for Expo Push API
-        messages = []
-        for token in target_tokens:
-            messages.append({
-                'to': token,
-                'title': title,
-                'body': body,
-                'data': data or {},
-                'sound': 'default',
-                'priority': 'high',
-                'channelId': 'default',
-            })
-
-        # Send to Expo Push API
-        expo_api_url = 'https://exp.host/--/api/v2/push/send'
-        response = requests.post(expo_api_url, json=messages, timeout=10)
-        response.raise_for_status()
-
-        result = response.json()
-        logger.info(f"✅ Sent push notifications to {len(target_tokens)} device(s)")
-        logger.info(f"📊 Expo API response: {result}")
-
-        # Count successes and failures
-        success_count = sum(1 for r in result.get('data', []) if r.get('status') == 'ok')
-        failure_count = len(result.get('data', [])) - success_count
-
-        return {
-            'success': success_count,
-            'failure': failure_count,
-            'details': result
-        }
+        return _enviar_mensajes([_armar_mensaje(t, title, body, data) for t in target_tokens])
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ Error sending push notifications: {e}")
-        return {'success': 0, 'failure': len(target_tokens or []), 'error': str(e)}
     except Exception as e:
         logger.error(f"❌ Unexpected error in send_push_notification: {e}")
-        return {'success': 0, 'failure': len(target_tokens or []), 'error': str(e)}
+        return {'success': 0, 'failure': len(tokens or []), 'error': str(e)}
 
 
-def send_new_message_notification(sender_name: str, message_body: str, conversation_id: str) -> Dict:
+# ============================================================================
+# DESPACHADOR EN SEGUNDO PLANO
+# ============================================================================
+
+def send_new_message_notification(
+    sender_name: str,
+    message_body: str,
+    conversation_id: str,
+    agente: Optional[str] = None
+) -> Dict:
     """
-    Send a push notification for a new message
+    Queue a push notification for a new message (never blocks the caller)
+
+    Varios mensajes de la misma conversación dentro de la ventana de
+    PUSH_COALESCER_SEG salen como una sola notificación.
 
     Args:
         sender_name: Name of the message sender
         message_body: Text content of the message
         conversation_id: ID of the conversation (phone number)
+        agente: Agent assigned to the conversation (None = every device)
 
     Returns:
-        dict: Result from send_push_notification
+        dict: {'queued': True}
     """
-    title = f"Nuevo mensaje de {sender_name}"
-    body = message_body[:100]  # Truncate long messages
+    with _pendientes_lock:
+        pendiente = _pendientes.get(conversation_id)
+        if pendiente:
+            pendiente['count'] += 1
+            pendiente['body'] = message_body[:100]
+            pendiente['agente'] = agente
+            _contar('agrupadas')
+        else:
+            _pendientes[conversation_id] = {
+                'sender_name': sender_name,
+                'body': message_body[:100],  # Truncate long messages
+                'agente': agente,
+                'count': 1,
+            }
+    _contar('encoladas')
+    iniciar_dispatcher()
+    _despertar.set()
+    return {'queued': True}
 
-    data = {
-        'type': 'new_message',
-        'conversationId': conversation_id,
-        'senderName': sender_name,
-    }
 
-    return send_push_notification(title=title, body=body, data=data)
+def _despachar_pendientes():
+    with _pendientes_lock:
+        lote = dict(_pendientes)
+        _pendientes.clear()
+    if not lote:
+        return
+
+    dispositivos = _tokens_activos()
+    if not dispositivos:
+        logger.warning("⚠️ No push tokens registered, skipping notification")
+        return
+
+    messages = []
+    for conversation_id, n in lote.items():
+        if n['count'] > 1:
+            title = f"{n['count']} mensajes nuevos de {n['sender_name']}"
+        else:
+            title = f"Nuevo mensaje de {n['sender_name']}"
+        data = {
+            'type': 'new_message',
+            'conversationId': conversation_id,
+            'senderName': n['sender_name'],
+            'count': n['count'],
+        }
+        for token, agente_token in dispositivos:
+            # Tokens sin agente (registrados antes) reciben todo, como antes
+            if n['agente'] is None or agente_token is None or agente_token == n['agente']:
+                messages.append(_armar_mensaje(token, title, n['body'], data))
+
+    if messages:
+        _enviar_mensajes(messages)
+
+
+def revisar_recibos():
+    """
+    Consulta a Expo los recibos de los tickets con más de 15 min y desactiva
+    los tokens DeviceNotRegistered. Los tickets se reclaman con SKIP LOCKED
+    (varios procesos no revisan los mismos) y se borran al confirmar.
+    """
+    while True:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                DELETE FROM push_tickets
+                WHERE ticket_id IN (
+                    SELECT ticket_id FROM push_tickets
+                    WHERE enviado_en < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY enviado_en
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT %s
+                )
+                RETURNING ticket_id, token, enviado_en < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """,
+                (PUSH_RECIBOS_ESPERA_SEG, EXPO_MAX_RECIBOS, PUSH_TICKETS_RETENCION_SEG)
+            )
+            tickets = cur.fetchall()
+            if not tickets:
+                conn.commit()
+                return
+
+            vigentes = {ticket_id: token for ticket_id, token, vencido in tickets if not vencido}
+            if vigentes:
+                response = requests.post(EXPO_RECEIPTS_URL, json={'ids': list(vigentes)}, timeout=15)
+                response.raise_for_status()
+                recibos = response.json().get('data', {})
+
+                no_registrados = {}
+                for ticket_id, recibo in recibos.items():
+                    if recibo.get('status') == 'error':
+                        error = (recibo.get('details') or {}).get('error')
+                        logger.warning(f"⚠️ Recibo push con error ({error}): {recibo.get('message')}")
+                        if error == 'DeviceNotRegistered' and ticket_id in vigentes:
+                            no_registrados[vigentes[ticket_id]] = error
+                _desactivar_tokens(no_registrados)
+
+            # Si Expo falló, el rollback del finally devuelve los tickets a la tabla
+            conn.commit()
+            cur.close()
+            if len(tickets) < EXPO_MAX_RECIBOS:
+                return
+        finally:
+            conn.rollback()
+            conn.close()
+
+
+def _loop_dispatcher():
+    ultima_revision = 0
+    while True:
+        _despertar.wait(PUSH_RECIBOS_INTERVALO_SEG)
+        _despertar.clear()
+        # Deja que llegue el resto de la ráfaga para agruparla en una notificación
+        time.sleep(PUSH_COALESCER_SEG)
+        try:
+            _despachar_pendientes()
+        except Exception as e:
+            logger.error(f"❌ Error despachando push notifications: {e}")
+        if time.time() - ultima_revision > PUSH_RECIBOS_INTERVALO_SEG:
+            ultima_revision = time.time()
+            try:
+                revisar_recibos()
+            except Exception as e:
+                logger.error(f"❌ Error revisando recibos push: {e}")
+
+
+def iniciar_dispatcher():
+    """Arranca (una sola vez por proceso) el despachador de push"""
+    global _dispatcher
+    if _dispatcher is not None:
+        return
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            return
+        _dispatcher = threading.Thread(target=_loop_dispatcher, name="push-dispatcher", daemon=True)
+        _dispatcher.start()
+    logger.info("✅ Despachador de push notifications iniciado")
 
 
 def get_registered_tokens_count() -> int:
-    """Get the count of registered push tokens"""
-    return len(push_tokens)
+    """Get the count of active push tokens"""
+    try:
+        return len(_tokens_activos())
+    except Exception as e:
+        logger.error(f"Error contando push tokens: {e}")
+        return 0
+
+
+def obtener_metricas_push() -> Dict:
+    """Contadores del despachador en este proceso"""
+    with _pendientes_lock:
+        pendientes = len(_pendientes)
+    with _metricas_lock:
+        metricas = dict(_metricas)
+    metricas['pendientes'] = pendientes
+    metricas['dispatcher_activo'] = _dispatcher is not None
+    return metricas
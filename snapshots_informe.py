@@ -0,0 +1,143 @@
+"""
+Snapshots del Informe de Condiciones de Salud
+=============================================
+
+El flujo del frontend es ver informe → recomendaciones IA → PDF. Antes el
+PDF volvía a traer HistoriaClinica y FORMULARIO y a correr todos los
+contar_* para la misma empresa y rango. Ahora el endpoint JSON guarda lo que
+calculó bajo un id (informe_snapshots) y los otros dos pasos lo leen.
+
+- SNAPSHOT_VERSION: subirla cuando cambie el esquema de `estadisticas` o
+  de `riesgoPsicosocial`; los snapshots de otra versión se ignoran y el
+  llamador recalcula.
+- riesgoPsicosocial: la distribución ADC de la empresa en el rango
+  (informe_adc.calcular_riesgo_psicosocial), o None si no se pudo calcular.
+- Expiran a las INFORME_SNAPSHOT_TTL_HORAS; un LRU chico en memoria evita
+  la lectura a Postgres cuando los tres pasos caen en el mismo proceso.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+INFORME_SNAPSHOT_TTL_HORAS = int(os.getenv("INFORME_SNAPSHOT_TTL_HORAS", "24"))
+SNAPSHOTS_EN_MEMORIA = 32
+
+_memoria = OrderedDict()   # id -> snapshot
+_memoria_lock = threading.Lock()
+
+
+def _conectar():
+    """Conexión con la tabla garantizada (se crea la primera vez en el proceso)"""
+    return conectar_con_esquema('init_informe_snapshots.sql')
+
+
+def _recordar(snapshot):
+    with _memoria_lock:
+        _memoria[snapshot['id']] = snapshot
+        _memoria.move_to_end(snapshot['id'])
+        while len(_memoria) > SNAPSHOTS_EN_MEMORIA:
+            _memoria.popitem(last=False)
+
+
+def guardar_snapshot(cod_empresa, fecha_inicio, fecha_fin, empresa_info, total_atenciones, total_formularios,
+                     estadisticas, riesgo_psicosocial=None):
+    """
+    Guarda las estadísticas calculadas del informe y el riesgo psicosocial ADC.
+
+    Returns:
+        str: id del snapshot
+    """
+    snapshot_id = uuid.uuid4().hex
+    datos = {
+        'empresaInfo': empresa_info,
+        'totalAtenciones': total_atenciones,
+        'totalFormularios': total_formularios,
+        'estadisticas': estadisticas,
+        'riesgoPsicosocial': riesgo_psicosocial,
+    }
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO informe_snapshots (id, version, cod_empresa, fecha_inicio, fecha_fin, datos, expira_en)
+            VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(hours => %s))
+            """,
+            (snapshot_id, SNAPSHOT_VERSION, cod_empresa, fecha_inicio, fecha_fin,
+             json.dumps(datos, default=str), INFORME_SNAPSHOT_TTL_HORAS)
+        )
+        # Limpieza oportunista de los vencidos
+        cur.execute("DELETE FROM informe_snapshots WHERE expira_en < CURRENT_TIMESTAMP")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    _recordar({
+        'id': snapshot_id, 'codEmpresa': cod_empresa,
+        'fechaInicio': fecha_inicio, 'fechaFin': fecha_fin, **datos
+    })
+    logger.info(f"💾 Snapshot de informe {snapshot_id} guardado ({cod_empresa}, {fecha_inicio} - {fecha_fin})")
+    return snapshot_id
+
+
+def obtener_snapshot(snapshot_id):
+    """
+    Snapshot vigente y de la versión actual, o None (el llamador recalcula).
+
+    Returns:
+        dict: {id, codEmpresa, fechaInicio, fechaFin, empresaInfo,
+               totalAtenciones, totalFormularios, estadisticas, riesgoPsicosocial}
+    """
+    if not snapshot_id:
+        return None
+    with _memoria_lock:
+        snapshot = _memoria.get(snapshot_id)
+    if snapshot:
+        return snapshot
+
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT cod_empresa, fecha_inicio, fecha_fin, datos
+                FROM informe_snapshots
+                WHERE id = %s AND version = %s AND expira_en > CURRENT_TIMESTAMP
+                """,
+                (snapshot_id, SNAPSHOT_VERSION)
+            )
+            fila = cur.fetchone()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"❌ Error leyendo snapshot de informe {snapshot_id}: {e}")
+        return None
+
+    if not fila:
+        logger.info(f"⚠️ Snapshot de informe {snapshot_id} no existe, venció o es de otra versión")
+        return None
+
+    cod_empresa, fecha_inicio, fecha_fin, datos = fila
+    if isinstance(datos, str):
+        datos = json.loads(datos)
+    snapshot = {
+        'id': snapshot_id, 'codEmpresa': cod_empresa,
+        'fechaInicio': fecha_inicio, 'fechaFin': fecha_fin, **datos
+    }
+    _recordar(snapshot)
+    return snapshot
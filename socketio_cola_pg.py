@@ -0,0 +1,167 @@
+"""
+Cola de Mensajes Socket.IO sobre Postgres (LISTEN/NOTIFY)
+=========================================================
+
+Con varios procesos sirviendo Socket.IO cada uno solo conoce sus propios
+sockets: un emit hecho en el proceso A no llega a un agente conectado al
+proceso B. python-socketio resuelve esto con un "client manager" de pub/sub
+(Redis, Kafka, ...); este módulo implementa el mismo contrato sobre la base
+Postgres que ya usamos, para no depender de un Redis extra.
+
+- _publish: NOTIFY en el canal con el mensaje en JSON. Los payloads que
+  superan el límite de NOTIFY (8000 bytes) se guardan en socketio_mensajes
+  y se notifica solo la referencia.
+- _listen: una conexión dedicada en LISTEN que entrega los mensajes al
+  hilo de python-socketio; se reconecta sola si se cae.
+
+Configuración (SOCKETIO_MESSAGE_QUEUE):
+- vacío          → sin cola, un solo proceso (comportamiento anterior)
+- redis://...    → RedisManager de python-socketio (requiere el paquete redis)
+- postgres       → PostgresManager de este módulo
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import re
+import json
+import logging
+import select
+import threading
+import time
+
+import socketio
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE", "").strip()
+SOCKETIO_CANAL = os.getenv("SOCKETIO_CANAL", "socketio")
+NOTIFY_MAX_BYTES = 7900                # NOTIFY admite hasta 8000 bytes de payload
+RETENCION_DESBORDE_SEG = 10 * 60       # los payloads grandes se borran a los 10 min
+LISTEN_TIMEOUT_SEG = 30
+
+
+# ============================================================================
+# CLIENT MANAGER
+# ============================================================================
+
+class PostgresManager(socketio.PubSubManager):
+    """
+    Client manager de python-socketio que usa LISTEN/NOTIFY como bus entre
+    procesos. Se pasa a SocketIO(client_manager=...).
+    """
+
+    name = 'postgres'
+
+    def __init__(self, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        # El canal de NOTIFY es un identificador SQL: solo letras, dígitos y _
+        self.canal_pg = re.sub(r'\W', '_', channel).lower()
+        self._conn_publicar = None
+        self._lock_publicar = threading.Lock()
+        self._desbordes = 0
+
+    def _conectar(self):
+        conn = conectar_con_esquema('init_socketio_cola_pg.sql')
+        conn.autocommit = True
+        return conn
+
+    def _notificar(self, cur, payload):
+        if len(payload.encode('utf-8')) > NOTIFY_MAX_BYTES:
+            cur.execute("INSERT INTO socketio_mensajes (payload) VALUES (%s) RETURNING id", (payload,))
+            payload = json.dumps({'_ref': cur.fetchone()[0]})
+            self._desbordes += 1
+            if self._desbordes % 100 == 0:
+                cur.execute(
+                    "DELETE FROM socketio_mensajes WHERE creado_en < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                    (RETENCION_DESBORDE_SEG,)
+                )
+        cur.execute("SELECT pg_notify(%s, %s)", (self.canal_pg, payload))
+
+    def _publish(self, data):
+        payload = json.dumps(data, default=str)
+        with self._lock_publicar:
+            for intento in range(2):
+                try:
+                    if self._conn_publicar is None or self._conn_publicar.closed:
+                        self._conn_publicar = self._conectar()
+                    cur = self._conn_publicar.cursor()
+                    self._notificar(cur, payload)
+                    cur.close()
+                    return
+                except Exception as e:
+                    # Conexión rota (reinicio de la BD, timeout de red): se reabre una vez
+                    logger.warning(f"⚠️ Error publicando en la cola Socket.IO (intento {intento + 1}): {e}")
+                    try:
+                        self._conn_publicar.close()
+                    except Exception:
+                        pass
+                    self._conn_publicar = None
+            logger.error("❌ No se pudo publicar el mensaje Socket.IO en Postgres")
+
+    def _resolver(self, cur, payload):
+        """Convierte la notificación en el mensaje original (leyendo el desborde si hace falta)"""
+        mensaje = json.loads(payload)
+        if isinstance(mensaje, dict) and '_ref' in mensaje:
+            cur.execute("SELECT payload FROM socketio_mensajes WHERE id = %s", (mensaje['_ref'],))
+            fila = cur.fetchone()
+            if not fila:
+                return None
+            mensaje = json.loads(fila[0])
+        return mensaje
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = self._conectar()
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {self.canal_pg}")
+                logger.info(f"✅ Escuchando la cola Socket.IO en Postgres (canal {self.canal_pg})")
+                while True:
+                    if select.select([conn], [], [], LISTEN_TIMEOUT_SEG) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notificacion = conn.notifies.pop(0)
+                        try:
+                            mensaje = self._resolver(cur, notificacion.payload)
+                        except Exception as e:
+                            logger.error(f"❌ Mensaje Socket.IO ilegible en la cola: {e}")
+                            continue
+                        if mensaje is not None:
+                            yield mensaje
+            except Exception as e:
+                logger.error(f"❌ Conexión LISTEN de la cola Socket.IO caída, reconectando: {e}")
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+def opciones_cola_socketio(url=None):
+    """
+    Argumentos extra para SocketIO(...) según SOCKETIO_MESSAGE_QUEUE.
+
+    Returns:
+        dict: {} sin cola, {'message_queue': url} para Redis o
+              {'client_manager': PostgresManager} para Postgres
+    """
+    url = SOCKETIO_MESSAGE_QUEUE if url is None else url
+    if not url:
+        return {}
+    if url.lower() in ('postgres', 'postgresql', 'pg'):
+        logger.info("📡 Socket.IO con cola de mensajes en Postgres (LISTEN/NOTIFY)")
+        return {'client_manager': PostgresManager(channel=SOCKETIO_CANAL)}
+    logger.info(f"📡 Socket.IO con cola de mensajes: {url.split('@')[-1]}")
+    return {'message_queue': url, 'channel': SOCKETIO_CANAL}
@@ -0,0 +1,34 @@
+-- ============================================================================
+-- QUITAR EL SNAPSHOT DEL CERTIFICADO
+-- ============================================================================
+--
+-- Deshace sql/init_certificado_snapshot.sql: borra los triggers de las tablas
+-- de origen, sus funciones y las tablas del snapshot. Con
+-- CERT_SNAPSHOT_ENABLED desactivado los triggers ya no escriben
+-- (certificado_snapshot_config.activo = false); este script los elimina.
+--
+-- Uso: psql -f sql/drop_certificado_snapshot.sql
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+DO $$
+DECLARE
+    trigger_origen RECORD;
+BEGIN
+    FOR trigger_origen IN
+        SELECT tgname, tgrelid::regclass AS tabla
+        FROM pg_trigger
+        WHERE tgname LIKE 'trg\_certificado\_snapshot\_%' AND NOT tgisinternal
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %s', trigger_origen.tgname, trigger_origen.tabla);
+    END LOOP;
+END;
+$$;
+
+DROP FUNCTION IF EXISTS certificado_snapshot_encolar();
+DROP FUNCTION IF EXISTS certificado_snapshot_encolar_por_historia();
+
+DROP TABLE IF EXISTS certificado_snapshot_config;
+DROP TABLE IF EXISTS certificado_snapshot;
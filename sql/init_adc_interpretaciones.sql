@@ -0,0 +1,36 @@
+-- ============================================================================
+-- INTERPRETACIONES ADC ALMACENADAS POR ORDEN
+-- ============================================================================
+--
+-- Perfil ADC calculado e interpretación IA de cada orden, generados una vez
+-- por el worker de adc_interpretaciones.py. El certificado solo lee esta
+-- fila: todos los renders muestran el mismo texto y ninguno espera a OpenAI.
+--
+-- Tablas creadas:
+-- - adc_interpretaciones: Una fila por orden_id, ligada a la versión de las
+--   respuestas de "pruebasADC"
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS adc_interpretaciones (
+    orden_id VARCHAR(100) PRIMARY KEY,
+    version CHAR(64) NOT NULL,
+    perfil JSON NOT NULL,
+    interpretacion_ia JSON,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    ultimo_error TEXT,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    generado_en TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_adc_interpretaciones_pendientes
+    ON adc_interpretaciones(proximo_intento) WHERE estado <> 'listo';
+
+COMMENT ON COLUMN adc_interpretaciones.version IS 'sha256 de las respuestas de "pruebasADC": si la prueba cambia, la fila se regenera';
+COMMENT ON COLUMN adc_interpretaciones.perfil IS 'Salida de calcular_perfil_adc (JSON y no JSONB: conserva el orden de subdimensiones del certificado)';
+COMMENT ON COLUMN adc_interpretaciones.estado IS 'pendiente | generando | listo | error (se reintenta hasta 3 veces)';
@@ -0,0 +1,96 @@
+-- ============================================================================
+-- ASIGNACIÓN ROUND-ROBIN ATÓMICA DE CONVERSACIONES WHATSAPP
+-- ============================================================================
+--
+-- Reemplaza el flujo de 4 viajes (SELECT ... FOR UPDATE del contador, UPDATE
+-- del contador, SELECT de la conversación, INSERT/UPDATE) por una sola llamada:
+--
+--     SELECT asignar_conversacion_round_robin('573001234567');
+--
+-- - Los agentes activos viven en la tabla agentes_chat (antes: dict AGENTES).
+-- - El turno sale de una secuencia: nextval no bloquea filas, así que dos
+--   conversaciones nuevas ya no esperan una detrás de otra por el contador.
+-- - Un advisory lock por celular evita que dos webhooks simultáneos del mismo
+--   número nuevo creen dos filas o gasten dos turnos.
+--
+-- Tablas / objetos creados:
+-- - agentes_chat
+-- - asignacion_round_robin_seq
+-- - asignar_conversacion_round_robin(celular)
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS agentes_chat (
+    username VARCHAR(50) PRIMARY KEY,
+    nombre VARCHAR(100),
+    activo BOOLEAN NOT NULL DEFAULT true,
+    orden INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE SEQUENCE IF NOT EXISTS asignacion_round_robin_seq;
+
+-- La primera vez la secuencia continúa donde quedó el contador anterior
+DO $$
+BEGIN
+    IF NOT (SELECT is_called FROM asignacion_round_robin_seq)
+       AND to_regclass('sistema_asignacion') IS NOT NULL THEN
+        PERFORM setval('asignacion_round_robin_seq', valor + 1, false)
+        FROM sistema_asignacion
+        WHERE clave = 'contador_round_robin';
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION asignar_conversacion_round_robin(p_celular VARCHAR)
+RETURNS VARCHAR AS $$
+DECLARE
+    v_agente VARCHAR;
+    v_turno BIGINT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('asignacion:' || p_celular));
+
+    -- Otro webhook del mismo número pudo asignarlo mientras esperábamos
+    SELECT agente_asignado INTO v_agente
+    FROM conversaciones_whatsapp
+    WHERE celular = p_celular AND agente_asignado IS NOT NULL
+    LIMIT 1;
+    IF v_agente IS NOT NULL THEN
+        RETURN v_agente;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM agentes_chat WHERE activo) THEN
+        RAISE EXCEPTION 'No hay agentes activos disponibles';
+    END IF;
+
+    v_turno := nextval('asignacion_round_robin_seq') - 1;
+
+    SELECT username INTO v_agente
+    FROM (
+        SELECT username,
+               row_number() OVER (ORDER BY orden, username) - 1 AS posicion,
+               count(*) OVER () AS total
+        FROM agentes_chat
+        WHERE activo
+    ) activos
+    WHERE posicion = v_turno % total;
+
+    UPDATE conversaciones_whatsapp
+    SET agente_asignado = v_agente,
+        fecha_asignacion = CURRENT_TIMESTAMP,
+        fecha_ultima_actividad = CURRENT_TIMESTAMP
+    WHERE celular = p_celular;
+
+    IF NOT FOUND THEN
+        INSERT INTO conversaciones_whatsapp (celular, agente_asignado, estado)
+        VALUES (p_celular, v_agente, 'activa');
+    END IF;
+
+    RETURN v_agente;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON TABLE agentes_chat IS 'Agentes del chat WhatsApp que reciben conversaciones por round-robin';
+COMMENT ON COLUMN agentes_chat.activo IS 'false = no recibe conversaciones nuevas';
+COMMENT ON COLUMN agentes_chat.orden IS 'Orden dentro del ciclo round-robin';
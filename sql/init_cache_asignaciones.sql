@@ -0,0 +1,36 @@
+-- ============================================================================
+-- NOTIFY DE ASIGNACIONES DE CONVERSACIONES WHATSAPP
+-- ============================================================================
+--
+-- Cada proceso del chat mantiene en memoria el mapa celular -> agente
+-- (ver cache_asignaciones.py). Este trigger avisa por el canal
+-- 'asignacion_conversacion' cada vez que una conversación cambia de agente,
+-- venga el cambio de donde venga (otro worker, la plataforma, un UPDATE manual),
+-- para que los demás procesos actualicen su cache.
+--
+-- Payload: {"celular": "...", "agente": "..."}
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION notificar_asignacion_conversacion() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.agente_asignado IS DISTINCT FROM OLD.agente_asignado THEN
+        PERFORM pg_notify(
+            'asignacion_conversacion',
+            json_build_object('celular', NEW.celular, 'agente', NEW.agente_asignado)::text
+        );
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notificar_asignacion ON conversaciones_whatsapp;
+CREATE TRIGGER trg_notificar_asignacion
+    AFTER INSERT OR UPDATE OF agente_asignado ON conversaciones_whatsapp
+    FOR EACH ROW EXECUTE FUNCTION notificar_asignacion_conversacion();
+
+-- La carga inicial del cache solo lee conversaciones con agente
+CREATE INDEX IF NOT EXISTS idx_conversaciones_con_agente
+    ON conversaciones_whatsapp(celular) WHERE agente_asignado IS NOT NULL;
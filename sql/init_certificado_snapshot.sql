@@ -0,0 +1,153 @@
+-- ============================================================================
+-- SNAPSHOT DEL CERTIFICADO POR ORDEN
+-- ============================================================================
+--
+-- Documento listo para renderizar certificado_medico.html, uno por orden.
+-- Lo construye el worker de certificado_snapshot.py; el preview del
+-- certificado lee una fila en vez de consultar una docena de tablas.
+--
+-- Los triggers marcan el snapshot como desactualizado (cambios + 1) y avisan
+-- por NOTIFY cuando cambia cualquier fila de origen. Un snapshot está al día
+-- cuando construido_con = cambios.
+--
+-- Tablas creadas:
+-- - certificado_snapshot: Una fila por orden_id (_id de HistoriaClinica)
+-- - certificado_snapshot_config: Una sola fila; activo = false apaga los
+--   triggers (la app lo pone en false al arrancar con CERT_SNAPSHOT_ENABLED
+--   desactivado). Para quitarlos del todo: sql/drop_certificado_snapshot.sql
+--
+-- Funciones/triggers:
+-- - certificado_snapshot_encolar(columna): tablas con el id de la orden
+-- - certificado_snapshot_encolar_por_historia(columna, columna_historia):
+--   tablas ligadas a HistoriaClinica por otra columna (médico, tenant, ...)
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS certificado_snapshot (
+    orden_id VARCHAR(100) PRIMARY KEY,
+    documento JSON,
+    cambios BIGINT NOT NULL DEFAULT 1,
+    construido_con BIGINT NOT NULL DEFAULT 0,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    ultimo_error TEXT,
+    cambio_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    construido_en TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_certificado_snapshot_pendientes
+    ON certificado_snapshot(cambio_en) WHERE construido_con < cambios;
+
+COMMENT ON COLUMN certificado_snapshot.documento IS 'datos_certificado sin los campos de cada render (JSON y no JSONB: conserva el orden de las claves)';
+COMMENT ON COLUMN certificado_snapshot.cambios IS 'Contador que suben los triggers de las tablas de origen';
+COMMENT ON COLUMN certificado_snapshot.construido_con IS 'Valor de cambios leído antes de ensamblar el documento guardado';
+
+CREATE TABLE IF NOT EXISTS certificado_snapshot_config (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    activo BOOLEAN NOT NULL DEFAULT true
+);
+
+-- Este script solo corre con CERT_SNAPSHOT_ENABLED: (re)activa los triggers
+INSERT INTO certificado_snapshot_config (id, activo) VALUES (true, true)
+ON CONFLICT (id) DO UPDATE SET activo = true;
+
+-- Tablas que guardan el id de la orden: crea o marca el snapshot
+CREATE OR REPLACE FUNCTION certificado_snapshot_encolar() RETURNS TRIGGER AS $$
+DECLARE
+    fila JSONB;
+    orden VARCHAR(100);
+BEGIN
+    IF NOT COALESCE((SELECT activo FROM certificado_snapshot_config), false) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        fila := to_jsonb(OLD);
+    ELSE
+        fila := to_jsonb(NEW);
+    END IF;
+    orden := fila ->> TG_ARGV[0];
+    IF orden IS NULL OR orden = '' THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO certificado_snapshot (orden_id) VALUES (orden)
+    ON CONFLICT (orden_id) DO UPDATE
+    SET cambios = certificado_snapshot.cambios + 1, cambio_en = CURRENT_TIMESTAMP, intentos = 0;
+
+    PERFORM pg_notify('certificado_snapshot', orden);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Tablas compartidas por muchas órdenes: marca solo los snapshots que existen
+CREATE OR REPLACE FUNCTION certificado_snapshot_encolar_por_historia() RETURNS TRIGGER AS $$
+DECLARE
+    fila JSONB;
+    valor TEXT;
+    marcados INTEGER;
+BEGIN
+    IF NOT COALESCE((SELECT activo FROM certificado_snapshot_config), false) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        fila := to_jsonb(OLD);
+    ELSE
+        fila := to_jsonb(NEW);
+    END IF;
+    valor := fila ->> TG_ARGV[0];
+    IF valor IS NULL OR valor = '' THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format(
+        'UPDATE certificado_snapshot s
+         SET cambios = s.cambios + 1, cambio_en = CURRENT_TIMESTAMP, intentos = 0
+         FROM "HistoriaClinica" h
+         WHERE h._id = s.orden_id AND h.%I::text = $1',
+        TG_ARGV[1]
+    ) USING valor;
+    GET DIAGNOSTICS marcados = ROW_COUNT;
+
+    IF marcados > 0 THEN
+        PERFORM pg_notify('certificado_snapshot', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers en las tablas de origen (solo las que existen y una sola vez)
+DO $$
+DECLARE
+    origen RECORD;
+BEGIN
+    FOR origen IN
+        SELECT * FROM (VALUES
+            ('"HistoriaClinica"', 'historia', 'certificado_snapshot_encolar', '''_id'''),
+            ('formularios', 'formularios', 'certificado_snapshot_encolar', '''wix_id'''),
+            ('formularios', 'formularios_numero_id', 'certificado_snapshot_encolar_por_historia', '''numero_id'', ''numeroId'''),
+            ('audiometrias', 'audiometrias', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('visiometrias', 'visiometrias', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('visiometrias_virtual', 'visiometrias_virtual', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('voximetrias_virtual', 'voximetrias_virtual', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('laboratorios', 'laboratorios', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('"pruebasADC"', 'pruebas_adc', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('adc_interpretaciones', 'adc_interpretaciones', 'certificado_snapshot_encolar', '''orden_id'''),
+            ('medicos', 'medicos', 'certificado_snapshot_encolar_por_historia', '''alias'', ''medico'''),
+            ('tenants', 'tenants', 'certificado_snapshot_encolar_por_historia', '''id'', ''tenant_id'''),
+            ('empresas', 'empresas', 'certificado_snapshot_encolar_por_historia', '''cod_empresa'', ''codEmpresa''')
+        ) AS t(tabla, sufijo, funcion, argumentos)
+    LOOP
+        IF to_regclass(origen.tabla) IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgname = 'trg_certificado_snapshot_' || origen.sufijo
+              AND tgrelid = to_regclass(origen.tabla)
+        ) THEN
+            EXECUTE format(
+                'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %s FOR EACH ROW EXECUTE FUNCTION %I(%s)',
+                'trg_certificado_snapshot_' || origen.sufijo, origen.tabla, origen.funcion, origen.argumentos
+            );
+        END IF;
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,44 @@
+-- ============================================================================
+-- COLA DURABLE DE EVENTOS DE WEBHOOK (WHAPI)
+-- ============================================================================
+--
+-- Los webhooks de Whapi solo validan, encolan aquí y responden 200. Los
+-- workers de cola_webhooks.py procesan cada evento (asignación, store,
+-- WebSocket, push) en orden por conversación.
+--
+-- Tablas creadas:
+-- - webhook_eventos: Una fila por mensaje o cambio de estado (idempotente por evento_id)
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS webhook_eventos (
+    id BIGSERIAL PRIMARY KEY,
+    evento_id VARCHAR(200) UNIQUE NOT NULL,
+    tipo VARCHAR(20) NOT NULL,
+    clave_orden VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    bloqueado_en TIMESTAMP,
+    ultimo_error TEXT,
+    recibido_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    procesado_en TIMESTAMP
+);
+
+-- Los workers solo miran eventos sin terminar
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_abiertos
+    ON webhook_eventos(clave_orden, id)
+    WHERE estado IN ('pendiente', 'procesando');
+
+-- Limpieza y métricas de latencia
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_procesado
+    ON webhook_eventos(procesado_en)
+    WHERE estado = 'procesado';
+
+COMMENT ON TABLE webhook_eventos IS 'Cola durable de eventos de webhook de Whapi';
+COMMENT ON COLUMN webhook_eventos.evento_id IS 'msg:<id Whapi> o st:<id>:<estado>: un reenvío de Whapi no se procesa dos veces';
+COMMENT ON COLUMN webhook_eventos.clave_orden IS 'Celular de la conversación: los eventos de una misma conversación se procesan en orden';
+COMMENT ON COLUMN webhook_eventos.estado IS 'pendiente, procesando, procesado, fallido';
@@ -0,0 +1,34 @@
+-- ============================================================================
+-- ANTI-REENVÍO DE CERTIFICADOS POR WHATSAPP
+-- ============================================================================
+--
+-- Ventana de de-duplicación compartida entre procesos: una fila por orden
+-- con el último envío. Las filas que ya salieron de la ventana se purgan y
+-- sus duplicados evitados se acumulan en el total histórico.
+--
+-- Tablas creadas:
+-- - envios_certificado_dedupe
+-- - envios_certificado_dedupe_totales
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS envios_certificado_dedupe (
+    wix_id VARCHAR(100) PRIMARY KEY,
+    sent_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    duplicados_evitados INTEGER NOT NULL DEFAULT 0
+);
+
+-- Purga de filas fuera de la ventana
+CREATE INDEX IF NOT EXISTS idx_envios_certificado_dedupe_sent_at ON envios_certificado_dedupe(sent_at);
+
+CREATE TABLE IF NOT EXISTS envios_certificado_dedupe_totales (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    duplicados_evitados BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO envios_certificado_dedupe_totales (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE envios_certificado_dedupe IS 'Último envío de certificado por orden (ventana anti-reenvío)';
+COMMENT ON TABLE envios_certificado_dedupe_totales IS 'Duplicados evitados de las filas ya purgadas (una sola fila)';
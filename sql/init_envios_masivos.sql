@@ -0,0 +1,50 @@
+-- ============================================================================
+-- TRABAJOS DE ENVÍO MASIVO DE CERTIFICADOS
+-- ============================================================================
+--
+-- Progreso y resultado por orden de cada envío masivo por WhatsApp. Vive en
+-- PostgreSQL para que el reporte se pueda consultar desde cualquier
+-- instancia, no solo desde la que lanzó el trabajo.
+--
+-- Tablas creadas:
+-- - envios_masivos_trabajos
+-- - envios_masivos_resultados
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS envios_masivos_trabajos (
+    id VARCHAR(12) PRIMARY KEY,
+    estado VARCHAR(20) NOT NULL DEFAULT 'en_curso',
+    descripcion JSONB NOT NULL DEFAULT '{}',
+    total INTEGER NOT NULL,
+    procesados INTEGER NOT NULL DEFAULT 0,
+    enviados INTEGER NOT NULL DEFAULT 0,
+    duplicados INTEGER NOT NULL DEFAULT 0,
+    sin_pago INTEGER NOT NULL DEFAULT 0,
+    errores INTEGER NOT NULL DEFAULT 0,
+    inicio TIMESTAMPTZ NOT NULL DEFAULT now(),
+    fin TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS envios_masivos_resultados (
+    id BIGSERIAL PRIMARY KEY,
+    trabajo_id VARCHAR(12) NOT NULL REFERENCES envios_masivos_trabajos(id) ON DELETE CASCADE,
+    historia_id VARCHAR(100),
+    resultado VARCHAR(20) NOT NULL,
+    status INTEGER,
+    sid VARCHAR(40),
+    message TEXT,
+    segundos NUMERIC(10, 2)
+);
+
+CREATE INDEX IF NOT EXISTS idx_envios_masivos_resultados_trabajo ON envios_masivos_resultados(trabajo_id, id);
+
+-- Purga de trabajos viejos
+CREATE INDEX IF NOT EXISTS idx_envios_masivos_trabajos_inicio ON envios_masivos_trabajos(inicio);
+
+COMMENT ON TABLE envios_masivos_trabajos IS 'Envíos masivos de certificados por WhatsApp y sus contadores';
+COMMENT ON COLUMN envios_masivos_trabajos.estado IS 'en_curso o completado';
+COMMENT ON TABLE envios_masivos_resultados IS 'Resultado por orden de un envío masivo';
+COMMENT ON COLUMN envios_masivos_resultados.resultado IS 'enviados, duplicados, sin_pago o errores';
@@ -0,0 +1,32 @@
+-- ============================================================================
+-- SNAPSHOTS DEL INFORME DE CONDICIONES DE SALUD
+-- ============================================================================
+--
+-- /api/informe-condiciones-salud guarda aquí las estadísticas que calculó
+-- (con SVE y datos de la empresa) y devuelve el id. El PDF y las
+-- recomendaciones IA reciben ese id y no vuelven a consultar HistoriaClinica
+-- ni FORMULARIO: el flujo ver → IA → PDF consulta la base una sola vez.
+--
+-- Tablas creadas:
+-- - informe_snapshots: Un snapshot por cálculo del informe (expira a las 24 h)
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS informe_snapshots (
+    id VARCHAR(40) PRIMARY KEY,
+    version INTEGER NOT NULL,
+    cod_empresa VARCHAR(100) NOT NULL,
+    fecha_inicio VARCHAR(20) NOT NULL,
+    fecha_fin VARCHAR(20) NOT NULL,
+    datos JSONB NOT NULL,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expira_en TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_informe_snapshots_expira
+    ON informe_snapshots(expira_en);
+
+COMMENT ON COLUMN informe_snapshots.version IS 'Versión del esquema de estadísticas: un snapshot de otra versión se ignora y se recalcula';
+COMMENT ON COLUMN informe_snapshots.datos IS 'empresaInfo, totalAtenciones, totalFormularios y estadisticas (incluye sve)';
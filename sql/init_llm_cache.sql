@@ -0,0 +1,34 @@
+-- ============================================================================
+-- CACHÉ PERSISTENTE DE RESPUESTAS LLM
+-- ============================================================================
+--
+-- cache_llm.completar_chat guarda aquí cada respuesta de OpenAI bajo el hash
+-- de (modelo, system, prompt, parámetros). Un informe repetido o un
+-- certificado re-renderizado con el mismo prompt no vuelve a llamar a la API.
+--
+-- Tablas creadas:
+-- - llm_cache: Una respuesta por clave, con su usage y vencimiento
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS llm_cache (
+    clave CHAR(64) PRIMARY KEY,
+    modelo VARCHAR(50) NOT NULL,
+    respuesta TEXT NOT NULL,
+    usage JSONB NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultimo_hit TIMESTAMP,
+    expira_en TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_cache_expira
+    ON llm_cache(expira_en);
+
+CREATE INDEX IF NOT EXISTS idx_llm_cache_modelo
+    ON llm_cache(modelo);
+
+COMMENT ON COLUMN llm_cache.clave IS 'sha256 de [modelo, system, prompt, {max_tokens, temperature}]';
+COMMENT ON COLUMN llm_cache.usage IS 'Tokens de la llamada original: lo que se ahorra en cada hit';
@@ -0,0 +1,42 @@
+-- ============================================================================
+-- TOKENS Y TICKETS DE NOTIFICACIONES PUSH (EXPO)
+-- ============================================================================
+--
+-- Reemplaza push_tokens.json: los tokens viven en Postgres, por agente, y
+-- los comparten todos los procesos. El despachador de push_notifications.py
+-- guarda los tickets de Expo para consultar los recibos más tarde y desactivar
+-- los tokens que Expo reporta como DeviceNotRegistered.
+--
+-- Tablas creadas:
+-- - push_tokens: Un token Expo por dispositivo, con el agente dueño
+-- - push_tickets: Tickets de envío pendientes de revisar su recibo
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS push_tokens (
+    token VARCHAR(200) PRIMARY KEY,
+    agente VARCHAR(50),
+    platform VARCHAR(20) NOT NULL DEFAULT 'ios',
+    activo BOOLEAN NOT NULL DEFAULT true,
+    ultimo_error VARCHAR(100),
+    registrado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_push_tokens_agente
+    ON push_tokens(agente) WHERE activo;
+
+CREATE TABLE IF NOT EXISTS push_tickets (
+    ticket_id VARCHAR(100) PRIMARY KEY,
+    token VARCHAR(200) NOT NULL,
+    enviado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_push_tickets_enviado
+    ON push_tickets(enviado_en);
+
+COMMENT ON COLUMN push_tokens.agente IS 'Username del agente; NULL = tokens anteriores al registro por agente (reciben todo)';
+COMMENT ON COLUMN push_tokens.activo IS 'false = Expo reportó DeviceNotRegistered (se reactiva si el dispositivo vuelve a registrarse)';
+COMMENT ON TABLE push_tickets IS 'Tickets de Expo: el recibo se consulta ~15 min después del envío y la fila se borra';
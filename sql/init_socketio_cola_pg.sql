@@ -0,0 +1,25 @@
+-- ============================================================================
+-- COLA DE MENSAJES SOCKET.IO SOBRE POSTGRES (LISTEN/NOTIFY)
+-- ============================================================================
+--
+-- Los procesos que sirven Socket.IO se reenvían los emits por NOTIFY
+-- (socketio_cola_pg.py). NOTIFY admite hasta 8000 bytes: los mensajes más
+-- grandes se guardan aquí y se notifica solo su id.
+--
+-- Tablas creadas:
+-- - socketio_mensajes: Payloads de emits que no caben en un NOTIFY
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS socketio_mensajes (
+    id BIGSERIAL PRIMARY KEY,
+    payload TEXT NOT NULL,
+    creado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_socketio_mensajes_creado
+    ON socketio_mensajes(creado_en);
+
+COMMENT ON TABLE socketio_mensajes IS 'Desborde de la cola Socket.IO: mensajes mayores al límite de NOTIFY (se borran a los 10 min)';
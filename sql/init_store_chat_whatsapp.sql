@@ -0,0 +1,65 @@
+-- ============================================================================
+-- STORE LOCAL DEL CHAT WHATSAPP (WHAPI)
+-- ============================================================================
+--
+-- Los webhooks de Whapi (mensajes y estados) se guardan en Postgres y el chat
+-- de agentes lee de aquí: lista de conversaciones e historial con paginación
+-- por keyset. A Whapi solo se le pide historial para conversaciones que nunca
+-- se cargaron (backfill en frío).
+--
+-- Columnas agregadas:
+-- - conversaciones_whatsapp: ultimo_mensaje, ultimo_mensaje_at, no_leidos,
+--   foto_perfil, historial_cargado
+-- - mensajes_whatsapp: whapi_id, estado_entrega
+--
+-- IMPORTANTE: NO modifica ni elimina ninguna columna existente
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS mensajes_whatsapp (
+    id SERIAL PRIMARY KEY,
+    conversacion_id INTEGER NOT NULL,
+    contenido TEXT,
+    direccion VARCHAR(20),
+    sid_twilio VARCHAR(100),
+    tipo_mensaje VARCHAR(30),
+    media_url TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    tenant_id VARCHAR(50)
+);
+
+ALTER TABLE mensajes_whatsapp
+ADD COLUMN IF NOT EXISTS whapi_id VARCHAR(100),
+ADD COLUMN IF NOT EXISTS estado_entrega VARCHAR(20);
+
+ALTER TABLE conversaciones_whatsapp
+ADD COLUMN IF NOT EXISTS ultimo_mensaje TEXT,
+ADD COLUMN IF NOT EXISTS ultimo_mensaje_at TIMESTAMP,
+ADD COLUMN IF NOT EXISTS no_leidos INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS foto_perfil TEXT,
+ADD COLUMN IF NOT EXISTS historial_cargado BOOLEAN NOT NULL DEFAULT false;
+
+-- Un webhook reenviado por Whapi no duplica el mensaje
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mensajes_whapi_id
+    ON mensajes_whatsapp(whapi_id) WHERE whapi_id IS NOT NULL;
+
+-- Historial de una conversación: keyset (timestamp, id) descendente
+CREATE INDEX IF NOT EXISTS idx_mensajes_conversacion_keyset
+    ON mensajes_whatsapp(conversacion_id, timestamp DESC, id DESC);
+
+-- Lista de conversaciones de un agente: keyset (ultimo_mensaje_at, id) descendente
+CREATE INDEX IF NOT EXISTS idx_conversaciones_agente_keyset
+    ON conversaciones_whatsapp(agente_asignado, ultimo_mensaje_at DESC, id DESC);
+
+-- Conversaciones asignadas antes de existir el store: se ordenan por su última actividad
+-- hasta que llegue un mensaje nuevo o corra el backfill
+UPDATE conversaciones_whatsapp
+SET ultimo_mensaje_at = fecha_ultima_actividad
+WHERE ultimo_mensaje_at IS NULL AND agente_asignado IS NOT NULL;
+
+COMMENT ON COLUMN conversaciones_whatsapp.ultimo_mensaje IS 'Vista previa del último mensaje (desnormalizado)';
+COMMENT ON COLUMN conversaciones_whatsapp.no_leidos IS 'Mensajes entrantes desde la última vez que el agente abrió el chat';
+COMMENT ON COLUMN conversaciones_whatsapp.historial_cargado IS 'true = el historial previo ya se trajo de Whapi';
+COMMENT ON COLUMN mensajes_whatsapp.whapi_id IS 'ID del mensaje en Whapi (idempotencia de webhooks)';
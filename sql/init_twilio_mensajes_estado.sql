@@ -0,0 +1,49 @@
+-- ============================================================================
+-- ESTADO DE ENTREGA DE MENSAJES TWILIO
+-- ============================================================================
+--
+-- Una fila por mensaje (SID), con el último estado reportado por el
+-- status callback de Twilio. Los certificados guardan además lo necesario
+-- para reenviarlos por plantilla si no se entregan (p.ej. error 63016:
+-- texto libre fuera de la ventana de 24h).
+--
+-- Tablas creadas:
+-- - twilio_mensajes_estado
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS twilio_mensajes_estado (
+    sid VARCHAR(40) PRIMARY KEY,
+    tipo VARCHAR(20) NOT NULL DEFAULT 'otro',
+    tenant_id VARCHAR(50),
+    destino VARCHAR(40),
+    wix_id VARCHAR(100),
+    usa_template BOOLEAN NOT NULL DEFAULT false,
+    variables JSONB,
+    estado VARCHAR(20) NOT NULL DEFAULT 'queued',
+    error_code INTEGER,
+    reintento_de VARCHAR(40),
+    reintentado BOOLEAN NOT NULL DEFAULT false,
+    intentos_reintento INTEGER NOT NULL DEFAULT 0,
+    proximo_reintento TIMESTAMPTZ,
+    ultimo_error_reintento TEXT,
+    creado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
+    actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- El worker de reintentos solo mira certificados fallidos sin reintentar
+CREATE INDEX IF NOT EXISTS idx_twilio_estado_reintentables
+    ON twilio_mensajes_estado(actualizado_en)
+    WHERE estado IN ('failed', 'undelivered') AND NOT reintentado AND tipo = 'certificado';
+
+-- Agregados de tasa de entrega por período (y purga por antigüedad)
+CREATE INDEX IF NOT EXISTS idx_twilio_estado_creado ON twilio_mensajes_estado(creado_en);
+
+COMMENT ON TABLE twilio_mensajes_estado IS 'Último estado de entrega por mensaje Twilio (status callback)';
+COMMENT ON COLUMN twilio_mensajes_estado.tipo IS 'certificado, chat u otro';
+COMMENT ON COLUMN twilio_mensajes_estado.variables IS 'Datos para reenviar por plantilla: nombre, cedula, url';
+COMMENT ON COLUMN twilio_mensajes_estado.reintento_de IS 'SID del mensaje original si este es un reintento automático';
+COMMENT ON COLUMN twilio_mensajes_estado.reintentado IS 'true cuando el reenvío por plantilla salió';
+COMMENT ON COLUMN twilio_mensajes_estado.proximo_reintento IS 'Reintento tomado por un worker o reprogramado tras un error';
@@ -0,0 +1,50 @@
+-- ============================================================================
+-- OUTBOX DE SUBIDAS DE PDF (Drive / GCS)
+-- ============================================================================
+--
+-- Cola durable de subidas de PDF a almacenamiento externo. Los endpoints que
+-- generan PDFs encolan aquí la tarea y responden de inmediato; un pool de
+-- workers drena la cola con reintentos y backoff exponencial. Las tareas
+-- terminadas se purgan tras UPLOAD_OUTBOX_RETENCION_DIAS.
+--
+-- Tablas creadas:
+-- - upload_outbox: Una fila por subida (idempotente por idempotency_key)
+--
+-- Autor: BSL
+-- Fecha: 2026-10-19
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS upload_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    idempotency_key VARCHAR(64) UNIQUE NOT NULL,
+    contenido BYTEA,
+    destino VARCHAR(20) NOT NULL,
+    folder_id VARCHAR(200),
+    nombre_visible TEXT NOT NULL,
+    empresa VARCHAR(50),
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    bloqueado_en TIMESTAMP,
+    enlace TEXT,
+    ultimo_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Índice parcial: los workers solo buscan tareas pendientes listas para correr
+CREATE INDEX IF NOT EXISTS idx_upload_outbox_pendientes
+    ON upload_outbox(proximo_intento)
+    WHERE estado = 'pendiente';
+
+-- Purga de tareas terminadas
+CREATE INDEX IF NOT EXISTS idx_upload_outbox_terminadas
+    ON upload_outbox(updated_at)
+    WHERE estado IN ('completado', 'fallido');
+
+COMMENT ON TABLE upload_outbox IS 'Cola durable de subidas de PDF a Drive/GCS';
+COMMENT ON COLUMN upload_outbox.idempotency_key IS 'sha256(destino|folder|nombre|contenido): evita subir dos veces el mismo PDF';
+COMMENT ON COLUMN upload_outbox.contenido IS 'PDF a subir (cualquier instancia puede tomar la tarea); NULL al completarse';
+COMMENT ON COLUMN upload_outbox.estado IS 'pendiente, procesando, completado, fallido';
+COMMENT ON COLUMN upload_outbox.proximo_intento IS 'No antes de esta fecha (backoff exponencial)';
+COMMENT ON COLUMN upload_outbox.bloqueado_en IS 'Momento en que un worker tomó la tarea (para recuperar tareas huérfanas)';
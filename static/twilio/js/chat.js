@@ -104,6 +104,10 @@ document.addEventListener('DOMContentLoaded', async function() {
     // Event: Conexión exitosa
     socket.on('connect', () => {
         console.log('✅ WebSocket conectado');
+        // Tras una reconexión, volver a la sala de la conversación abierta
+        if (conversacionActual) {
+            socket.emit('join_conversation', { numero: conversacionActual });
+        }
     });
 
     // Event: Desconexión
@@ -507,7 +511,14 @@ function actualizarConversacion(numero) {
 
 async function abrirConversacion(numero) {
     try {
+        // Cambiar de sala: solo llegan eventos del chat abierto y de mis conversaciones
+        if (socket && conversacionActual && conversacionActual !== numero) {
+            socket.emit('leave_conversation', { numero: conversacionActual });
+        }
         conversacionActual = numero;
+        if (socket) {
+            socket.emit('join_conversation', { numero: numero });
+        }
 
         // Update UI
         updateActiveConversation(numero);
@@ -557,6 +568,9 @@ function volverALista() {
     if (chatArea) chatArea.classList.remove('active');
 
     // Limpiar conversación actual
+    if (socket && conversacionActual) {
+        socket.emit('leave_conversation', { numero: conversacionActual });
+    }
     conversacionActual = null;
 }
 
@@ -0,0 +1,338 @@
+"""
+Backends de Almacenamiento de PDFs
+==================================
+
+Registro de backends de almacenamiento detrás de una interfaz común
+(put / get / exists / public_url / delete). El backend activo se elige con
+STORAGE_DESTINATION:
+
+- drive:       Google Drive con service account (drive_uploader)
+- drive-oauth: Google Drive con token OAuth (upload_to_drive_oauth)
+- gcs:         Google Cloud Storage (gcs_uploader)
+- spaces:      Digital Ocean Spaces (DO_SPACES_*)
+- s3:          Cualquier S3 compatible, p.ej. MinIO local (STORAGE_S3_*)
+- local:       Sistema de archivos local, para correr y medir todo offline
+
+En los backends de Drive la "carpeta" es el folder_id; en el resto es un
+prefijo de la llave del objeto (p.ej. la empresa).
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend:
+    """Interfaz común. Las llaves son el nombre visible del archivo."""
+
+    nombre = None
+    usa_folder_id = False  # True si la carpeta es un folder_id de Drive
+
+    def put(self, ruta_local, nombre, carpeta=None):
+        """Sube el archivo y devuelve su enlace público"""
+        raise NotImplementedError
+
+    def get(self, nombre, carpeta=None):
+        """Devuelve los bytes del archivo o None si no existe"""
+        raise NotImplementedError
+
+    def exists(self, nombre, carpeta=None):
+        raise NotImplementedError
+
+    def public_url(self, nombre, carpeta=None):
+        """Enlace público del archivo o None si no existe"""
+        raise NotImplementedError
+
+    def delete(self, nombre, carpeta=None):
+        """True si se eliminó, False si no existía"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _llave(nombre, carpeta=None):
+        return f"{carpeta}/{nombre}" if carpeta else nombre
+
+
+# ============================================================================
+# LOCAL
+# ============================================================================
+
+class LocalStorageBackend(StorageBackend):
+    """Guarda los PDFs en disco. Útil para desarrollo, pruebas y benchmarks."""
+
+    nombre = "local"
+
+    def __init__(self, raiz=None, base_url=None):
+        self.raiz = raiz or os.getenv("STORAGE_LOCAL_DIR", os.path.join("/tmp", "storage-local"))
+        self.base_url = base_url or os.getenv("BASE_URL", "http://localhost:8080")
+        os.makedirs(self.raiz, exist_ok=True)
+
+    def _ruta(self, nombre, carpeta=None):
+        ruta = os.path.normpath(os.path.join(self.raiz, self._llave(nombre, carpeta)))
+        if not ruta.startswith(os.path.normpath(self.raiz) + os.sep):
+            raise ValueError(f"Llave fuera del almacenamiento local: {nombre}")
+        return ruta
+
+    def put(self, ruta_local, nombre, carpeta=None):
+        destino = self._ruta(nombre, carpeta)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Copiar a un temporal y renombrar: nunca se expone un archivo a medias
+        temporal = f"{destino}.parcial-{threading.get_ident()}"
+        shutil.copyfile(ruta_local, temporal)
+        os.replace(temporal, destino)
+        return self.public_url(nombre, carpeta)
+
+    def get(self, nombre, carpeta=None):
+        try:
+            with open(self._ruta(nombre, carpeta), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, nombre, carpeta=None):
+        return os.path.exists(self._ruta(nombre, carpeta))
+
+    def public_url(self, nombre, carpeta=None):
+        return f"{self.base_url}/storage-local/{self._llave(nombre, carpeta)}"
+
+    def delete(self, nombre, carpeta=None):
+        try:
+            os.remove(self._ruta(nombre, carpeta))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+# ============================================================================
+# S3 COMPATIBLE (DO Spaces, MinIO)
+# ============================================================================
+
+class S3StorageBackend(StorageBackend):
+    """Backend S3 compatible. Con endpoint_url apuntando a MinIO corre offline."""
+
+    nombre = "s3"
+
+    def __init__(self, bucket, endpoint_url, access_key, secret_key, region=None,
+                 url_publica=None, acl_publica=True):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.url_publica = (url_publica or f"{self.endpoint_url}/{bucket}").rstrip('/')
+        self.acl_publica = acl_publica
+        self.client = boto3.client(
+            's3',
+            region_name=region,
+            endpoint_url=self.endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(max_pool_connections=20, retries={'max_attempts': 3})
+        )
+
+    @classmethod
+    def desde_env(cls):
+        """MinIO u otro S3 compatible configurado con STORAGE_S3_*"""
+        return cls(
+            bucket=os.getenv("STORAGE_S3_BUCKET", "certificados-bsl"),
+            endpoint_url=os.getenv("STORAGE_S3_ENDPOINT", "http://localhost:9000"),
+            access_key=os.getenv("STORAGE_S3_ACCESS_KEY", "minioadmin"),
+            secret_key=os.getenv("STORAGE_S3_SECRET_KEY", "minioadmin"),
+            region=os.getenv("STORAGE_S3_REGION", "us-east-1"),
+            url_publica=os.getenv("STORAGE_S3_PUBLIC_URL"),
+            acl_publica=os.getenv("STORAGE_S3_PUBLIC_ACL", "false").lower() == "true"
+        )
+
+    @classmethod
+    def desde_do_spaces(cls):
+        """Digital Ocean Spaces con las mismas variables DO_SPACES_* del uploader de imágenes"""
+        region = os.getenv('DO_SPACES_REGION', 'sfo3')
+        bucket = os.getenv('DO_SPACES_BUCKET_NAME')
+        backend = cls(
+            bucket=bucket,
+            endpoint_url=f"https://{region}.digitaloceanspaces.com",
+            access_key=os.getenv('DO_SPACES_ACCESS_KEY'),
+            secret_key=os.getenv('DO_SPACES_SECRET_KEY'),
+            region=region,
+            url_publica=f"https://{bucket}.{region}.digitaloceanspaces.com"
+        )
+        backend.nombre = "spaces"
+        return backend
+
+    def put(self, ruta_local, nombre, carpeta=None):
+        llave = self._llave(nombre, carpeta)
+        extra_args = {'ContentType': 'application/pdf'}
+        if self.acl_publica:
+            extra_args['ACL'] = 'public-read'
+        self.client.upload_file(ruta_local, self.bucket, llave, ExtraArgs=extra_args)
+        return self.public_url(nombre, carpeta)
+
+    def get(self, nombre, carpeta=None):
+        from botocore.exceptions import ClientError
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._llave(nombre, carpeta))
+            return obj['Body'].read()
+        except ClientError:
+            return None
+
+    def exists(self, nombre, carpeta=None):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._llave(nombre, carpeta))
+            return True
+        except ClientError:
+            return False
+
+    def public_url(self, nombre, carpeta=None):
+        return f"{self.url_publica}/{self._llave(nombre, carpeta)}"
+
+    def delete(self, nombre, carpeta=None):
+        if not self.exists(nombre, carpeta):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._llave(nombre, carpeta))
+        return True
+
+
+# ============================================================================
+# GOOGLE CLOUD STORAGE
+# ============================================================================
+
+class GCSStorageBackend(StorageBackend):
+    nombre = "gcs"
+
+    def __init__(self):
+        from gcs_uploader import subir_pdf_a_gcs, BUCKET_NAME, CREDENTIALS_FILE
+        from google.cloud import storage
+
+        self._subir = subir_pdf_a_gcs
+        self.bucket_name = BUCKET_NAME
+        self.bucket = storage.Client.from_service_account_json(CREDENTIALS_FILE).bucket(BUCKET_NAME)
+
+    def put(self, ruta_local, nombre, carpeta=None):
+        return self._subir(ruta_local, self._llave(nombre, carpeta))
+
+    def get(self, nombre, carpeta=None):
+        blob = self.bucket.blob(self._llave(nombre, carpeta))
+        return blob.download_as_bytes() if blob.exists() else None
+
+    def exists(self, nombre, carpeta=None):
+        return self.bucket.blob(self._llave(nombre, carpeta)).exists()
+
+    def public_url(self, nombre, carpeta=None):
+        return f"https://storage.googleapis.com/{self.bucket_name}/{self._llave(nombre, carpeta)}"
+
+    def delete(self, nombre, carpeta=None):
+        blob = self.bucket.blob(self._llave(nombre, carpeta))
+        if not blob.exists():
+            return False
+        blob.delete()
+        return True
+
+
+# ============================================================================
+# GOOGLE DRIVE
+# ============================================================================
+
+class DriveStorageBackend(StorageBackend):
+    """Drive con service account. La carpeta es el folder_id."""
+
+    nombre = "drive"
+    usa_folder_id = True
+
+    def __init__(self):
+        from drive_uploader import subir_pdf_a_drive, obtener_servicio_drive
+        self._subir = subir_pdf_a_drive
+        self._servicio = obtener_servicio_drive
+
+    def put(self, ruta_local, nombre, carpeta=None):
+        return self._subir(ruta_local, nombre, carpeta)
+
+    def _buscar(self, nombre, carpeta=None):
+        service = self._servicio()
+        nombre_q = nombre.replace("'", "\\'")
+        query = f"name = '{nombre_q}' and trashed = false"
+        if carpeta:
+            query = f"parents in '{carpeta}' and " + query
+        files = service.files().list(
+            q=query,
+            fields="files(id, name, webViewLink, webContentLink)"
+        ).execute().get('files', [])
+        return files[0] if files else None
+
+    def get(self, nombre, carpeta=None):
+        archivo = self._buscar(nombre, carpeta)
+        if not archivo:
+            return None
+        return self._servicio().files().get_media(fileId=archivo['id']).execute()
+
+    def exists(self, nombre, carpeta=None):
+        return self._buscar(nombre, carpeta) is not None
+
+    def public_url(self, nombre, carpeta=None):
+        archivo = self._buscar(nombre, carpeta)
+        if not archivo:
+            return None
+        return archivo.get('webContentLink') or archivo.get('webViewLink')
+
+    def delete(self, nombre, carpeta=None):
+        archivo = self._buscar(nombre, carpeta)
+        if not archivo:
+            return False
+        self._servicio().files().delete(fileId=archivo['id']).execute()
+        return True
+
+
+class DriveOAuthStorageBackend(DriveStorageBackend):
+    """Drive con token OAuth (upload_to_drive_oauth)."""
+
+    nombre = "drive-oauth"
+
+    def __init__(self):
+        from upload_to_drive_oauth import subir_pdf_a_drive_oauth, get_authenticated_service
+        self._subir = subir_pdf_a_drive_oauth
+        self._servicio = get_authenticated_service
+
+
+# ============================================================================
+# REGISTRO
+# ============================================================================
+
+BACKENDS = {
+    "drive": DriveStorageBackend,
+    "drive-oauth": DriveOAuthStorageBackend,
+    "gcs": GCSStorageBackend,
+    "spaces": S3StorageBackend.desde_do_spaces,
+    "s3": S3StorageBackend.desde_env,
+    "local": LocalStorageBackend,
+}
+
+_instancias = {}
+_instancias_lock = threading.Lock()
+
+
+def registrar_backend(nombre, fabrica):
+    """Registra (o reemplaza) un backend. fabrica() debe devolver un StorageBackend."""
+    with _instancias_lock:
+        BACKENDS[nombre] = fabrica
+        _instancias.pop(nombre, None)
+
+
+def obtener_backend(nombre):
+    """Devuelve la instancia (única por proceso) del backend solicitado"""
+    instancia = _instancias.get(nombre)
+    if instancia is not None:
+        return instancia
+
+    with _instancias_lock:
+        if nombre not in _instancias:
+            fabrica = BACKENDS.get(nombre)
+            if fabrica is None:
+                raise Exception(f"Destino {nombre} no soportado")
+            _instancias[nombre] = fabrica()
+            logger.info(f"✅ Backend de almacenamiento inicializado: {nombre}")
+        return _instancias[nombre]
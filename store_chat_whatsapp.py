@@ -0,0 +1,442 @@
+"""
+Store Local del Chat WhatsApp (Whapi)
+=====================================
+
+Los webhooks de Whapi se guardan en mensajes_whatsapp / conversaciones_whatsapp
+y el chat de agentes lee de Postgres en vez de pedirle a Whapi la lista de
+chats y el historial completo en cada apertura:
+
+- guardar_mensajes_whapi(): idempotente por whapi_id; mantiene desnormalizados
+  el último mensaje y el contador de no leídos de la conversación.
+- actualizar_estado_mensaje(): estados de entrega (sent/delivered/read).
+- listar_conversaciones() / listar_mensajes(): paginación por keyset
+  (cursor opaco "fecha|id"), sin OFFSET.
+- backfill_*: única llamada a Whapi, para conversaciones que nunca se cargaron.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timezone
+
+import requests
+
+from conexion_pg import conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+WHAPI_TOKEN = os.getenv('WHAPI_TOKEN')
+WHAPI_BASE_URL = os.getenv('WHAPI_BASE_URL', 'https://gate.whapi.cloud')
+WHAPI_PHONE_NUMBER = os.getenv('WHAPI_PHONE_NUMBER', '573008021701')  # Número de la línea Whapi
+WHAPI_BACKFILL_MENSAJES = 100
+
+# Orden de los estados de Whapi: un "delivered" tardío no pisa un "read"
+RANGO_ESTADOS_WHAPI = {'pending': 0, 'sent': 1, 'delivered': 2, 'read': 3, 'played': 4, 'failed': 5}
+
+_backfill_lista_hecho = False
+_backfill_lock = threading.Lock()
+
+
+def _conectar():
+    """Conexión con las columnas del store garantizadas (se crean la primera vez)"""
+    return conectar_con_esquema('init_store_chat_whatsapp.sql')
+
+
+def numero_desde_chat_id(chat_id):
+    """'573001234567@s.whatsapp.net' -> '573001234567' (formato de la BD, sin +)"""
+    return chat_id.replace('@s.whatsapp.net', '').replace('@g.us', '').lstrip('+')
+
+
+# ============================================================================
+# CURSORES KEYSET
+# ============================================================================
+
+# Las columnas TIMESTAMP guardan la hora UTC sin zona: se escribe UTC naive
+# y al leer se le pone la zona, igual en todos los hosts.
+
+def _a_utc_naive(momento):
+    """datetime con zona -> UTC sin zona (naive se asume ya en UTC)"""
+    if momento is not None and momento.tzinfo is not None:
+        return momento.astimezone(timezone.utc).replace(tzinfo=None)
+    return momento
+
+
+def _iso_utc(momento):
+    """TIMESTAMP leído -> isoformat con zona UTC ('2026-10-19T15:00:00+00:00')"""
+    if momento is None:
+        return None
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return momento.astimezone(timezone.utc).isoformat()
+
+
+def _desde_epoch(timestamp):
+    """Segundos epoch de Whapi -> UTC sin zona"""
+    return _a_utc_naive(datetime.fromtimestamp(int(timestamp), tz=timezone.utc))
+
+
+def _codificar_cursor(momento, fila_id):
+    return f"{_iso_utc(momento)}|{fila_id}"
+
+
+def _decodificar_cursor(cursor):
+    """'2026-10-19T10:00:00+00:00|123' -> (datetime UTC sin zona, 123); None si no viene o es inválido"""
+    if not cursor:
+        return None
+    try:
+        momento, fila_id = cursor.rsplit('|', 1)
+        return _a_utc_naive(datetime.fromisoformat(momento)), int(fila_id)
+    except ValueError:
+        return None
+
+
+# ============================================================================
+# ESCRITURA (WEBHOOKS)
+# ============================================================================
+
+def _normalizar_mensaje_whapi(msg):
+    tipo = msg.get('type', 'text')
+    if tipo == 'text':
+        contenido = msg.get('text', {}).get('body', '')
+        media_url = None
+    else:
+        media = msg.get(tipo) if isinstance(msg.get(tipo), dict) else {}
+        contenido = media.get('caption') or f'(media: {tipo})'
+        media_url = media.get('link')
+
+    timestamp = msg.get('timestamp')
+    momento = _desde_epoch(timestamp) if timestamp else _a_utc_naive(datetime.now(timezone.utc))
+
+    return {
+        'whapi_id': msg.get('id'),
+        'celular': numero_desde_chat_id(msg.get('chat_id', '')),
+        'contenido': contenido,
+        'direccion': 'saliente' if msg.get('from_me') else 'entrante',
+        'tipo': tipo,
+        'media_url': media_url,
+        'momento': momento,
+        'nombre': None if msg.get('from_me') else msg.get('from_name'),
+    }
+
+
+def _id_conversacion(cur, celular, nombre=None):
+    """Id de la conversación del chat (celular sin +); la crea si no existe"""
+    cur.execute(
+        "SELECT id FROM conversaciones_whatsapp WHERE celular = %s ORDER BY id LIMIT 1",
+        (celular,)
+    )
+    fila = cur.fetchone()
+    if fila:
+        return fila[0]
+    cur.execute(
+        """
+        INSERT INTO conversaciones_whatsapp (celular, nombre_paciente, estado)
+        VALUES (%s, %s, 'activa') RETURNING id
+        """,
+        (celular, nombre)
+    )
+    return cur.fetchone()[0]
+
+
+def _guardar_mensaje(cur, m, contar_no_leido=True):
+    """Inserta un mensaje y, si era nuevo, actualiza la desnormalización. Devuelve True si era nuevo."""
+    conversacion_id = _id_conversacion(cur, m['celular'], m['nombre'])
+    cur.execute(
+        """
+        WITH nuevo AS (
+            INSERT INTO mensajes_whatsapp
+                (conversacion_id, contenido, direccion, tipo_mensaje, media_url, timestamp, whapi_id)
+            VALUES (%(conversacion_id)s, %(contenido)s, %(direccion)s, %(tipo)s, %(media_url)s, %(momento)s, %(whapi_id)s)
+            ON CONFLICT (whapi_id) WHERE whapi_id IS NOT NULL DO NOTHING
+            RETURNING conversacion_id, timestamp
+        )
+        UPDATE conversaciones_whatsapp c SET
+            ultimo_mensaje = CASE WHEN c.ultimo_mensaje_at IS NULL OR nuevo.timestamp >= c.ultimo_mensaje_at
+                                  THEN LEFT(%(contenido)s, 200) ELSE c.ultimo_mensaje END,
+            ultimo_mensaje_at = GREATEST(c.ultimo_mensaje_at, nuevo.timestamp),
+            no_leidos = c.no_leidos + %(suma_no_leidos)s,
+            nombre_paciente = COALESCE(c.nombre_paciente, %(nombre)s)
+        FROM nuevo
+        WHERE c.id = nuevo.conversacion_id
+        RETURNING c.id
+        """,
+        dict(m, conversacion_id=conversacion_id,
+             suma_no_leidos=1 if contar_no_leido and m['direccion'] == 'entrante' else 0)
+    )
+    return cur.fetchone() is not None
+
+
+def guardar_mensajes_whapi(mensajes, contar_no_leidos=True):
+    """
+    Guarda los mensajes de un webhook (o de un backfill) en una sola transacción.
+
+    Returns:
+        list: whapi_id de los mensajes que no estaban guardados
+    """
+    nuevos = []
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        for msg in mensajes:
+            m = _normalizar_mensaje_whapi(msg)
+            if not m['celular']:
+                continue
+            if _guardar_mensaje(cur, m, contar_no_leidos):
+                nuevos.append(m['whapi_id'])
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return nuevos
+
+
+def actualizar_estado_mensaje(estados):
+    """
+    Aplica estados de entrega de Whapi: lista de (whapi_id, estado).
+    Solo avanza el estado (los eventos pueden llegar desordenados).
+    """
+    casos = " ".join(f"WHEN '{e}' THEN {r}" for e, r in RANGO_ESTADOS_WHAPI.items())
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        for whapi_id, estado in estados:
+            cur.execute(
+                f"""
+                UPDATE mensajes_whatsapp SET estado_entrega = %(estado)s
+                WHERE whapi_id = %(whapi_id)s
+                  AND (estado_entrega IS NULL
+                       OR (CASE %(estado)s {casos} ELSE 0 END) >= (CASE estado_entrega {casos} ELSE 0 END))
+                """,
+                {'whapi_id': whapi_id, 'estado': estado}
+            )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def marcar_leida(celular):
+    """Pone en cero los no leídos de la conversación"""
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE conversaciones_whatsapp SET no_leidos = 0 WHERE celular = %s AND no_leidos > 0", (celular,))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# LECTURA (CHAT DE AGENTES)
+# ============================================================================
+
+def listar_conversaciones(agente, limite=30, cursor=None):
+    """
+    Conversaciones del agente, la más reciente primero.
+
+    Returns:
+        dict: conversaciones (lista), total, next_cursor (None si no hay más)
+    """
+    despues = _decodificar_cursor(cursor)
+    filtro_cursor = "AND (ultimo_mensaje_at, id) < (%s, %s)" if despues else ""
+    params = [agente] + (list(despues) if despues else []) + [limite + 1]
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT id, celular, nombre_paciente, ultimo_mensaje, ultimo_mensaje_at, no_leidos, foto_perfil
+            FROM conversaciones_whatsapp
+            WHERE agente_asignado = %s AND ultimo_mensaje_at IS NOT NULL {filtro_cursor}
+            ORDER BY ultimo_mensaje_at DESC, id DESC
+            LIMIT %s
+            """,
+            params
+        )
+        filas = cur.fetchall()
+        cur.execute(
+            "SELECT COUNT(*) FROM conversaciones_whatsapp WHERE agente_asignado = %s AND ultimo_mensaje_at IS NOT NULL",
+            (agente,)
+        )
+        total = cur.fetchone()[0]
+        cur.close()
+    finally:
+        conn.close()
+
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    conversaciones = [{
+        'id': fila_id,
+        'numero': celular,
+        'nombre': nombre or f"Usuario {celular[-4:]}",
+        'last_message': (ultimo or '')[:50],
+        'last_message_time': _iso_utc(momento),
+        'unread': no_leidos,
+        'profile_picture': foto,
+        'source': 'whapi',
+    } for fila_id, celular, nombre, ultimo, momento, no_leidos, foto in filas]
+
+    ultimo = filas[-1] if filas else None
+    return {
+        'conversaciones': conversaciones,
+        'total': total,
+        'next_cursor': _codificar_cursor(ultimo[4], ultimo[0]) if hay_mas and ultimo else None,
+    }
+
+
+def listar_mensajes(celular, limite=50, cursor=None):
+    """
+    Página de mensajes de una conversación, yendo hacia atrás en el tiempo.
+    Los mensajes de la página vienen en orden cronológico (más antiguos primero).
+
+    Returns:
+        dict: mensajes, next_cursor (para pedir mensajes más antiguos), historial_cargado
+    """
+    antes = _decodificar_cursor(cursor)
+    filtro_cursor = "AND (m.timestamp, m.id) < (%s, %s)" if antes else ""
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, historial_cargado FROM conversaciones_whatsapp WHERE celular = %s ORDER BY id LIMIT 1",
+            (celular,)
+        )
+        conversacion = cur.fetchone()
+        if not conversacion:
+            cur.close()
+            return {'mensajes': [], 'next_cursor': None, 'historial_cargado': False}
+
+        cur.execute(
+            f"""
+            SELECT m.id, m.whapi_id, m.contenido, m.direccion, m.tipo_mensaje, m.media_url,
+                   m.timestamp, m.estado_entrega
+            FROM mensajes_whatsapp m
+            WHERE m.conversacion_id = %s {filtro_cursor}
+            ORDER BY m.timestamp DESC, m.id DESC
+            LIMIT %s
+            """,
+            [conversacion[0]] + (list(antes) if antes else []) + [limite + 1]
+        )
+        filas = cur.fetchall()
+        cur.close()
+    finally:
+        conn.close()
+
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    chat_id = f"{celular}@s.whatsapp.net"
+    mensajes = [{
+        'id': whapi_id or str(fila_id),
+        'chat_id': chat_id,
+        'from': WHAPI_PHONE_NUMBER if direccion == 'saliente' else celular,
+        'to': celular if direccion == 'saliente' else WHAPI_PHONE_NUMBER,
+        'body': contenido or '',
+        'date_sent': _iso_utc(momento),
+        'status': estado or 'delivered',
+        'direction': 'outbound' if direccion == 'saliente' else 'inbound',
+        'media_count': 1 if media_url else 0,
+        'media_url': media_url,
+        'type': tipo,
+        'source': 'whapi',
+    } for fila_id, whapi_id, contenido, direccion, tipo, media_url, momento, estado in reversed(filas)]
+
+    mas_antiguo = filas[-1] if filas else None
+    return {
+        'mensajes': mensajes,
+        'next_cursor': _codificar_cursor(mas_antiguo[6], mas_antiguo[0]) if hay_mas and mas_antiguo else None,
+        'historial_cargado': conversacion[1],
+    }
+
+
+# ============================================================================
+# BACKFILL EN FRÍO (ÚNICAS LLAMADAS A WHAPI)
+# ============================================================================
+
+def _whapi_get(ruta, params=None):
+    if not WHAPI_TOKEN:
+        raise Exception("WHAPI_TOKEN no configurado")
+    response = requests.get(
+        f"{WHAPI_BASE_URL}{ruta}",
+        headers={"accept": "application/json", "authorization": f"Bearer {WHAPI_TOKEN}"},
+        params=params,
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def backfill_historial(celular):
+    """
+    Trae de Whapi el historial de una conversación que nunca se cargó y lo
+    guarda. Los mensajes históricos no suman a no leídos.
+
+    Returns:
+        int: mensajes nuevos guardados
+    """
+    chat_id = f"{celular}@s.whatsapp.net"
+    mensajes = _whapi_get(f"/messages/list/{chat_id}", {"count": WHAPI_BACKFILL_MENSAJES}).get('messages', [])
+    nuevos = guardar_mensajes_whapi(mensajes, contar_no_leidos=False)
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE conversaciones_whatsapp SET historial_cargado = true WHERE celular = %s", (celular,))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    logger.info(f"📥 Backfill de {celular}: {len(nuevos)}/{len(mensajes)} mensajes nuevos desde Whapi")
+    return len(nuevos)
+
+
+def backfill_resumen_conversaciones():
+    """
+    Completa nombre, foto y último mensaje de las conversaciones ya asignadas
+    con la lista de chats de Whapi. Una vez por proceso, en segundo plano.
+    """
+    global _backfill_lista_hecho
+    with _backfill_lock:
+        if _backfill_lista_hecho:
+            return
+        _backfill_lista_hecho = True
+
+    def _correr():
+        try:
+            chats = _whapi_get("/chats").get('chats', [])
+            conn = _conectar()
+            try:
+                cur = conn.cursor()
+                for chat in chats:
+                    celular = numero_desde_chat_id(chat.get('id', ''))
+                    last_msg = chat.get('last_message') or {}
+                    momento = _desde_epoch(last_msg['timestamp']) if last_msg.get('timestamp') else None
+                    texto = last_msg.get('text', {}).get('body', '') if last_msg.get('type') == 'text' else '(media)'
+                    foto = chat.get('chat_pic_full') or chat.get('chat_pic') or chat.get('picture') or chat.get('image')
+                    cur.execute(
+                        """
+                        UPDATE conversaciones_whatsapp SET
+                            nombre_paciente = COALESCE(nombre_paciente, %(nombre)s),
+                            foto_perfil = COALESCE(%(foto)s, foto_perfil),
+                            ultimo_mensaje = CASE WHEN %(momento)s::timestamp > ultimo_mensaje_at OR ultimo_mensaje IS NULL
+                                                  THEN %(texto)s ELSE ultimo_mensaje END,
+                            ultimo_mensaje_at = GREATEST(ultimo_mensaje_at, %(momento)s::timestamp)
+                        WHERE celular = %(celular)s AND agente_asignado IS NOT NULL
+                        """,
+                        {'celular': celular, 'nombre': chat.get('name'), 'foto': foto, 'momento': momento, 'texto': texto}
+                    )
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+            logger.info(f"📥 Backfill de lista: {len(chats)} chats de Whapi revisados")
+        except Exception as e:
+            logger.error(f"❌ Backfill de lista de conversaciones falló: {e}")
+
+    threading.Thread(target=_correr, name="whapi-backfill-lista", daemon=True).start()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Prueba de paridad de la calificación ADC por lotes (adc_scoring.py).
+
+calcular_perfiles_adc debe dar exactamente lo mismo que calcular_perfil_adc
+fila por fila (==, incluido el orden de las claves): respuestas válidas,
+vacías, None, con espacios o desconocidas, filas como dicts o como tuplas de
+cursor sin la columna cooc37, y cada bruto posible de cada escala.
+
+Uso: python test_adc_scoring_lote.py
+"""
+
+import json
+import random
+
+from adc_scoring import (
+    calcular_perfil_adc, calcular_perfiles_adc, codificar_respuestas, puntuar_lote,
+    estandarizar_lote, COLUMNAS_ADC, ESCALAS_ADC, ETIQUETAS_NIVEL, AREAS_CONGRUENCIA, SCORE_DA
+)
+
+OPCIONES = list(SCORE_DA) + [None, '', '  En desacuerdo ', 'De Acuerdo', 'NS/NR']
+
+# Escala de congruencia -> (área, 'valoracion' | 'conducta') en el perfil
+AREA_DE = {}
+for area, key_val, key_con in AREAS_CONGRUENCIA:
+    AREA_DE[key_val] = (area, 'valoracion')
+    AREA_DE[key_con] = (area, 'conducta')
+
+
+def main():
+    print("🧪 Calificación ADC por lotes")
+    rnd = random.Random(2026)
+    fallas = 0
+
+    def verificar(condicion, mensaje):
+        nonlocal fallas
+        print(f"   {'✅' if condicion else '❌'} {mensaje}")
+        fallas += not condicion
+
+    filas = [{col: rnd.choice(OPCIONES) for col in COLUMNAS_ADC} for _ in range(3000)]
+    # Extremos: todo en un sentido y todo vacío
+    for texto in list(SCORE_DA) + [None]:
+        filas.append({col: texto for col in COLUMNAS_ADC})
+    filas.append({})
+
+    esperados = [calcular_perfil_adc(fila) for fila in filas]
+    obtenidos = calcular_perfiles_adc(filas)
+    verificar(obtenidos == esperados, f"Dicts: {len(filas)} perfiles idénticos")
+    verificar(all(json.dumps(o) == json.dumps(e) for o, e in zip(obtenidos, esperados)),
+              "Mismo orden de claves (mismo JSON)")
+
+    # Como llegan de un cursor de "pruebasADC": tuplas, sin cooc37
+    columnas = [col for col in COLUMNAS_ADC if col != 'cooc37']
+    rnd.shuffle(columnas)
+    tuplas = [tuple(fila.get(col) for col in columnas) for fila in filas]
+    sin_cooc37 = [calcular_perfil_adc({**fila, 'cooc37': None}) for fila in filas]
+    verificar(calcular_perfiles_adc(tuplas, columnas) == sin_cooc37, "Tuplas de cursor sin cooc37")
+
+    # Cada bruto posible: una columna en "De acuerdo" a la vez recorre las tablas
+    escalonadas = []
+    for n in range(len(COLUMNAS_ADC) + 1):
+        escalonadas.append({col: ('De acuerdo' if i < n else 'En desacuerdo') for i, col in enumerate(COLUMNAS_ADC)})
+    verificar(calcular_perfiles_adc(escalonadas) == [calcular_perfil_adc(f) for f in escalonadas],
+              "Barrido de brutos por escala")
+
+    # Los arreglos numéricos coinciden con los dicts
+    brutos = puntuar_lote(codificar_respuestas(filas))
+    estandarizados, niveles, congruencia = estandarizar_lote(brutos)
+    coinciden = True
+    for i, perfil in enumerate(esperados):
+        for j, (escala, nombre) in enumerate(ESCALAS_ADC):
+            if escala == 'congruencia':
+                grupo = perfil['congruencia']['areas'][AREA_DE[nombre][0]][AREA_DE[nombre][1]]
+            elif nombre == 'general':
+                grupo = perfil[escala]['general']
+            else:
+                grupo = perfil[escala]['subdimensiones'][nombre]
+            coinciden &= (grupo['raw'] == brutos[i, j] and grupo['estandarizado'] == estandarizados[i, j]
+                          and grupo['nivel'] == ETIQUETAS_NIVEL[niveles[i, j]])
+        etiquetas = [a['congruencia'] for a in perfil['congruencia']['areas'].values()]
+        coinciden &= etiquetas == [ETIQUETAS_NIVEL[k] for k in congruencia[i]]
+    verificar(bool(coinciden), "Brutos, estandarizados, niveles y congruencia en arreglos")
+
+    verificar(calcular_perfiles_adc([]) == [], "Lote vacío")
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Prueba de concurrencia de la asignación round-robin atómica
+(sql/init_asignacion_round_robin.sql).
+
+Simula webhooks en paralelo contra la función SQL, en un schema temporal
+(no toca las tablas reales):
+- N números nuevos distintos → cada agente debe recibir N/agentes (±1)
+- El mismo número nuevo disparado varias veces a la vez → una sola fila, un solo agente
+
+Uso: TEST_POSTGRES_HOST (obligatoria, nunca toma un host por defecto) y
+POSTGRES_PORT/USER/PASSWORD/DB en el entorno, luego
+    python test_asignacion_round_robin.py
+Sin TEST_POSTGRES_HOST la prueba se omite.
+"""
+
+import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+AGENTES_PRUEBA = ['agente1', 'agente2', 'agente3']
+NUMEROS_NUEVOS = 300
+WEBHOOKS_PARALELOS = 30
+REPETICIONES_MISMO_NUMERO = 20
+
+SCHEMA = f"test_rr_{uuid.uuid4().hex[:8]}"
+HOST = os.getenv("TEST_POSTGRES_HOST")
+
+
+def conectar():
+    import psycopg2
+
+    conn = psycopg2.connect(
+        host=HOST,
+        port=int(os.getenv("POSTGRES_PORT", "25060")),
+        user=os.getenv("POSTGRES_USER", "doadmin"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        database=os.getenv("POSTGRES_DB", "defaultdb"),
+        sslmode="require",
+        options=f"-c search_path={SCHEMA}"
+    )
+    return conn
+
+
+def preparar():
+    conn = conectar()
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"SET search_path TO {SCHEMA}")
+    cur.execute("""
+        CREATE TABLE conversaciones_whatsapp (
+            id SERIAL PRIMARY KEY,
+            celular VARCHAR(20),
+            agente_asignado VARCHAR(50),
+            fecha_asignacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            fecha_ultima_actividad TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            estado VARCHAR(20)
+        )
+    """)
+    sql_path = os.path.join(os.path.dirname(__file__), 'sql', 'init_asignacion_round_robin.sql')
+    with open(sql_path, 'r', encoding='utf-8') as f:
+        cur.execute(f.read())
+    for orden, username in enumerate(AGENTES_PRUEBA):
+        cur.execute("INSERT INTO agentes_chat (username, nombre, orden) VALUES (%s, %s, %s)", (username, username, orden))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def limpiar():
+    conn = conectar()
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def webhook(numero):
+    """Lo mismo que hace asignar_conversacion_round_robin en chat_whatsapp: una llamada"""
+    conn = conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT asignar_conversacion_round_robin(%s)", (numero,))
+        agente = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+        return agente
+    finally:
+        conn.close()
+
+
+def main():
+    if not HOST:
+        print("⏭️ TEST_POSTGRES_HOST no configurada — prueba omitida")
+        return 0
+    print(f"🧪 Asignación round-robin concurrente (schema {SCHEMA} en {HOST})")
+    preparar()
+    fallas = 0
+    try:
+        # 1. Números nuevos distintos en paralelo
+        numeros = [f"5730{i:08d}" for i in range(NUMEROS_NUEVOS)]
+        inicio = time.time()
+        with ThreadPoolExecutor(max_workers=WEBHOOKS_PARALELOS) as pool:
+            agentes = list(pool.map(webhook, numeros))
+        duracion = time.time() - inicio
+
+        conteo = Counter(agentes)
+        print(f"📊 {NUMEROS_NUEVOS} asignaciones en {duracion:.2f}s con {WEBHOOKS_PARALELOS} webhooks paralelos")
+        print(f"   Distribución: {dict(conteo)}")
+        if max(conteo.values()) - min(conteo.values()) > 1 or set(conteo) != set(AGENTES_PRUEBA):
+            print("   ❌ Distribución desigual")
+            fallas += 1
+        else:
+            print("   ✅ Distribución pareja (±1)")
+
+        # 2. El mismo número nuevo, muchas veces a la vez
+        numero = "573999999999"
+        with ThreadPoolExecutor(max_workers=REPETICIONES_MISMO_NUMERO) as pool:
+            agentes = list(pool.map(webhook, [numero] * REPETICIONES_MISMO_NUMERO))
+
+        conn = conectar()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM conversaciones_whatsapp WHERE celular = %s", (numero,))
+        filas = cur.fetchone()[0]
+        cur.close()
+        conn.close()
+
+        print(f"📊 Mismo número x{REPETICIONES_MISMO_NUMERO}: agentes={set(agentes)}, filas={filas}")
+        if len(set(agentes)) != 1 or filas != 1:
+            print("   ❌ El número quedó duplicado o con agentes distintos")
+            fallas += 1
+        else:
+            print("   ✅ Una sola fila y un solo agente")
+    finally:
+        limpiar()
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
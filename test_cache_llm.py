@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Prueba de la caché de respuestas LLM (cache_llm.py).
+
+Usa un cliente falso con la forma de la respuesta de OpenAI y verifica:
+el mismo prompt llama a la API una sola vez, el modo determinista pide
+temperature=0, un prompt distinto o no cacheable sí llama, las respuestas
+cortadas por max_tokens no se guardan, una entrada vencida en memoria no se
+sirve y las métricas cuentan los tokens ahorrados. Sin POSTGRES_PASSWORD corre solo con la capa en memoria.
+
+Uso: python test_cache_llm.py
+"""
+
+import time
+from types import SimpleNamespace
+
+import cache_llm
+from cache_llm import completar_chat, obtener_metricas_llm
+
+SYSTEM = "Eres un médico laboral experto en salud ocupacional."
+
+
+class ClienteFalso:
+    """client.chat.completions.create como el SDK de OpenAI"""
+
+    def __init__(self):
+        self.llamadas = []
+        self.finish_reason = 'stop'
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, max_tokens, temperature):
+        self.llamadas.append({'model': model, 'prompt': messages[1]['content'], 'temperature': temperature})
+        return SimpleNamespace(
+            choices=[SimpleNamespace(
+                message=SimpleNamespace(content=f"Respuesta {len(self.llamadas)}"),
+                finish_reason=self.finish_reason
+            )],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50, total_tokens=150)
+        )
+
+
+def main():
+    print("🧪 Caché de respuestas LLM")
+    cache_llm._memoria.clear()
+    cliente = ClienteFalso()
+    fallas = 0
+
+    def verificar(condicion, mensaje):
+        nonlocal fallas
+        print(f"   {'✅' if condicion else '❌'} {mensaje}")
+        fallas += not condicion
+
+    antes = obtener_metricas_llm()
+    primera = completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt A", max_tokens=500)
+    segunda = completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt A", max_tokens=500)
+    verificar(len(cliente.llamadas) == 1, "Mismo prompt: una sola llamada a la API")
+    verificar(not primera['cache'] and segunda['cache'], "La segunda respuesta sale de la caché")
+    verificar(segunda['content'] == primera['content'] and segunda['usage'] == primera['usage'],
+              "Misma respuesta y mismo usage")
+    if cache_llm.LLM_CACHE_DETERMINISTA:
+        verificar(cliente.llamadas[0]['temperature'] == 0, "Modo determinista: temperature=0")
+
+    completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt B", max_tokens=500)
+    completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt A", max_tokens=900)
+    verificar(len(cliente.llamadas) == 3, "Otro prompt u otros parámetros: nueva llamada")
+
+    completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt A", max_tokens=500, temperature=0.7, cacheable=False)
+    verificar(len(cliente.llamadas) == 4 and cliente.llamadas[-1]['temperature'] == 0.7,
+              "No cacheable: siempre llama, con su temperature")
+
+    cliente.finish_reason = 'length'
+    completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt C", max_tokens=10)
+    completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt C", max_tokens=10)
+    verificar(len(cliente.llamadas) == 6, "Respuesta cortada por max_tokens: no se guarda")
+
+    # La capa en memoria respeta el vencimiento de cada entrada
+    cliente.finish_reason = 'stop'
+    clave = cache_llm.clave_llm("gpt-4o-mini", SYSTEM, "Prompt A", {'max_tokens': 500, 'temperature': cliente.llamadas[0]['temperature']})
+    respuesta, usage, _ = cache_llm._memoria[clave]
+    cache_llm._memoria[clave] = (respuesta, usage, time.time() - 1)
+    vencida = completar_chat(cliente, "gpt-4o-mini", SYSTEM, "Prompt A", max_tokens=500)
+    verificar(len(cliente.llamadas) == 7 and not vencida['cache'] and clave in cache_llm._memoria,
+              "Entrada vencida en memoria: no se sirve y se vuelve a pedir")
+    verificar(cache_llm._memoria[clave][2] <= time.time() + cache_llm.LLM_CACHE_MEMORIA_SEG,
+              "La memoria guarda como mucho LLM_CACHE_MEMORIA_SEG")
+
+    despues = obtener_metricas_llm()
+    ahorrados = despues['tokens_ahorrados'] - antes['tokens_ahorrados']
+    verificar(ahorrados == 150, f"Métricas: {ahorrados} tokens ahorrados, tasa {despues['tasa_aciertos']}")
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de Socket.IO del chat (/twilio-chat).
+
+Abre N sockets simultáneos (sin sesión → sala 'sin_sesion', que recibe todos
+los eventos), dispara webhooks de Whapi de prueba y mide cuánto tarda cada
+'new_message' en llegar a todos los sockets.
+
+Para comparar antes/después se corre contra las dos formas de servir:
+- Antes:   python descargar_bsl.py                     (threading, 1 proceso)
+- Después: Procfile.socketio (gevent + gunicorn) con SOCKETIO_MESSAGE_QUEUE,
+           varias instancias: pasar todas las URLs separadas por coma. Los
+           sockets se reparten entre instancias y los webhooks van solo a la
+           primera, así se mide también el fan-out entre procesos.
+
+Uso:
+    CARGA_URLS=http://localhost:8080 CARGA_SOCKETS=500 python test_carga_socketio.py
+
+Requiere python-socketio[client] (websocket-client). Los mensajes se guardan
+en la conversación de CARGA_NUMERO: correr contra staging, no producción.
+
+Resultados (oct-2026, 1 instancia, 10 mensajes, 1 CPU con cliente y servidor
+en la misma máquina, Postgres local detrás de un proxy TLS, tablas del chat
+completadas a mano con las columnas de producción, SOCKETIO_LOGS_DETALLADOS
+por defecto; sin Redis, así que no se midió el fan-out entre instancias):
+
+    modo       sockets  conexión p50/p95  webhook p50/p95  entrega p50/p95  entregas
+    threading       50    0.159/0.208s     0.075/0.127s     0.218/0.323s   500/500
+    threading      200    0.308/0.596s     0.072/0.119s     0.261/0.339s   2000/2000
+    threading      500    0.278/0.483s     0.074/0.122s     0.371/0.532s   5000/5000
+    gevent          50    0.185/0.204s     0.063/0.096s     0.224/0.260s   500/500
+    gevent         200    0.213/0.286s     0.060/0.096s     0.279/0.349s   2000/2000
+    gevent         500    0.185/0.471s     0.093/0.192s     0.567/0.726s   5000/5000
+
+Con una sola CPU compartida con 500 clientes gevent no gana en latencia de
+entrega; su ventaja esperada es no atar un hilo por socket y escalar a varias
+instancias con SOCKETIO_MESSAGE_QUEUE, que aquí no se pudo probar.
+"""
+
+import os
+import time
+import uuid
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import socketio
+
+URLS = [u.strip().rstrip('/') for u in os.getenv("CARGA_URLS", "http://localhost:8080").split(',') if u.strip()]
+SOCKETS = int(os.getenv("CARGA_SOCKETS", "500"))
+CONEXIONES_PARALELAS = int(os.getenv("CARGA_CONEXIONES_PARALELAS", "50"))
+MENSAJES = int(os.getenv("CARGA_MENSAJES", "20"))
+INTERVALO_SEG = float(os.getenv("CARGA_INTERVALO_SEG", "0.5"))
+ESPERA_FINAL_SEG = 15
+NUMERO = os.getenv("CARGA_NUMERO", "573000000000")
+NAMESPACE = '/twilio-chat'
+
+_recibidos = {}            # marca -> [segundos de latencia]
+_recibidos_lock = threading.Lock()
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def crear_cliente(i):
+    """Conecta un socket a una de las URLs (round-robin) y devuelve (cliente, segundos)"""
+    cliente = socketio.Client(reconnection=False)
+
+    @cliente.on('new_message', namespace=NAMESPACE)
+    def on_new_message(data):
+        llegada = time.time()
+        body = (data or {}).get('body', '')
+        if not body.startswith('carga:'):
+            return
+        _, marca, enviado = body.split(':', 2)
+        with _recibidos_lock:
+            _recibidos.setdefault(marca, []).append(llegada - float(enviado))
+
+    inicio = time.time()
+    cliente.connect(URLS[i % len(URLS)], namespaces=[NAMESPACE], transports=['websocket'], wait_timeout=30)
+    return cliente, time.time() - inicio
+
+
+def desconectar(cliente):
+    try:
+        cliente.disconnect()
+    except Exception:
+        pass
+
+
+def enviar_webhook():
+    """Simula un mensaje entrante de Whapi; devuelve (marca, segundos de respuesta del webhook)"""
+    marca = uuid.uuid4().hex[:12]
+    ahora = time.time()
+    payload = {'messages': [{
+        'id': f"carga-{marca}",
+        'chat_id': f"{NUMERO}@s.whatsapp.net",
+        'from': NUMERO,
+        'from_me': False,
+        'type': 'text',
+        'timestamp': int(ahora),
+        'text': {'body': f"carga:{marca}:{ahora}"},
+    }]}
+    r = requests.post(f"{URLS[0]}/twilio-chat/webhook/whapi", json=payload, timeout=30)
+    r.raise_for_status()
+    return marca, time.time() - ahora
+
+
+def main():
+    print(f"🧪 Carga Socket.IO: {SOCKETS} sockets en {len(URLS)} instancia(s), {MENSAJES} mensajes")
+
+    # 1. Conectar sockets
+    clientes, tiempos, errores = [], [], 0
+    inicio = time.time()
+    with ThreadPoolExecutor(max_workers=CONEXIONES_PARALELAS) as pool:
+        for futuro in [pool.submit(crear_cliente, i) for i in range(SOCKETS)]:
+            try:
+                cliente, segundos = futuro.result()
+                clientes.append(cliente)
+                tiempos.append(segundos)
+            except Exception as e:
+                errores += 1
+                if errores <= 3:
+                    print(f"   ⚠️ Conexión fallida: {e}")
+    print(f"🔌 Conectados {len(clientes)}/{SOCKETS} en {time.time() - inicio:.2f}s "
+          f"(p50 {percentil(tiempos, 50) or 0:.3f}s, p95 {percentil(tiempos, 95) or 0:.3f}s, fallidos {errores})")
+
+    # 2. Webhooks y broadcast
+    marcas, respuestas = [], []
+    try:
+        for _ in range(MENSAJES):
+            marca, segundos = enviar_webhook()
+            marcas.append(marca)
+            respuestas.append(segundos)
+            time.sleep(INTERVALO_SEG)
+
+        limite = time.time() + ESPERA_FINAL_SEG
+        while time.time() < limite:
+            with _recibidos_lock:
+                completos = sum(1 for m in marcas if len(_recibidos.get(m, [])) >= len(clientes))
+            if completos == len(marcas):
+                break
+            time.sleep(0.5)
+    finally:
+        # En paralelo: con threading cada disconnect tarda ~3s en cerrar el websocket
+        with ThreadPoolExecutor(max_workers=CONEXIONES_PARALELAS) as pool:
+            list(pool.map(desconectar, clientes))
+
+    # 3. Resultados
+    with _recibidos_lock:
+        latencias = [l for m in marcas for l in _recibidos.get(m, [])]
+        ultimas = [max(_recibidos[m]) for m in marcas if _recibidos.get(m)]
+    esperados = len(marcas) * len(clientes)
+    print(f"📨 Webhook: p50 {percentil(respuestas, 50):.3f}s, p95 {percentil(respuestas, 95):.3f}s")
+    print(f"📡 Entregas: {len(latencias)}/{esperados}")
+    if latencias:
+        print(f"   Latencia por socket: p50 {percentil(latencias, 50):.3f}s, p95 {percentil(latencias, 95):.3f}s, "
+              f"media {statistics.mean(latencias):.3f}s")
+        print(f"   Hasta el último socket: p50 {percentil(ultimas, 50):.3f}s, p95 {percentil(ultimas, 95):.3f}s")
+
+    ok = bool(clientes) and len(latencias) == esperados
+    print()
+    print("✅ TODO OK" if ok else "❌ Hubo sockets sin conectar o mensajes sin entregar")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Prueba del snapshot del certificado (certificado_snapshot.py).
+
+Verifica sin base de datos: la normalización del documento (fechas y
+decimales como texto, orden de claves), la comparación del verificador de
+consistencia, lo que guarda guardar_snapshot con un cursor falso y que sin
+snapshot disponible el preview ensambla en vivo.
+
+Uso: python test_certificado_snapshot.py
+"""
+
+import os
+import json
+from decimal import Decimal
+from datetime import date, datetime
+
+import certificado_snapshot
+from certificado_snapshot import (
+    normalizar_documento, comparar_documentos, guardar_snapshot, leer_snapshot, obtener_datos_certificado
+)
+
+
+class CursorFalso:
+    """Guarda lo ejecutado y devuelve la fila configurada"""
+
+    def __init__(self, fila=None):
+        self.fila = fila
+        self.ejecutados = []
+
+    def execute(self, sql, params=None):
+        self.ejecutados.append((sql, params))
+
+    def fetchone(self):
+        return self.fila
+
+
+def main():
+    print("🧪 Snapshot del certificado")
+    fallas = 0
+
+    def verificar(condicion, mensaje):
+        nonlocal fallas
+        print(f"   {'✅' if condicion else '❌'} {mensaje}")
+        fallas += not condicion
+
+    datos = {
+        "nombres_apellidos": "ANA MARÍA PÉREZ",
+        "fecha_nacimiento": date(1990, 5, 17),
+        "datos_voximetria": {"f0_mean": Decimal("182.4"), "concepto": "NORMAL"},
+        "resultados_generales": [{"examen": "AUDIOMETRÍA", "descripcion": "Normal"}],
+        "datos_adc": None,
+    }
+    normalizado = normalizar_documento(datos)
+    verificar(normalizado["fecha_nacimiento"] == "1990-05-17", "Fecha guardada como se imprime")
+    verificar(normalizado["datos_voximetria"]["f0_mean"] == "182.4", "Decimal guardado como se imprime")
+    verificar(list(normalizado) == list(datos), "Conserva el orden de las claves")
+
+    verificar(comparar_documentos(normalizado, normalizar_documento(datos)) == [], "Mismo documento: sin diferencias")
+    cambiado = dict(normalizado, concepto_medico="APTO", datos_adc={"pendiente": True})
+    verificar(comparar_documentos(normalizado, cambiado) == ["concepto_medico", "datos_adc"],
+              "Reporta las claves que difieren")
+
+    cur = CursorFalso()
+    guardar_snapshot(cur, "orden-1", dict(datos, creado=datetime(2026, 10, 19, 8, 30)), 4)
+    _, params = cur.ejecutados[0]
+    verificar(params[0] == "orden-1" and params[2] == 4 and params[3] == 4,
+              "Se guarda con la versión leída antes de ensamblar")
+    verificar(json.loads(params[1])["nombres_apellidos"] == "ANA MARÍA PÉREZ", "Documento en JSON sin escapar tildes")
+
+    verificar(leer_snapshot(CursorFalso(None), "orden-2") == (None, 0), "Sin fila: faltante con versión 0")
+    verificar(leer_snapshot(CursorFalso((json.dumps(normalizado), 3, False)), "orden-1") == (None, 3),
+              "Desactualizado: faltante con la versión actual")
+    documento, cambios = leer_snapshot(CursorFalso((json.dumps(normalizado), 3, True)), "orden-1")
+    verificar(documento == normalizado and cambios == 3, "Al día: devuelve el documento")
+
+    ensamblados = []
+
+    def ensamblar(orden_id):
+        ensamblados.append(orden_id)
+        return dict(datos)
+
+    habilitado = certificado_snapshot.CERT_SNAPSHOT_ENABLED
+    password = os.environ.pop("POSTGRES_PASSWORD", None)
+    try:
+        certificado_snapshot.CERT_SNAPSHOT_ENABLED = False
+        resultado = obtener_datos_certificado("orden-3", ensamblar)
+        verificar(resultado == datos and ensamblados == ["orden-3"], "Deshabilitado: ensambla en vivo")
+
+        certificado_snapshot.CERT_SNAPSHOT_ENABLED = True
+        resultado = obtener_datos_certificado("orden-4", ensamblar)
+        verificar(resultado == datos and ensamblados[-1] == "orden-4", "Sin base de datos: ensambla en vivo")
+    finally:
+        certificado_snapshot.CERT_SNAPSHOT_ENABLED = habilitado
+        if password is not None:
+            os.environ["POSTGRES_PASSWORD"] = password
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Prueba del pool de gráficos del informe (graficos_informe.py).
+
+Dibuja los ocho gráficos del PDF en el proceso y en el pool y verifica que
+las imágenes sean idénticas y lleguen en el mismo orden. Imprime los tiempos
+de ambos caminos; sin iniciar_pool_graficos() no debe crearse ningún pool.
+Después verifica que la caché por contenido devuelva lo
+mismo sin redibujar (memoria y disco), y que tras una falla del pool se
+dibuje en el proceso sin volver a crearlo.
+
+Uso: python test_graficos_paralelos.py
+"""
+
+import time
+import tempfile
+
+import graficos_informe
+from graficos_informe import renderizar_graficos
+
+CIUDADES = {f"Ciudad {i}": 40 - i for i in range(25)}
+PROFESIONES = {f"Profesión número {i}": 30 - i for i in range(20)}
+DIAGNOSTICOS = {f"Diagnóstico de prueba con nombre largo {i}": 50 - 2 * i for i in range(18)}
+
+TRABAJOS = {
+    'genero': ('pie', ({'Masculino': 60, 'Femenino': 40}, 'Distribución por Género'), {}),
+    'edad': ('barras', ({'15-20': 10, '21-30': 30, '31-40': 35, '41-50': 20, 'Mayor 50': 5}, 'Distribución por Edad'),
+             {'xlabel': 'Rango de Edad', 'ylabel': 'Cantidad de Trabajadores'}),
+    'estadoCivil': ('pie', ({'Soltero': 45, 'Casado': 30, 'Unión Libre': 20, 'Divorciado': 3, 'Viudo': 2},
+                            'Distribución por Estado Civil'), {}),
+    'nivelEducativo': ('barras', ({'Primaria': 12, 'Secundaria': 50, 'Universitario': 30, 'Postgrado': 8},
+                                  'Distribución por Nivel Educativo'),
+                       {'xlabel': 'Nivel Educativo', 'ylabel': 'Cantidad de Trabajadores'}),
+    'hijos': ('barras', ({'Sin hijos': 40, '1 hijo': 30, '2 hijos': 20, '3+ hijos': 10}, 'Distribución por Número de Hijos'),
+              {'xlabel': 'Número de Hijos', 'ylabel': 'Cantidad de Trabajadores'}),
+    'ciudadResidencia': ('barras_horizontales', (CIUDADES, 'Top 15 Ciudades de Residencia'),
+                         {'xlabel': 'Cantidad de Trabajadores', 'max_items': 15}),
+    'profesionUOficio': ('barras_horizontales', (PROFESIONES, 'Top 15 Profesiones u Oficios'),
+                         {'xlabel': 'Cantidad de Trabajadores', 'max_items': 15}),
+    'diagnosticos': ('barras_horizontales', (DIAGNOSTICOS, 'Top 15 Diagnósticos Encontrados'),
+                     {'xlabel': 'Número de Casos', 'max_items': 15}),
+}
+
+
+def vaciar_cache():
+    graficos_informe._cache.clear()
+    graficos_informe._cache_bytes = 0
+    graficos_informe.GRAFICOS_CACHE_DIR = tempfile.mkdtemp(prefix='test_graficos_')
+
+
+def medir(procesos):
+    vaciar_cache()
+    graficos_informe.GRAFICOS_PROCESOS = procesos
+    if procesos:
+        graficos_informe.iniciar_pool_graficos()
+    renderizar_graficos({'genero': TRABAJOS['genero']})  # calentar (pool o matplotlib)
+    inicio = time.time()
+    resultado = renderizar_graficos(TRABAJOS)
+    return resultado, time.time() - inicio
+
+
+def main():
+    print("🧪 Gráficos del informe: proceso vs pool")
+    graficos_informe.GRAFICOS_PROCESOS = 4
+    vaciar_cache()
+    renderizar_graficos({'genero': TRABAJOS['genero']})
+    fallas = 0
+    if graficos_informe._pool is not None:
+        print("   ❌ Se creó el pool sin iniciar_pool_graficos()")
+        fallas += 1
+    else:
+        print("   ✅ Sin iniciar_pool_graficos() se dibuja en el proceso")
+
+    secuencial, t_secuencial = medir(0)
+    paralelo, t_paralelo = medir(4)
+    print(f"📊 En el proceso: {t_secuencial:.2f}s | Pool (4 procesos): {t_paralelo:.2f}s")
+
+    if list(paralelo) != list(TRABAJOS):
+        print("   ❌ El pool devolvió los gráficos en otro orden")
+        fallas += 1
+    distintos = [k for k in TRABAJOS if secuencial[k] != paralelo[k]]
+    if distintos:
+        print(f"   ❌ Imágenes distintas: {distintos}")
+        fallas += 1
+    else:
+        print("   ✅ Mismas imágenes, mismo orden")
+
+    # Caché: la misma llamada otra vez no dibuja nada (memoria), y tampoco
+    # con la memoria vacía (disco)
+    antes = graficos_informe.obtener_metricas_graficos()
+    inicio = time.time()
+    de_memoria = renderizar_graficos(TRABAJOS)
+    t_memoria = time.time() - inicio
+    graficos_informe._cache.clear()
+    graficos_informe._cache_bytes = 0
+    inicio = time.time()
+    de_disco = renderizar_graficos(TRABAJOS)
+    t_disco = time.time() - inicio
+    despues = graficos_informe.obtener_metricas_graficos()
+
+    print(f"📊 Caché en memoria: {t_memoria * 1000:.1f}ms | en disco: {t_disco * 1000:.1f}ms")
+    if despues['misses'] != antes['misses']:
+        print(f"   ❌ Se redibujaron {despues['misses'] - antes['misses']} gráficos idénticos")
+        fallas += 1
+    elif de_memoria != paralelo or de_disco != paralelo:
+        print("   ❌ La caché devolvió imágenes distintas")
+        fallas += 1
+    else:
+        print(f"   ✅ Sin redibujar (hits memoria {despues['hits_memoria'] - antes['hits_memoria']}, "
+              f"disco {despues['hits_disco'] - antes['hits_disco']})")
+
+    # Falla del pool: se descarta y no se vuelve a hacer fork
+    graficos_informe._descartar_pool()
+    vaciar_cache()
+    tras_falla = renderizar_graficos({'genero': TRABAJOS['genero']})
+    if graficos_informe._pool is not None:
+        print("   ❌ El pool se recreó tras la falla")
+        fallas += 1
+    elif tras_falla['genero'] != paralelo['genero']:
+        print("   ❌ El dibujo en el proceso tras la falla es distinto")
+        fallas += 1
+    else:
+        print("   ✅ Tras la falla se dibuja en el proceso, sin recrear el pool")
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Prueba del informe de riesgo psicosocial ADC (informe_adc.py).
+
+Agrega pruebas sintéticas por bloques, como llegan del cursor del servidor,
+y compara cada conteo con el de calcular_perfil_adc fila por fila: niveles
+por subdimensión y general, congruencia por área, promedios y riesgo. Dibuja
+también los gráficos de la sección y valida que el template renderice.
+
+Uso: python test_informe_adc.py
+"""
+
+import os
+import random
+from collections import Counter
+
+from jinja2 import Template
+
+from adc_scoring import calcular_perfil_adc, SCORE_DA
+from graficos_informe import renderizar_graficos
+from informe_adc import COLUMNAS_PG, nuevo_acumulado, agregar_lote, resumir, trabajos_graficos_adc
+
+OPCIONES = list(SCORE_DA) + [None, '']
+
+
+def main():
+    print("🧪 Riesgo psicosocial ADC por empresa")
+    rnd = random.Random(2026)
+    fallas = 0
+
+    def verificar(condicion, mensaje):
+        nonlocal fallas
+        print(f"   {'✅' if condicion else '❌'} {mensaje}")
+        fallas += not condicion
+
+    # Respuestas sesgadas por trabajador para que aparezcan todos los niveles
+    tuplas = []
+    for _ in range(2500):
+        sesgo = rnd.random()
+        tuplas.append(tuple(
+            rnd.choice(OPCIONES[:2] if rnd.random() < sesgo else OPCIONES) for _ in COLUMNAS_PG
+        ))
+
+    acumulado = nuevo_acumulado()
+    for inicio in range(0, len(tuplas), 700):
+        agregar_lote(acumulado, tuplas[inicio:inicio + 700], COLUMNAS_PG)
+    resultado = resumir(acumulado)
+
+    perfiles = [calcular_perfil_adc({**dict(zip(COLUMNAS_PG, fila)), 'cooc37': None}) for fila in tuplas]
+    verificar(resultado['total'] == len(perfiles), f"Total: {resultado['total']} pruebas")
+
+    iguales = True
+    for clave in ('ansiedad', 'depresion'):
+        grupos = dict(resultado[clave]['subdimensiones'], General=resultado[clave]['general'])
+        for nombre, dist in grupos.items():
+            datos = [p[clave]['general'] if nombre == 'General' else p[clave]['subdimensiones'][nombre] for p in perfiles]
+            conteo = Counter(d['nivel'] for d in datos)
+            iguales &= all(dist['niveles'][e]['cantidad'] == conteo.get(e, 0) for e in resultado['etiquetasNivel'])
+            iguales &= dist['promedioEstandarizado'] == round(sum(d['estandarizado'] for d in datos) / len(datos), 1)
+    verificar(iguales, "Ansiedad y depresión: niveles y promedios por subdimensión")
+
+    iguales = True
+    for nombre, area in resultado['congruencia']['areas'].items():
+        for parte in ('valoracion', 'conducta'):
+            conteo = Counter(p['congruencia']['areas'][nombre][parte]['nivel'] for p in perfiles)
+            iguales &= all(area[parte]['niveles'][e]['cantidad'] == conteo.get(e, 0) for e in resultado['etiquetasNivel'])
+        conteo = Counter(p['congruencia']['areas'][nombre]['congruencia'] for p in perfiles)
+        iguales &= all(area['congruencia']['niveles'][e]['cantidad'] == conteo.get(e, 0) for e in resultado['etiquetasNivel'])
+    verificar(iguales, "Congruencia: niveles por área")
+
+    alto = lambda p, clave: p[clave]['general']['nivel'] in ('ALTO', 'MUY ALTO')
+    esperado = {
+        'ansiedad': sum(alto(p, 'ansiedad') for p in perfiles),
+        'depresion': sum(alto(p, 'depresion') for p in perfiles),
+        'ambas': sum(alto(p, 'ansiedad') and alto(p, 'depresion') for p in perfiles),
+        'alguna': sum(alto(p, 'ansiedad') or alto(p, 'depresion') for p in perfiles),
+    }
+    verificar({k: v['cantidad'] for k, v in resultado['riesgo'].items()} == esperado, f"Riesgo: {esperado}")
+
+    verificar(resumir(agregar_lote(nuevo_acumulado(), [], COLUMNAS_PG))['total'] == 0, "Empresa sin pruebas")
+
+    graficos = renderizar_graficos(trabajos_graficos_adc(resultado), formato='svg')
+    verificar(list(graficos) == ['adc_ansiedad', 'adc_depresion', 'adc_congruencia'] and all(graficos.values()),
+              "Gráficos de barras apiladas")
+
+    plantilla = os.path.join(os.path.dirname(__file__), 'templates', 'informe_pdf.html')
+    with open(plantilla, 'r', encoding='utf-8') as f:
+        contenido = f.read()
+    seccion = contenido[contenido.index('<!-- RIESGO PSICOSOCIAL ADC -->'):contenido.index('<!-- CONCLUSIONES FINALES -->')]
+    html = Template(seccion).render(riesgo_adc=resultado, graficos=graficos, graficos_mime='image/svg+xml')
+    verificar('Riesgo Psicosocial' in html and 'Sobre Ti Mismo' in html and 'Ocupacional' in html,
+              "Sección del template renderiza")
+
+    print()
+    print("✅ TODO OK" if not fallas else f"❌ {fallas} verificaciones fallaron")
+    return fallas
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+"""
+Registro de Clientes Twilio
+===========================
+
+Un cliente Twilio por juego de credenciales (account_sid + auth_token),
+reutilizado entre envíos. Todos comparten un único TwilioHttpClient con pool
+de conexiones keep-alive hacia api.twilio.com, así que un envío masivo de
+certificados o las respuestas del chat no pagan un handshake TLS por mensaje.
+
+Si las credenciales de un tenant cambian (se editan fuera de esta app), el
+cliente viejo se descarta la próxima vez que se piden: la llave del registro
+incluye un hash del token y las credenciales se releen cada 60 s.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "15"))  # segundos (connect + read)
+TWILIO_HTTP_POOL_SIZE = int(os.getenv("TWILIO_HTTP_POOL_SIZE", "20"))
+
+_clientes = {}            # (account_sid, hash_token) -> Client
+_llave_por_tenant = {}    # tenant_id -> (account_sid, hash_token)
+_http_client = None
+_lock = threading.Lock()
+
+
+def _crear_http_client():
+    """TwilioHttpClient con pool de conexiones compartido y timeouts acotados"""
+    from twilio.http.http_client import TwilioHttpClient
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    http_client = TwilioHttpClient(pool_connections=True, timeout=TWILIO_HTTP_TIMEOUT)
+    # Solo se reintentan errores de conexión: un POST a /Messages que llegó a Twilio
+    # no se reenvía (sería un WhatsApp duplicado).
+    adapter = HTTPAdapter(
+        pool_connections=TWILIO_HTTP_POOL_SIZE,
+        pool_maxsize=TWILIO_HTTP_POOL_SIZE,
+        max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3)
+    )
+    http_client.session.mount("https://", adapter)
+    return http_client
+
+
+def _obtener_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = _crear_http_client()
+        logger.info(f"✅ Pool HTTP de Twilio inicializado (tamaño={TWILIO_HTTP_POOL_SIZE}, timeout={TWILIO_HTTP_TIMEOUT}s)")
+    return _http_client
+
+
+def _llave(account_sid, auth_token):
+    return (account_sid, hashlib.sha256(auth_token.encode('utf-8')).hexdigest())
+
+
+def obtener_cliente_twilio(account_sid, auth_token, tenant_id=None):
+    """
+    Devuelve un cliente Twilio reutilizable para estas credenciales.
+
+    Args:
+        account_sid, auth_token: credenciales del tenant
+        tenant_id: si se indica, al cambiar las credenciales del tenant se
+                   descarta el cliente anterior
+
+    Returns:
+        twilio.rest.Client o None si faltan credenciales
+    """
+    if not account_sid or not auth_token:
+        return None
+
+    llave = _llave(account_sid, auth_token)
+    with _lock:
+        if tenant_id is not None:
+            llave_anterior = _llave_por_tenant.get(tenant_id)
+            if llave_anterior and llave_anterior != llave:
+                _descartar(llave_anterior, excepto_tenant=tenant_id)
+                logger.info(f"🔄 Credenciales Twilio de {tenant_id} cambiaron — cliente anterior descartado")
+            _llave_por_tenant[tenant_id] = llave
+
+        cliente = _clientes.get(llave)
+        if cliente is None:
+            from twilio.rest import Client
+            cliente = Client(account_sid, auth_token, http_client=_obtener_http_client())
+            _clientes[llave] = cliente
+        return cliente
+
+
+def _descartar(llave, excepto_tenant=None):
+    """Quita un cliente si ningún otro tenant lo está usando (llamar con _lock tomado)"""
+    en_uso = any(l == llave for t, l in _llave_por_tenant.items() if t != excepto_tenant)
+    if not en_uso:
+        _clientes.pop(llave, None)
@@ -0,0 +1,398 @@
+"""
+Estado de Entrega de Mensajes Twilio
+====================================
+
+- registrar_envio(): se llama al enviar un certificado; guarda el SID y lo
+  necesario para reenviarlo.
+- registrar_estado(): lo llama el status callback de Twilio; conserva solo el
+  último estado por SID (los callbacks pueden llegar desordenados).
+- firma_twilio_valida(): valida X-Twilio-Signature del callback con el
+  auth token de la cuenta que lo envía.
+- Worker de reintentos: toma certificados failed/undelivered y los reenvía una
+  vez por la plantilla certificado_pdf_media del tenant. Si el reenvío falla
+  se vuelve a intentar con espera creciente, hasta TWILIO_MAX_REINTENTOS.
+  También borra las filas más viejas que TWILIO_ESTADOS_RETENCION_DIAS.
+- obtener_metricas_entrega(): tasa de entrega por período y tenant.
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from conexion_pg import conectar_con_esquema, obtener_conexion_pg
+
+logger = logging.getLogger(__name__)
+
+TWILIO_REINTENTOS_ENABLED = os.getenv("TWILIO_REINTENTOS_ENABLED", "true").lower() == "true"
+TWILIO_REINTENTOS_POLL_SEG = 60
+TWILIO_MAX_REINTENTOS = 3
+TWILIO_VALIDAR_FIRMA = os.getenv("TWILIO_VALIDAR_FIRMA", "true").lower() == "true"
+TWILIO_ESTADOS_RETENCION_DIAS = int(os.getenv("TWILIO_ESTADOS_RETENCION_DIAS", "90"))
+# Filas 'otro' (SIDs que nadie registró: mensajes del chat) solo sirven mientras llega registrar_envio
+TWILIO_ESTADOS_OTRO_HORAS = 24
+TWILIO_PURGA_CADA_SEG = 3600
+
+# Orden de los estados: un callback "sent" que llega después de "delivered" no retrocede la fila
+RANGO_ESTADOS = {
+    'accepted': 0, 'scheduled': 0, 'queued': 0, 'sending': 1, 'sent': 2,
+    'delivered': 3, 'read': 4, 'undelivered': 5, 'failed': 5, 'canceled': 5,
+}
+
+# Errores en los que reenviar no sirve (número inválido, usuario bloqueó, etc.)
+ERRORES_NO_REINTENTABLES = {21211, 21408, 21610, 21614, 63003, 63024}
+
+_worker = None
+_worker_lock = threading.Lock()
+_tokens_cuenta = {}  # account_sid -> {'t', 'token'} (TTL 60 s, como las credenciales del tenant)
+_TOKENS_TTL = 60
+
+
+def _conectar():
+    """Conexión con la tabla garantizada (se crea la primera vez en el proceso)"""
+    return conectar_con_esquema('init_twilio_mensajes_estado.sql')
+
+
+def _sql_rango(columna):
+    casos = " ".join(f"WHEN '{e}' THEN {r}" for e, r in RANGO_ESTADOS.items())
+    return f"(CASE {columna} {casos} ELSE 0 END)"
+
+
+# ============================================================================
+# REGISTRO
+# ============================================================================
+
+def registrar_envio(sid, tipo, tenant_id=None, destino=None, wix_id=None,
+                    usa_template=False, variables=None, estado='queued', reintento_de=None):
+    """Guarda un mensaje recién enviado. Nunca revienta el flujo de envío."""
+    try:
+        conn = _conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                INSERT INTO twilio_mensajes_estado
+                    (sid, tipo, tenant_id, destino, wix_id, usa_template, variables, estado, reintento_de)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (sid) DO UPDATE SET
+                    tipo = EXCLUDED.tipo, tenant_id = EXCLUDED.tenant_id, destino = EXCLUDED.destino,
+                    wix_id = EXCLUDED.wix_id, usa_template = EXCLUDED.usa_template,
+                    variables = EXCLUDED.variables, reintento_de = EXCLUDED.reintento_de
+                """,
+                (sid, tipo, tenant_id, destino, wix_id, usa_template,
+                 json.dumps(variables) if variables else None, estado or 'queued', reintento_de)
+            )
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo registrar el envío {sid}: {e}")
+
+
+def registrar_estado(sid, estado, error_code=None, destino=None):
+    """
+    Aplica un evento del status callback. Si el SID no se conocía (un mensaje
+    del chat, o un certificado cuyo registrar_envio todavía no llegó) se crea
+    la fila con tipo 'otro'; la purga borra las que nadie registró.
+    """
+    estado = (estado or '').lower()
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO twilio_mensajes_estado AS m (sid, destino, estado, error_code)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (sid) DO UPDATE SET
+                estado = EXCLUDED.estado,
+                error_code = COALESCE(EXCLUDED.error_code, m.error_code),
+                actualizado_en = now()
+            WHERE {_sql_rango('EXCLUDED.estado')} >= {_sql_rango('m.estado')}
+            """,
+            (sid, destino, estado, int(error_code) if error_code else None)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# FIRMA DEL STATUS CALLBACK
+# ============================================================================
+
+def _auth_token_de_cuenta(account_sid):
+    """Auth token de la cuenta Twilio: la de las variables de entorno (BSL) o la de un tenant"""
+    if account_sid and account_sid == os.getenv('TWILIO_ACCOUNT_SID'):
+        return os.getenv('TWILIO_AUTH_TOKEN')
+
+    cached = _tokens_cuenta.get(account_sid)
+    if cached and (time.time() - cached['t']) < _TOKENS_TTL:
+        return cached['token']
+
+    conn = obtener_conexion_pg()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT credenciales -> 'twilio' ->> 'auth_token' FROM tenants "
+            "WHERE credenciales -> 'twilio' ->> 'account_sid' = %s LIMIT 1",
+            (account_sid,)
+        )
+        fila = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    token = fila[0] if fila else None
+    _tokens_cuenta[account_sid] = {'t': time.time(), 'token': token}
+    return token
+
+
+def firma_twilio_valida(urls, parametros, firma):
+    """
+    Valida X-Twilio-Signature de un webhook.
+
+    Args:
+        urls: URLs candidatas con las que Twilio pudo firmar (detrás del
+              balanceador el esquema que ve Flask puede no ser el público)
+        parametros: dict del formulario POST (incluye AccountSid)
+        firma: header X-Twilio-Signature
+
+    Returns:
+        bool: True si la firma corresponde (o si TWILIO_VALIDAR_FIRMA=false)
+    """
+    if not TWILIO_VALIDAR_FIRMA:
+        return True
+    if not firma:
+        return False
+
+    from twilio.request_validator import RequestValidator
+
+    auth_token = _auth_token_de_cuenta(parametros.get('AccountSid'))
+    if not auth_token:
+        return False
+    validador = RequestValidator(auth_token)
+    return any(validador.validate(url, parametros, firma) for url in urls)
+
+
+# ============================================================================
+# REINTENTOS AUTOMÁTICOS
+# ============================================================================
+
+def _tomar_fallidos(cur, limite=20):
+    # El reintento queda "tomado" 10 minutos; solo se marca reintentado cuando el
+    # reenvío sale. Si falla, _reintento_fallido lo reprograma.
+    cur.execute(
+        """
+        UPDATE twilio_mensajes_estado
+        SET intentos_reintento = intentos_reintento + 1,
+            proximo_reintento = now() + INTERVAL '10 minutes'
+        WHERE sid IN (
+            SELECT sid FROM twilio_mensajes_estado
+            WHERE estado IN ('failed', 'undelivered') AND NOT reintentado AND tipo = 'certificado'
+              AND reintento_de IS NULL
+              AND (error_code IS NULL OR error_code <> ALL(%s))
+              AND intentos_reintento < %s
+              AND (proximo_reintento IS NULL OR proximo_reintento <= now())
+            ORDER BY actualizado_en
+            FOR UPDATE SKIP LOCKED
+            LIMIT %s
+        )
+        RETURNING sid, tenant_id, destino, wix_id, usa_template, variables, error_code
+        """,
+        (list(ERRORES_NO_REINTENTABLES), TWILIO_MAX_REINTENTOS, limite)
+    )
+    return cur.fetchall()
+
+
+def _cerrar_reintento(sid, error=None):
+    """Reenvío hecho: no se vuelve a tomar. Con error: se reprograma con espera creciente."""
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        if error is None:
+            cur.execute(
+                "UPDATE twilio_mensajes_estado SET reintentado = true, ultimo_error_reintento = NULL WHERE sid = %s",
+                (sid,)
+            )
+        else:
+            cur.execute(
+                """
+                UPDATE twilio_mensajes_estado
+                SET ultimo_error_reintento = %s,
+                    proximo_reintento = now() + make_interval(mins => 5 * power(2, intentos_reintento)::int)
+                WHERE sid = %s
+                """,
+                (error[:500], sid)
+            )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def purgar_estados():
+    """
+    Borra filas más viejas que TWILIO_ESTADOS_RETENCION_DIAS y las 'otro' (SIDs
+    que nadie registró) de más de TWILIO_ESTADOS_OTRO_HORAS.
+
+    Returns:
+        int: filas borradas
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            DELETE FROM twilio_mensajes_estado
+            WHERE creado_en < now() - make_interval(days => %s)
+               OR (tipo = 'otro' AND creado_en < now() - make_interval(hours => %s))
+            """,
+            (TWILIO_ESTADOS_RETENCION_DIAS, TWILIO_ESTADOS_OTRO_HORAS)
+        )
+        borradas = cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if borradas:
+        logger.info(f"🧹 {borradas} estados de mensajes Twilio purgados")
+    return borradas
+
+
+def procesar_reintentos(reenviar_fn):
+    """
+    Reenvía certificados no entregados.
+
+    Args:
+        reenviar_fn: callable(fila: dict) -> nuevo SID (o None si no se pudo)
+
+    Returns:
+        int: cantidad de mensajes reintentados
+    """
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        filas = _tomar_fallidos(cur)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    for sid, tenant_id, destino, wix_id, usa_template, variables, error_code in filas:
+        fila = {
+            'sid': sid, 'tenant_id': tenant_id, 'destino': destino, 'wix_id': wix_id,
+            'usa_template': usa_template, 'variables': variables or {}, 'error_code': error_code
+        }
+        try:
+            nuevo_sid = reenviar_fn(fila)
+        except Exception as e:
+            logger.error(f"❌ Reintento de {sid} falló: {e}")
+            _cerrar_reintento(sid, str(e) or type(e).__name__)
+            continue
+        _cerrar_reintento(sid)
+        logger.info(f"🔁 Certificado {wix_id} reenviado por plantilla: {sid} → {nuevo_sid} (error {error_code})")
+    return len(filas)
+
+
+def _loop_reintentos(reenviar_fn, detener):
+    ultima_purga = 0
+    while not detener.wait(TWILIO_REINTENTOS_POLL_SEG):
+        try:
+            procesar_reintentos(reenviar_fn)
+            if time.time() - ultima_purga > TWILIO_PURGA_CADA_SEG:
+                purgar_estados()
+                ultima_purga = time.time()
+        except Exception as e:
+            logger.error(f"❌ Error en worker de reintentos Twilio: {e}")
+
+
+def iniciar_worker_reintentos(reenviar_fn):
+    """Arranca (una sola vez por proceso) el worker de reintentos"""
+    global _worker
+    with _worker_lock:
+        if _worker or not TWILIO_REINTENTOS_ENABLED:
+            return
+        _worker = threading.Thread(
+            target=_loop_reintentos, args=(reenviar_fn, threading.Event()),
+            name="twilio-reintentos", daemon=True
+        )
+        _worker.start()
+    logger.info("✅ Worker de reintentos de certificados Twilio iniciado")
+
+
+# ============================================================================
+# MÉTRICAS
+# ============================================================================
+
+def obtener_metricas_entrega(desde, hasta, tenant_id=None, tipo=None):
+    """
+    Tasa de entrega en [desde, hasta) (fechas YYYY-MM-DD, sobre creado_en).
+
+    Returns:
+        dict: totales por estado, tasa de entrega, top errores y reintentos
+    """
+    filtros = ["creado_en >= %s::date", "creado_en < %s::date + INTERVAL '1 day'"]
+    params = [desde, hasta]
+    if tenant_id:
+        filtros.append("tenant_id = %s")
+        params.append(tenant_id)
+    if tipo:
+        filtros.append("tipo = %s")
+        params.append(tipo)
+    where = " AND ".join(filtros)
+
+    conn = _conectar()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT estado, COUNT(*) FROM twilio_mensajes_estado WHERE {where} GROUP BY estado", params)
+        por_estado = {estado: n for estado, n in cur.fetchall()}
+
+        cur.execute(
+            f"""
+            SELECT error_code, COUNT(*) FROM twilio_mensajes_estado
+            WHERE {where} AND error_code IS NOT NULL
+            GROUP BY error_code ORDER BY COUNT(*) DESC LIMIT 10
+            """,
+            params
+        )
+        errores = [{'error_code': code, 'cantidad': n} for code, n in cur.fetchall()]
+
+        cur.execute(
+            f"""
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE estado IN ('delivered', 'read'))
+            FROM twilio_mensajes_estado
+            WHERE {where} AND reintento_de IS NOT NULL
+            """,
+            params
+        )
+        reintentos, reintentos_entregados = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    total = sum(por_estado.values())
+    entregados = por_estado.get('delivered', 0) + por_estado.get('read', 0)
+    fallidos = por_estado.get('failed', 0) + por_estado.get('undelivered', 0)
+    finalizados = entregados + fallidos
+    return {
+        'desde': desde,
+        'hasta': hasta,
+        'tenant_id': tenant_id,
+        'tipo': tipo,
+        'total': total,
+        'por_estado': por_estado,
+        'entregados': entregados,
+        'fallidos': fallidos,
+        'tasa_entrega': round(entregados / finalizados, 4) if finalizados else None,
+        'errores_principales': errores,
+        'reintentos': reintentos,
+        'reintentos_entregados': reintentos_entregados,
+    }
@@ -0,0 +1,349 @@
+"""
+Outbox de Subidas de PDF
+========================
+
+Cola durable (tabla upload_outbox en PostgreSQL) para desacoplar la
+generación de PDFs de su subida a Drive/GCS:
+
+- Los endpoints encolan la tarea (contenido del PDF, destino, carpeta,
+  nombre) y responden apenas el PDF existe.
+- El PDF viaja en la fila (BYTEA), no en un archivo local: cualquier worker
+  de cualquier instancia puede tomar la tarea y la cola sobrevive a un
+  redeploy que borre /tmp.
+- Un pool de workers drena la cola con backoff exponencial y actualiza
+  estado y enlace al terminar.
+- Cada tarea lleva una idempotency_key: re-encolar el mismo PDF no crea
+  una segunda subida.
+- Las tareas completadas o fallidas se purgan tras
+  UPLOAD_OUTBOX_RETENCION_DIAS (el enlace se consulta mientras tanto).
+
+Autor: BSL
+Fecha: 2026-10-19
+"""
+
+import os
+import random
+import hashlib
+import tempfile
+import logging
+import threading
+import time
+
+from conexion_pg import obtener_conexion_pg, conectar_con_esquema
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+UPLOAD_OUTBOX_ENABLED = os.getenv("UPLOAD_OUTBOX_ENABLED", "false").lower() == "true"
+# Solo para el archivo temporal que se arma al subir (no guarda la cola)
+UPLOAD_OUTBOX_DIR = os.getenv("UPLOAD_OUTBOX_DIR", os.path.join("/tmp", "upload-outbox"))
+UPLOAD_OUTBOX_WORKERS = int(os.getenv("UPLOAD_OUTBOX_WORKERS", "2"))
+UPLOAD_OUTBOX_MAX_INTENTOS = int(os.getenv("UPLOAD_OUTBOX_MAX_INTENTOS", "8"))
+UPLOAD_OUTBOX_BACKOFF_BASE = 5       # segundos: 5, 10, 20, 40... (+ jitter)
+UPLOAD_OUTBOX_BACKOFF_MAX = 15 * 60  # nunca esperar más de 15 min entre intentos
+UPLOAD_OUTBOX_POLL_SEG = 5           # espera entre consultas cuando la cola está vacía
+UPLOAD_OUTBOX_LOCK_TIMEOUT = 10 * 60  # tareas 'procesando' más viejas se consideran huérfanas
+UPLOAD_OUTBOX_RETENCION_DIAS = int(os.getenv("UPLOAD_OUTBOX_RETENCION_DIAS", "7"))
+UPLOAD_OUTBOX_PURGA_CADA_SEG = 3600
+
+_workers = []
+_workers_lock = threading.Lock()
+_despertar = threading.Event()
+_ultima_purga = 0.0
+_purga_lock = threading.Lock()
+
+
+def inicializar_tabla_outbox():
+    """Crea la tabla upload_outbox si no existe"""
+    try:
+        conectar_con_esquema('init_upload_outbox.sql').close()
+        logger.info("✅ Tabla upload_outbox inicializada")
+    except Exception as e:
+        logger.error(f"❌ Error inicializando upload_outbox: {e}")
+
+
+# ============================================================================
+# ENCOLAR
+# ============================================================================
+
+def calcular_idempotency_key(contenido, destino, folder_id, nombre_visible):
+    """sha256 del destino lógico + contenido del PDF"""
+    h = hashlib.sha256()
+    h.update(f"{destino}|{folder_id or ''}|{nombre_visible}|".encode('utf-8'))
+    h.update(contenido)
+    return h.hexdigest()
+
+
+def encolar_subida(ruta_local, destino, nombre_visible, folder_id=None, empresa=None):
+    """
+    Encola la subida de un PDF ya generado.
+
+    El contenido se guarda en la fila: el endpoint puede borrar su temporal
+    sin esperar al worker, y la tarea no depende del disco de esta instancia.
+
+    Returns:
+        dict: {'id', 'idempotency_key', 'estado', 'enlace'} de la tarea
+              (la existente si ya se había encolado el mismo PDF)
+    """
+    import psycopg2
+
+    with open(ruta_local, 'rb') as f:
+        contenido = f.read()
+    idempotency_key = calcular_idempotency_key(contenido, destino, folder_id, nombre_visible)
+
+    conn = obtener_conexion_pg()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO upload_outbox (idempotency_key, contenido, destino, folder_id, nombre_visible, empresa)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (idempotency_key) DO UPDATE
+                SET updated_at = upload_outbox.updated_at
+            RETURNING id, estado, enlace
+            """,
+            (idempotency_key, psycopg2.Binary(contenido), destino, folder_id, nombre_visible, empresa)
+        )
+        tarea_id, estado, enlace = cur.fetchone()
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    logger.info(f"📥 Subida encolada #{tarea_id} ({destino}): {nombre_visible} [{estado}]")
+    _despertar.set()
+
+    return {
+        'id': tarea_id,
+        'idempotency_key': idempotency_key,
+        'estado': estado,
+        'enlace': enlace
+    }
+
+
+def obtener_estado_subida(tarea_id):
+    """Devuelve el estado de una tarea del outbox o None si no existe"""
+    conn = obtener_conexion_pg()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, estado, intentos, enlace, ultimo_error, nombre_visible, destino,
+                   created_at, updated_at
+            FROM upload_outbox
+            WHERE id = %s
+            """,
+            (tarea_id,)
+        )
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+
+    if not row:
+        return None
+
+    return {
+        'id': row[0],
+        'estado': row[1],
+        'intentos': row[2],
+        'enlace': row[3],
+        'error': row[4],
+        'nombre': row[5],
+        'destino': row[6],
+        'created_at': row[7].isoformat() if row[7] else None,
+        'updated_at': row[8].isoformat() if row[8] else None
+    }
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+def calcular_backoff(intentos):
+    """Backoff exponencial con jitter completo, acotado a UPLOAD_OUTBOX_BACKOFF_MAX"""
+    espera = min(UPLOAD_OUTBOX_BACKOFF_BASE * (2 ** max(intentos - 1, 0)), UPLOAD_OUTBOX_BACKOFF_MAX)
+    return random.uniform(espera / 2, espera)
+
+
+def _tomar_tarea(cur):
+    """
+    Reclama atómicamente una tarea lista (FOR UPDATE SKIP LOCKED: varios
+    workers o procesos no toman la misma). También recupera tareas que
+    quedaron 'procesando' por un worker que murió.
+    """
+    cur.execute(
+        """
+        UPDATE upload_outbox
+        SET estado = 'procesando',
+            intentos = intentos + 1,
+            bloqueado_en = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = (
+            SELECT id FROM upload_outbox
+            WHERE (estado = 'pendiente' AND proximo_intento <= CURRENT_TIMESTAMP)
+               OR (estado = 'procesando' AND bloqueado_en < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY proximo_intento
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, contenido, destino, folder_id, nombre_visible, empresa, intentos
+        """,
+        (UPLOAD_OUTBOX_LOCK_TIMEOUT,)
+    )
+    return cur.fetchone()
+
+
+def _materializar(tarea_id, contenido):
+    """Escribe el PDF de la fila en un temporal local para subir_fn (que recibe una ruta)"""
+    os.makedirs(UPLOAD_OUTBOX_DIR, exist_ok=True)
+    fd, ruta = tempfile.mkstemp(prefix=f"outbox-{tarea_id}-", suffix=".pdf", dir=UPLOAD_OUTBOX_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(bytes(contenido))
+    return ruta
+
+
+def procesar_siguiente(subir_fn):
+    """
+    Procesa una tarea del outbox.
+
+    Args:
+        subir_fn: callable(destino, ruta_local, nombre_visible, folder_id, empresa) -> enlace
+
+    Returns:
+        bool: True si había una tarea (exitosa o no), False si la cola estaba vacía
+    """
+    conn = obtener_conexion_pg()
+    try:
+        cur = conn.cursor()
+        tarea = _tomar_tarea(cur)
+        conn.commit()
+        if not tarea:
+            cur.close()
+            return False
+
+        tarea_id, contenido, destino, folder_id, nombre_visible, empresa, intentos = tarea
+
+        ruta_temporal = None
+        try:
+            inicio = time.time()
+            ruta_temporal = _materializar(tarea_id, contenido)
+            enlace = subir_fn(destino, ruta_temporal, nombre_visible, folder_id, empresa)
+            # El contenido ya no hace falta: se libera el espacio de la fila
+            cur.execute(
+                """
+                UPDATE upload_outbox
+                SET estado = 'completado', enlace = %s, ultimo_error = NULL, contenido = NULL,
+                    bloqueado_en = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                """,
+                (enlace, tarea_id)
+            )
+            conn.commit()
+            logger.info(f"☁️ Subida #{tarea_id} completada en {time.time() - inicio:.2f}s: {enlace}")
+
+        except Exception as e:
+            conn.rollback()
+            if intentos >= UPLOAD_OUTBOX_MAX_INTENTOS:
+                cur.execute(
+                    """
+                    UPDATE upload_outbox
+                    SET estado = 'fallido', ultimo_error = %s,
+                        bloqueado_en = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    """,
+                    (str(e)[:2000], tarea_id)
+                )
+                logger.error(f"❌ Subida #{tarea_id} falló definitivamente tras {intentos} intentos: {e}")
+            else:
+                espera = calcular_backoff(intentos)
+                cur.execute(
+                    """
+                    UPDATE upload_outbox
+                    SET estado = 'pendiente', ultimo_error = %s, bloqueado_en = NULL,
+                        proximo_intento = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    """,
+                    (str(e)[:2000], espera, tarea_id)
+                )
+                logger.warning(f"⚠️ Subida #{tarea_id} falló (intento {intentos}), reintento en {espera:.0f}s: {e}")
+            conn.commit()
+        finally:
+            if ruta_temporal:
+                try:
+                    os.remove(ruta_temporal)
+                except OSError:
+                    pass
+
+        cur.close()
+        return True
+    finally:
+        conn.close()
+
+
+def purgar_outbox():
+    """
+    Borra las tareas completadas o fallidas sin cambios en los últimos
+    UPLOAD_OUTBOX_RETENCION_DIAS.
+
+    Returns:
+        int: filas borradas
+    """
+    conn = obtener_conexion_pg()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            DELETE FROM upload_outbox
+            WHERE estado IN ('completado', 'fallido')
+              AND updated_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+            """,
+            (UPLOAD_OUTBOX_RETENCION_DIAS,)
+        )
+        borradas = cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    if borradas:
+        logger.info(f"🧹 {borradas} tareas terminadas del outbox purgadas")
+    return borradas
+
+
+def _purgar_si_toca():
+    """Con la cola vacía, un solo worker del proceso purga cada UPLOAD_OUTBOX_PURGA_CADA_SEG"""
+    global _ultima_purga
+    with _purga_lock:
+        if time.time() - _ultima_purga < UPLOAD_OUTBOX_PURGA_CADA_SEG:
+            return
+        _ultima_purga = time.time()
+    purgar_outbox()
+
+
+def _loop_worker(subir_fn):
+    while True:
+        try:
+            if procesar_siguiente(subir_fn):
+                continue
+            _purgar_si_toca()
+        except Exception as e:
+            logger.error(f"❌ Error en worker del outbox: {e}")
+        _despertar.wait(UPLOAD_OUTBOX_POLL_SEG)
+        _despertar.clear()
+
+
+def iniciar_workers_outbox(subir_fn, num_workers=None):
+    """Arranca (una sola vez por proceso) el pool de workers del outbox"""
+    with _workers_lock:
+        if _workers:
+            return
+        for i in range(num_workers or UPLOAD_OUTBOX_WORKERS):
+            t = threading.Thread(target=_loop_worker, args=(subir_fn,), name=f"upload-outbox-{i}", daemon=True)
+            t.start()
+            _workers.append(t)
+    logger.info(f"✅ Workers del outbox de subidas iniciados: {len(_workers)}")
@@ -0,0 +1,14 @@
+"""
+Punto de entrada WSGI para gunicorn (modo alta concurrencia de Socket.IO).
+
+Un worker gevent por proceso/instancia atiende miles de WebSockets con
+greenlets; para escalar se agregan instancias y todas comparten los emits
+por SOCKETIO_MESSAGE_QUEUE (redis://... o postgres). Ver Procfile.socketio.
+
+    SOCKETIO_ASYNC_MODE=gevent SOCKETIO_MESSAGE_QUEUE=postgres \\
+        gunicorn -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker -w 1 -b 0.0.0.0:8080 wsgi:app
+"""
+
+from descargar_bsl import app, inicializar_servicios
+
+inicializar_servicios()